@@ -1,133 +1,21 @@
-from datetime import datetime, timedelta, date
+from datetime import timedelta, date
 from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from pymysql import IntegrityError
-from sqlalchemy import func, text, and_
 from sqlalchemy.orm import Session
 
 from ..db.database import get_db
 from ..dependencies.role_checker import require_roles
-from ..models.models_v2 import LandingAdAssignment, AdAccount, User, AdStaff, Purchase, \
-    LandingAdPeriod, Landing, AdVisit
+from ..services_v2 import ad_performance
+from ..models.models_v2 import LandingAdAssignment, AdAccount, User, AdStaff
 
 router = APIRouter()
 
 DEFAULT_STAFF_NAME = "Не назначен"
 DEFAULT_ACCOUNT_NAME = "Не указан"
 
-def _active_ad_periods(db: Session, language: Optional[str] = None):
-    """
-    Возвращает список (Landing, started_at) только для тех, кто сейчас в рекламе,
-    по активной записи landing_ad_periods (ended_at IS NULL).
-    """
-    q = (
-        db.query(Landing, LandingAdPeriod.started_at)
-          .join(LandingAdPeriod, LandingAdPeriod.landing_id == Landing.id)
-          .filter(
-              Landing.in_advertising.is_(True),
-              LandingAdPeriod.ended_at.is_(None),
-          )
-    )
-    if language:
-        q = q.filter(Landing.language == language.upper().strip())
-    return q.all()
-
-def _cycle_count_map(db: Session, landing_ids: list[int]) -> dict[int, int]:
-    rows = (
-        db.query(LandingAdPeriod.landing_id, func.count().label("cnt"))
-          .filter(LandingAdPeriod.landing_id.in_(landing_ids))
-          .group_by(LandingAdPeriod.landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-def _ad_sales_first5_map(db: Session, pairs: list[tuple[int, datetime]]) -> dict[int, int]:
-    """
-    pairs: [(landing_id, started_at)]
-    """
-    if not pairs:
-        return {}
-    # подготавливаем временную таблицу в памяти: landing_id -> started_at
-    # сделаем через VALUES-подобный UNION ALL
-    from sqlalchemy import literal, union_all, select
-    parts = []
-    for lid, st in pairs:
-        parts.append(select(literal(lid).label("lid"), literal(st).label("st")))
-    ap = union_all(*parts).alias("ap")
-
-    # COUNT(*) where p.from_ad=1 and p.created_at in [st, least(st+5d, now))
-    now = datetime.utcnow()
-    five = func.date_add(ap.c.st, text("INTERVAL 5 DAY"))
-    win_end = func.least(five, func.utc_timestamp())
-    rows = (
-        db.query(ap.c.lid, func.count(Purchase.id))
-          .join(Purchase, and_(
-              Purchase.landing_id == ap.c.lid,
-              Purchase.from_ad.is_(True),
-              Purchase.created_at >= ap.c.st,
-              Purchase.created_at <  win_end,
-          ))
-          .group_by(ap.c.lid)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-def _ad_sales_last10_map(db: Session, landing_ids: list[int]) -> dict[int, int]:
-    if not landing_ids:
-        return {}
-    now = datetime.utcnow()
-    win_start = now - timedelta(days=10)
-    rows = (
-        db.query(Purchase.landing_id, func.count(Purchase.id))
-          .filter(
-              Purchase.landing_id.in_(landing_ids),
-              Purchase.from_ad.is_(True),
-              Purchase.created_at >= win_start,
-              Purchase.created_at <  now,
-          )
-          .group_by(Purchase.landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-def _ad_visits_last10_map(db: Session, landing_ids: list[int]) -> dict[int, int]:
-    """Посещения с рекламы за последние 10 дней (AV10d)."""
-    if not landing_ids:
-        return {}
-    now = datetime.utcnow()
-    win_start = now - timedelta(days=10)
-    rows = (
-        db.query(AdVisit.landing_id, func.count(AdVisit.id))
-          .filter(
-              AdVisit.landing_id.in_(landing_ids),
-              AdVisit.visited_at >= win_start,
-              AdVisit.visited_at <  now,
-          )
-          .group_by(AdVisit.landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-def _total_purchases_last10_map(db: Session, landing_ids: list[int]) -> dict[int, int]:
-    """Все покупки (рекламные и нерекламные) за последние 10 дней (TP10d)."""
-    if not landing_ids:
-        return {}
-    now = datetime.utcnow()
-    win_start = now - timedelta(days=10)
-    rows = (
-        db.query(Purchase.landing_id, func.count(Purchase.id))
-          .filter(
-              Purchase.landing_id.in_(landing_ids),
-              Purchase.created_at >= win_start,
-              Purchase.created_at <  now,
-          )
-          .group_by(Purchase.landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
 def _q_color(days:int, any_sale:bool) -> str:
     if any_sale:
         return "green"
@@ -144,103 +32,13 @@ def _o_color(sales10:int) -> str:
         return "orange"
     return "green"
 
-GRACE_HOURS = 14
-
-def _merge_periods(periods, now: datetime) -> list[tuple[datetime, datetime|None]]:
-    """
-    periods: [(started_at, ended_at or None)] отсортированные по started_at.
-    Склеиваем соседние, если gap <= GRACE_HOURS.
-    """
-    if not periods:
-        return []
-    grace = timedelta(hours=GRACE_HOURS)
-    merged = []
-    cur_start, cur_end = periods[0][0], periods[0][1] or now
-
-    for st, en in periods[1:]:
-        st2, en2 = st, (en or now)
-        # если перерыв между cur_end и st2 небольшой — склеиваем
-        if st2 - cur_end <= grace:
-            # расширяем конец
-            cur_end = max(cur_end, en2)
-        else:
-            merged.append((cur_start, cur_end))
-            cur_start, cur_end = st2, en2
-    merged.append((cur_start, cur_end))
-    return merged
-
-def _effective_cycle_count_map(db: Session, landing_ids: list[int]) -> dict[int, int]:
-    """
-    Количество СКЛЕЕННЫХ эпизодов рекламы (а не сырых периодов).
-    """
-    if not landing_ids:
-        return {}
-    rows = (
-        db.query(
-            LandingAdPeriod.landing_id,
-            LandingAdPeriod.started_at,
-            LandingAdPeriod.ended_at,
-        )
-        .filter(LandingAdPeriod.landing_id.in_(landing_ids))
-        .order_by(LandingAdPeriod.landing_id.asc(), LandingAdPeriod.started_at.asc())
-        .all()
-    )
-    now = datetime.utcnow()
-    by_lid: dict[int, list[tuple[datetime, datetime|None]]] = {}
-    for lid, st, en in rows:
-        by_lid.setdefault(lid, []).append((st, en))
-
-    out: dict[int, int] = {}
-    for lid, periods in by_lid.items():
-        merged = _merge_periods(periods, now)
-        out[lid] = len(merged)
-    return out
-
-def _active_episode_start_map(db: Session, landing_ids: list[int]) -> dict[int, datetime]:
-    """
-    Для тех, у кого сейчас реклама (есть open-период ended_at IS NULL),
-    возвращает НАЧАЛО СКЛЕЕННОГО эпизода (первое started_at с учётом склейки).
-    """
-    if not landing_ids:
-        return {}
-    now = datetime.utcnow()
-
-    # грузим все периоды по нужным лендингам
-    rows = (
-        db.query(
-            LandingAdPeriod.landing_id,
-            LandingAdPeriod.started_at,
-            LandingAdPeriod.ended_at,
-        )
-        .filter(LandingAdPeriod.landing_id.in_(landing_ids))
-        .order_by(LandingAdPeriod.landing_id.asc(), LandingAdPeriod.started_at.asc())
-        .all()
-    )
-
-    by_lid: dict[int, list[tuple[datetime, datetime|None]]] = {}
-    for lid, st, en in rows:
-        by_lid.setdefault(lid, []).append((st, en))
-
-    episode_start: dict[int, datetime] = {}
-    for lid, periods in by_lid.items():
-        merged = _merge_periods(periods, now)
-        if not merged:
-            continue
-        # активный эпизод = последний в склеенном списке, если сейчас есть open-период
-        # проверим: есть ли open-период вообще (с ended_at IS NULL)
-        has_open = any(en is None for _, en in periods)
-        if has_open:
-            start, _ = merged[-1]
-            episode_start[lid] = start
-    return episode_start
-
 from typing import Optional, List, Literal
 from fastapi import Query, Depends, HTTPException
-from datetime import datetime, timedelta
+from datetime import timedelta
 from sqlalchemy.orm import Session
 from ..dependencies.role_checker import require_roles
 from ..db.database import get_db
-from ..models.models_v2 import User, Landing, LandingAdAssignment
+from ..models.models_v2 import User, LandingAdAssignment
 
 ColorLiteral = Literal["white", "orange", "red", "green"]
 
@@ -276,64 +74,39 @@ def ads_quarantine_list(
     db: Session = Depends(get_db),
     current_admin: User = Depends(require_roles("admin")),
 ):
-    now = datetime.utcnow()
-
-    rows = _active_ad_periods(db, language)  # [(Landing, started_at_of_open_period)]
-    if not rows:
-        return {"items": [], "as_of": now.isoformat() + "Z"}
-
-    landing_ids = [l.id for (l, _) in rows]
-
-    # 1) начало СКЛЕЕННОГО эпизода
-    episode_start_map = _active_episode_start_map(db, landing_ids)
-
-    # 2) корректный счётчик кругов
-    cycles_map = _effective_cycle_count_map(db, landing_ids)
-
-    # 3) продажи в первые 5 дней от СКЛЕЕННОГО начала
-    pairs = [(l.id, episode_start_map.get(l.id)) for (l, _) in rows if episode_start_map.get(l.id)]
-    first5_map = _ad_sales_first5_map(db, pairs)
-
-    # 4) назначения + словари имён (одним батчем)
-    assign_rows = db.query(LandingAdAssignment).filter(LandingAdAssignment.landing_id.in_(landing_ids)).all()
-    assign_map = {a.landing_id: a for a in assign_rows}
-    staff_ids = [a.staff_id for a in assign_rows if a.staff_id is not None]
-    acc_ids = [a.account_id for a in assign_rows if a.account_id is not None]
-    staff_name_map = {s.id: s.name for s in db.query(AdStaff).filter(AdStaff.id.in_(staff_ids)).all()} if staff_ids else {}
-    acc_name_map = {a.id: a.name for a in db.query(AdAccount).filter(AdAccount.id.in_(acc_ids)).all()} if acc_ids else {}
+    # 1-4) склеенный старт, круги, first5, назначения — один снимок (services_v2.ad_performance)
+    snap = ad_performance.get_snapshot(db, ad_performance.KIND_LANDING)
+    now = snap.as_of
 
     # 5) собираем сырой список
     raw = []
-    for landing, _open_started_at in rows:
-        st = episode_start_map.get(landing.id)
-        if not st:
-            continue
+    for perf in snap.for_language(language):
+        st = perf.stage_started_at
 
         days = (now - st).days  # целые дни
-        first5_cnt = int(first5_map.get(landing.id, 0))
+        first5_cnt = perf.ad_purchases_first_5_days
         in_first5_window = now < (st + timedelta(days=5))
         is_quarantine = in_first5_window or (not in_first5_window and first5_cnt == 0)
         if not is_quarantine:
             continue
 
         color = _q_color(days, any_sale=(first5_cnt > 0))
-        assign = assign_map.get(landing.id)
         q_end = st + timedelta(days=5)
 
-        cycle_no = int(cycles_map.get(landing.id, 0))  # гарантируем int
-
         raw.append({
-            "id": landing.id,
-            "landing_name": landing.landing_name,
-            "language": landing.language,
-            "cycle_no": cycle_no,
+            "id": perf.id,
+            "landing_name": perf.landing_name,
+            "language": perf.language,
+            "cycle_no": perf.cycle_no,
             "stage_started_dt": st,
             "quarantine_ends_dt": q_end,
             "days_in_stage": int(days),
             "ad_purchases_first_5_days": first5_cnt,
             "color": color,
-            "staff_id": getattr(assign, "staff_id", None),
-            "account_id": getattr(assign, "account_id", None),
+            "staff_id": perf.staff_id,
+            "staff_name": perf.staff_name,
+            "account_id": perf.account_id,
+            "account_name": perf.account_name,
         })
 
     # 6) фильтры (инклюзивные границы)
@@ -408,9 +181,9 @@ def ads_quarantine_list(
             "color": r["color"],
             "assignee": {
                 "staff_id": sid,
-                "staff_name": staff_name_map.get(sid, DEFAULT_STAFF_NAME) if sid is not None else DEFAULT_STAFF_NAME,
+                "staff_name": r["staff_name"] or DEFAULT_STAFF_NAME,
                 "account_id": aid,
-                "account_name": acc_name_map.get(aid, DEFAULT_ACCOUNT_NAME) if aid is not None else DEFAULT_ACCOUNT_NAME,
+                "account_name": r["account_name"] or DEFAULT_ACCOUNT_NAME,
             }
         })
 
@@ -439,62 +212,32 @@ def ads_observation_list(
     db: Session = Depends(get_db),
     current_admin: User = Depends(require_roles("admin")),
 ):
-    now = datetime.utcnow()
-
-    rows = _active_ad_periods(db, language)
-    if not rows:
-        return {"items": [], "as_of": now.isoformat() + "Z"}
-
-    landing_ids = [l.id for (l, _) in rows]
-    episode_start_map = _active_episode_start_map(db, landing_ids)
-    cycles_map = _effective_cycle_count_map(db, landing_ids)
-
-    pairs = [(l.id, episode_start_map.get(l.id)) for (l, _) in rows if episode_start_map.get(l.id)]
-    first5_map = _ad_sales_first5_map(db, pairs)
-
-    # кандидаты в наблюдение
-    obs_ids = [
-        l.id for (l, _st) in rows
-        if (episode_start_map.get(l.id) is not None
-            and now >= episode_start_map[l.id] + timedelta(days=5)
-            and int(first5_map.get(l.id, 0)) >= 1)
-    ]
-    if not obs_ids:
-        return {"items": [], "as_of": now.isoformat() + "Z"}
-
-    last10_map = _ad_sales_last10_map(db, obs_ids)
-
-    # назначения + имена
-    assign_rows = db.query(LandingAdAssignment).filter(LandingAdAssignment.landing_id.in_(obs_ids)).all()
-    assign_map = {a.landing_id: a for a in assign_rows}
-    staff_ids = [a.staff_id for a in assign_rows if a.staff_id is not None]
-    acc_ids = [a.account_id for a in assign_rows if a.account_id is not None]
-    staff_name_map = {s.id: s.name for s in db.query(AdStaff).filter(AdStaff.id.in_(staff_ids)).all()} if staff_ids else {}
-    acc_name_map = {a.id: a.name for a in db.query(AdAccount).filter(AdAccount.id.in_(acc_ids)).all()} if acc_ids else {}
-
-    # сырые строки
+    snap = ad_performance.get_snapshot(db, ad_performance.KIND_LANDING)
+    now = snap.as_of
+
+    # сырые строки: кандидаты в наблюдение — прошли 5 дней и была ad-продажа в первые 5
     raw = []
-    for (landing, _st_open) in rows:
-        if landing.id not in obs_ids:
+    for perf in snap.for_language(language):
+        st = perf.stage_started_at
+        if now < st + timedelta(days=5) or perf.ad_purchases_first_5_days < 1:
             continue
-        st = episode_start_map[landing.id]
         days = (now - st).days
-        sales10 = int(last10_map.get(landing.id, 0))
+        sales10 = perf.ad_purchases_last_10_days
         color = _o_color(sales10)
-        assign = assign_map.get(landing.id)
-        cycle_no = int(cycles_map.get(landing.id, 0))
 
         raw.append({
-            "id": landing.id,
-            "landing_name": landing.landing_name,
-            "language": landing.language,
-            "cycle_no": cycle_no,
+            "id": perf.id,
+            "landing_name": perf.landing_name,
+            "language": perf.language,
+            "cycle_no": perf.cycle_no,
             "stage_started_dt": st,
             "days_in_stage": int(days),
             "ad_purchases_last_10_days": sales10,
             "color": color,
-            "staff_id": getattr(assign, "staff_id", None),
-            "account_id": getattr(assign, "account_id", None),
+            "staff_id": perf.staff_id,
+            "staff_name": perf.staff_name,
+            "account_id": perf.account_id,
+            "account_name": perf.account_name,
         })
 
     # фильтры (инклюзивные)
@@ -565,9 +308,9 @@ def ads_observation_list(
             "color": r["color"],
             "assignee": {
                 "staff_id": sid,
-                "staff_name": staff_name_map.get(sid, DEFAULT_STAFF_NAME) if sid is not None else DEFAULT_STAFF_NAME,
+                "staff_name": r["staff_name"] or DEFAULT_STAFF_NAME,
                 "account_id": aid,
-                "account_name": acc_name_map.get(aid, DEFAULT_ACCOUNT_NAME) if aid is not None else DEFAULT_ACCOUNT_NAME,
+                "account_name": r["account_name"] or DEFAULT_ACCOUNT_NAME,
             }
         })
 
@@ -591,7 +334,7 @@ def create_ad_staff(payload: StaffIn, db: Session = Depends(get_db), current_adm
 def update_ad_staff(staff_id: int, payload: StaffIn, db: Session = Depends(get_db), current_admin: User = Depends(require_roles("admin"))):
     row = db.query(AdStaff).get(staff_id)
     if not row: raise HTTPException(404, "Staff not found")
-    row.name = payload.name; db.commit(); return {"ok": True}
+    row.name = payload.name; db.commit(); ad_performance.invalidate(); return {"ok": True}
 
 @router.delete("/ads/staff/{staff_id}", status_code=204)
 def delete_ad_staff(staff_id: int, db: Session = Depends(get_db), current_admin: User = Depends(require_roles("admin"))):
@@ -608,6 +351,7 @@ def delete_ad_staff(staff_id: int, db: Session = Depends(get_db), current_admin:
     try:
         db.delete(row)
         db.commit()
+        ad_performance.invalidate()
     except IntegrityError:
         db.rollback()
         # На случай, если есть другие таблицы с FK — сообщим аккуратно
@@ -633,7 +377,7 @@ def create_ad_account(payload: AccountIn, db: Session = Depends(get_db), current
 def update_ad_account(account_id: int, payload: AccountIn, db: Session = Depends(get_db), current_admin: User = Depends(require_roles("admin"))):
     row = db.query(AdAccount).get(account_id)
     if not row: raise HTTPException(404, "Account not found")
-    row.name = payload.name; db.commit(); return {"ok": True}
+    row.name = payload.name; db.commit(); ad_performance.invalidate(); return {"ok": True}
 
 @router.delete("/ads/accounts/{account_id}", status_code=204)
 def delete_ad_account(account_id: int, db: Session = Depends(get_db), current_admin: User = Depends(require_roles("admin"))):
@@ -650,6 +394,7 @@ def delete_ad_account(account_id: int, db: Session = Depends(get_db), current_ad
     try:
         db.delete(row)
         db.commit()
+        ad_performance.invalidate()
     except IntegrityError:
         db.rollback()
         raise HTTPException(409, "Cannot delete account: still referenced elsewhere")
@@ -682,58 +427,12 @@ def set_assignment(landing_id: int, payload: AssignmentIn, db: Session = Depends
         a.staff_id = payload.staff_id
         a.account_id = payload.account_id
     db.commit()
+    ad_performance.invalidate(ad_performance.KIND_LANDING)
     return {"ok": True}
 
 # добавили black для особого случая
 OverviewColor = Literal["white", "orange", "red", "green", "black"]
 
-WHITE_DAYS_THRESHOLD = 5  # < 5 дней от старта => white
-
-def _ad_sales_lifetime_map(db: Session, landing_ids: list[int]) -> dict[int, int]:
-    if not landing_ids:
-        return {}
-    rows = (
-        db.query(Purchase.landing_id, func.count(Purchase.id))
-          .filter(
-              Purchase.landing_id.in_(landing_ids),
-              Purchase.from_ad.is_(True),
-          )
-          .group_by(Purchase.landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-def _hours_left_map(db: Session, landing_ids: list[int], now: datetime) -> dict[int, Optional[int]]:
-    if not landing_ids:
-        return {}
-    rows = (
-        db.query(Landing.id, Landing.ad_flag_expires_at)
-          .filter(Landing.id.in_(landing_ids))
-          .all()
-    )
-    out: dict[int, Optional[int]] = {}
-    for lid, exp in rows:
-        if exp is None:
-            out[lid] = None
-        else:
-            diff = exp - now
-            # округляем в сторону нуля (как TIMESTAMPDIFF HOUR делает по целым границам)
-            out[lid] = int(diff.total_seconds() // 3600)
-    return out
-
-def _overview_color(now: datetime, stage_start: datetime, sales10: int, lifetime_sales: int) -> OverviewColor:
-    # приоритет белого — если эпизод начался < 5 дней назад
-    if (now - stage_start).days < WHITE_DAYS_THRESHOLD:
-        return "white"
-    if sales10 > 3:
-        return "green"
-    if 1 <= sales10 <= 3:
-        return "orange"
-    # sales10 == 0
-    if lifetime_sales > 3:
-        return "black"
-    return "red"
-
 @router.get("/ads/overview")
 def ads_overview_list(
     language: Optional[str] = Query(None, description="EN/RU/…; пусто = все"),
@@ -758,79 +457,38 @@ def ads_overview_list(
     db: Session = Depends(get_db),
     current_admin: User = Depends(require_roles("admin")),
 ):
-    now = datetime.utcnow()
-
-    # только те, кто сейчас помечен "в рекламе", как в вашем примере SQL
-    base = (
-        db.query(Landing, LandingAdPeriod.started_at)
-          .join(LandingAdPeriod, LandingAdPeriod.landing_id == Landing.id)
-          .filter(
-              Landing.in_advertising.is_(True),
-              LandingAdPeriod.ended_at.is_(None),
-          )
-    )
-    if language:
-        base = base.filter(Landing.language == language.upper().strip())
-
-    rows = base.all()  # [(Landing, started_at_of_open_period)]
-    if not rows:
-        return {"items": [], "as_of": now.isoformat() + "Z"}
-
-    landing_ids = [l.id for (l, _) in rows]
-
-    # 1) склеённое начало активного эпизода
-    episode_start_map = _active_episode_start_map(db, landing_ids)
-
-    # 2) продажи: рекламные за 10 дней + за всё время
-    sales10_map = _ad_sales_last10_map(db, landing_ids)
-    lifetime_map = _ad_sales_lifetime_map(db, landing_ids)
-
-    # 3) посещения с рекламы за последние 10 дней
-    visits10_map = _ad_visits_last10_map(db, landing_ids)
-
-    # 4) все покупки за последние 10 дней
-    total_purchases10_map = _total_purchases_last10_map(db, landing_ids)
-
-    # 5) назначения + имена
-    assign_rows = db.query(LandingAdAssignment).filter(LandingAdAssignment.landing_id.in_(landing_ids)).all()
-    assign_map = {a.landing_id: a for a in assign_rows}
-    staff_ids = [a.staff_id for a in assign_rows if a.staff_id is not None]
-    acc_ids = [a.account_id for a in assign_rows if a.account_id is not None]
-    staff_name_map = {s.id: s.name for s in db.query(AdStaff).filter(AdStaff.id.in_(staff_ids)).all()} if staff_ids else {}
-    acc_name_map = {a.id: a.name for a in db.query(AdAccount).filter(AdAccount.id.in_(acc_ids)).all()} if acc_ids else {}
+    # 1-5) склеённый старт эпизода, продажи/посещения за 10 дней и за всё время,
+    # назначения + имена — один снимок (services_v2.ad_performance)
+    snap = ad_performance.get_snapshot(db, ad_performance.KIND_LANDING)
+    now = snap.as_of
 
     # 6) собираем сырые строки
     raw = []
-    for landing, _st_open in rows:
-        st = episode_start_map.get(landing.id)
-        if not st:
-            continue  # на всякий случай
-
+    for perf in snap.for_language(language):
+        st = perf.stage_started_at
         days = (now - st).days
-        s10 = int(sales10_map.get(landing.id, 0))
-        life = int(lifetime_map.get(landing.id, 0))
-        color = _overview_color(now, st, s10, life)
-
-        assign = assign_map.get(landing.id)
-        av10d = int(visits10_map.get(landing.id, 0))
-        tp10d = int(total_purchases10_map.get(landing.id, 0))
+        s10 = perf.ad_purchases_last_10_days
+        life = perf.ad_purchases_lifetime
+        color = ad_performance.overview_color(now, st, s10, life)
 
         raw.append({
-            "id": landing.id,
-            "landing_name": landing.landing_name,
-            "language": landing.language,
+            "id": perf.id,
+            "landing_name": perf.landing_name,
+            "language": perf.language,
             "stage_started_dt": st,
             "days_in_stage": int(days),
             # Visits
-            "ad_visits_last_10_days": av10d,
+            "ad_visits_last_10_days": perf.ad_visits_last_10_days,
             # Purchases
             "ad_purchases_last_10_days": s10,
-            "total_purchases_last_10_days": tp10d,
+            "total_purchases_last_10_days": perf.total_purchases_last_10_days,
             "ad_purchases_lifetime": life,
-            "total_purchases_lifetime": landing.sales_count or 0,
+            "total_purchases_lifetime": perf.sales_count,
             "color": color,
-            "staff_id": getattr(assign, "staff_id", None),
-            "account_id": getattr(assign, "account_id", None),
+            "staff_id": perf.staff_id,
+            "staff_name": perf.staff_name,
+            "account_id": perf.account_id,
+            "account_name": perf.account_name,
         })
 
     # 7) фильтры
@@ -924,9 +582,9 @@ def ads_overview_list(
             # Assignee
             "assignee": {
                 "staff_id": sid,
-                "staff_name": staff_name_map.get(sid, DEFAULT_STAFF_NAME) if sid is not None else DEFAULT_STAFF_NAME,
+                "staff_name": r["staff_name"] or DEFAULT_STAFF_NAME,
                 "account_id": aid,
-                "account_name": acc_name_map.get(aid, DEFAULT_ACCOUNT_NAME) if aid is not None else DEFAULT_ACCOUNT_NAME,
+                "account_name": r["account_name"] or DEFAULT_ACCOUNT_NAME,
             }
         })
 
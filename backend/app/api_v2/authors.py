@@ -5,7 +5,7 @@ from math import ceil
 from typing import List, Optional, Set, Dict
 
 from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy import text, func, cast, Numeric as SqlNumeric, or_
+from sqlalchemy import text, func, or_
 from sqlalchemy.orm import Session, selectinload
 
 from ..db.database import get_db
@@ -23,9 +23,8 @@ from ..services_v2.author_service import (
     get_author_detail, create_author, update_author,
     delete_author, get_author_full_detail, list_authors_by_page, list_authors_search_paginated
 )
-from ..services_v2.filter_aggregation_service import (
-    build_author_base_query, aggregate_author_filters
-)
+from ..services_v2.facet_engine import facet_author_filters
+from ..services_v2.catalog_snapshot import get_catalog_snapshot
 
 router = APIRouter()
 
@@ -325,7 +324,7 @@ def _calculate_author_stats(
     # 1) Минимальная цена по каждому курсу
     min_price_by_course: Dict[int, float] = {}
     for l in visible_landings:
-        price = _safe_price(l.new_price)
+        price = _safe_price(l.new_price_num)
         for c in (l.courses or []):
             cid = c.id
             if cid not in min_price_by_course or price < min_price_by_course[cid]:
@@ -334,7 +333,7 @@ def _calculate_author_stats(
     # 2) Оставляем только «дешёвые» лендинги (без дубликатов по курсам) - для расчёта цены
     kept_landings: List[Landing] = []
     for l in visible_landings:
-        price = _safe_price(l.new_price)
+        price = _safe_price(l.new_price_num)
         has_cheaper_alt = any(
             price > min_price_by_course.get(c.id, price)
             for c in (l.courses or [])
@@ -342,10 +341,10 @@ def _calculate_author_stats(
         if not has_cheaper_alt:
             kept_landings.append(l)
     
-    # 3) Уникальные курсы из ВСЕХ видимых лендингов (не только kept_landings!)
-    # Это для правильного подсчёта courses_count
-    unique_course_ids: Set[int] = {c.id for l in visible_landings for c in (l.courses or [])}
-    # Теги тоже из всех видимых лендингов
+    # 3) courses_count / books_count — предпосчитанные счётчики снапшота
+    #    (уникальные курсы ВСЕХ видимых лендингов, книги с видимыми лендингами)
+    counters = get_catalog_snapshot(db).author_counters(author.id, lang_filter)
+    # Теги — из всех видимых лендингов
     tags_from_landings: Set[str] = {t.name for l in visible_landings for t in (l.tags or [])}
     
     # 4) Книги с видимыми BookLanding
@@ -363,8 +362,6 @@ def _calculate_author_stats(
             if min_bl_price != float("inf"):
                 min_price_by_book[b.id] = min_bl_price
     
-    books_count = len(visible_books)
-    
     # Теги из книг
     tags_from_books: Set[str] = {t.name for b in (author.books or []) for t in (getattr(b, 'tags', []) or [])}
     all_tags = tags_from_landings | tags_from_books
@@ -388,8 +385,8 @@ def _calculate_author_stats(
                 popularity += (bl.sales_count or 0)
     
     return {
-        "courses_count": len(unique_course_ids),
-        "books_count": books_count,
+        "courses_count": counters.courses,
+        "books_count": counters.books,
         "total_min_price": round(total_min_price, 2) if total_min_price > 0 else None,
         "popularity": popularity,
         "tags": sorted(all_tags),
@@ -749,12 +746,12 @@ def author_cards_v2(
     price_courses_q = (
         db.query(
             landing_authors.c.author_id,
-            func.coalesce(func.sum(cast(Landing.new_price, SqlNumeric(10, 2))), 0).label('courses_price')
+            func.coalesce(func.sum(Landing.new_price_num), 0).label('courses_price')
         )
         .select_from(landing_authors)
         .join(Landing, landing_authors.c.landing_id == Landing.id)
         .filter(Landing.is_hidden.is_(False))
-        .filter(Landing.new_price.isnot(None))
+        .filter(Landing.new_price_num.isnot(None))
     )
     if language:
         price_courses_q = price_courses_q.filter(Landing.language == language.upper())
@@ -763,7 +760,7 @@ def author_cards_v2(
     price_books_q = (
         db.query(
             book_authors.c.author_id,
-            func.coalesce(func.sum(cast(BookLanding.new_price, SqlNumeric(10, 2))), 0).label('books_price')
+            func.coalesce(func.sum(BookLanding.new_price), 0).label('books_price')
         )
         .select_from(book_authors)
         .join(Book, book_authors.c.book_id == Book.id)
@@ -875,21 +872,7 @@ def author_cards_v2(
     # Получаем метаданные фильтров, если запрошено
     filters_metadata = None
     if include_filters:
-        base_for_filters = build_author_base_query(
-            db=db,
-            language=language,
-            tags=tags,
-            courses_from=courses_from,
-            courses_to=courses_to,
-            books_from=books_from,
-            books_to=books_to,
-            q=q,
-        )
-        filters_metadata = aggregate_author_filters(
-            db=db,
-            base_query=base_for_filters,
-            current_filters=current_filters
-        )
+        filters_metadata = facet_author_filters(db=db, current_filters=current_filters)
     
     # Загружаем авторов с необходимыми связями
     authors = (
@@ -1,232 +1,24 @@
 # app/api_v2/book_ad_control.py
 # Аналитика рекламы для книжных лендингов
 
-from datetime import datetime, timedelta, date
+from datetime import date
 from typing import Optional, List, Literal
 
 from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from pymysql import IntegrityError
-from sqlalchemy import func, text, and_
 from sqlalchemy.orm import Session
 
 from ..db.database import get_db
 from ..dependencies.role_checker import require_roles
-from ..models.models_v2 import (
-    BookLandingAdAssignment, AdAccount, User, AdStaff, Purchase,
-    BookLandingAdPeriod, BookLanding, BookAdVisit
-)
+from ..models.models_v2 import BookLandingAdAssignment, AdAccount, User, AdStaff
 from ..services_v2.book_service import reset_expired_book_ad_flags
+from ..services_v2 import ad_performance
 
 router = APIRouter()
 
 DEFAULT_STAFF_NAME = "Не назначен"
 DEFAULT_ACCOUNT_NAME = "Не указан"
-GRACE_HOURS = 14  # для склейки периодов
-WHITE_DAYS_THRESHOLD = 5  # < 5 дней => white
-
-# ============================================================================
-# Вспомогательные функции для аналитики
-# ============================================================================
-
-def _active_book_ad_periods(db: Session, language: Optional[str] = None):
-    """
-    Возвращает список (BookLanding, started_at) только для тех, кто сейчас в рекламе,
-    по активной записи book_landing_ad_periods (ended_at IS NULL).
-    """
-    q = (
-        db.query(BookLanding, BookLandingAdPeriod.started_at)
-          .join(BookLandingAdPeriod, BookLandingAdPeriod.book_landing_id == BookLanding.id)
-          .filter(
-              BookLanding.in_advertising.is_(True),
-              BookLandingAdPeriod.ended_at.is_(None),
-          )
-    )
-    if language:
-        q = q.filter(BookLanding.language == language.upper().strip())
-    return q.all()
-
-
-def _merge_periods(periods, now: datetime) -> list[tuple[datetime, datetime|None]]:
-    """
-    periods: [(started_at, ended_at or None)] отсортированные по started_at.
-    Склеиваем соседние, если gap <= GRACE_HOURS.
-    """
-    if not periods:
-        return []
-    grace = timedelta(hours=GRACE_HOURS)
-    merged = []
-    cur_start, cur_end = periods[0][0], periods[0][1] or now
-
-    for st, en in periods[1:]:
-        st2, en2 = st, (en or now)
-        if st2 - cur_end <= grace:
-            cur_end = max(cur_end, en2)
-        else:
-            merged.append((cur_start, cur_end))
-            cur_start, cur_end = st2, en2
-    merged.append((cur_start, cur_end))
-    return merged
-
-
-def _effective_book_cycle_count_map(db: Session, book_landing_ids: list[int]) -> dict[int, int]:
-    """
-    Количество СКЛЕЕННЫХ эпизодов рекламы (а не сырых периодов).
-    """
-    if not book_landing_ids:
-        return {}
-    rows = (
-        db.query(
-            BookLandingAdPeriod.book_landing_id,
-            BookLandingAdPeriod.started_at,
-            BookLandingAdPeriod.ended_at,
-        )
-        .filter(BookLandingAdPeriod.book_landing_id.in_(book_landing_ids))
-        .order_by(BookLandingAdPeriod.book_landing_id.asc(), BookLandingAdPeriod.started_at.asc())
-        .all()
-    )
-    now = datetime.utcnow()
-    by_lid: dict[int, list[tuple[datetime, datetime|None]]] = {}
-    for lid, st, en in rows:
-        by_lid.setdefault(lid, []).append((st, en))
-
-    out: dict[int, int] = {}
-    for lid, periods in by_lid.items():
-        merged = _merge_periods(periods, now)
-        out[lid] = len(merged)
-    return out
-
-
-def _active_book_episode_start_map(db: Session, book_landing_ids: list[int]) -> dict[int, datetime]:
-    """
-    Для тех, у кого сейчас реклама (есть open-период ended_at IS NULL),
-    возвращает НАЧАЛО СКЛЕЕННОГО эпизода (первое started_at с учётом склейки).
-    """
-    if not book_landing_ids:
-        return {}
-    now = datetime.utcnow()
-
-    rows = (
-        db.query(
-            BookLandingAdPeriod.book_landing_id,
-            BookLandingAdPeriod.started_at,
-            BookLandingAdPeriod.ended_at,
-        )
-        .filter(BookLandingAdPeriod.book_landing_id.in_(book_landing_ids))
-        .order_by(BookLandingAdPeriod.book_landing_id.asc(), BookLandingAdPeriod.started_at.asc())
-        .all()
-    )
-
-    by_lid: dict[int, list[tuple[datetime, datetime|None]]] = {}
-    for lid, st, en in rows:
-        by_lid.setdefault(lid, []).append((st, en))
-
-    episode_start: dict[int, datetime] = {}
-    for lid, periods in by_lid.items():
-        merged = _merge_periods(periods, now)
-        if not merged:
-            continue
-        has_open = any(en is None for _, en in periods)
-        if has_open:
-            start, _ = merged[-1]
-            episode_start[lid] = start
-    return episode_start
-
-
-def _book_ad_sales_last10_map(db: Session, book_landing_ids: list[int]) -> dict[int, int]:
-    """Рекламные продажи книжных лендингов за последние 10 дней."""
-    if not book_landing_ids:
-        return {}
-    now = datetime.utcnow()
-    win_start = now - timedelta(days=10)
-    rows = (
-        db.query(Purchase.book_landing_id, func.count(Purchase.id))
-          .filter(
-              Purchase.book_landing_id.in_(book_landing_ids),
-              Purchase.from_ad.is_(True),
-              Purchase.created_at >= win_start,
-              Purchase.created_at <  now,
-          )
-          .group_by(Purchase.book_landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-
-def _book_ad_visits_last10_map(db: Session, book_landing_ids: list[int]) -> dict[int, int]:
-    """Посещения с рекламы для книжных лендингов за последние 10 дней (AV10d)."""
-    if not book_landing_ids:
-        return {}
-    now = datetime.utcnow()
-    win_start = now - timedelta(days=10)
-    rows = (
-        db.query(BookAdVisit.book_landing_id, func.count(BookAdVisit.id))
-          .filter(
-              BookAdVisit.book_landing_id.in_(book_landing_ids),
-              BookAdVisit.visited_at >= win_start,
-              BookAdVisit.visited_at <  now,
-          )
-          .group_by(BookAdVisit.book_landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-
-def _book_total_purchases_last10_map(db: Session, book_landing_ids: list[int]) -> dict[int, int]:
-    """Все покупки (рекламные и нерекламные) книжных лендингов за последние 10 дней (TP10d)."""
-    if not book_landing_ids:
-        return {}
-    now = datetime.utcnow()
-    win_start = now - timedelta(days=10)
-    rows = (
-        db.query(Purchase.book_landing_id, func.count(Purchase.id))
-          .filter(
-              Purchase.book_landing_id.in_(book_landing_ids),
-              Purchase.created_at >= win_start,
-              Purchase.created_at <  now,
-          )
-          .group_by(Purchase.book_landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-
-def _book_ad_sales_lifetime_map(db: Session, book_landing_ids: list[int]) -> dict[int, int]:
-    """Рекламные продажи книжных лендингов за всё время."""
-    if not book_landing_ids:
-        return {}
-    rows = (
-        db.query(Purchase.book_landing_id, func.count(Purchase.id))
-          .filter(
-              Purchase.book_landing_id.in_(book_landing_ids),
-              Purchase.from_ad.is_(True),
-          )
-          .group_by(Purchase.book_landing_id)
-          .all()
-    )
-    return {lid: int(cnt) for lid, cnt in rows}
-
-
-def _book_overview_color(now: datetime, stage_start: datetime, sales10: int, lifetime_sales: int) -> str:
-    """
-    Определяет цвет для overview книжного лендинга:
-    - white: < 5 дней от старта
-    - green: sales10 > 3
-    - orange: 1 <= sales10 <= 3
-    - black: sales10 == 0 && lifetime_sales > 3
-    - red: sales10 == 0 && lifetime_sales <= 3
-    """
-    if (now - stage_start).days < WHITE_DAYS_THRESHOLD:
-        return "white"
-    if sales10 > 3:
-        return "green"
-    if 1 <= sales10 <= 3:
-        return "orange"
-    # sales10 == 0
-    if lifetime_sales > 3:
-        return "black"
-    return "red"
-
 
 # ============================================================================
 # API Endpoints
@@ -264,80 +56,41 @@ def book_ads_overview_list(
     Общая аналитика по книжным лендингам в рекламе.
     Показывает метрики: посещения, продажи, время в рекламе, цветовую индикацию.
     """
-    now = datetime.utcnow()
-    reset_expired_book_ad_flags(db)
-
-    # только те, кто сейчас помечен "в рекламе"
-    base = (
-        db.query(BookLanding, BookLandingAdPeriod.started_at)
-          .join(BookLandingAdPeriod, BookLandingAdPeriod.book_landing_id == BookLanding.id)
-          .filter(
-              BookLanding.in_advertising.is_(True),
-              BookLandingAdPeriod.ended_at.is_(None),
-          )
-    )
-    if language:
-        base = base.filter(BookLanding.language == language.upper().strip())
-
-    rows = base.all()  # [(BookLanding, started_at_of_open_period)]
-    if not rows:
-        return {"items": [], "as_of": now.isoformat() + "Z"}
-
-    book_landing_ids = [bl.id for (bl, _) in rows]
-
-    # 1) склеённое начало активного эпизода
-    episode_start_map = _active_book_episode_start_map(db, book_landing_ids)
+    if reset_expired_book_ad_flags(db):
+        ad_performance.invalidate(ad_performance.KIND_BOOK_LANDING)
 
-    # 2) продажи: рекламные за 10 дней + за всё время
-    sales10_map = _book_ad_sales_last10_map(db, book_landing_ids)
-    lifetime_map = _book_ad_sales_lifetime_map(db, book_landing_ids)
-
-    # 3) посещения с рекламы за последние 10 дней
-    visits10_map = _book_ad_visits_last10_map(db, book_landing_ids)
-
-    # 4) все покупки за последние 10 дней
-    total_purchases10_map = _book_total_purchases_last10_map(db, book_landing_ids)
-
-    # 5) назначения + имена
-    assign_rows = db.query(BookLandingAdAssignment).filter(BookLandingAdAssignment.book_landing_id.in_(book_landing_ids)).all()
-    assign_map = {a.book_landing_id: a for a in assign_rows}
-    staff_ids = [a.staff_id for a in assign_rows if a.staff_id is not None]
-    acc_ids = [a.account_id for a in assign_rows if a.account_id is not None]
-    staff_name_map = {s.id: s.name for s in db.query(AdStaff).filter(AdStaff.id.in_(staff_ids)).all()} if staff_ids else {}
-    acc_name_map = {a.id: a.name for a in db.query(AdAccount).filter(AdAccount.id.in_(acc_ids)).all()} if acc_ids else {}
+    # 1-5) склеённый старт эпизода, продажи/посещения за 10 дней и за всё время,
+    # назначения + имена — один снимок (services_v2.ad_performance)
+    snap = ad_performance.get_snapshot(db, ad_performance.KIND_BOOK_LANDING)
+    now = snap.as_of
 
     # 6) собираем сырые строки
     raw = []
-    for book_landing, _st_open in rows:
-        st = episode_start_map.get(book_landing.id)
-        if not st:
-            continue
-
+    for perf in snap.for_language(language):
+        st = perf.stage_started_at
         days = (now - st).days
-        s10 = int(sales10_map.get(book_landing.id, 0))
-        life = int(lifetime_map.get(book_landing.id, 0))
-        color = _book_overview_color(now, st, s10, life)
-
-        assign = assign_map.get(book_landing.id)
-        av10d = int(visits10_map.get(book_landing.id, 0))
-        tp10d = int(total_purchases10_map.get(book_landing.id, 0))
+        s10 = perf.ad_purchases_last_10_days
+        life = perf.ad_purchases_lifetime
+        color = ad_performance.overview_color(now, st, s10, life)
 
         raw.append({
-            "id": book_landing.id,
-            "landing_name": book_landing.landing_name,
-            "language": book_landing.language,
+            "id": perf.id,
+            "landing_name": perf.landing_name,
+            "language": perf.language,
             "stage_started_dt": st,
             "days_in_stage": int(days),
             # Visits
-            "ad_visits_last_10_days": av10d,
+            "ad_visits_last_10_days": perf.ad_visits_last_10_days,
             # Purchases
             "ad_purchases_last_10_days": s10,
-            "total_purchases_last_10_days": tp10d,
+            "total_purchases_last_10_days": perf.total_purchases_last_10_days,
             "ad_purchases_lifetime": life,
-            "total_purchases_lifetime": book_landing.sales_count or 0,
+            "total_purchases_lifetime": perf.sales_count,
             "color": color,
-            "staff_id": getattr(assign, "staff_id", None),
-            "account_id": getattr(assign, "account_id", None),
+            "staff_id": perf.staff_id,
+            "staff_name": perf.staff_name,
+            "account_id": perf.account_id,
+            "account_name": perf.account_name,
         })
 
     # 7) фильтры
@@ -431,9 +184,9 @@ def book_ads_overview_list(
             # Assignee
             "assignee": {
                 "staff_id": sid,
-                "staff_name": staff_name_map.get(sid, DEFAULT_STAFF_NAME) if sid is not None else DEFAULT_STAFF_NAME,
+                "staff_name": r["staff_name"] or DEFAULT_STAFF_NAME,
                 "account_id": aid,
-                "account_name": acc_name_map.get(aid, DEFAULT_ACCOUNT_NAME) if aid is not None else DEFAULT_ACCOUNT_NAME,
+                "account_name": r["account_name"] or DEFAULT_ACCOUNT_NAME,
             }
         })
 
@@ -491,6 +244,7 @@ def set_book_assignment(
         a.staff_id = payload.staff_id
         a.account_id = payload.account_id
     db.commit()
+    ad_performance.invalidate(ad_performance.KIND_BOOK_LANDING)
     return {"ok": True}
 
 
@@ -3,26 +3,22 @@
 #  - GET /api/books/{book_id}/download    — выдать presigned URL по формату (PDF/EPUB/...)
 #  - GET /api/books/{book_id}/pdf         — потоковая раздача PDF с поддержкой Range (200 OK → 206 Partial)
 #  - GET /api/books/audios/{audio_id}/download — presigned URL аудиодорожки
-# Требует: users_books, модели Book/BookFile/BookAudio, utils.s3.generate_presigned_url, boto3
+# Требует: users_books, модели Book/BookFile/BookAudio, utils.s3.generate_presigned_url, boto3, httpx
 
 import logging
 from datetime import timedelta
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session, selectinload
 
 from ..db.database import get_db
 from .users import get_current_user
 from ..models.models_v2 import User, Book, BookAudio, BookFileFormat
 from ..utils.s3 import generate_presigned_url
-from ..services_v2.book_service import PDF_CACHE_CONTROL, PDF_CONTENT_DISPOSITION
-
-# S3 client для стриминга
-from ..core.storage import S3_BUCKET, s3_client
-
-s3_client = s3_client(signature_version="s3v4", max_pool_connections=50)
+from ..services_v2 import pdf_range_proxy
+from ..core.storage import S3_BUCKET
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -201,20 +197,7 @@ def download_book_audio(
     return {"url": _sign(audio.s3_url)}
 
 
-@router.get("/{book_id}/pdf", summary="Потоковая раздача PDF с поддержкой Range")
-def stream_book_pdf(
-    book_id: int,
-    request: Request,
-    db: Session = Depends(get_db),
-):
-    """
-    Возвращает PDF с поддержкой HTTP Range, проксируя запрос в S3.
-    
-    Для запросов без Range header возвращает полный файл (200 OK).
-    Для Range запросов возвращает частичный контент (206 Partial Content).
-    """
-    # Загружаем данные из БД и сразу извлекаем нужные значения,
-    # чтобы освободить соединение с БД до начала стриминга
+def _pdf_s3_url(db: Session, book_id: int) -> str:
     book = (
         db.query(Book)
           .options(selectinload(Book.files))
@@ -227,97 +210,31 @@ def stream_book_pdf(
     pdf_file = next((f for f in (book.files or []) if f.file_format == BookFileFormat.PDF), None)
     if not pdf_file or not pdf_file.s3_url:
         raise HTTPException(status_code=404, detail="PDF not found")
-    
-    # Извлекаем s3_url до закрытия сессии
-    s3_url = pdf_file.s3_url
-    
-    # Закрываем DB сессию ПЕРЕД стримингом, чтобы не держать соединение
-    db.close()
+    return pdf_file.s3_url
 
-    key = _s3_key_from_url(s3_url)
 
-    range_header = request.headers.get("range") or request.headers.get("Range")
-    logger.info(f"PDF request for book {book_id}: Range header = {range_header}")
-    
-    # Всегда получаем размер файла через head_object
-    try:
-        head_obj = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
-        file_size = head_obj.get("ContentLength", 0)
-        metadata = head_obj.get("Metadata") or {}
-        logger.info(f"PDF file size: {file_size} bytes ({file_size / 1024 / 1024:.2f} MB)")
-    except s3_client.exceptions.NoSuchKey:  # type: ignore[attr-defined]
-        raise HTTPException(status_code=404, detail="PDF not found")
-    except Exception as e:
-        logger.error("S3 head_object error: %s", e)
-        raise HTTPException(status_code=502, detail="Failed to fetch PDF metadata")
-    
-    get_kwargs = {"Bucket": S3_BUCKET, "Key": key}
-    
-    if range_header:
-        # Если есть Range header от клиента - используем его
-        get_kwargs["Range"] = range_header
-        logger.info(f"Using client Range: {range_header}")
-    else:
-        # Первый запрос без Range - стримим весь файл
-        # PDF.js увидит Accept-Ranges: bytes и МОЖЕТ начать делать Range-запросы
-        # (но это не гарантировано - зависит от настроек PDF.js)
-        logger.info(f"Request without Range header, streaming full file ({file_size} bytes)")
+@router.get("/{book_id}/pdf", summary="Потоковая раздача PDF с поддержкой Range")
+async def stream_book_pdf(
+    book_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    """
+    Возвращает PDF с поддержкой HTTP Range, проксируя запрос в S3 (services_v2.pdf_range_proxy).
 
+    Для запросов без Range header возвращает полный файл (200 OK).
+    Для Range запросов возвращает частичный контент (206 Partial Content),
+    для нескольких диапазонов — multipart/byteranges.
+    If-None-Match с актуальным ETag → 304 без обращения к S3.
+    """
+    # Запрос в БД — в threadpool; сессию закрываем ПЕРЕД стримингом,
+    # чтобы не держать соединение
     try:
-        obj = s3_client.get_object(**get_kwargs)
-    except s3_client.exceptions.NoSuchKey:  # type: ignore[attr-defined]
-        raise HTTPException(status_code=404, detail="PDF not found")
-    except Exception as e:
-        logger.error("S3 get_object error: %s", e)
-        raise HTTPException(status_code=502, detail="Failed to fetch PDF")
-
-    body = obj["Body"]
-    content_type = obj.get("ContentType") or "application/pdf"
-    content_length = obj.get("ContentLength")
-    content_range = obj.get("ContentRange")
-    
-    # Если metadata не получена из head_object, пробуем из get_object
-    if not metadata:
-        metadata = obj.get("Metadata") or {}
-
-    headers = {
-        "Accept-Ranges": "bytes",
-        "Content-Type": content_type,
-        "Content-Disposition": PDF_CONTENT_DISPOSITION,
-        "Cache-Control": PDF_CACHE_CONTROL,
-    }
-    
-    # Если был Range запрос - возвращаем 206 Partial Content
-    # Если не было Range - возвращаем 200 OK, PDF.js увидит Accept-Ranges и начнет делать Range-запросы
-    if content_range:
-        headers["Content-Range"] = content_range
-        headers["Content-Length"] = str(content_length) if content_length else str(0)
-        status_code = 206
-        logger.info(f"Returning 206 Partial Content: {content_range}")
-    else:
-        headers["Content-Length"] = str(file_size)
-        status_code = 200
-        logger.info(f"Returning 200 OK with full Content-Length: {file_size}, PDF.js will use Range requests")
-
-    if metadata.get("asset"):
-        headers["X-Book-Pdf-Asset"] = metadata["asset"]
-    if metadata.get("pages"):
-        headers["X-Book-Preview-Pages"] = metadata["pages"]
-    if metadata.get("book-id"):
-        headers["X-Book-Id"] = metadata["book-id"]
-    if metadata.get("book-slug"):
-        headers["X-Book-Slug"] = metadata["book-slug"]
-
-    # У объекта StreamingBody нет iter_chunks в старых версиях botocore; используем iter_chunks/iter_lines fallbacks
-    iterator = getattr(body, "iter_chunks", None)
-    if callable(iterator):
-        stream_iter = body.iter_chunks()
-    else:
-        stream_iter = iter(lambda: body.read(8192), b"")
+        s3_url = await run_in_threadpool(_pdf_s3_url, db, book_id)
+    finally:
+        db.close()
 
-    return StreamingResponse(
-        stream_iter,
-        status_code=status_code,
-        headers=headers,
-        media_type=content_type,
-    )
+    key = _s3_key_from_url(s3_url)
+    meta = await pdf_range_proxy.get_object_meta(key)
+    logger.debug("PDF request for book %s: Range = %s", book_id, request.headers.get("range"))
+    return await pdf_range_proxy.build_pdf_response(meta, request.headers)
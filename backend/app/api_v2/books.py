@@ -8,7 +8,7 @@ from datetime import datetime, date, time, timedelta
 from decimal import Decimal
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
-from sqlalchemy import or_, desc, func, cast, Integer, Numeric as SqlNumeric
+from sqlalchemy import or_, desc, func
 from sqlalchemy.orm import Session, selectinload
 from pydantic import BaseModel
 
@@ -24,7 +24,6 @@ from ..models.models_v2 import (
     BookLanding,
     BookLandingImage,
     Landing,
-    BookLandingVisit,
     book_authors,
     book_publishers,
     book_tags,
@@ -48,9 +47,10 @@ from ..schemas_v2.landing import LandingListPageResponse, LangEnum, LandingDetai
 from ..schemas_v2.common import AuthorCardResponse, FilterSearchResponse, FilterOption
 from ..services_v2 import book_service
 from ..services_v2.book_service import paginate_like_courses, serialize_book_landing_to_course_item
-from ..services_v2.filter_aggregation_service import (
-    build_book_landing_base_query,
-    aggregate_book_filters
+from ..services_v2.visit_ingest import record_visit, KIND_BOOK_LANDING_VISIT
+from ..services_v2.facet_engine import facet_book_filters
+from ..services_v2.catalog_snapshot import (
+    get_catalog_snapshot, publish_catalog_change, KIND_BOOK, KIND_BOOK_LANDING,
 )
 from ..utils.s3 import generate_presigned_url
 from ..core.storage import S3_PUBLIC_HOST, s3_client
@@ -101,7 +101,9 @@ def create_new_book(
     db: Session = Depends(get_db),
     current_admin: User = Depends(require_roles("admin")),
 ):
-    return book_service.create_book(db, payload)
+    book = book_service.create_book(db, payload)
+    publish_catalog_change(KIND_BOOK, [book.id])
+    return book
 
 
 @router.put("/{book_id}", response_model=BookResponse)
@@ -111,7 +113,9 @@ def update_book_route(
     db: Session = Depends(get_db),
     current_admin: User = Depends(require_roles("admin")),
 ):
-    return book_service.update_book(db, book_id, payload)
+    book = book_service.update_book(db, book_id, payload)
+    publish_catalog_change(KIND_BOOK, [book_id])
+    return book
 
 
 @router.delete("/{book_id}", response_model=dict)
@@ -121,6 +125,7 @@ def delete_book_route(
     current_admin: User = Depends(require_roles("admin")),
 ):
     book_service.delete_book(db, book_id)
+    publish_catalog_change(KIND_BOOK, [book_id])
     return {"detail": "Book deleted successfully"}
 
 
@@ -151,6 +156,7 @@ def create_book_landing(
 
     db.commit()
     db.refresh(landing)
+    publish_catalog_change(KIND_BOOK_LANDING, [landing.id])
     return landing
 
 
@@ -184,6 +190,7 @@ def update_book_landing(
 
     db.commit()
     db.refresh(landing)
+    publish_catalog_change(KIND_BOOK_LANDING, [landing.id])
     return landing
 
 
@@ -195,6 +202,7 @@ def delete_book_landing_route(
     current_admin: User = Depends(require_roles("admin")),
 ):
     book_service.delete_book_landing(db, landing_id)
+    publish_catalog_change(KIND_BOOK_LANDING, [landing_id])
     return {"detail": "Book landing deleted successfully"}
 
 
@@ -235,11 +243,10 @@ def track_book_landing_visit(
 ):
     """
     Отслеживает визит на книжный лендинг.
-    Если from_ad=True и реклама включена, продлевает TTL и открывает период.
+    Визит пишется через буфер (services_v2.visit_ingest); если from_ad=True и
+    реклама включена, при сбросе пачки продлевается TTL и открывается период.
     Визиты от ботов Facebook/Meta игнорируются.
     """
-    from ..services_v2.book_service import open_book_ad_period_if_needed, BOOK_AD_TTL
-    
     exists = db.query(BookLanding.id).filter(BookLanding.id == book_landing_id).first()
     if not exists:
         raise HTTPException(status_code=404, detail="Book landing not found")
@@ -249,42 +256,10 @@ def track_book_landing_visit(
         return {"ok": True, "skipped": "bot"}
 
     payload = payload or BookVisitIn()
-    from_ad = bool(payload.from_ad)
-
-    # 1) фиксируем визит в book_landing_visits
-    db.add(BookLandingVisit(
-        book_landing_id=book_landing_id,
-        from_ad=from_ad,
-    ))
-
-    # 2) если визит рекламный — продлеваем TTL ТОЛЬКО если реклама уже включена
-    if from_ad:
-        from sqlalchemy.exc import OperationalError
-        now = datetime.utcnow()
-        try:
-            book_landing = (
-                db.query(BookLanding)
-                  .filter(BookLanding.id == book_landing_id)
-                  .with_for_update(nowait=True)
-                  .first()
-            )
-        except OperationalError:
-            # Блокировка занята — коммитим визит, пропускаем TTL-обновление
-            db.commit()
-            return {"ok": True}
-        
-        if book_landing and book_landing.in_advertising:
-            # гарантируем открытый период, если вдруг его нет
-            open_book_ad_period_if_needed(db, book_landing_id, started_by=None)
-
-            # продлеваем TTL
-            new_ttl = now + BOOK_AD_TTL
-            if not book_landing.ad_flag_expires_at or book_landing.ad_flag_expires_at < new_ttl:
-                book_landing.ad_flag_expires_at = new_ttl
-
-        # ВАЖНО: если in_advertising == False, НИЧЕГО не включаем и не трогаем период/TTL
 
-    db.commit()
+    # визит уходит в буфер и пишется пачкой; если from_ad и реклама уже
+    # включена — там же продлевается TTL (без row-lock на каждый просмотр)
+    record_visit(db, KIND_BOOK_LANDING_VISIT, book_landing_id, from_ad=bool(payload.from_ad))
     return {"ok": True}
 
 
@@ -444,10 +419,11 @@ def public_book_landing_by_slug(page_name: str, db: Session = Depends(get_db)):
     landing = (
         db.query(BookLanding)
         .options(
+            # теги автора; courses_count/books_count — из счётчиков снапшота
             selectinload(BookLanding.books).selectinload(Book.authors)
-                .selectinload(Author.landings).selectinload(Landing.courses),
+                .selectinload(Author.landings).selectinload(Landing.tags),
             selectinload(BookLanding.books).selectinload(Book.authors)
-                .selectinload(Author.books).selectinload(Book.landings),
+                .selectinload(Author.books).selectinload(Book.tags),
             selectinload(BookLanding.books).selectinload(Book.tags),
             selectinload(BookLanding.books).selectinload(Book.publishers),
             selectinload(BookLanding.books).selectinload(Book.files),
@@ -506,12 +482,6 @@ def public_book_landing_by_slug(page_name: str, db: Session = Depends(get_db)):
     tags: list[str] = list({t.name for b in landing.books for t in b.tags})
 
     # Авторы с полной информацией (как в детальном роуте)
-    def safe_price(val) -> float:
-        try:
-            return float(val) if val is not None else float("inf")
-        except (ValueError, TypeError):
-            return float("inf")
-    
     authors_map: dict[int, Author] = {}
     author_tags_set: dict[int, set[str]] = {}  # теги автора из его курсов и книг
     
@@ -532,50 +502,18 @@ def public_book_landing_by_slug(page_name: str, db: Session = Depends(get_db)):
     authors = []
     lang_filter = [landing.language.upper()] if landing.language else None
     
+    snapshot = get_catalog_snapshot(db)
     for aid, author in authors_map.items():
-        # Подсчёт courses_count и books_count
-        visible_landings = [l for l in (author.landings or []) 
-                           if not l.is_hidden and (not lang_filter or l.language.upper() in lang_filter)]
-        
-        min_price_by_course = {}
-        for l in visible_landings:
-            price = safe_price(l.new_price)
-            for c in (l.courses or []):
-                cid = c.id
-                if cid not in min_price_by_course or price < min_price_by_course[cid]:
-                    min_price_by_course[cid] = price
-        
-        kept_landings = []
-        for l in visible_landings:
-            price = safe_price(l.new_price)
-            if not any(price > min_price_by_course.get(c.id, float("inf")) for c in (l.courses or [])):
-                kept_landings.append(l)
-        
-        course_ids = set()
-        for l in kept_landings:
-            for c in (l.courses or []):
-                if c.id:
-                    course_ids.add(c.id)
-        courses_count = len(course_ids)
-        
-        # Подсчёт books_count
-        books_count = 0
-        for book in (author.books or []):
-            visible_bl = [bl for bl in (book.landings or []) 
-                         if not bl.is_hidden and (not lang_filter or bl.language.upper() in lang_filter)]
-            if visible_bl:
-                price_min = min(safe_price(bl.new_price) for bl in visible_bl)
-                if price_min != float("inf"):
-                    books_count += 1
-        
+        # Счётчики по языку лендинга: курсы без дорогих дублей, книги с ценой
+        counters = snapshot.author_counters(aid, lang_filter)
         authors.append({
             "id": author.id,
             "name": author.name,
             "description": author.description or None,
             "photo": author.photo,
             "language": author.language or None,
-            "courses_count": courses_count,
-            "books_count": books_count,
+            "courses_count": counters.cheapest_courses,
+            "books_count": counters.priced_books,
             "tags": sorted(list(author_tags_set.get(aid, set()))),
         })
 
@@ -616,6 +554,7 @@ def set_book_landing_is_hidden(
     bl.is_hidden = is_hidden
     db.commit()
     db.refresh(bl)
+    publish_catalog_change(KIND_BOOK_LANDING, [bl.id])
     return bl
 
 
@@ -1144,9 +1083,9 @@ def book_landing_cards_v2(
         'q': q,
     }
     
-    # Строим базовый запрос с применением всех фильтров
-    base = build_book_landing_base_query(
-        db=db,
+    # Фильтрация, сортировка и пагинация — по in-process снапшоту каталога
+    snapshot = get_catalog_snapshot(db)
+    total, records = snapshot.query_book_landings(
         language=language,
         tags=tags,
         formats=formats,
@@ -1159,138 +1098,16 @@ def book_landing_cards_v2(
         pages_from=pages_from,
         pages_to=pages_to,
         q=q,
+        sort=sort,
+        offset=(page - 1) * size,
+        limit=size,
     )
-    
-    # Применяем сортировку
-    # Явный CAST к DECIMAL для корректной числовой сортировки в MySQL
-    if sort == "price_asc":
-        base = base.order_by(
-            cast(BookLanding.new_price, SqlNumeric(10, 2)).asc(),
-            BookLanding.id.asc()
-        )
-    elif sort == "price_desc":
-        base = base.order_by(
-            cast(BookLanding.new_price, SqlNumeric(10, 2)).desc(),
-            BookLanding.id.desc()
-        )
-    elif sort == "pages_asc":
-        # Сортировка по сумме страниц - сложнее, используем подзапрос
-        from ..models.models_v2 import book_landing_books
-        subq = (
-            db.query(
-                book_landing_books.c.book_landing_id,
-                func.sum(func.coalesce(Book.page_count, 0)).label('total_pages')
-            )
-            .join(Book, book_landing_books.c.book_id == Book.id)
-            .group_by(book_landing_books.c.book_landing_id)
-            .subquery()
-        )
-        base = base.outerjoin(subq, BookLanding.id == subq.c.book_landing_id)
-        base = base.order_by(
-            func.coalesce(subq.c.total_pages, 0).asc(),
-            BookLanding.id.asc()
-        )
-    elif sort == "pages_desc":
-        from ..models.models_v2 import book_landing_books
-        subq = (
-            db.query(
-                book_landing_books.c.book_landing_id,
-                func.sum(func.coalesce(Book.page_count, 0)).label('total_pages')
-            )
-            .join(Book, book_landing_books.c.book_id == Book.id)
-            .group_by(book_landing_books.c.book_landing_id)
-            .subquery()
-        )
-        base = base.outerjoin(subq, BookLanding.id == subq.c.book_landing_id)
-        base = base.order_by(
-            func.coalesce(subq.c.total_pages, 0).desc(),
-            BookLanding.id.desc()
-        )
-    elif sort == "year_asc":
-        # Сортировка по году публикации (из первой книги)
-        from ..models.models_v2 import book_landing_books
-        # Берем минимальный год из всех книг лендинга
-        subq = (
-            db.query(
-                book_landing_books.c.book_landing_id,
-                func.min(cast(func.left(Book.publication_date, 4), Integer)).label('min_year')
-            )
-            .join(Book, book_landing_books.c.book_id == Book.id)
-            .filter(Book.publication_date.isnot(None))
-            .group_by(book_landing_books.c.book_landing_id)
-            .subquery()
-        )
-        base = base.outerjoin(subq, BookLanding.id == subq.c.book_landing_id)
-        base = base.order_by(
-            subq.c.min_year.is_(None),
-            subq.c.min_year.asc(),
-            BookLanding.id.asc()
-        )
-    elif sort == "year_desc":
-        from ..models.models_v2 import book_landing_books
-        subq = (
-            db.query(
-                book_landing_books.c.book_landing_id,
-                func.max(cast(func.left(Book.publication_date, 4), Integer)).label('max_year')
-            )
-            .join(Book, book_landing_books.c.book_id == Book.id)
-            .filter(Book.publication_date.isnot(None))
-            .group_by(book_landing_books.c.book_landing_id)
-            .subquery()
-        )
-        base = base.outerjoin(subq, BookLanding.id == subq.c.book_landing_id)
-        base = base.order_by(
-            subq.c.max_year.is_(None),
-            subq.c.max_year.desc(),
-            BookLanding.id.desc()
-        )
-    elif sort == "new_asc":
-        base = base.order_by(
-            BookLanding.updated_at.is_(None),
-            BookLanding.updated_at.asc(),
-            BookLanding.id.asc()
-        )
-    elif sort == "new_desc":
-        base = base.order_by(
-            BookLanding.updated_at.is_(None),
-            BookLanding.updated_at.desc(),
-            BookLanding.id.desc()
-        )
-    elif sort == "popular_asc":
-        base = base.order_by(
-            BookLanding.sales_count.is_(None),
-            BookLanding.sales_count.asc(),
-            BookLanding.id.asc()
-        )
-    elif sort == "popular_desc":
-        base = base.order_by(
-            BookLanding.sales_count.is_(None),
-            BookLanding.sales_count.desc(),
-            BookLanding.id.desc()
-        )
-    else:
-        # Дефолтная сортировка - по новизне
-        base = base.order_by(
-            BookLanding.updated_at.is_(None),
-            BookLanding.updated_at.desc(),
-            BookLanding.id.desc()
-        )
-    
-    # Подсчитываем total (для кнопки "Показать XXX результатов")
-    total = base.order_by(None).with_entities(func.count()).scalar() or 0
+    cards = [snapshot.book_landing_card(r) for r in records]
     
     # Получаем метаданные фильтров, если запрошено
     filters_metadata = None
     if include_filters:
-        filters_metadata = aggregate_book_filters(
-            db=db,
-            base_query=base.order_by(None),  # Убираем сортировку для агрегации
-            current_filters=current_filters
-        )
-    
-    # Применяем пагинацию и получаем карточки
-    rows = base.offset((page - 1) * size).limit(size).all()
-    cards = [_serialize_book_card(r) for r in rows]
+        filters_metadata = facet_book_filters(db=db, current_filters=current_filters)
     
     # Формируем ответ
     return BookLandingCardsV2Response(
@@ -1496,6 +1313,7 @@ def patch_book(
 
     db.commit()
     db.refresh(book)
+    publish_catalog_change(KIND_BOOK, [book.id])
 
     files = []
     for f in (book.files or []):
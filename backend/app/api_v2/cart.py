@@ -48,7 +48,7 @@ def _item_price(item: CartItem) -> float:
     if item.price is not None:
         return _safe_price(item.price)
     if item.item_type == CartItemType.LANDING and item.landing:
-        return _safe_price(item.landing.new_price)
+        return _safe_price(item.landing.new_price_num)
     if item.item_type == CartItemType.BOOK and item.book_landing:
         return _safe_price(item.book_landing.new_price)
     return 0.0
@@ -183,7 +183,7 @@ def my_cart(
     # --- суммы: учитываем и LANDING, и BOOK-LANDING
     def _price_of_item(it: CartItem) -> float:
         if it.landing is not None:
-            return _safe_price(it.landing.new_price or 0)
+            return _safe_price(it.landing.new_price_num or 0)
         if it.book_landing is not None:
             return _safe_price(it.book_landing.new_price or 0)
         # fallback: цена из строки item.price (если она у тебя хранится) — опционально
@@ -191,7 +191,7 @@ def my_cart(
 
     total_new = sum(_price_of_item(it) for it in cart.items)
     total_old = sum(
-        _safe_price(it.landing.old_price) if it.landing is not None
+        _safe_price(it.landing.old_price_num) if it.landing is not None
         else _safe_price(it.book_landing.old_price) if it.book_landing is not None
         else 0
         for it in cart.items
@@ -412,9 +412,9 @@ def cart_preview(
     def _safe_str_price(x):  # локально, если _safe_price уже есть — лучше его
         return _safe_price(x) if x is not None else 0.0
 
-    total_new = sum(_safe_str_price(l.new_price) for l in ordered_landings) + \
+    total_new = sum(_safe_str_price(l.new_price_num) for l in ordered_landings) + \
                 sum(_safe_str_price(b.new_price) for b in ordered_book_landings)
-    total_old = sum(_safe_str_price(l.old_price) for l in ordered_landings) + \
+    total_old = sum(_safe_str_price(l.old_price_num) for l in ordered_landings) + \
                 sum(_safe_str_price(b.old_price) for b in ordered_book_landings)
 
     # скидка — только по курсовым
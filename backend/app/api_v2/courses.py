@@ -17,7 +17,7 @@ from ..services_v2.course_service import get_course_detail, update_course
 from ..schemas_v2.course import CourseListResponse, CourseDetailResponse, CourseUpdate, CourseCreate, \
     CourseListPageResponse, CourseDetailResponsePutRequest, LandingOfferInfo, CourseAccessLevel
 from ..services_v2.landing_service import get_cheapest_landing_for_course
-from ..services_v2.preview_service import get_or_schedule_preview
+from ..services_v2.preview_service import get_previews_batch
 
 router = APIRouter()
 
@@ -65,28 +65,36 @@ def _attach_previews_and_trim(
     should_trim: bool,
 ) -> None:
     """
-    • Для каждого урока вызывает get_or_schedule_preview – он сам решит,
-      брать сохранённый кадр или запускать генерацию заново.
+    • Превью всех уроков берутся одним батчем (get_previews_batch): один
+      SELECT, один INSERT новых записей, одна постановка задач генерации;
+      проверка «живости» URL — в фоне, не в запросе.
     • При should_trim=True оставляет video_link только у самого первого урока.
     """
 
+    lessons = [
+        lesson
+        for sec in sections
+        for lesson in next(iter(sec.values()))["lessons"]
+    ]
+    previews = get_previews_batch(
+        db, [lesson["video_link"] for lesson in lessons if lesson.get("video_link")]
+    )
+
     unlocked_shown = False  # нужно, чтобы показать ссылку ровно один раз
-    for sec in sections:
-        _, data = next(iter(sec.items()))
-        for lesson in data["lessons"]:
-            v_link = lesson.get("video_link")
-            if not v_link:
-                continue
+    for lesson in lessons:
+        v_link = lesson.get("video_link")
+        if not v_link:
+            continue
 
-            # всегда проверяем «живость» превью; если его нет – планируем генерацию
-            lesson["preview"] = get_or_schedule_preview(db, v_link)
+        if v_link in previews:
+            lesson["preview"] = previews[v_link]
 
-            # «обрезаем» доступ при partial / special-offer
-            if should_trim:
-                if unlocked_shown:
-                    lesson.pop("video_link", None)
-                else:
-                    unlocked_shown = True
+        # «обрезаем» доступ при partial / special-offer
+        if should_trim:
+            if unlocked_shown:
+                lesson.pop("video_link", None)
+            else:
+                unlocked_shown = True
 
 @router.get("/detail/{course_id}", response_model=CourseDetailResponse)
 def get_course_by_id(
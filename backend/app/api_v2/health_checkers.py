@@ -1,5 +1,5 @@
 # app/api_v2/health_checkers.py
-import asyncio, json, logging
+import asyncio, json
 import time
 from typing import Any, Dict, List, Optional
 
@@ -20,7 +20,8 @@ from botocore.exceptions import ClientError
 from fastapi import APIRouter, HTTPException, Depends, Body
 
 from ..db.database import get_async_db                   # ваша обёртка
-from ..models.models_v2 import Course, Landing        # ваши модели
+from ..models.models_v2 import LessonVideo
+from ..services_v2.lesson_video_index import ENTITY_COURSE
 from ..celery_app import celery
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, s3_client
 
@@ -54,48 +55,23 @@ async def probe_url(session: aiohttp.ClientSession, url: str, timeout: int = 10)
         except Exception:
             return False
 
-# ---------- JSON-парсинг полей моделей ---------- #
+# ---------- строки индекса lesson_videos → элементы ответа ---------- #
 
-def extract_videos_from_course(course: Course) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    if not course.sections:
-        return out
-    try:
-        for sec in course.sections.values():
-            sec_name = sec.get("section_name", "")
-            for lesson in sec.get("lessons", []):
-                out.append(
-                    {
-                        "source": "course",
-                        "course_id": course.id,
-                        "section": sec_name,
-                        "lesson": lesson.get("lesson_name", ""),
-                        "video_link": lesson.get("video_link", ""),
-                    }
-                )
-    except Exception as e:
-        logging.warning("Course %s JSON parse error: %s", course.id, e)
-    return out
-
-
-def extract_videos_from_landing(landing: Landing) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    if not landing.lessons_info:
-        return out
-    try:
-        for item in landing.lessons_info:
-            _, info = next(iter(item.items()))
-            out.append(
-                {
-                    "source": "landing",
-                    "landing_id": landing.id,
-                    "lesson": info.get("name", ""),
-                    "video_link": info.get("link", ""),
-                }
-            )
-    except Exception as e:
-        logging.warning("Landing %s JSON parse error: %s", landing.id, e)
-    return out
+def _video_item(v: LessonVideo) -> Dict[str, Any]:
+    if v.entity_type == ENTITY_COURSE:
+        return {
+            "source": "course",
+            "course_id": v.entity_id,
+            "section": v.section_name or "",
+            "lesson": v.lesson_name or "",
+            "video_link": v.video_url,
+        }
+    return {
+        "source": "landing",
+        "landing_id": v.entity_id,
+        "lesson": v.lesson_name or "",
+        "video_link": v.video_url,
+    }
 
 # --------------------------------------------------------------------------- #
 #                            С т р и м – г е н е р а т о р                    #
@@ -108,18 +84,15 @@ async def broken_videos_stream(db: AsyncSession, concurrency: int = 30):
       2. проверяет их параллельно,
       3. сразу стримит «битые» как элементы JSON-массива.
     """
-    # 1. достаём модели из БД
-    courses  = (await db.scalars(select(Course))).all()
-    landings = (await db.scalars(select(Landing))).all()
-
-    videos: List[Dict[str, Any]] = [
-        *(
-            v for c in courses  for v in extract_videos_from_course(c)  if v["video_link"]
-        ),
-        *(
-            v for l in landings for v in extract_videos_from_landing(l) if v["video_link"]
-        ),
-    ]
+    # 1. ссылки уроков из индекса lesson_videos (без загрузки JSON всех курсов/лендингов)
+    rows = (
+        await db.scalars(
+            select(LessonVideo)
+            .where(LessonVideo.video_url.isnot(None))
+            .order_by(LessonVideo.entity_type, LessonVideo.entity_id, LessonVideo.id)
+        )
+    ).all()
+    videos: List[Dict[str, Any]] = [_video_item(v) for v in rows]
 
     # 2. конвейер проверки
     semaphore = asyncio.Semaphore(concurrency)
@@ -322,4 +295,12 @@ async def trigger_recount():
     if celery is None:
         raise HTTPException(status_code=500, detail="Celery not configured")
     celery.send_task("app.tasks.ensure_hls.recount_hls_counters", queue="special")
-    return {"status": "started"}
\ No newline at end of file
+    return {"status": "started"}
+# ============================================================================
+# Латентность по маршрутам (гистограммы MonitoringMiddleware, текущий воркер)
+# ============================================================================
+
+@router.get("/latency")
+async def route_latency_stats():
+    from ..middlewares.monitoring import latency_snapshot
+    return latency_snapshot()
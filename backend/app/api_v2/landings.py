@@ -12,8 +12,7 @@ from fastapi import APIRouter, Depends, Query, status, HTTPException, Request
 from sqlalchemy import or_
 from fastapi import APIRouter, Depends, Query, status, HTTPException, Request, Body
 from pydantic import BaseModel
-from sqlalchemy import or_, func, cast
-from sqlalchemy.types import Numeric as SqlNumeric
+from sqlalchemy import or_, func
 from sqlalchemy.orm import Session, selectinload, joinedload
 from typing import List, Optional, Dict, Literal, Union
 from math import ceil
@@ -25,33 +24,31 @@ _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True)
 LANDING_CACHE_TTL = 180  # 2 минуты кэша
 from ..dependencies.auth import get_current_user, get_current_user_optional
 from ..dependencies.role_checker import require_roles
-from ..models.models_v2 import User, Tag, Landing, Author, LandingVisit, Purchase, LandingAdPeriod, \
-    BookLanding, BookLandingVisit, BookLandingAdPeriod
+from ..models.models_v2 import User, Tag, Landing, Author, LandingAdPeriod, \
+    BookLanding, BookLandingAdPeriod
 from ..schemas_v2.author import AuthorResponse
 
 from ..services_v2.landing_service import get_landing_detail, create_landing, update_landing, \
     delete_landing, get_landing_cards, get_top_landings_by_sales, \
     get_purchases_by_language, get_landing_cards_pagination, list_landings_paginated, search_landings_paginated, \
     track_ad_visit, get_recommended_landing_cards, get_personalized_landing_cards, get_purchases_by_language_per_day, \
-    open_ad_period_if_needed, AD_TTL, get_sales_totals
+    get_sales_totals
 from ..services_v2.book_service import (
     get_top_book_landings_by_sales,
     get_book_sales_totals,
 )
 from ..utils.ip_utils import is_bot_request
+from ..services_v2.visit_ingest import record_visit, KIND_LANDING_VISIT
+from ..services_v2 import traffic_rollup
 from ..schemas_v2.landing import LandingListResponse, LandingDetailResponse, LandingCreate, LandingUpdate, TrackAdIn
 from ..schemas_v2.landing import LandingListResponse, LandingDetailResponse, LandingCreate, LandingUpdate, TagResponse, \
     LandingSearchResponse, LandingCardsResponse, LandingItemResponse, LandingCardsResponsePaginations, \
     LandingListPageResponse, LangEnum, FreeAccessRequest, LandingCardsV2Response, LandingCardResponse
 from pydantic import BaseModel
 from ..schemas_v2.common import TagResponse, CatalogFiltersMetadata
-from ..services_v2.filter_aggregation_service import (
-    build_landing_base_query,
-    aggregate_landing_filters,
-    parse_duration_to_minutes,
-    calculate_landing_lessons_count,
-    count_lessons_from_sections,
-)
+from ..services_v2.filter_aggregation_service import count_lessons_from_sections
+from ..services_v2.facet_engine import facet_landing_filters
+from ..services_v2.catalog_snapshot import get_catalog_snapshot, publish_catalog_change, KIND_LANDING
 from ..models.models_v2 import Course, landing_course
 from ..services_v2.preview_service import get_or_schedule_preview, get_previews_batch
 from ..services_v2.user_service import add_partial_course_to_user, create_access_token, create_user, \
@@ -158,7 +155,7 @@ def get_landing_by_id(
         # 4.1) минимальная цена по каждому курсу
         min_price: Dict[int, float] = {}
         for l in a.landings:
-            p = _safe_price(l.new_price)
+            p = _safe_price(l.new_price_num)
             for c in l.courses:
                 if p < min_price.get(c.id, float("inf")):
                     min_price[c.id] = p
@@ -167,7 +164,7 @@ def get_landing_by_id(
         kept = [
             l for l in a.landings
             if not any(
-                _safe_price(l.new_price) > min_price.get(c.id, _safe_price(l.new_price))
+                _safe_price(l.new_price_num) > min_price.get(c.id, _safe_price(l.new_price_num))
                 for c in l.courses
             )
         ]
@@ -383,59 +380,19 @@ def get_landing_by_page(
 
 def _get_author_stats_batch(db: Session, author_ids: List[int]) -> Dict[int, dict]:
     """
-    Получить статистику по авторам (количество курсов и теги) оптимизированным запросом.
-    
+    Статистика по авторам (количество курсов и теги) из предпосчитанных
+    счётчиков снапшота каталога — без запросов к БД.
+
     Возвращает: {author_id: {"courses_count": N, "tags": [...]}}
     """
     if not author_ids:
         return {}
-    
-    from ..models.models_v2 import landing_authors, landing_course, landing_tags
-    
-    result: Dict[int, dict] = {aid: {"courses_count": 0, "tags": []} for aid in author_ids}
-    
-    # Запрос для подсчёта уникальных курсов на автора
-    courses_query = (
-        db.query(
-            landing_authors.c.author_id,
-            func.count(func.distinct(landing_course.c.course_id)).label("cnt")
-        )
-        .join(Landing, Landing.id == landing_authors.c.landing_id)
-        .join(landing_course, landing_course.c.landing_id == Landing.id)
-        .filter(
-            landing_authors.c.author_id.in_(author_ids),
-            Landing.is_hidden == False
-        )
-        .group_by(landing_authors.c.author_id)
-    )
-    
-    for author_id, cnt in courses_query:
-        result[author_id]["courses_count"] = cnt
-    
-    # Запрос для получения уникальных тегов на автора
-    from ..models.models_v2 import Tag as TagModel
-    tags_query = (
-        db.query(
-            landing_authors.c.author_id,
-            TagModel.name
-        )
-        .join(Landing, Landing.id == landing_authors.c.landing_id)
-        .join(landing_tags, landing_tags.c.landing_id == Landing.id)
-        .join(TagModel, TagModel.id == landing_tags.c.tag_id)
-        .filter(
-            landing_authors.c.author_id.in_(author_ids),
-            Landing.is_hidden == False
-        )
-        .distinct()
-    )
-    
-    author_tags: Dict[int, set] = {aid: set() for aid in author_ids}
-    for author_id, tag_name in tags_query:
-        author_tags[author_id].add(tag_name)
-    
-    for author_id, tags in author_tags.items():
-        result[author_id]["tags"] = sorted(tags)
-    
+
+    snapshot = get_catalog_snapshot(db)
+    result: Dict[int, dict] = {}
+    for author_id in author_ids:
+        counters = snapshot.author_counters(author_id)
+        result[author_id] = {"courses_count": counters.courses, "tags": list(counters.tags)}
     return result
 
 @router.post("/", response_model=LandingListResponse)
@@ -577,19 +534,6 @@ def _serialize_landing_card(landing: Landing) -> dict:
     }
 
 
-def _get_landing_sort_key(landing: Landing, db: Session, sort: str):
-    """
-    Возвращает ключ сортировки для лендинга (для сортировок в памяти).
-    """
-    if sort in ("duration_asc", "duration_desc"):
-        duration_minutes = parse_duration_to_minutes(landing.duration)
-        return duration_minutes or 0
-    elif sort in ("lessons_asc", "lessons_desc"):
-        lessons_count_num = calculate_landing_lessons_count(db, landing.id)
-        return lessons_count_num or 0
-    return 0
-
-
 @router.get(
     "/v2/cards",
     response_model=LandingCardsV2Response,
@@ -739,17 +683,12 @@ def landing_cards_v2(
             language=language,
         )
         
-        # Переформатируем результат под V2 формат
-        cards = []
-        for card in result.get("cards", []):
-            # Получаем полный объект лендинга для сериализации
-            landing = db.query(Landing).options(
-                selectinload(Landing.authors),
-                selectinload(Landing.tags),
-                selectinload(Landing.courses),
-            ).filter(Landing.id == card["id"]).first()
-            if landing:
-                cards.append(_serialize_landing_card(landing))
+        # Переформатируем результат под V2 формат (landing_name не бывает None);
+        # связи уже загружены сервисом — дополнительных запросов на карточку нет
+        cards = [
+            {**card, "landing_name": card.get("landing_name") or ""}
+            for card in result.get("cards", [])
+        ]
         
         total = result.get("total", 0)
         
@@ -766,20 +705,8 @@ def landing_cards_v2(
                 'lessons_to': lessons_to,
                 'q': q,
             }
-            base = build_landing_base_query(
+            filters_metadata = facet_landing_filters(
                 db=db,
-                language=language,
-                tags=tags,
-                author_ids=author_ids,
-                price_from=price_from,
-                price_to=price_to,
-                lessons_from=lessons_from,
-                lessons_to=lessons_to,
-                q=q,
-            )
-            filters_metadata = aggregate_landing_filters(
-                db=db,
-                base_query=base.order_by(None),
                 current_filters=current_filters,
                 include_recommend=is_authenticated
             )
@@ -805,9 +732,9 @@ def landing_cards_v2(
         'q': q,
     }
     
-    # Строим базовый запрос с применением всех фильтров
-    base = build_landing_base_query(
-        db=db,
+    # Фильтрация, сортировка и пагинация — по in-process снапшоту каталога
+    snapshot = get_catalog_snapshot(db)
+    total, records = snapshot.query_landings(
         language=language,
         tags=tags,
         author_ids=author_ids,
@@ -816,100 +743,21 @@ def landing_cards_v2(
         lessons_from=lessons_from,
         lessons_to=lessons_to,
         q=q,
+        sort=sort,
+        offset=(page - 1) * size,
+        limit=size,
     )
-    
-    # Применяем сортировку
-    if sort == "price_asc":
-        base = base.order_by(
-            cast(Landing.new_price, SqlNumeric(10, 2)).asc(),
-            Landing.id.asc()
-        )
-    elif sort == "price_desc":
-        base = base.order_by(
-            cast(Landing.new_price, SqlNumeric(10, 2)).desc(),
-            Landing.id.desc()
-        )
-    elif sort == "popular_asc":
-        base = base.order_by(
-            Landing.sales_count.is_(None),
-            Landing.sales_count.asc(),
-            Landing.id.asc()
-        )
-    elif sort == "popular_desc":
-        base = base.order_by(
-            Landing.sales_count.is_(None),
-            Landing.sales_count.desc(),
-            Landing.id.desc()
-        )
-    elif sort == "new_asc":
-        base = base.order_by(
-            Landing.created_at.is_(None),
-            Landing.created_at.asc(),
-            Landing.id.asc()
-        )
-    elif sort == "new_desc":
-        base = base.order_by(
-            Landing.created_at.is_(None),
-            Landing.created_at.desc(),
-            Landing.id.desc()
-        )
-    elif sort == "duration_asc" or sort == "duration_desc":
-        # Для сортировки по длительности нужно парсить строку duration
-        # Это сложно сделать на уровне SQL, поэтому сортируем в памяти после получения
-        pass  # Обработаем после получения данных
-    elif sort == "lessons_asc" or sort == "lessons_desc":
-        # Для сортировки по урокам нужен подзапрос
-        # Создаём подзапрос для подсчёта уроков
-        # Это сложнее, так как уроки хранятся в JSON - сортируем в памяти
-        pass  # Обработаем после получения данных
-    else:
-        # Дефолтная сортировка - по новизне
-        base = base.order_by(
-            Landing.created_at.is_(None),
-            Landing.created_at.desc(),
-            Landing.id.desc()
-        )
-    
-    # Подсчитываем total
-    total = base.order_by(None).with_entities(func.count()).scalar() or 0
+    cards = [snapshot.landing_card(r) for r in records]
     
     # Получаем метаданные фильтров, если запрошено
     filters_metadata = None
     if include_filters:
-        filters_metadata = aggregate_landing_filters(
+        filters_metadata = facet_landing_filters(
             db=db,
-            base_query=base.order_by(None),
             current_filters=current_filters,
             include_recommend=is_authenticated
         )
     
-    # Для сортировки по duration и lessons нужна специальная обработка
-    if sort in ("duration_asc", "duration_desc", "lessons_asc", "lessons_desc"):
-        # Получаем все лендинги и сортируем в памяти
-        all_landings = base.all()
-        
-        # Собираем данные с метриками для сортировки
-        landings_with_metrics = []
-        for landing in all_landings:
-            sort_key = _get_landing_sort_key(landing, db, sort)
-            landings_with_metrics.append((landing, sort_key))
-        
-        # Сортируем
-        if sort in ("duration_asc", "lessons_asc"):
-            landings_with_metrics.sort(key=lambda x: (x[1], x[0].id))
-        else:  # duration_desc, lessons_desc
-            landings_with_metrics.sort(key=lambda x: (-x[1], -x[0].id))
-        
-        # Применяем пагинацию в памяти
-        start_idx = (page - 1) * size
-        end_idx = start_idx + size
-        paginated = landings_with_metrics[start_idx:end_idx]
-        cards = [_serialize_landing_card(landing) for landing, _ in paginated]
-    else:
-        # Стандартная пагинация через SQL
-        rows = base.offset((page - 1) * size).limit(size).all()
-        cards = [_serialize_landing_card(r) for r in rows]
-    
     return LandingCardsV2Response(
         total=total,
         total_pages=ceil(total / size) if total > 0 else 0,
@@ -920,6 +768,19 @@ def landing_cards_v2(
     )
 
 
+@router.post("/admin/metrics/backfill")
+def backfill_landing_metrics_route(
+    current_admin: User = Depends(require_roles("admin")),
+):
+    """
+    Ставит в очередь пересчёт lessons_total / duration_minutes для всех лендингов.
+    """
+    from ..tasks.landing_metrics import backfill_landing_metrics
+
+    task = backfill_landing_metrics.apply_async(queue="special")
+    return {"task_id": task.id}
+
+
 @router.get("/debug/lessons-top")
 def debug_lessons_top(
     limit: int = Query(10, ge=1, le=50),
@@ -1121,6 +982,7 @@ def set_landing_is_hidden(
     landing.is_hidden = is_hidden
     db.commit()
     db.refresh(landing)
+    publish_catalog_change(KIND_LANDING, [landing.id])
     return landing
 
 
@@ -1519,42 +1381,10 @@ def track_landing_visit(
         return {"ok": True, "skipped": "bot"}
 
     payload = payload or VisitIn()
-    from_ad = bool(payload.from_ad)
-
-    # 1) фиксируем визит (только в landing_visits)
-    db.add(LandingVisit(
-        landing_id=landing_id,
-        from_ad=from_ad,
-    ))
-
-    # 2) если визит рекламный — продлеваем TTL ТОЛЬКО если реклама уже включена
-    if from_ad:
-        from sqlalchemy.exc import OperationalError
-        now = datetime.utcnow()
-        try:
-            landing = (
-                db.query(Landing)
-                  .filter(Landing.id == landing_id)
-                  .with_for_update(nowait=True)
-                  .first()
-            )
-        except OperationalError:
-            # Блокировка занята — коммитим визит, пропускаем TTL-обновление
-            db.commit()
-            return {"ok": True}
-        
-        if landing and landing.in_advertising:
-            # гарантируем открытый период, если вдруг его нет
-            open_ad_period_if_needed(db, landing_id, started_by=None)
-
-            # продлеваем TTL
-            new_ttl = now + AD_TTL
-            if not landing.ad_flag_expires_at or landing.ad_flag_expires_at < new_ttl:
-                landing.ad_flag_expires_at = new_ttl
 
-        # ВАЖНО: если in_advertising == False, НИЧЕГО не включаем и не трогаем период/TTL
-
-    db.commit()
+    # визит уходит в буфер и пишется пачкой; если from_ad и реклама уже
+    # включена — там же продлевается TTL (без row-lock на каждый просмотр)
+    record_visit(db, KIND_LANDING_VISIT, landing_id, from_ad=bool(payload.from_ad))
     return {"ok": True}
 
 
@@ -1576,22 +1406,6 @@ def _resolve_period(
 def _auto_granularity(start_dt: datetime, end_dt: datetime) -> Granularity:
     return "hour" if (end_dt - start_dt) <= timedelta(hours=48) else "day"
 
-def _bucket_expr_mysql(ts_col, granularity: Granularity):
-    if granularity == "day":
-        return func.date(ts_col)  # 'YYYY-MM-DD'
-    return func.date_format(ts_col, '%Y-%m-%d %H:00:00')  # 'YYYY-MM-DD HH:00:00'
-
-def _coerce_bucket_to_dt(v, granularity: Granularity) -> datetime:
-    if isinstance(v, datetime):
-        return v.replace(minute=0, second=0, microsecond=0) if granularity == "hour" else v.replace(hour=0, minute=0, second=0, microsecond=0)
-    if isinstance(v, date):
-        return datetime(v.year, v.month, v.day)
-    # MySQL DATE_FORMAT -> str
-    from datetime import datetime as _dt
-    if len(v) == 19:
-        return _dt.strptime(v, "%Y-%m-%d %H:%M:%S")
-    return _dt.strptime(v, "%Y-%m-%d")
-
 def _iter_grid(start_dt: datetime, end_dt: datetime, granularity: Granularity):
     step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
     cur = start_dt.replace(minute=0, second=0, microsecond=0) if granularity == "hour" \
@@ -1603,28 +1417,6 @@ def _iter_grid(start_dt: datetime, end_dt: datetime, granularity: Granularity):
 def _fill_series(start_dt: datetime, end_dt: datetime, granularity: Granularity, m: Dict[datetime, int]):
     return [{"ts": ts.isoformat() + "Z", "count": int(m.get(ts, 0))} for ts in _iter_grid(start_dt, end_dt, granularity)]
 
-def _fetch_counts(
-    db: Session,
-    ts_col,
-    filters,
-    start_dt: datetime,
-    end_dt: datetime,
-    granularity: Granularity,
-) -> tuple[Dict[datetime, int], int]:
-    bucket = _bucket_expr_mysql(ts_col, granularity).label("b")
-    rows = (db.query(bucket, func.count("*"))
-              .filter(ts_col >= start_dt, ts_col < end_dt, *filters)
-              .group_by(bucket)
-              .order_by(bucket)
-              .all())
-    m: Dict[datetime, int] = {}
-    total = 0
-    for b, cnt in rows:
-        dt = _coerce_bucket_to_dt(b, granularity)
-        m[dt] = int(cnt)
-        total += int(cnt)
-    return m, total
-
 def _pct(numer: int, denom: int) -> float:
     if denom <= 0:
         return 0.0
@@ -1662,47 +1454,17 @@ def landing_traffic(
     start_dt, end_dt = _resolve_period(start_date, end_date)
     gran = bucket or _auto_granularity(start_dt, end_dt)
 
-    # 3) визиты/покупки за диапазон (у тебя это уже было)
-    visit_map, visits_range_total = _fetch_counts(
-        db=db,
-        ts_col=LandingVisit.visited_at,
-        filters=[LandingVisit.landing_id == landing_id],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
+    # 3) визиты/покупки за диапазон и «за всё время» — из почасовых роллапов
+    rng = traffic_rollup.series(db, traffic_rollup.KIND_LANDING, landing_id, start_dt, end_dt, gran)
+    visit_map, visits_range_total = rng["visits"], sum(rng["visits"].values())
+    ad_visit_map, ad_visits_range_total = rng["ad_visits"], sum(rng["ad_visits"].values())
+    purchase_map, purchases_range_total = rng["purchases"], sum(rng["purchases"].values())
 
-    purchase_map, purchases_range_total = _fetch_counts(
-        db=db,
-        ts_col=Purchase.created_at,
-        filters=[Purchase.landing_id == landing_id],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
+    all_time = traffic_rollup.totals(db, traffic_rollup.KIND_LANDING, landing_id)
+    visits_all_time = all_time["visits"]
+    ad_visits_all_time = all_time["ad_visits"]
+    purchases_all_time = all_time["purchases"]
 
-    # 4) суммы «за всё время» (без ограничений по дате)
-    visits_all_time = (
-        db.query(func.count(LandingVisit.id))
-          .filter(LandingVisit.landing_id == landing_id)
-          .scalar()
-        or 0
-    )
-    purchases_all_time = (
-        db.query(func.count(Purchase.id))
-          .filter(Purchase.landing_id == landing_id)
-          .scalar()
-        or 0
-    )
-    ad_visit_map, ad_visits_range_total = _fetch_counts(
-        db=db,
-        ts_col=LandingVisit.visited_at,
-        filters=[LandingVisit.landing_id == landing_id,
-                 LandingVisit.from_ad.is_(True)],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
     # Пересечение периодов рекламы с выбранным окном [start_dt, end_dt)
     period_rows = (
         db.query(LandingAdPeriod.started_at, LandingAdPeriod.ended_at)
@@ -1726,28 +1488,11 @@ def landing_traffic(
                 "end": clip_end.isoformat() + "Z"
             })
 
-    ad_visits_all_time = (
-                             db.query(func.count(LandingVisit.id))
-                             .filter(LandingVisit.landing_id == landing_id,
-                                     LandingVisit.from_ad.is_(True))
-                             .scalar()
-                         ) or 0
-
-    first_visit_at = (
-        db.query(func.min(LandingVisit.visited_at))
-        .filter(LandingVisit.landing_id == landing_id)
-        .scalar()
-    )
-
+    first_visit_at = traffic_rollup.first_visit_at(db, traffic_rollup.KIND_LANDING, landing_id)
     if first_visit_at is not None:
-        purchases_since_first_visit = (
-                                          db.query(func.count(Purchase.id))
-                                          .filter(
-                                              Purchase.landing_id == landing_id,
-                                              Purchase.created_at >= first_visit_at
-                                          )
-                                          .scalar()
-                                      ) or 0
+        purchases_since_first_visit = traffic_rollup.totals(
+            db, traffic_rollup.KIND_LANDING, landing_id, start_dt=first_visit_at,
+        )["purchases"]
     else:
         purchases_since_first_visit = 0
 
@@ -1812,48 +1557,16 @@ def book_landing_traffic(
     start_dt, end_dt = _resolve_period(start_date, end_date)
     gran = bucket or _auto_granularity(start_dt, end_dt)
 
-    # 3) визиты/покупки за диапазон
-    visit_map, visits_range_total = _fetch_counts(
-        db=db,
-        ts_col=BookLandingVisit.visited_at,
-        filters=[BookLandingVisit.book_landing_id == book_landing_id],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
+    # 3) визиты/покупки за диапазон и «за всё время» — из почасовых роллапов
+    rng = traffic_rollup.series(db, traffic_rollup.KIND_BOOK_LANDING, book_landing_id, start_dt, end_dt, gran)
+    visit_map, visits_range_total = rng["visits"], sum(rng["visits"].values())
+    ad_visit_map, ad_visits_range_total = rng["ad_visits"], sum(rng["ad_visits"].values())
+    purchase_map, purchases_range_total = rng["purchases"], sum(rng["purchases"].values())
 
-    purchase_map, purchases_range_total = _fetch_counts(
-        db=db,
-        ts_col=Purchase.created_at,
-        filters=[Purchase.book_landing_id == book_landing_id],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    # 4) суммы «за всё время»
-    visits_all_time = (
-        db.query(func.count(BookLandingVisit.id))
-          .filter(BookLandingVisit.book_landing_id == book_landing_id)
-          .scalar()
-        or 0
-    )
-    purchases_all_time = (
-        db.query(func.count(Purchase.id))
-          .filter(Purchase.book_landing_id == book_landing_id)
-          .scalar()
-        or 0
-    )
-
-    ad_visit_map, ad_visits_range_total = _fetch_counts(
-        db=db,
-        ts_col=BookLandingVisit.visited_at,
-        filters=[BookLandingVisit.book_landing_id == book_landing_id,
-                 BookLandingVisit.from_ad.is_(True)],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
+    all_time = traffic_rollup.totals(db, traffic_rollup.KIND_BOOK_LANDING, book_landing_id)
+    visits_all_time = all_time["visits"]
+    ad_visits_all_time = all_time["ad_visits"]
+    purchases_all_time = all_time["purchases"]
 
     # Пересечение периодов рекламы с выбранным окном [start_dt, end_dt)
     period_rows = (
@@ -1878,30 +1591,11 @@ def book_landing_traffic(
                 "end": clip_end.isoformat() + "Z"
             })
 
-    ad_visits_all_time = (
-        db.query(func.count(BookLandingVisit.id))
-          .filter(
-              BookLandingVisit.book_landing_id == book_landing_id,
-              BookLandingVisit.from_ad.is_(True)
-          )
-          .scalar()
-    ) or 0
-
-    first_visit_at = (
-        db.query(func.min(BookLandingVisit.visited_at))
-        .filter(BookLandingVisit.book_landing_id == book_landing_id)
-        .scalar()
-    )
-
+    first_visit_at = traffic_rollup.first_visit_at(db, traffic_rollup.KIND_BOOK_LANDING, book_landing_id)
     if first_visit_at is not None:
-        purchases_since_first_visit = (
-            db.query(func.count(Purchase.id))
-              .filter(
-                  Purchase.book_landing_id == book_landing_id,
-                  Purchase.created_at >= first_visit_at
-              )
-              .scalar()
-        ) or 0
+        purchases_since_first_visit = traffic_rollup.totals(
+            db, traffic_rollup.KIND_BOOK_LANDING, book_landing_id, start_dt=first_visit_at,
+        )["purchases"]
     else:
         purchases_since_first_visit = 0
 
@@ -1971,148 +1665,21 @@ def site_traffic(
     start_dt, end_dt = _resolve_period(start_date, end_date)
     gran = bucket or _auto_granularity(start_dt, end_dt)
 
-    # 2) серии и итоги за диапазон (курсы)
-    visit_map_l, visits_range_total_l = _fetch_counts(
-        db=db,
-        ts_col=LandingVisit.visited_at,
-        filters=[LandingVisit.landing_id.in_(landing_ids_subq)],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    ad_visit_map_l, ad_visits_range_total_l = _fetch_counts(
-        db=db,
-        ts_col=LandingVisit.visited_at,
-        filters=[
-            LandingVisit.landing_id.in_(landing_ids_subq),
-            LandingVisit.from_ad.is_(True),
-        ],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    purchase_map_l, purchases_range_total_l = _fetch_counts(
-        db=db,
-        ts_col=Purchase.created_at,
-        filters=[Purchase.landing_id.in_(landing_ids_subq)],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    ad_purchase_map_l, ad_purchases_range_total_l = _fetch_counts(
-        db=db,
-        ts_col=Purchase.created_at,
-        filters=[
-            Purchase.landing_id.in_(landing_ids_subq),
-            Purchase.from_ad.is_(True),
-        ],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    # 2b) серии и итоги за диапазон (книги)
-    visit_map_b, visits_range_total_b = _fetch_counts(
-        db=db,
-        ts_col=BookLandingVisit.visited_at,
-        filters=[BookLandingVisit.book_landing_id.in_(book_landing_ids_subq)],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    ad_visit_map_b, ad_visits_range_total_b = _fetch_counts(
-        db=db,
-        ts_col=BookLandingVisit.visited_at,
-        filters=[
-            BookLandingVisit.book_landing_id.in_(book_landing_ids_subq),
-            BookLandingVisit.from_ad.is_(True),
-        ],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    purchase_map_b, purchases_range_total_b = _fetch_counts(
-        db=db,
-        ts_col=Purchase.created_at,
-        filters=[Purchase.book_landing_id.in_(book_landing_ids_subq)],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
-
-    ad_purchase_map_b, ad_purchases_range_total_b = _fetch_counts(
-        db=db,
-        ts_col=Purchase.created_at,
-        filters=[
-            Purchase.book_landing_id.in_(book_landing_ids_subq),
-            Purchase.from_ad.is_(True),
-        ],
-        start_dt=start_dt,
-        end_dt=end_dt,
-        granularity=gran,
-    )
+    # 2) серии и итоги за диапазон — из почасовых роллапов (курсы + книги)
+    rng_l = traffic_rollup.series(db, traffic_rollup.KIND_LANDING, landing_ids_subq, start_dt, end_dt, gran)
+    rng_b = traffic_rollup.series(db, traffic_rollup.KIND_BOOK_LANDING, book_landing_ids_subq, start_dt, end_dt, gran)
+    visit_map = _sum_maps(rng_l["visits"], rng_b["visits"])
+    ad_visit_map = _sum_maps(rng_l["ad_visits"], rng_b["ad_visits"])
+    purchase_map = _sum_maps(rng_l["purchases"], rng_b["purchases"])
+    ad_purchase_map = _sum_maps(rng_l["ad_purchases"], rng_b["ad_purchases"])
 
     # 3) totals «за всё время» (без ограничений по дате)
-    visits_all_time = (
-        db.query(func.count(LandingVisit.id))
-          .filter(LandingVisit.landing_id.in_(landing_ids_subq))
-          .scalar()
-    ) or 0
-    visits_all_time += (
-        db.query(func.count(BookLandingVisit.id))
-          .filter(BookLandingVisit.book_landing_id.in_(book_landing_ids_subq))
-          .scalar()
-    ) or 0
-
-    ad_visits_all_time = (
-        db.query(func.count(LandingVisit.id))
-          .filter(
-              LandingVisit.landing_id.in_(landing_ids_subq),
-              LandingVisit.from_ad.is_(True),
-          )
-          .scalar()
-    ) or 0
-    ad_visits_all_time += (
-        db.query(func.count(BookLandingVisit.id))
-          .filter(
-              BookLandingVisit.book_landing_id.in_(book_landing_ids_subq),
-              BookLandingVisit.from_ad.is_(True),
-          )
-          .scalar()
-    ) or 0
-
-    purchases_all_time = (
-        db.query(func.count(Purchase.id))
-          .filter(Purchase.landing_id.in_(landing_ids_subq))
-          .scalar()
-    ) or 0
-    purchases_all_time += (
-        db.query(func.count(Purchase.id))
-          .filter(Purchase.book_landing_id.in_(book_landing_ids_subq))
-          .scalar()
-    ) or 0
-
-    ad_purchases_all_time = (
-        db.query(func.count(Purchase.id))
-          .filter(
-              Purchase.landing_id.in_(landing_ids_subq),
-              Purchase.from_ad.is_(True),
-          )
-          .scalar()
-    ) or 0
-    ad_purchases_all_time += (
-        db.query(func.count(Purchase.id))
-          .filter(
-              Purchase.book_landing_id.in_(book_landing_ids_subq),
-              Purchase.from_ad.is_(True),
-          )
-          .scalar()
-    ) or 0
+    all_l = traffic_rollup.totals(db, traffic_rollup.KIND_LANDING, landing_ids_subq)
+    all_b = traffic_rollup.totals(db, traffic_rollup.KIND_BOOK_LANDING, book_landing_ids_subq)
+    visits_all_time = all_l["visits"] + all_b["visits"]
+    ad_visits_all_time = all_l["ad_visits"] + all_b["ad_visits"]
+    purchases_all_time = all_l["purchases"] + all_b["purchases"]
+    ad_purchases_all_time = all_l["ad_purchases"] + all_b["ad_purchases"]
 
     # 4) ответ — структура максимально похожа на landing_traffic
     return {
@@ -2132,16 +1699,16 @@ def site_traffic(
             "ad_purchases": ad_purchases_all_time,
         },
         "totals_range": {
-            "visits": visits_range_total_l + visits_range_total_b,
-            "ad_visits": ad_visits_range_total_l + ad_visits_range_total_b,
-            "purchases": purchases_range_total_l + purchases_range_total_b,
-            "ad_purchases": ad_purchases_range_total_l + ad_purchases_range_total_b,
+            "visits": sum(visit_map.values()),
+            "ad_visits": sum(ad_visit_map.values()),
+            "purchases": sum(purchase_map.values()),
+            "ad_purchases": sum(ad_purchase_map.values()),
         },
 
         "series": {
-            "visits":        _fill_series(start_dt, end_dt, gran, _sum_maps(visit_map_l, visit_map_b)),
-            "ad_visits":     _fill_series(start_dt, end_dt, gran, _sum_maps(ad_visit_map_l, ad_visit_map_b)),
-            "purchases":     _fill_series(start_dt, end_dt, gran, _sum_maps(purchase_map_l, purchase_map_b)),
-            "ad_purchases":  _fill_series(start_dt, end_dt, gran, _sum_maps(ad_purchase_map_l, ad_purchase_map_b)),
+            "visits":        _fill_series(start_dt, end_dt, gran, visit_map),
+            "ad_visits":     _fill_series(start_dt, end_dt, gran, ad_visit_map),
+            "purchases":     _fill_series(start_dt, end_dt, gran, purchase_map),
+            "ad_purchases":  _fill_series(start_dt, end_dt, gran, ad_purchase_map),
         }
     }
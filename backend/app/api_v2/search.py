@@ -2,11 +2,10 @@ from datetime import datetime, timedelta
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, Query, Request
-from sqlalchemy import or_
 from sqlalchemy.orm import Session
 
 from ..db.database import get_db
-from ..services_v2.search_service import search_everything
+from ..services_v2.search_service import search_everything, DEFAULT_LIMIT
 from ..schemas_v2.search import SearchResponse, SearchTypeEnum
 from ..models.models_v2 import SearchQuery
 from ..utils.ip_utils import get_client_ip
@@ -38,6 +37,8 @@ def search_v2(
         None,
         description="Фильтр по языкам (мультивыбор): EN, RU, ES, PT, AR, IT",
     ),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=200, description="Размер страницы выдачи"),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущего ответа"),
     db: Session = Depends(get_db),
 ):
     # 1. Поиск
@@ -46,10 +47,12 @@ def search_v2(
         q=q,
         types=[t.value for t in types] if types else None,
         languages=languages,
+        limit=limit,
+        cursor=cursor,
     )
 
-    # 2. Отсекаем совсем короткие запросы
-    if len(q.strip()) < MIN_LEN:
+    # 2. Отсекаем совсем короткие запросы и догрузку следующих страниц
+    if len(q.strip()) < MIN_LEN or cursor:
         return result
 
     # 3. Идентификаторы пользователя
@@ -59,24 +62,24 @@ def search_v2(
 
     now = datetime.utcnow()
 
-    # 4. Находим последнюю запись этого юзера/IP на этот path
-    filters = [SearchQuery.path == path]
-    id_filters = []
-    if user_id is not None:
-        id_filters.append(SearchQuery.user_id == user_id)
-    if ip_address is not None:
-        id_filters.append(SearchQuery.ip_address == ip_address)
-    if id_filters:
-        filters.append(or_(*id_filters))
-
+    # 4. Находим последнюю запись этого юзера/IP на этот path.
+    #    Отдельный запрос на каждый идентификатор — чтобы каждый шёл по своему
+    #    индексу (user_id, created_at) / (ip_address, created_at), а не по OR.
     last_record = None
-    if id_filters:
-        last_record = (
+    for id_filter in (
+        SearchQuery.user_id == user_id if user_id is not None else None,
+        SearchQuery.ip_address == ip_address if ip_address is not None else None,
+    ):
+        if id_filter is None:
+            continue
+        candidate = (
             db.query(SearchQuery)
-            .filter(*filters)
+            .filter(id_filter, SearchQuery.path == path)
             .order_by(SearchQuery.created_at.desc())
             .first()
         )
+        if candidate is not None and (last_record is None or candidate.created_at > last_record.created_at):
+            last_record = candidate
 
     record = None
 
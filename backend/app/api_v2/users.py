@@ -8,7 +8,7 @@ from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks, Form, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import func, Float, and_, case
+from sqlalchemy import func, and_, case
 from sqlalchemy.orm import Session, joinedload, aliased, selectinload
 
 from ..db.database import get_db
@@ -305,7 +305,7 @@ def get_user_courses(
                     partition_by=landing_course.c.course_id,
                     order_by=[
                         case((Landing.preview_photo.is_(None), 1), else_=0),
-                        Landing.new_price.cast(Float),
+                        Landing.new_price_num,
                     ],
                 ).label("rn"),
             )
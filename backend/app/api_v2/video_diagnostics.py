@@ -3,12 +3,16 @@
 Диагностика видео: проверка доступности MP4, HLS сегментов, URL encoding и т.д.
 Помогает выявить причины ошибок 520 и остановки видео.
 """
+import asyncio
 import json
 import logging
 import os
 import subprocess
 import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field, asdict
+from functools import partial
 from typing import Dict, List, Any, Optional
 from urllib.parse import urlparse, unquote, quote
 
@@ -21,6 +25,7 @@ from pydantic import BaseModel
 from ..dependencies.role_checker import require_roles
 from ..models.models import User
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, s3_client
+from ..utils import s3_meta_index
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +52,11 @@ class VideoHealth:
     overall_status: str  # healthy, degraded, broken
     checks: Dict[str, DiagnosticResult] = field(default_factory=dict)
     recommendations: List[str] = field(default_factory=list)
+    # дедлайн диагностики: partial=True — часть проверок не успела (их имена в timed_out)
+    deadline_sec: float = 0.0
+    duration_sec: float = 0.0
+    partial: bool = False
+    timed_out: List[str] = field(default_factory=list)
 
 
 def key_from_url(url: str) -> str:
@@ -81,13 +91,22 @@ def safe_cdn_url(key: str) -> str:
     return f"{S3_PUBLIC_HOST}/{'/'.join(encoded_parts)}"
 
 
-def check_s3_object(key: str) -> DiagnosticResult:
-    """Проверяет существование и доступность объекта в S3."""
+def check_s3_object(key: str, fresh: bool = False) -> DiagnosticResult:
+    """
+    Проверяет существование и доступность объекта в S3.
+    Данные берутся из индекса метаданных (fresh=True — принудительный HEAD).
+    """
     try:
-        head = s3.head_object(Bucket=S3_BUCKET, Key=key)
-        size = head.get("ContentLength", 0)
-        content_type = head.get("ContentType", "unknown")
-        metadata = head.get("Metadata", {})
+        head = s3_meta_index.head(key, client=s3, fresh=fresh)
+        if head is None:
+            return DiagnosticResult(
+                status="error",
+                message="Object not found in S3",
+                details={"error_code": "404"}
+            )
+        size = head.size or 0
+        content_type = head.content_type or "unknown"
+        metadata = head.metadata
         
         return DiagnosticResult(
             status="ok",
@@ -166,13 +185,47 @@ def check_cdn_access(url: str, timeout: int = 10) -> DiagnosticResult:
         )
 
 
-def check_hls_playlist(key: str) -> DiagnosticResult:
+class PlaylistFetcher:
+    """
+    Тексты плейлистов из S3 на время одной диагностики.
+    Проверки playlist/segments/segments_cdn читают одни и те же ключи (и alias-цели):
+    каждый ключ скачивается один раз, даже если его одновременно ждут несколько потоков.
+    Ошибка чтения (ClientError) тоже запоминается и пробрасывается всем ожидающим.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+
+    def get_text(self, key: str) -> str:
+        with self._lock:
+            fut = self._futures.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._futures[key] = Future()
+        if owner:
+            try:
+                fut.set_result(_read_s3_text(key))
+            except BaseException as e:
+                fut.set_exception(e)
+        return fut.result()
+
+
+def _read_s3_text(key: str) -> str:
+    obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
+    return obj["Body"].read().decode("utf-8", errors="replace")
+
+
+def _read_playlist_text(key: str, fetcher: Optional[PlaylistFetcher] = None) -> str:
+    return fetcher.get_text(key) if fetcher is not None else _read_s3_text(key)
+
+
+def check_hls_playlist(key: str, fetcher: Optional["PlaylistFetcher"] = None) -> DiagnosticResult:
     """Проверяет HLS playlist и считает сегменты. Следует по alias'ам."""
     try:
         # Сначала пробуем прочитать плейлист напрямую
         try:
-            obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
-            content = obj["Body"].read().decode("utf-8", errors="replace")
+            content = _read_playlist_text(key, fetcher)
             resolved_key = key
             is_alias = False
         except ClientError as e:
@@ -213,8 +266,7 @@ def check_hls_playlist(key: str) -> DiagnosticResult:
                 if not try_key:
                     continue
                 try:
-                    obj = s3.get_object(Bucket=S3_BUCKET, Key=try_key)
-                    content = obj["Body"].read().decode("utf-8", errors="replace")
+                    content = _read_playlist_text(try_key, fetcher)
                     resolved_key = try_key
                     target_key = try_key
                     is_alias = True
@@ -308,13 +360,14 @@ def check_hls_playlist(key: str) -> DiagnosticResult:
         )
 
 
-def check_hls_segments(playlist_key: str, sample_count: int = 3) -> DiagnosticResult:
+def check_hls_segments(
+    playlist_key: str, sample_count: int = 3, fetcher: Optional["PlaylistFetcher"] = None
+) -> DiagnosticResult:
     """Проверяет доступность нескольких HLS сегментов. Следует по alias'ам."""
     try:
         # Пробуем прочитать плейлист
         try:
-            obj = s3.get_object(Bucket=S3_BUCKET, Key=playlist_key)
-            content = obj["Body"].read().decode("utf-8", errors="replace")
+            content = _read_playlist_text(playlist_key, fetcher)
         except ClientError as e:
             code = e.response["Error"]["Code"]
             return DiagnosticResult(
@@ -352,8 +405,7 @@ def check_hls_segments(playlist_key: str, sample_count: int = 3) -> DiagnosticRe
                 if not try_key:
                     continue
                 try:
-                    obj = s3.get_object(Bucket=S3_BUCKET, Key=try_key)
-                    content = obj["Body"].read().decode("utf-8", errors="replace")
+                    content = _read_playlist_text(try_key, fetcher)
                     resolved_key = try_key
                     target_key = try_key
                     is_alias = True
@@ -449,7 +501,12 @@ def check_hls_segments(playlist_key: str, sample_count: int = 3) -> DiagnosticRe
         )
 
 
-def check_hls_segments_cdn(playlist_key: str, sample_count: int = 5, timeout: int = 20) -> DiagnosticResult:
+def check_hls_segments_cdn(
+    playlist_key: str,
+    sample_count: int = 5,
+    timeout: int = 20,
+    fetcher: Optional["PlaylistFetcher"] = None,
+) -> DiagnosticResult:
     """
     Проверяет доступность HLS сегментов через CDN с реальным GET запросом.
     Делает "стресс-тест": несколько запросов подряд для выявления rate limiting.
@@ -519,8 +576,7 @@ def check_hls_segments_cdn(playlist_key: str, sample_count: int = 5, timeout: in
         for _ in range(max_depth):
             chain.append(current)
             try:
-                obj = s3.get_object(Bucket=S3_BUCKET, Key=current)
-                last_text = obj["Body"].read().decode("utf-8", errors="replace")
+                last_text = _read_playlist_text(current, fetcher)
             except ClientError as e:
                 code = e.response["Error"]["Code"]
                 return {"resolved_key": current, "kind": "error", "chain": chain, "error_code": code, "segments": []}
@@ -730,9 +786,9 @@ def check_hls_segments_cdn(playlist_key: str, sample_count: int = 5, timeout: in
         )
 
 
-def check_hls_acl(playlist_keys: List[str], sample_count: int = 3) -> DiagnosticResult:
+def check_hls_acl(playlist_keys: List[str], sample_count: int = 3, fresh: bool = False) -> DiagnosticResult:
     """
-    Проверяет ACL нескольких HLS файлов.
+    Проверяет ACL нескольких HLS файлов (через индекс метаданных).
     Возвращает ошибку если файлы не публичные.
     """
     if not playlist_keys:
@@ -749,38 +805,24 @@ def check_hls_acl(playlist_keys: List[str], sample_count: int = 3) -> Diagnostic
     
     for pl_key in playlist_keys[:sample_count]:
         try:
-            # Получаем ACL файла
-            acl_response = s3.get_object_acl(Bucket=S3_BUCKET, Key=pl_key)
-            grants = acl_response.get("Grants", [])
-            
-            # Проверяем есть ли public-read grant
-            is_public = False
-            for grant in grants:
-                grantee = grant.get("Grantee", {})
-                permission = grant.get("Permission", "")
-                # AllUsers URI означает публичный доступ
-                if grantee.get("URI") == "http://acs.amazonaws.com/groups/global/AllUsers":
-                    if permission in ("READ", "FULL_CONTROL"):
-                        is_public = True
-                        break
+            # public-read по AllUsers; None — ACL API запрещён/не поддержан
+            # (AccessDenied/NotImplemented). Это НЕ означает, что файл приватный,
+            # поэтому не считаем это деградацией.
+            is_public = s3_meta_index.acl_public(pl_key, client=s3, fresh=fresh)
+            if is_public is None:
+                unsupported.append({"key": pl_key, "error": "acl_unsupported"})
+                continue
             
             checked.append({
                 "key": pl_key,
                 "is_public": is_public,
-                "grants_count": len(grants)
             })
             
             if not is_public:
                 private_files.append(pl_key)
                 
         except ClientError as e:
-            code = e.response["Error"]["Code"]
-            # Частый кейс: ACL API может быть запрещён/не поддержан (например, AccessDenied/NotImplemented).
-            # Это НЕ означает, что файл приватный. Тогда не считаем это деградацией.
-            if code in ("AccessDenied", "NotImplemented", "MethodNotAllowed", "InvalidRequest"):
-                unsupported.append({"key": pl_key, "error": code})
-            else:
-                errors.append({"key": pl_key, "error": code})
+            errors.append({"key": pl_key, "error": e.response["Error"]["Code"]})
         except Exception as e:
             errors.append({"key": pl_key, "error": str(e)})
     
@@ -817,7 +859,7 @@ def check_hls_acl(playlist_keys: List[str], sample_count: int = 3) -> Diagnostic
     )
 
 
-def check_video_codecs(url: str) -> DiagnosticResult:
+def check_video_codecs(url: str, timeout: int = 30) -> DiagnosticResult:
     """Проверяет кодеки видео через ffprobe (если доступен)."""
     try:
         cmd = [
@@ -828,7 +870,7 @@ def check_video_codecs(url: str) -> DiagnosticResult:
             "-probesize", "5000000",
             url
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
         
         if result.returncode != 0:
             return DiagnosticResult(
@@ -894,7 +936,7 @@ def check_video_codecs(url: str) -> DiagnosticResult:
         return DiagnosticResult(
             status="warning",
             message="ffprobe timed out (video may be slow to load)",
-            details={"timeout": 30}
+            details={"timeout": timeout}
         )
     except FileNotFoundError:
         return DiagnosticResult(
@@ -949,13 +991,14 @@ def _compute_slugs_for_mp4(mp4_key: str) -> List[str]:
     return slugs
 
 
-def find_hls_playlists(mp4_key: str, only_matching: bool = True) -> List[str]:
+def find_hls_playlists(mp4_key: str, only_matching: bool = True, fresh: bool = False) -> List[str]:
     """
     Находит HLS плейлисты для данного MP4.
     
     Args:
         mp4_key: S3 ключ MP4 файла
         only_matching: Если True, возвращает только плейлисты, соответствующие slug'у видео
+        fresh: Если True, листинг идёт в S3 мимо индекса метаданных
     """
     base_dir = mp4_key.rsplit("/", 1)[0] if "/" in mp4_key else ""
     hls_prefix = f"{base_dir}/.hls/" if base_dir else ".hls/"
@@ -963,12 +1006,7 @@ def find_hls_playlists(mp4_key: str, only_matching: bool = True) -> List[str]:
     playlists = []
     try:
         # Используем s3_v4 для листинга (требуется для корректной работы с пробелами)
-        paginator = s3_v4.get_paginator("list_objects_v2")
-        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=hls_prefix):
-            for obj in page.get("Contents", []):
-                key = obj["Key"]
-                if key.endswith("playlist.m3u8"):
-                    playlists.append(key)
+        playlists = s3_meta_index.list_keys(hls_prefix, suffix="playlist.m3u8", client=s3_v4, fresh=fresh)
     except Exception as e:
         logger.warning(f"Failed to list HLS playlists: {e}")
     
@@ -993,62 +1031,170 @@ def find_hls_playlists(mp4_key: str, only_matching: bool = True) -> List[str]:
     return matching if matching else playlists[:5]  # Fallback: первые 5 если ничего не нашли
 
 
-def diagnose_video(video_url: str) -> VideoHealth:
-    """Выполняет полную диагностику видео."""
+DIAG_DEADLINE_SEC = float(os.getenv("VIDEO_DIAG_DEADLINE_SEC", "25"))
+DIAG_BATCH_MAX = int(os.getenv("VIDEO_DIAG_BATCH_MAX", "200"))
+# Проверки — блокирующие boto3/requests: выполняются в пуле потоков.
+# ffprobe — отдельный маленький пул: ограничивает число процессов на весь сервис.
+_DIAG_IO_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("VIDEO_DIAG_IO_WORKERS", "32")), thread_name_prefix="diag-io"
+)
+_DIAG_FFPROBE_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("VIDEO_DIAG_FFPROBE_WORKERS", "4")), thread_name_prefix="diag-ffprobe"
+)
+
+
+async def diagnose_video_async(
+    video_url: str,
+    fresh: bool = False,
+    deadline_sec: float = DIAG_DEADLINE_SEC,
+) -> VideoHealth:
+    """
+    Полная диагностика видео: проверки запускаются параллельно по графу зависимостей.
+
+    • s3_mp4, cdn_mp4, original_url, codecs, moov — сразу (ffprobe — в своём пуле);
+    • поиск HLS → для каждого плейлиста playlist/segments/cdn/segments_cdn и ACL;
+      тексты плейлистов читаются один раз (PlaylistFetcher) и общие для проверок.
+    По истечении deadline_sec возвращается то, что успело: недоделанные проверки
+    помечаются warning'ом и перечислены в health.timed_out.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + max(1.0, deadline_sec)
+
     s3_key = key_from_url(video_url)
     health = VideoHealth(
         video_url=video_url,
         s3_key=s3_key,
-        overall_status="unknown"
+        overall_status="unknown",
+        deadline_sec=deadline_sec,
     )
-    
-    # 1. Проверка исходного MP4 в S3
-    health.checks["s3_mp4"] = check_s3_object(s3_key)
-    
-    # 2. Проверка доступности через CDN
     cdn_url = safe_cdn_url(s3_key)
-    health.checks["cdn_mp4"] = check_cdn_access(cdn_url)
-    
-    # 3. Проверка оригинального URL (если отличается)
+    fetcher = PlaylistFetcher()
+
+    def left(cap: float) -> int:
+        """Таймаут отдельной проверки: не дольше своего и не дольше остатка дедлайна."""
+        return max(1, int(min(cap, deadline - loop.time())))
+
+    # порядок ключей в отчёте — как при последовательной диагностике
+    order: List[str] = []
+    tasks: Dict[str, asyncio.Future] = {}
+    ready: Dict[str, DiagnosticResult] = {}
+
+    def start(name: str, fn, *args, pool: ThreadPoolExecutor = _DIAG_IO_POOL, **kwargs) -> None:
+        order.append(name)
+        tasks[name] = loop.run_in_executor(pool, partial(fn, *args, **kwargs))
+
+    # 1. Исходный MP4 в S3, 2-3. CDN
+    start("s3_mp4", check_s3_object, s3_key, fresh=fresh)
+    start("cdn_mp4", check_cdn_access, cdn_url, timeout=left(10))
     if video_url != cdn_url:
-        health.checks["original_url"] = check_cdn_access(video_url)
-    
-    # 4. Поиск и проверка HLS плейлистов
-    hls_playlists = find_hls_playlists(s3_key)
+        start("original_url", check_cdn_access, video_url, timeout=left(10))
+
+    # 5. Кодеки и faststart «по факту» — ffprobe, стартуют сразу, не дожидаясь HLS
+    codecs = loop.run_in_executor(_DIAG_FFPROBE_POOL, partial(check_video_codecs, cdn_url, timeout=left(30)))
+    moov = loop.run_in_executor(_DIAG_FFPROBE_POOL, partial(check_moov_position, cdn_url, timeout=left(15)))
+
+    # 4. Поиск HLS: от него зависят проверки плейлистов
+    order.append("hls_found")
+    hls_playlists: Optional[List[str]] = None
+    try:
+        hls_playlists = await asyncio.wait_for(
+            loop.run_in_executor(_DIAG_IO_POOL, partial(find_hls_playlists, s3_key, fresh=fresh)),
+            timeout=max(0.0, deadline - loop.time()),
+        )
+    except asyncio.TimeoutError:
+        health.timed_out.append("hls_found")
+        ready["hls_found"] = DiagnosticResult(
+            status="warning",
+            message="HLS lookup timed out (diagnostic deadline)",
+            details={"deadline_sec": deadline_sec},
+        )
+
     if hls_playlists:
-        health.checks["hls_found"] = DiagnosticResult(
+        ready["hls_found"] = DiagnosticResult(
             status="ok",
             message=f"Found {len(hls_playlists)} HLS playlist(s)",
             details={"playlists": hls_playlists}
         )
-        
-        # Проверяем первый (обычно canonical) плейлист
-        for pl_key in hls_playlists[:2]:  # Проверяем максимум 2
+        for pl_key in hls_playlists[:2]:  # Проверяем максимум 2 (обычно canonical первый)
             pl_name = pl_key.split("/")[-2] if "/" in pl_key else "playlist"
-            health.checks[f"hls_playlist_{pl_name}"] = check_hls_playlist(pl_key)
-            health.checks[f"hls_segments_{pl_name}"] = check_hls_segments(pl_key)
-            
-            # Проверяем доступность через CDN
-            pl_cdn_url = safe_cdn_url(pl_key)
-            health.checks[f"hls_cdn_{pl_name}"] = check_cdn_access(pl_cdn_url)
-            
-            # Проверяем доступность сегментов через CDN (выявляет HTTP/2 ошибки и rate limiting)
-            health.checks[f"hls_segments_cdn_{pl_name}"] = check_hls_segments_cdn(pl_key)
-        
-        # 4.1. Проверка ACL HLS файлов
-        health.checks["hls_acl"] = check_hls_acl(hls_playlists)
-    else:
-        health.checks["hls_found"] = DiagnosticResult(
+            start(f"hls_playlist_{pl_name}", check_hls_playlist, pl_key, fetcher=fetcher)
+            start(f"hls_segments_{pl_name}", check_hls_segments, pl_key, fetcher=fetcher)
+            start(f"hls_cdn_{pl_name}", check_cdn_access, safe_cdn_url(pl_key), timeout=left(10))
+            # сегменты через CDN (выявляет HTTP/2 ошибки и rate limiting)
+            start(
+                f"hls_segments_cdn_{pl_name}", check_hls_segments_cdn, pl_key,
+                timeout=left(20), fetcher=fetcher,
+            )
+        start("hls_acl", check_hls_acl, hls_playlists, fresh=fresh)
+    elif hls_playlists is not None:
+        ready["hls_found"] = DiagnosticResult(
             status="warning",
             message="No HLS playlists found",
             details={"searched_prefix": f"{s3_key.rsplit('/', 1)[0]}/.hls/"}
         )
-    
-    # 5. Проверка кодеков (через CDN URL)
-    health.checks["codecs"] = check_video_codecs(cdn_url)
-    # 5.1 Проверка faststart "по факту" (moov before mdat)
-    health.checks["moov"] = check_moov_position(cdn_url)
-    
+
+    order += ["codecs", "moov"]
+    tasks["codecs"], tasks["moov"] = codecs, moov
+
+    pending = list(tasks.values())
+    if pending:
+        await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()))
+
+    for name in order:
+        if name in ready:
+            health.checks[name] = ready[name]
+            continue
+        fut = tasks[name]
+        if not fut.done():
+            # поток доработает сам (его таймаут ограничен остатком дедлайна), результат не ждём
+            fut.cancel()
+            health.timed_out.append(name)
+            health.checks[name] = DiagnosticResult(
+                status="warning",
+                message="Check timed out (diagnostic deadline)",
+                details={"deadline_sec": deadline_sec},
+            )
+            continue
+        try:
+            health.checks[name] = fut.result()
+        except Exception as e:
+            health.checks[name] = DiagnosticResult(
+                status="error",
+                message=f"Check failed: {type(e).__name__}",
+                details={"error": str(e)},
+            )
+
+    health.partial = bool(health.timed_out)
+    health.duration_sec = round(loop.time() - started, 2)
+    _summarize_health(health)
+    return health
+
+
+def diagnose_video(video_url: str, fresh: bool = False, deadline_sec: float = DIAG_DEADLINE_SEC) -> VideoHealth:
+    """Синхронная обёртка (для вызова вне event loop, например из Celery)."""
+    return asyncio.run(diagnose_video_async(video_url, fresh=fresh, deadline_sec=deadline_sec))
+
+
+async def diagnose_videos(
+    video_urls: List[str],
+    *,
+    fresh: bool = False,
+    deadline_sec: float = DIAG_DEADLINE_SEC,
+    concurrency: int = 4,
+) -> List[VideoHealth]:
+    """Пакетная диагностика: до concurrency видео одновременно, дедлайн — на каждое видео."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(url: str) -> VideoHealth:
+        async with sem:
+            return await diagnose_video_async(url, fresh=fresh, deadline_sec=deadline_sec)
+
+    return list(await asyncio.gather(*(one(u) for u in video_urls)))
+
+
+def _summarize_health(health: VideoHealth) -> None:
+    """Общий статус и рекомендации по собранным проверкам."""
     # Определяем общий статус и рекомендации
     # НЕ считаем ошибкой: alias плейлисты, таймауты ffprobe, S3 ошибки когда CDN работает
     
@@ -1089,6 +1235,9 @@ def diagnose_video(video_url: str) -> VideoHealth:
     def is_real_warning(key: str, check: DiagnosticResult) -> bool:
         if check.status != "warning":
             return False
+        # не успели за дедлайн — результата нет, это не деградация видео
+        if key in health.timed_out:
+            return False
         # ffprobe timeout для больших файлов - не критично
         if "codecs" in key and "timed out" in check.message:
             return False
@@ -1193,51 +1342,99 @@ def diagnose_video(video_url: str) -> VideoHealth:
                 "Возможные причины: rate limiting, перегрузка S3/CDN."
             )
             break
-    
-    return health
+
+    if health.timed_out:
+        health.recommendations.append(
+            f"Не все проверки успели за {health.deadline_sec:.0f}s ({', '.join(health.timed_out)}). "
+            "Повторите диагностику или увеличьте deadline_sec."
+        )
 
 
 class DiagnoseRequest(BaseModel):
     video_url: str
+    fresh: bool = False  # мимо индекса метаданных S3
+    deadline_sec: float = DIAG_DEADLINE_SEC
+
+
+class DiagnoseBatchRequest(BaseModel):
+    video_urls: List[str]
+    fresh: bool = False
+    deadline_sec: float = DIAG_DEADLINE_SEC  # на каждое видео
+    concurrency: int = 4
+    include_checks: bool = False  # полные checks по каждому видео (объёмно)
+
+
+def _health_to_dict(health: VideoHealth, include_checks: bool = True) -> Dict[str, Any]:
+    out = {
+        "video_url": health.video_url,
+        "s3_key": health.s3_key,
+        "overall_status": health.overall_status,
+        "recommendations": health.recommendations,
+        "partial": health.partial,
+        "timed_out": health.timed_out,
+        "duration_sec": health.duration_sec,
+    }
+    if include_checks:
+        out["checks"] = {k: asdict(v) for k, v in health.checks.items()}
+    else:
+        out["failed_checks"] = [k for k, v in health.checks.items() if v.status == "error"]
+    return out
 
 
 @router.post("/diagnose")
-def diagnose_video_endpoint(
+async def diagnose_video_endpoint(
     req: DiagnoseRequest,
     current_admin: User = Depends(require_roles("admin"))
 ) -> Dict[str, Any]:
     """
     Диагностика видео: проверяет MP4, CDN доступность, HLS сегменты, кодеки.
     Помогает выявить причины ошибок 520 и остановки видео.
+    Проверки идут параллельно; по deadline_sec возвращается частичный результат.
     """
-    health = diagnose_video(req.video_url)
-    
-    # Конвертируем в dict
-    result = {
-        "video_url": health.video_url,
-        "s3_key": health.s3_key,
-        "overall_status": health.overall_status,
-        "checks": {k: asdict(v) for k, v in health.checks.items()},
-        "recommendations": health.recommendations,
-    }
-    
-    return result
+    health = await diagnose_video_async(req.video_url, fresh=req.fresh, deadline_sec=req.deadline_sec)
+    return _health_to_dict(health)
 
 
 @router.get("/diagnose")
-def diagnose_video_get(
+async def diagnose_video_get(
     video_url: str = Query(..., description="URL видео для диагностики"),
+    fresh: bool = Query(False, description="Проверять S3 мимо индекса метаданных"),
+    deadline_sec: float = Query(DIAG_DEADLINE_SEC, description="Общий дедлайн диагностики, сек"),
     current_admin: User = Depends(require_roles("admin"))
 ) -> Dict[str, Any]:
     """GET версия диагностики для удобства."""
-    health = diagnose_video(video_url)
-    
+    health = await diagnose_video_async(video_url, fresh=fresh, deadline_sec=deadline_sec)
+    return _health_to_dict(health)
+
+
+@router.post("/diagnose-batch")
+async def diagnose_batch_endpoint(
+    req: DiagnoseBatchRequest,
+    current_admin: User = Depends(require_roles("admin"))
+) -> Dict[str, Any]:
+    """
+    Пакетная диагностика для админских проходов по многим видео:
+    до concurrency видео параллельно, внутри каждого — параллельные проверки.
+    """
+    urls = list(dict.fromkeys(u.strip() for u in req.video_urls if u and u.strip()))
+    if not urls:
+        raise HTTPException(status_code=400, detail="video_urls is empty")
+    if len(urls) > DIAG_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many videos (max {DIAG_BATCH_MAX})")
+
+    results = await diagnose_videos(
+        urls,
+        fresh=req.fresh,
+        deadline_sec=req.deadline_sec,
+        concurrency=min(max(1, req.concurrency), 16),
+    )
+    summary: Dict[str, int] = {}
+    for h in results:
+        summary[h.overall_status] = summary.get(h.overall_status, 0) + 1
     return {
-        "video_url": health.video_url,
-        "s3_key": health.s3_key,
-        "overall_status": health.overall_status,
-        "checks": {k: asdict(v) for k, v in health.checks.items()},
-        "recommendations": health.recommendations,
+        "count": len(results),
+        "summary": summary,
+        "results": [_health_to_dict(h, include_checks=req.include_checks) for h in results],
     }
 
 
@@ -1278,7 +1475,7 @@ def quick_check(
     return results
 
 
-def check_moov_position(url: str) -> DiagnosticResult:
+def check_moov_position(url: str, timeout: int = 15) -> DiagnosticResult:
     """
     Проверяет позицию moov atom в MP4 файле.
     moov в начале = faststart, moov в конце = медленная загрузка.
@@ -1294,7 +1491,7 @@ def check_moov_position(url: str) -> DiagnosticResult:
             cmd, 
             capture_output=True, 
             text=True, 
-            timeout=15
+            timeout=timeout
         )
         
         stderr = result.stderr or ""
@@ -1631,6 +1828,7 @@ def cleanup_hls_endpoint(
                         for i in range(0, len(objects_to_delete), 1000):
                             batch = objects_to_delete[i:i+1000]
                             s3.delete_objects(Bucket=S3_BUCKET, Delete={"Objects": batch})
+                        s3_meta_index.forget(o["Key"] for o in objects_to_delete)
                         
                         results["deleted"].append({
                             "key": pl_key,
@@ -1762,6 +1960,7 @@ def fix_encoded_paths_endpoint(
                                     Key=decoded_key,
                                     MetadataDirective="COPY"
                                 )
+                                s3_meta_index.drop([decoded_key])
                                 results["copied"].append(decoded_key)
                             except Exception as e:
                                 results["errors"].append({
@@ -1860,6 +2059,7 @@ def fix_hls_master_playlists_endpoint(
                                     ContentType="application/vnd.apple.mpegurl",
                                     CacheControl="public, max-age=60"
                                 )
+                                s3_meta_index.drop([key])
                                 results["fixed"].append(key)
                             except Exception as e:
                                 results["errors"].append({
@@ -1961,6 +2161,7 @@ def fix_all_hls_aliases_endpoint(
                             ContentType="application/vnd.apple.mpegurl",
                             CacheControl="public, max-age=60"
                         )
+                        s3_meta_index.drop([key])
                         results["fixed"].append(key)
                     else:
                         results["fixed"].append({"key": key, "would_fix": True})
@@ -2033,6 +2234,7 @@ def fix_hls_permissions_endpoint(
                                 Key=key,
                                 ACL='public-read'
                             )
+                            s3_meta_index.record(key, acl_public=True)
                             results["files_fixed"].append(key)
                         except Exception as e:
                             results["errors"].append({
@@ -2129,6 +2331,7 @@ def _fix_hls_acl_for_video(video_url: str, dry_run: bool = False) -> Dict[str, A
                             Key=key,
                             ACL='public-read'
                         )
+                        s3_meta_index.record(key, acl_public=True)
                         results["files_fixed"].append(key)
                     else:
                         results["files_fixed"].append({"key": key, "would_fix": True})
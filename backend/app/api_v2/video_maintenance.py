@@ -367,3 +367,55 @@ def video_maintenance_audit(limit: int = 50) -> Dict[str, Any]:
     return {"count": len(items), "items": items}
 
 
+
+
+@router.get("/jobs", dependencies=[Depends(require_roles("admin"))])
+def video_maintenance_jobs(
+    status: Optional[str] = None,
+    limit: int = 50,
+    db: Session = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Состояние очереди video_maintenance_jobs: счётчики по статусам и последние
+    задачи (по умолчанию — с ошибками), чтобы видеть, что и почему не починилось.
+    """
+    from sqlalchemy import func
+
+    from ..models.models_v2 import VideoJobStatus, VideoMaintenanceJob as J
+
+    counts = {
+        (s.value if isinstance(s, VideoJobStatus) else str(s)): int(n)
+        for s, n in db.query(J.status, func.count(J.id)).group_by(J.status).all()
+    }
+
+    if status:
+        try:
+            statuses = [VideoJobStatus(status)]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Unknown job status")
+    else:
+        statuses = [VideoJobStatus.ERROR, VideoJobStatus.FAILED]
+
+    rows = (
+        db.query(J)
+        .filter(J.status.in_(statuses))
+        .order_by(J.updated_at.desc())
+        .limit(max(1, min(limit, 500)))
+        .all()
+    )
+    items = [
+        {
+            "id": j.id,
+            "video_key": j.video_key,
+            "status": j.status.value if isinstance(j.status, VideoJobStatus) else j.status,
+            "attempts": j.attempts,
+            "last_error": j.last_error,
+            "result": j.result,
+            "source": j.source,
+            "source_id": j.source_id,
+            "next_run_at": j.next_run_at,
+            "updated_at": j.updated_at,
+        }
+        for j in rows
+    ]
+    return {"counts": counts, "count": len(items), "items": items}
@@ -29,6 +29,12 @@ celery = Celery(
             "app.tasks.referral_campaign",
             "app.tasks.migrate_abandoned_to_leads",
             "app.tasks.ny2026_leads",
+            "app.tasks.email_dispatch",
+            "app.tasks.landing_metrics",
+            "app.tasks.recommendations",
+            "app.tasks.visit_flush",
+            "app.tasks.traffic_rollup",
+            "app.tasks.lesson_videos",
         ],
 )
 
@@ -108,15 +114,70 @@ celery.conf.update(
         #     "schedule": 600,  # каждые 10 минут (батч N видео за тик)
         #     "options": {"queue": "special"},
         # },
-        # DB-driven tick: постоянная нагрузка без раздувания очереди:
+        # DB-driven tick: воркер очереди video_maintenance_jobs:
         # - запускаем часто
-        # - expires чуть меньше schedule, чтобы задачи “протухали”, если воркер занят
-        # - внутри таски есть lock и max_runtime
+        # - expires чуть меньше schedule, чтобы задачи “протухали”, если воркеры заняты
+        # - задачи берутся через SKIP LOCKED, поэтому тики на разных воркерах идут параллельно
         "video-maintenance-db-tick": {
             "task": "app.tasks.video_maintenance.tick_db",
             "schedule": 15,
             "options": {"queue": "special", "expires": 14},
         },
+        # Индекс метаданных S3 (размер/ETag/плейлисты) для video-пайплайнов
+        "s3-meta-index-sweep-daily": {
+            "task": "app.tasks.video_maintenance.sweep_s3_meta_index",
+            "schedule": 86400,
+            "options": {"queue": "special", "expires": 3600},
+        },
+        # Наполнение очереди video_maintenance_jobs: новые ключи из courses/landings
+        "video-maintenance-scan-jobs": {
+            "task": "app.tasks.video_maintenance.scan_jobs",
+            "schedule": 3600,
+            "options": {"queue": "special", "expires": 3000},
+        },
+        # Страховочный пересчёт lessons_total / duration_minutes лендингов
+        "landing-metrics-daily": {
+            "task": "app.tasks.landing_metrics.backfill_landing_metrics",
+            "schedule": 86400,
+            "options": {"queue": "special"},
+        },
+        # Страховочная пересборка индекса уроков/видео lesson_videos
+        "lesson-video-index-rebuild-daily": {
+            "task": "app.tasks.lesson_videos.rebuild_lesson_video_index",
+            "schedule": 86400,
+            "options": {"queue": "special", "expires": 3600},
+        },
+        # Буфер визитов лендингов → БД пачками (services_v2.visit_ingest)
+        "visits-flush": {
+            "task": "app.tasks.visit_flush.flush_visits",
+            "schedule": 5,
+            "options": {"queue": "default", "expires": 30},
+        },
+        # Почасовые роллапы трафика/покупок для /analytics (services_v2.traffic_rollup)
+        "traffic-rollup-refresh": {
+            "task": "app.tasks.traffic_rollup.refresh_traffic_rollups",
+            "schedule": 60,
+            "options": {"queue": "default", "expires": 120},
+        },
+        # Ночная сверка роллапов за последние сутки-трое (удалённые покупки, поздние коммиты)
+        "traffic-rollup-rebuild-daily": {
+            "task": "app.tasks.traffic_rollup.rebuild_traffic_rollups",
+            "schedule": 86400,
+            "kwargs": {"days": 3},
+            "options": {"queue": "special", "expires": 3600},
+        },
+        # Проверка «живости» превью уроков: не больше PREVIEW_SWEEP_MAX_PER_RUN HEAD за запуск
+        "preview-liveness-sweep": {
+            "task": "app.tasks.preview_tasks.sweep_preview_liveness",
+            "schedule": 600,
+            "options": {"queue": "default", "expires": 590},
+        },
+        # Матрица совместных покупок для рекомендаций (sort=recommend)
+        "copurchase-matrix-hourly": {
+            "task": "app.tasks.recommendations.build_copurchase_matrix",
+            "schedule": 3600,
+            "options": {"queue": "special"},
+        },
         # === Email tasks: каждый час, ~55 писем каждая = 165/час суммарно ===
         "process-abandoned-checkouts-hourly": {
             "task": "app.tasks.abandoned_checkouts.process_abandoned_checkouts",
@@ -181,6 +242,12 @@ celery.conf.task_queues = (
 celery.conf.task_routes = {
     "app.tasks.preview_tasks.*": {"queue": "default"},
     "app.tasks.special_offers.process_special_offers": {"queue": "special"},
+    "app.tasks.landing_metrics.*": {"queue": "special"},
+    "app.tasks.recommendations.*": {"queue": "special"},
+    "app.tasks.lesson_videos.*": {"queue": "special"},
+    "app.tasks.visit_flush.*": {"queue": "default"},
+    "app.tasks.traffic_rollup.refresh_traffic_rollups": {"queue": "default"},
+    "app.tasks.traffic_rollup.rebuild_traffic_rollups": {"queue": "special"},
     # storage_links.replace_storage_links — оставляем роутинг на special,
     # если вдруг вызовете вручную через apply_async
     "app.tasks.storage_links.replace_storage_links": {"queue": "special"},
@@ -190,6 +257,9 @@ celery.conf.task_routes = {
     "app.tasks.ensure_hls.fix_missing_legacy_aliases": {"queue": "special"},
     # manual video maintenance (API/админка) — высокий приоритет
     "app.tasks.video_maintenance.process_list": {"queue": "special_priority"},
+    "app.tasks.video_maintenance.scan_jobs": {"queue": "special"},
+    "app.tasks.video_maintenance.tick_db": {"queue": "special"},
+    "app.tasks.video_maintenance.sweep_s3_meta_index": {"queue": "special"},
     "app.tasks.book_formats.*": {"queue": "book"},
     "app.tasks.book_previews.*": {"queue": "book"},
     "app.tasks.book_covers.*": {"queue": "book"},
@@ -200,4 +270,5 @@ celery.conf.task_routes = {
     "app.tasks.abandoned_checkouts.process_abandoned_checkouts": {"queue": "email"},
     "app.tasks.big_cart_reminder.process_big_cart_reminders": {"queue": "email"},
     "app.tasks.referral_campaign.send_referral_campaign_batch": {"queue": "email"},
+    "app.tasks.email_dispatch.*": {"queue": "email"},
 }
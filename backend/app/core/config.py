@@ -53,6 +53,14 @@ class Settings(BaseSettings):
     # Увеличивайте, чтобы "растянуть" скорость и снизить вероятность throttling/Too old.
     EMAIL_SEND_MIN_INTERVAL_SECONDS: float = 5.0
 
+    # Общий token bucket рассылок (services_v2.email_dispatch), один на всех email-воркеров.
+    # transactional — MAILGUN_DOMAIN / SMTP (брошенные корзины, big cart, рефералка),
+    # marketing — MAILGUN_MARKETING_DOMAIN (NY2026). BURST — ёмкость ведра (всплеск).
+    EMAIL_BUCKET_PER_HOUR: int = 165
+    EMAIL_BUCKET_BURST: int = 10
+    EMAIL_MARKETING_BUCKET_PER_HOUR: int = 3600
+    EMAIL_MARKETING_BUCKET_BURST: int = 400
+
     # Facebook
     FACEBOOK_PIXEL_ID : str
     FACEBOOK_ACCESS_TOKEN : str
@@ -65,6 +65,16 @@ class VideoMaintenanceConfig:
     # Ограничение времени выполнения одного тика (сек), чтобы держать “ровный” ритм
     db_tick_max_runtime_sec: int = 40
 
+    # ───────── Очередь video_maintenance_jobs ─────────
+    # Сканер courses/landings → таблица задач; воркеры (tick_db) берут строки через SKIP LOCKED,
+    # поэтому параллельные тики на разных воркерах не мешают друг другу.
+    jobs_scan_chunk: int = 200            # сущностей за один SELECT сканера
+    jobs_upsert_chunk: int = 1000         # строк в одном INSERT … ON DUPLICATE KEY UPDATE
+    jobs_max_attempts: int = 5            # после стольких ошибок — failed (только ручной перезапуск)
+    jobs_retry_base_sec: int = 300        # бэкофф ошибок: base * 2^(attempt-1)
+    jobs_locked_retry_sec: int = 60       # ключ занят ручным прогоном — повторим позже без штрафа
+    jobs_stale_running_sec: int = 2 * 3600  # running дольше этого — воркер умер, задача возвращается
+
 
 VIDEO_MAINTENANCE = VideoMaintenanceConfig()
 
@@ -6,7 +6,7 @@ from .api_v2 import users, courses, landings, authors, photo, stripe, wallet, bo
     surveys, restore_photos, migrate_landing_photos, mailgun_webhooks, video_diagnostics, video_playback, bans, video_maintenance
 
 from fastapi.middleware.cors import CORSMiddleware
-from .middlewares.rate_limiter import RateLimitMiddleware
+from .middlewares.rate_limiter import RateLimitMiddleware, RateLimitPolicy
 from .middlewares.monitoring import MonitoringMiddleware
 
 from .db.database import init_db
@@ -25,17 +25,24 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
     
-    # Rate Limiting: 100 запросов в минуту с одного IP (Sliding Window)
+    # Rate Limiting: 100 запросов в минуту с одного IP (Sliding Window в Redis,
+    # общий для всех воркеров). Политики проверяются по порядку, остальное — default.
     # Исключения: пути, которые не подлежат rate limiting
     excluded_paths = [
         r"^/api/books/\d+/pdf$",  # Скачивание PDF книг
         r"^/api/validations/check-email$",  # Проверка email
     ]
+    rate_limit_policies = [
+        # Вход/регистрация/сброс пароля — подбор паролей и рассылка писем
+        RateLimitPolicy("auth", r"^/api/users/(login|register|forgot-password)$",
+                        max_requests=20, window_seconds=60),
+    ]
     app.add_middleware(
         RateLimitMiddleware, 
         max_requests=100, 
         window_seconds=60,
-        excluded_paths=excluded_paths
+        excluded_paths=excluded_paths,
+        policies=rate_limit_policies,
     )
     
     # Monitoring: отслеживание ошибок и медленных запросов
@@ -1,119 +1,160 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
+import os
 import time
 import asyncio
+import threading
 import traceback
 import logging
+from bisect import bisect_left
+
+from .request_meta import get_request_meta
 from ..utils.telegram_monitor import send_error_notification, send_slow_request_notification
 
 logger = logging.getLogger(__name__)
 
 
-class MonitoringMiddleware(BaseHTTPMiddleware):
+class LatencyHistograms:
+    """
+    Гистограммы латентности по маршрутам (шаблон пути FastAPI, а не сырой URL —
+    число ключей ограничено числом роутов). Латентность — до начала ответа
+    (заголовков), поэтому стриминг тела в неё не входит.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(method, route): [count, sum, bucket_0, ..., bucket_inf]}
+        self._data = {}
+
+    def observe(self, method: str, route: str, seconds: float) -> None:
+        idx = bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            row = self._data.get((method, route))
+            if row is None:
+                row = self._data[(method, route)] = [0, 0.0] + [0] * (len(self.BUCKETS) + 1)
+            row[0] += 1
+            row[1] += seconds
+            row[2 + idx] += 1
+
+    def snapshot(self) -> list:
+        """Данные текущего процесса: бакеты кумулятивные, как у Prometheus (le)."""
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._data.items()]
+        out = []
+        for (method, route), row in sorted(items):
+            cumulative, buckets = 0, {}
+            for bound, n in zip(self.BUCKETS + (float("inf"),), row[2:]):
+                cumulative += n
+                buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            out.append({
+                "method": method,
+                "route": route,
+                "count": row[0],
+                "avg_ms": round(row[1] / row[0] * 1000, 2) if row[0] else 0.0,
+                "buckets": buckets,
+            })
+        return out
+
+
+route_latency = LatencyHistograms()
+
+
+def latency_snapshot() -> dict:
+    return {"pid": os.getpid(), "routes": route_latency.snapshot()}
+
+
+class MonitoringMiddleware:
     """
-    Middleware для мониторинга производительности и ошибок.
+    ASGI-middleware для мониторинга производительности и ошибок.
     - Отправляет уведомления о 500 ошибках в Telegram
     - Отправляет уведомления о медленных запросах (>5 секунд)
-    - Не изменяет существующие логи
+    - Пишет гистограммы латентности по маршрутам (route_latency)
+    - Не изменяет существующие логи и не буферизует тело ответа
     """
-    
+
     # Эндпоинты, исключённые из мониторинга производительности
     PERFORMANCE_EXCLUDE_PATTERNS = [
         "/api/courses/detail/",
         "/api/books/",  # стриминг PDF и другие тяжёлые операции с книгами
     ]
-    
+
     # Порог для медленных запросов (в секундах)
     SLOW_REQUEST_THRESHOLD = 5.0
-    
+
     def __init__(self, app):
-        super().__init__(app)
-    
-    def _get_client_ip(self, request: Request) -> str:
-        """Получает IP клиента из заголовков или напрямую"""
-        forwarded = request.headers.get("x-forwarded-for")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
-        
-        if request.client:
-            return request.client.host
-        
-        return "unknown"
-    
+        self.app = app
+
     def _should_exclude_performance_monitoring(self, url: str) -> bool:
         """Проверяет, нужно ли исключать URL из мониторинга производительности"""
         for pattern in self.PERFORMANCE_EXCLUDE_PATTERNS:
             if pattern in url:
                 return True
         return False
-    
-    async def dispatch(self, request: Request, call_next):
-        """Обрабатывает каждый запрос"""
-        start_time = time.time()
-        response = None
-        error_occurred = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        meta = get_request_meta(scope)
+        start_time = time.perf_counter()
+        status_code = None
+        response_started_at = None
         error_info = None
-        
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_started_at
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_started_at = time.perf_counter()
+            await send(message)
+
         try:
-            # Выполняем запрос
-            response = await call_next(request)
-            
+            await self.app(scope, receive, send_wrapper)
+
             # Проверяем статус код ответа
-            if response.status_code >= 500:
-                error_occurred = True
+            if status_code is not None and status_code >= 500:
                 error_info = {
-                    "type": f"{response.status_code} Error",
-                    "traceback": f"HTTP {response.status_code} response from endpoint"
+                    "type": f"{status_code} Error",
+                    "traceback": f"HTTP {status_code} response from endpoint"
                 }
-            
+
         except Exception as e:
             # Необработанное исключение
-            error_occurred = True
             error_info = {
                 "type": type(e).__name__,
                 "traceback": traceback.format_exc()
             }
             # Пробрасываем исключение дальше, чтобы FastAPI обработал его
             raise
-        
+
         finally:
-            # Вычисляем время выполнения
-            duration = time.time() - start_time
-            
-            # Получаем информацию о запросе
-            method = request.method
-            url = str(request.url.path)
-            domain = request.headers.get("host", "unknown")
-            client_ip = self._get_client_ip(request)
-            
+            # Время выполнения — до начала ответа (как раньше у call_next)
+            duration = (response_started_at or time.perf_counter()) - start_time
+
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "<unmatched>"
+            route_latency.observe(meta.method, route_path, duration)
+
             # Отправляем уведомление об ошибке
-            if error_occurred and error_info:
-                status_code = response.status_code if response else 500
+            if error_info:
                 asyncio.create_task(send_error_notification(
-                    method=method,
-                    url=url,
-                    status_code=status_code,
+                    method=meta.method,
+                    url=meta.path,
+                    status_code=status_code if status_code and status_code >= 500 else 500,
                     error_type=error_info["type"],
                     traceback_text=error_info["traceback"],
-                    domain=domain,
-                    client_ip=client_ip
+                    domain=meta.host,
+                    client_ip=meta.client_ip
                 ))
-            
+
             # Проверяем медленные запросы (только если не исключён из мониторинга)
-            if (duration > self.SLOW_REQUEST_THRESHOLD and 
-                not self._should_exclude_performance_monitoring(url)):
+            if (duration > self.SLOW_REQUEST_THRESHOLD and
+                not self._should_exclude_performance_monitoring(meta.path)):
                 asyncio.create_task(send_slow_request_notification(
-                    method=method,
-                    url=url,
+                    method=meta.method,
+                    url=meta.path,
                     duration=duration,
-                    domain=domain,
-                    client_ip=client_ip
+                    domain=meta.host,
+                    client_ip=meta.client_ip
                 ))
-        
-        return response
-
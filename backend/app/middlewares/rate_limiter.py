@@ -1,194 +1,309 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
 from starlette.responses import JSONResponse
-from collections import defaultdict
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
 from time import time
+from typing import Optional, List
 import asyncio
 import logging
+import os
 import re
+import redis.asyncio as aioredis
 from jose import jwt, JWTError
+from .request_meta import RequestMeta, get_request_meta
 from ..core.config import settings
 from ..utils.telegram_monitor import send_rate_limit_notification
 
 logger = logging.getLogger(__name__)
 
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+HISTORY_SIZE = 10              # последние запросы ключа — для уведомления в Telegram
+REDIS_RETRY_SECONDS = 5        # после ошибки Redis столько секунд работаем локально
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
+# Sliding window counter: оценка = prev * (доля прошлого окна, ещё попадающая в
+# скользящее окно) + cur. Два GET + INCR + LPUSH/LTRIM — O(1) на запрос,
+# атомарно для всех воркеров.
+#   KEYS: 1 — счётчик текущего окна, 2 — счётчик прошлого окна, 3 — история
+#   ARGV: 1 — мс от начала текущего окна, 2 — окно (мс), 3 — лимит,
+#         4 — запись истории, 5 — размер истории
+_SLIDING_WINDOW_LUA = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '0')
+local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+local elapsed = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local estimated = prev * (window - elapsed) / window + cur
+if estimated >= limit then
+  local retry = window - elapsed
+  if prev > 0 and cur < limit then
+    retry = window - elapsed - (limit - cur) * window / prev
+  end
+  if retry < 0 then retry = 0 end
+  return {0, math.floor(estimated), math.ceil(retry)}
+end
+redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], window * 2)
+redis.call('LPUSH', KEYS[3], ARGV[4])
+redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[5]) - 1)
+redis.call('PEXPIRE', KEYS[3], window)
+return {1, math.floor(estimated) + 1, 0}
+"""
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
     """
-    Rate Limiting Middleware с алгоритмом Sliding Window.
-    Ограничивает количество запросов с одного IP до max_requests за window_seconds.
+    Политика лимита для группы путей.
+
+    pattern=None — подходит для любого пути (политика по умолчанию).
+    per="ip" — счётчик на IP; per="user" — на user_id из JWT
+    (для анонимных запросов — на IP).
     """
-    
-    def __init__(self, app, max_requests: int = 120, window_seconds: int = 60, excluded_paths: list = None):
-        super().__init__(app)
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        # Словарь: {ip: [(timestamp, method, url), ...]}
-        self.request_times = defaultdict(list)
-        # Для очистки старых записей
-        self.last_cleanup = time()
-        self.cleanup_interval = 300  # Очистка каждые 5 минут
+    name: str
+    pattern: Optional[str]
+    max_requests: int
+    window_seconds: int
+    per: str = "ip"
+
+
+class _LocalWindow:
+    """In-process копия того же алгоритма — фолбэк, когда Redis недоступен."""
+
+    __slots__ = ("start", "cur", "prev", "history")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.cur = 0
+        self.prev = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+
+@lru_cache(maxsize=4096)
+def _decode_token(token: str) -> tuple:
+    """(user_id, email, exp) из JWT; кэш — чтобы не проверять подпись на каждый запрос."""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None, None, None
+    except Exception as e:
+        logger.debug(f"Error decoding JWT in rate limiter: {e}")
+        return None, None, None
+    return payload.get("user_id"), payload.get("email"), payload.get("exp")
+
+
+class RateLimitMiddleware:
+    """
+    Распределённый Rate Limiting (Sliding Window Counter в Redis), ASGI-middleware.
+    Лимит общий для всех воркеров; политики по путям и по пользователю,
+    при недоступности Redis — локальный счётчик в процессе.
+    redis_url=None — только локальный счётчик (dev, бенчмарки).
+    """
+
+    def __init__(
+        self,
+        app,
+        max_requests: int = 120,
+        window_seconds: int = 60,
+        excluded_paths: list = None,
+        policies: List[RateLimitPolicy] = None,
+        redis_url: str = REDIS_URL,
+    ):
+        self.app = app
+        # Политики проверяются по порядку; последняя — по умолчанию для всех путей
+        self.policies = list(policies or [])
+        self.policies.append(RateLimitPolicy("default", None, max_requests, window_seconds))
+        self.policy_patterns = [
+            (re.compile(p.pattern) if p.pattern else None, p) for p in self.policies
+        ]
         # Пути, исключенные из rate limiting (поддерживает паттерны)
         self.excluded_paths = excluded_paths or []
-        # Компилируем regex паттерны для исключенных путей
         self.excluded_patterns = [re.compile(pattern) for pattern in self.excluded_paths]
-        
-    def _cleanup_old_entries(self):
-        """Удаляет старые записи из памяти"""
-        current_time = time()
-        if current_time - self.last_cleanup > self.cleanup_interval:
-            cutoff_time = current_time - self.window_seconds * 2
-            
-            # Удаляем IP, у которых все запросы старше cutoff_time
-            ips_to_remove = []
-            for ip, requests in self.request_times.items():
-                # Удаляем старые запросы
-                requests[:] = [req for req in requests if req[0] > cutoff_time]
-                if not requests:
-                    ips_to_remove.append(ip)
-            
-            for ip in ips_to_remove:
-                del self.request_times[ip]
-            
-            self.last_cleanup = current_time
-            logger.debug(f"Rate limiter cleanup: removed {len(ips_to_remove)} IPs")
-    
+
+        if redis_url:
+            self.redis = aioredis.Redis.from_url(
+                redis_url, decode_responses=True, socket_timeout=0.2, socket_connect_timeout=0.2,
+            )
+            self.script = self.redis.register_script(_SLIDING_WINDOW_LUA)
+            self.redis_down_until = 0.0
+        else:
+            self.redis = self.script = None
+            self.redis_down_until = float("inf")
+
+        # Локальный фолбэк: {key: _LocalWindow}
+        self.local_windows = {}
+        self.last_cleanup = time()
+        self.cleanup_interval = 300  # Очистка каждые 5 минут
+
     def _is_excluded(self, path: str) -> bool:
         """Проверяет, находится ли путь в списке исключений"""
         for pattern in self.excluded_patterns:
             if pattern.match(path):
                 return True
         return False
-    
-    def _get_client_ip(self, request: Request) -> str:
-        """Получает IP клиента из заголовков или напрямую"""
-        # Nginx передаёт реальный IP в X-Real-IP или X-Forwarded-For
-        forwarded = request.headers.get("x-forwarded-for")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
-        
-        # Если заголовков нет, берём из request.client
-        if request.client:
-            return request.client.host
-        
-        return "unknown"
-    
-    def _get_user_info(self, request: Request) -> tuple:
+
+    def _get_policy(self, path: str) -> RateLimitPolicy:
+        for pattern, policy in self.policy_patterns:
+            if pattern is None or pattern.match(path):
+                return policy
+        return self.policies[-1]
+
+    def _get_user_info(self, meta: RequestMeta) -> tuple:
         """Извлекает информацию о пользователе из JWT токена напрямую"""
         # Middleware выполняется ДО dependencies авторизации,
         # поэтому декодируем JWT токен напрямую из заголовка Authorization
-        user_email = None
-        user_id = None
-        
-        auth_header = request.headers.get("authorization")
-        if auth_header and auth_header.lower().startswith("bearer "):
-            token = auth_header[7:]  # Убираем "Bearer "
-            try:
-                payload = jwt.decode(
-                    token, 
-                    settings.SECRET_KEY, 
-                    algorithms=[settings.ALGORITHM]
-                )
-                user_id = payload.get("user_id")
-                user_email = payload.get("email")  # Если есть в токене
-            except JWTError:
-                pass  # Невалидный токен - пропускаем
-            except Exception as e:
-                logger.debug(f"Error decoding JWT in rate limiter: {e}")
-        
+        auth_header = meta.authorization
+        if not auth_header or not auth_header.lower().startswith("bearer "):
+            return None, None
+        user_id, user_email, exp = _decode_token(auth_header[7:])
+        if exp is not None and exp < time():
+            return None, None
         return user_email, user_id
-    
-    async def dispatch(self, request: Request, call_next):
+
+    # ─────────────── счётчики ───────────────
+
+    async def _hit_redis(self, key: str, policy: RateLimitPolicy, now: float, entry: str):
+        window_ms = policy.window_seconds * 1000
+        now_ms = int(now * 1000)
+        start = now_ms - now_ms % window_ms
+        allowed, count, retry_ms = await self.script(
+            keys=[f"{key}:{start}", f"{key}:{start - window_ms}", f"{key}:history"],
+            args=[now_ms - start, window_ms, policy.max_requests, entry, HISTORY_SIZE],
+        )
+        return bool(allowed), int(count), retry_ms / 1000.0
+
+    def _hit_local(self, key: str, policy: RateLimitPolicy, now: float, entry: str):
+        self._cleanup_local(now)
+        window = policy.window_seconds
+        start = int(now // window) * window
+        state = self.local_windows.get(key)
+        if state is None:
+            state = self.local_windows[key] = _LocalWindow(start)
+        if state.start != start:
+            # Сдвиг окна: текущее становится прошлым (или обнуляется, если пропущено больше окна)
+            state.prev = state.cur if start - state.start == window else 0
+            state.cur = 0
+            state.start = start
+        elapsed = now - start
+        estimated = state.prev * (window - elapsed) / window + state.cur
+        if estimated >= policy.max_requests:
+            retry = window - elapsed
+            if state.prev > 0 and state.cur < policy.max_requests:
+                retry = window - elapsed - (policy.max_requests - state.cur) * window / state.prev
+            return False, int(estimated), max(retry, 0.0)
+        state.cur += 1
+        state.history.appendleft(entry)
+        return True, int(estimated) + 1, 0.0
+
+    def _cleanup_local(self, now: float):
+        """Удаляет из памяти ключи, окна которых давно закончились"""
+        if now - self.last_cleanup <= self.cleanup_interval:
+            return
+        max_window = max(p.window_seconds for p in self.policies)
+        stale = [k for k, s in self.local_windows.items() if now - s.start > max_window * 2]
+        for k in stale:
+            del self.local_windows[k]
+        self.last_cleanup = now
+        logger.debug(f"Rate limiter cleanup: removed {len(stale)} keys")
+
+    async def _history(self, key: str) -> list:
+        if time() >= self.redis_down_until:
+            try:
+                return await self.redis.lrange(f"{key}:history", 0, HISTORY_SIZE - 1)
+            except Exception:
+                pass
+        state = self.local_windows.get(key)
+        return list(state.history) if state else []
+
+    # ─────────────── обработка запроса ───────────────
+
+    async def __call__(self, scope, receive, send):
         """Обрабатывает каждый запрос"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # Проверяем, не находится ли путь в исключениях
-        url = str(request.url.path)
+        meta = get_request_meta(scope)
+        url = meta.path
         if self._is_excluded(url):
             # Пропускаем запрос без rate limiting
-            response = await call_next(request)
-            return response
-        
-        # Периодическая очистка
-        self._cleanup_old_entries()
-        
-        client_ip = self._get_client_ip(request)
+            await self.app(scope, receive, send)
+            return
+
+        policy = self._get_policy(url)
+        client_ip = meta.client_ip
+        ident = f"ip:{client_ip}"
+        if policy.per == "user":
+            _, user_id = self._get_user_info(meta)
+            if user_id is not None:
+                ident = f"user:{user_id}"
+        key = f"rl:{policy.name}:{ident}"
+
         current_time = time()
-        method = request.method
-        
-        # Получаем запросы для этого IP
-        requests = self.request_times[client_ip]
-        
-        # Удаляем запросы старше window_seconds (Sliding Window)
-        cutoff_time = current_time - self.window_seconds
-        requests[:] = [req for req in requests if req[0] > cutoff_time]
-        
-        # Проверяем лимит
-        if len(requests) >= self.max_requests:
-            # Лимит превышен
-            # Вычисляем время до доступности (когда самый старый запрос выйдет из окна)
-            oldest_timestamp = requests[0][0]
-            time_until_available = self.window_seconds - (current_time - oldest_timestamp)
-            
-            # Получаем информацию о пользователе
-            user_email, user_id = self._get_user_info(request)
-            domain = request.headers.get("host", "unknown")
-            
-            # Получаем последние 10 запросов для отправки в Telegram
-            # ВАЖНО: создаём копию данных на момент превышения лимита,
-            # чтобы они не изменились к моменту асинхронной отправки
-            current_request_count = len(requests)
-            snapshot_time = current_time  # Фиксируем время для расчёта "секунд назад"
-            last_requests = [
-                {
-                    "method": req[1], 
-                    "url": req[2], 
-                    "seconds_ago": int(snapshot_time - req[0])
-                }
-                for req in requests[-10:]
-            ]
-            
-            # Отправляем уведомление в Telegram (неблокирующе)
-            asyncio.create_task(send_rate_limit_notification(
-                client_ip=client_ip,
-                domain=domain,
-                request_count=current_request_count,
-                max_requests=self.max_requests,
-                user_email=user_email,
-                user_id=user_id,
-                time_until_available=time_until_available,
-                last_requests=last_requests
-            ))
-            
-            logger.warning(
-                f"Rate limit exceeded for IP {client_ip}: "
-                f"{len(requests)}/{self.max_requests} requests in {self.window_seconds}s"
-            )
-            
-            # Добавляем CORS-заголовки, т.к. этот ответ не проходит через CORSMiddleware
-            # (middleware выполняются в обратном порядке)
-            return JSONResponse(
-                status_code=429,
-                content={
-                    "detail": "Rate limit exceeded. Try again later.",
-                    "retry_after": int(time_until_available)
-                },
-                headers={
-                    "Retry-After": str(int(time_until_available)),
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Credentials": "true",
-                    "Access-Control-Allow-Methods": "*",
-                    "Access-Control-Allow-Headers": "*",
-                    "Access-Control-Expose-Headers": "Retry-After",
-                }
-            )
-        
-        # Добавляем текущий запрос
-        requests.append((current_time, method, url))
-        
-        # Пропускаем запрос дальше
-        response = await call_next(request)
-        return response
+        entry = f"{current_time:.3f}|{meta.method}|{url}"
+
+        if current_time >= self.redis_down_until:
+            try:
+                allowed, count, time_until_available = await self._hit_redis(key, policy, current_time, entry)
+            except Exception as e:
+                logger.warning(f"Rate limiter: Redis unavailable ({e}), local fallback for {REDIS_RETRY_SECONDS}s")
+                self.redis_down_until = current_time + REDIS_RETRY_SECONDS
+                allowed, count, time_until_available = self._hit_local(key, policy, current_time, entry)
+        else:
+            allowed, count, time_until_available = self._hit_local(key, policy, current_time, entry)
+
+        if allowed:
+            # Пропускаем запрос дальше
+            await self.app(scope, receive, send)
+            return
+
+        # Лимит превышен
+        # Получаем информацию о пользователе
+        user_email, user_id = self._get_user_info(meta)
+
+        # Последние 10 пропущенных запросов ключа (новые — первыми в истории)
+        last_requests = []
+        for item in reversed(await self._history(key)):
+            ts, method, path = item.split("|", 2)
+            last_requests.append({
+                "method": method,
+                "url": path,
+                "seconds_ago": int(current_time - float(ts)),
+            })
+
+        # Отправляем уведомление в Telegram (неблокирующе)
+        asyncio.create_task(send_rate_limit_notification(
+            client_ip=client_ip,
+            domain=meta.host,
+            request_count=count,
+            max_requests=policy.max_requests,
+            user_email=user_email,
+            user_id=user_id,
+            time_until_available=time_until_available,
+            last_requests=last_requests
+        ))
+
+        logger.warning(
+            f"Rate limit exceeded for {ident} ({policy.name}): "
+            f"{count}/{policy.max_requests} requests in {policy.window_seconds}s"
+        )
 
+        retry_after = max(int(time_until_available), 1)
+        # Добавляем CORS-заголовки, т.к. этот ответ не проходит через CORSMiddleware
+        # (middleware выполняются в обратном порядке)
+        response = JSONResponse(
+            status_code=429,
+            content={
+                "detail": "Rate limit exceeded. Try again later.",
+                "retry_after": retry_after
+            },
+            headers={
+                "Retry-After": str(retry_after),
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Credentials": "true",
+                "Access-Control-Allow-Methods": "*",
+                "Access-Control-Allow-Headers": "*",
+                "Access-Control-Expose-Headers": "Retry-After",
+            }
+        )
+        await response(scope, receive, send)
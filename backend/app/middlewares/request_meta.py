@@ -0,0 +1,60 @@
+from typing import Optional
+
+
+class RequestMeta:
+    """
+    Данные запроса, нужные middleware (IP клиента, путь, домен, Authorization).
+
+    Разбираются из ASGI scope один раз и кладутся в scope["state"], так что
+    мониторинг и rate limiter не проходят по заголовкам повторно.
+    """
+
+    __slots__ = ("method", "path", "client_ip", "host", "authorization")
+
+    def __init__(self, method: str, path: str, client_ip: str, host: str, authorization: Optional[str]):
+        self.method = method
+        self.path = path
+        self.client_ip = client_ip
+        self.host = host
+        self.authorization = authorization
+
+
+_STATE_KEY = "request_meta"
+
+
+def get_request_meta(scope) -> RequestMeta:
+    state = scope.setdefault("state", {})
+    meta = state.get(_STATE_KEY)
+    if meta is not None:
+        return meta
+
+    forwarded = real_ip = host = authorization = None
+    for name, value in scope.get("headers") or ():
+        if name == b"x-forwarded-for":
+            forwarded = value.decode("latin-1")
+        elif name == b"x-real-ip":
+            real_ip = value.decode("latin-1")
+        elif name == b"host":
+            host = value.decode("latin-1")
+        elif name == b"authorization":
+            authorization = value.decode("latin-1")
+
+    # Nginx передаёт реальный IP в X-Real-IP или X-Forwarded-For
+    if forwarded:
+        client_ip = forwarded.split(",")[0].strip()
+    elif real_ip:
+        client_ip = real_ip
+    elif scope.get("client"):
+        client_ip = scope["client"][0]
+    else:
+        client_ip = "unknown"
+
+    meta = RequestMeta(
+        method=scope.get("method", ""),
+        path=scope.get("path", ""),
+        client_ip=client_ip,
+        host=host or "unknown",
+        authorization=authorization,
+    )
+    state[_STATE_KEY] = meta
+    return meta
@@ -1,8 +1,10 @@
 from sqlalchemy import Column, Integer, String, Text, JSON, ForeignKey, Table, Enum, Boolean, DateTime, func, Float, \
     Index, BigInteger, Numeric, Date
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import declarative_base, relationship, backref
+from sqlalchemy.orm import declarative_base, relationship, backref, validates
 from enum import Enum as PyEnum
+import re
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
 import datetime as _dt
 from sqlalchemy.dialects.mysql import BIGINT
 
@@ -117,6 +119,36 @@ class FreeCourseSource(str, PyEnum):
     SPECIAL_OFFER  = "special_offer"   # спец-предложение
     EMAIL = "email"
 
+# Те же правила, что у бэкфилла в sql/004_landing_numeric_prices.sql:
+# неотрицательное число без экспоненты, округление half-up, влезает в DECIMAL(10, 2).
+_PRICE_RE = re.compile(r"^[0-9]+(\.[0-9]+)?$")
+_PRICE_CENT = Decimal("0.01")
+_PRICE_MAX = Decimal("99999999.99")
+
+
+def normalize_price(value) -> Decimal | None:
+    """
+    Строковая цена лендинга → Decimal(10, 2).
+    '49.99' / '49,99' / ' 49 ' → Decimal('49.99');
+    пусто/мусор/отрицательное/экспонента/NaN/Infinity/больше DECIMAL(10, 2) → None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        if not value.is_finite() or value < 0:
+            return None
+        s = format(value, "f")
+    else:
+        s = str(value).strip().replace(",", ".")
+    if not _PRICE_RE.match(s):
+        return None
+    try:
+        price = Decimal(s).quantize(_PRICE_CENT, rounding=ROUND_HALF_UP)
+    except (InvalidOperation, ValueError):
+        return None
+    return price if price <= _PRICE_MAX else None
+
+
 class Course(Base):
     __tablename__ = 'courses'
     id = Column(Integer, primary_key=True)
@@ -135,12 +167,22 @@ class Landing(Base):
     landing_name = Column(Text)
     old_price = Column(String(255))
     new_price = Column(String(255))
+    # Числовые копии old_price/new_price для фильтров/сортировок/индексов.
+    # Синхронизируются автоматически (см. _sync_price_num ниже).
+    old_price_num = Column(Numeric(10, 2), nullable=True)
+    new_price_num = Column(Numeric(10, 2), nullable=True)
     course_program = Column(Text)
     lessons_info = Column(JSON)
     preview_photo = Column(String(255), default='')
     sales_count = Column(Integer, default=0)
     duration = Column(String(50), default='')
     lessons_count = Column(String(50), default='')
+    # Материализованные метрики для сортировок/фильтров каталога:
+    # lessons_total — сумма уроков из Course.sections всех курсов лендинга,
+    # duration_minutes — распарсенное поле duration.
+    # Пересчитываются в landing_service / course_service и таской landing_metrics.
+    lessons_total = Column(Integer, nullable=False, server_default="0")
+    duration_minutes = Column(Integer, nullable=False, server_default="0")
     is_hidden = Column(Boolean, nullable=False, server_default='0')
     in_advertising = Column(Boolean, default=False)
     ad_flag_expires_at = Column(DateTime, nullable=True)
@@ -154,6 +196,9 @@ class Landing(Base):
         # если у тебя уже есть другие индексы — добавь этот в кортеж
         Index("ix_landings_created_at", "created_at"),
         Index("ix_landings_page_name", "page_name"),
+        Index("ix_landings_hidden_lessons", "is_hidden", "lessons_total"),
+        Index("ix_landings_hidden_duration", "is_hidden", "duration_minutes"),
+        Index("ix_landings_hidden_lang_price", "is_hidden", "language", "new_price_num"),
     )
 
 
@@ -168,6 +213,12 @@ class Landing(Base):
         """Список ID курсов, связанных с этим лендингом."""
         return [c.id for c in self.courses]
 
+    @validates("old_price", "new_price")
+    def _sync_price_num(self, key, value):
+        """Любая запись строковой цены через ORM обновляет её числовую копию."""
+        setattr(self, f"{key}_num", normalize_price(value))
+        return value
+
 class LandingAdPeriod(Base):
     __tablename__ = "landing_ad_periods"
 
@@ -816,6 +867,10 @@ class BookLanding(Base):
     updated_at    = Column(DateTime, server_default=func.utc_timestamp(),
                            onupdate=func.utc_timestamp())
 
+    __table_args__ = (
+        Index("ix_book_landings_hidden_lang_price", "is_hidden", "language", "new_price"),
+    )
+
     books = relationship("Book", secondary=book_landing_books,
                          back_populates="landings", lazy="selectin")
     tags = relationship("Tag", secondary=book_landing_tags,
@@ -1027,6 +1082,11 @@ class SearchQuery(Base):
 
     user = relationship("User", backref="search_queries")
 
+    __table_args__ = (
+        Index("ix_search_queries_user_created", "user_id", "created_at"),
+        Index("ix_search_queries_ip_created", "ip_address", "created_at"),
+    )
+
 
 # ───────────────── Система опросов (Surveys) ─────────────────
 
@@ -1205,3 +1265,146 @@ class BanIP(Base):
     )
 
     emails = relationship("BanEmail", secondary=ban_email_ip, back_populates="ips", lazy="selectin")
+
+
+# ───────────────── Video maintenance: очередь задач ─────────────────
+
+class VideoJobStatus(str, PyEnum):
+    PENDING = "pending"    # ждёт обработки (новый ключ или повтор после ошибки)
+    RUNNING = "running"    # захвачен воркером (locked_at/locked_by)
+    DONE    = "done"       # видео здоровое — повторные прогоны его пропускают
+    ERROR   = "error"      # ошибка, будет повтор после next_run_at
+    FAILED  = "failed"     # попытки исчерпаны — только ручной перезапуск
+
+
+class VideoMaintenanceJob(Base):
+    """
+    Одна строка = один mp4-ключ, найденный сканером в courses.sections / landings.lessons_info.
+    Воркеры захватывают строки через SELECT … FOR UPDATE SKIP LOCKED.
+    """
+    __tablename__ = "video_maintenance_jobs"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    key_hash = Column(String(40), nullable=False, unique=True)   # sha1(video_key): ключи длиннее лимита индекса
+    video_key = Column(Text, nullable=False)
+    source = Column(String(16), nullable=True)                   # course | landing | rename
+    source_id = Column(Integer, nullable=True)
+
+    status = Column(
+        Enum(
+            VideoJobStatus,
+            name="video_job_status",
+            validate_strings=True,
+            values_callable=lambda e: [x.value for x in e],
+        ),
+        nullable=False,
+        server_default=VideoJobStatus.PENDING.value,
+    )
+    attempts = Column(Integer, nullable=False, server_default="0")
+    last_error = Column(Text, nullable=True)
+    result = Column(JSON, nullable=True)                         # краткая сводка последнего прогона
+
+    next_run_at = Column(DateTime, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    locked_by = Column(String(100), nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    last_seen_at = Column(DateTime, nullable=True)               # когда сканер последний раз видел ссылку
+    created_at = Column(DateTime, nullable=False, server_default=func.utc_timestamp())
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        server_default=func.utc_timestamp(),
+        onupdate=func.utc_timestamp(),
+    )
+
+    __table_args__ = (
+        Index("ix_vmj_status_next_run", "status", "next_run_at"),
+    )
+
+
+class TrafficHourly(Base):
+    """
+    Почасовой роллап визитов и покупок лендинга (services_v2.traffic_rollup).
+    kind: landing | book_landing; bucket — начало часа (UTC).
+    """
+    __tablename__ = "traffic_hourly"
+
+    kind = Column(String(16), primary_key=True)
+    target_id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+
+    visits = Column(Integer, nullable=False, server_default="0")        # landing_visits / book_landing_visits
+    ad_visits = Column(Integer, nullable=False, server_default="0")     # … из них from_ad
+    ad_hits = Column(Integer, nullable=False, server_default="0")       # ad_visits / book_ad_visits (track-ad)
+    purchases = Column(Integer, nullable=False, server_default="0")
+    ad_purchases = Column(Integer, nullable=False, server_default="0")
+    amount = Column(Numeric(14, 2), nullable=False, server_default="0")  # сумма purchases.amount
+
+    __table_args__ = (
+        Index("ix_traffic_hourly_kind_bucket", "kind", "bucket"),
+    )
+
+
+class TrafficTotal(Base):
+    """Итоги «за всё время» по лендингу — те же счётчики, что в TrafficHourly."""
+    __tablename__ = "traffic_totals"
+
+    kind = Column(String(16), primary_key=True)
+    target_id = Column(Integer, primary_key=True)
+
+    visits = Column(Integer, nullable=False, server_default="0")
+    ad_visits = Column(Integer, nullable=False, server_default="0")
+    ad_hits = Column(Integer, nullable=False, server_default="0")
+    purchases = Column(Integer, nullable=False, server_default="0")
+    ad_purchases = Column(Integer, nullable=False, server_default="0")
+    amount = Column(Numeric(14, 2), nullable=False, server_default="0")
+    first_visit_at = Column(DateTime, nullable=True)
+
+
+class TrafficRollupState(Base):
+    """High-water mark роллапа: до какого id исходная таблица уже учтена."""
+    __tablename__ = "traffic_rollup_state"
+
+    source = Column(String(32), primary_key=True)     # имя исходной таблицы
+    last_id = Column(BigInteger, nullable=False, server_default="0")
+    seen_id = Column(BigInteger, nullable=True)       # MAX(id), замеченный прошлым refresh
+    seen_at = Column(DateTime, nullable=True)         # когда замечен (UTC)
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        server_default=func.utc_timestamp(),
+        onupdate=func.utc_timestamp(),
+    )
+
+
+class LessonVideo(Base):
+    """
+    Производный индекс уроков из courses.sections и landings.lessons_info
+    (services_v2.lesson_video_index): одна строка = один урок.
+    entity_type: course | landing; section — ключ секции курса (у лендинга NULL).
+    key_hash = sha1(video_key): ключи длиннее лимита индекса.
+    """
+    __tablename__ = "lesson_videos"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    entity_type = Column(String(16), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    section = Column(String(64), nullable=True)
+    section_name = Column(String(255), nullable=True)
+    lesson_index = Column(Integer, nullable=False)               # позиция урока в секции / в lessons_info
+    lesson_name = Column(String(255), nullable=True)
+
+    video_url = Column(Text, nullable=True)                      # как записано в JSON
+    video_key = Column(Text, nullable=True)                      # нормализованный S3 key
+    key_hash = Column(String(40), nullable=True)
+    source_host = Column(String(255), nullable=True)             # NULL — ссылка без хоста (сырой key)
+    is_ours = Column(Boolean, nullable=False, server_default="0")  # наш mp4 (cloud/cdn/r2) — берёт video_maintenance
+
+    updated_at = Column(DateTime, nullable=False, server_default=func.utc_timestamp())
+
+    __table_args__ = (
+        Index("ix_lesson_videos_entity", "entity_type", "entity_id"),
+        Index("ix_lesson_videos_key_hash", "key_hash"),
+        Index("ix_lesson_videos_source_host", "source_host"),
+        Index("ix_lesson_videos_ours", "is_ours", "entity_type", "entity_id"),
+    )
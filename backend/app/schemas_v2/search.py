@@ -52,6 +52,7 @@ class SearchResponse(BaseModel):
     returned: int                 # сколько реально отдали (≤ limit)
     limit: int                    # применённый лимит
     truncated: bool               # были ли урезания по лимиту
+    next_cursor: Optional[str] = None  # курсор следующей страницы (если truncated)
     authors: List[SearchAuthorItem]
     landings: List[SearchLandingItem]
     book_landings: List[SearchBookLandingItem]
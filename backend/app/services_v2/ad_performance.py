@@ -0,0 +1,331 @@
+"""
+Метрики рекламы по лендингам (курсовым и книжным) для дашбордов ad_control.
+
+Раньше каждая строка /ads/quarantine, /ads/observation, /ads/overview и
+/ads/books/overview собиралась из отдельных карт: все периоды рекламы
+грузились в Python и склеивались там (_merge_periods), first5 считался
+UNION ALL-таблицей пар, каждая метрика за 10 дней / за всё время — своим
+вызовом traffic_rollup, назначения и имена — ещё тремя запросами.
+book_ad_control повторял всё это для книг.
+
+Здесь на вид лендинга:
+  • один SQL-запрос: склейка периодов (GRACE_HOURS) оконными функциями
+    (gaps-and-islands: MAX(конец) по предыдущим периодам → признак нового
+    эпизода → SUM/MAX по лендингу), first5 коррелированным подзапросом,
+    назначения и имена сотрудника/кабинета — LEFT JOIN;
+  • два чтения роллапа traffic_rollup (окно 10 дней и всё время) сразу
+    по всем метрикам и лендингам.
+Снимок держится in-process AD_PERFORMANCE_TTL секунд (интервал обновления
+дашборда); ручки назначения сбрасывают его через invalidate() — в своём
+воркере сразу, в остальных через Redis pub/sub (канал AD_PERFORMANCE_CHANNEL),
+как инвалидация снапшота каталога.
+Эталон — старые карты в scripts/bench_ad_performance.py.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import redis
+from sqlalchemy import case, func, or_, select, text
+from sqlalchemy.orm import Session
+
+from ..models.models_v2 import (
+    AdAccount, AdStaff, BookLanding, BookLandingAdAssignment, BookLandingAdPeriod,
+    Landing, LandingAdAssignment, LandingAdPeriod, Purchase,
+)
+from . import traffic_rollup
+
+logger = logging.getLogger(__name__)
+
+KIND_LANDING = traffic_rollup.KIND_LANDING
+KIND_BOOK_LANDING = traffic_rollup.KIND_BOOK_LANDING
+
+AD_PERFORMANCE_TTL = int(os.getenv("AD_PERFORMANCE_TTL", "60"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+AD_PERFORMANCE_CHANNEL = os.getenv("AD_PERFORMANCE_CHANNEL", "ad_performance:invalidate")
+
+GRACE_HOURS = 14           # периоды с перерывом <= GRACE_HOURS склеиваются в один эпизод
+FIRST_DAYS = 5             # окно first5 от склеенного старта
+RECENT_DAYS = 10           # окно метрик *_10d
+WHITE_DAYS_THRESHOLD = 5   # < 5 дней от старта => white
+
+
+@dataclass(frozen=True)
+class _Kind:
+    landing: type
+    period: type
+    period_fk: object
+    assignment: type
+    assignment_fk: object
+    purchase_fk: object
+
+
+_KINDS = {
+    KIND_LANDING: _Kind(
+        Landing, LandingAdPeriod, LandingAdPeriod.landing_id,
+        LandingAdAssignment, LandingAdAssignment.landing_id, Purchase.landing_id,
+    ),
+    KIND_BOOK_LANDING: _Kind(
+        BookLanding, BookLandingAdPeriod, BookLandingAdPeriod.book_landing_id,
+        BookLandingAdAssignment, BookLandingAdAssignment.book_landing_id, Purchase.book_landing_id,
+    ),
+}
+
+
+@dataclass
+class AdPerformanceRow:
+    id: int
+    landing_name: Optional[str]
+    language: Optional[str]
+    sales_count: int
+    stage_started_at: datetime        # начало склеенного активного эпизода
+    cycle_no: int                     # число склеенных эпизодов за всё время
+    ad_purchases_first_5_days: int
+    ad_purchases_last_10_days: int
+    ad_visits_last_10_days: int       # track-ad хиты (AV10d)
+    total_purchases_last_10_days: int
+    ad_purchases_lifetime: int
+    hours_left: Optional[int]         # до ad_flag_expires_at, к нулю
+    staff_id: Optional[int]
+    staff_name: Optional[str]
+    account_id: Optional[int]
+    account_name: Optional[str]
+
+
+@dataclass
+class AdPerformanceSnapshot:
+    kind: str
+    as_of: datetime
+    rows: List[AdPerformanceRow]
+    built_at: float
+
+    def for_language(self, language: Optional[str]) -> List[AdPerformanceRow]:
+        if not language:
+            return list(self.rows)
+        lang = language.upper().strip()
+        return [r for r in self.rows if r.language == lang]
+
+
+def overview_color(now: datetime, stage_start: datetime, sales10: int, lifetime_sales: int) -> str:
+    """
+    Цвет overview:
+    - white: < WHITE_DAYS_THRESHOLD дней от старта
+    - green: sales10 > 3
+    - orange: 1 <= sales10 <= 3
+    - black: sales10 == 0 && lifetime_sales > 3
+    - red: sales10 == 0 && lifetime_sales <= 3
+    """
+    if (now - stage_start).days < WHITE_DAYS_THRESHOLD:
+        return "white"
+    if sales10 > 3:
+        return "green"
+    if 1 <= sales10 <= 3:
+        return "orange"
+    if lifetime_sales > 3:
+        return "black"
+    return "red"
+
+
+def _episodes(k: _Kind, now: datetime):
+    """
+    По лендингам в рекламе: cycles (склеенных эпизодов), episode_start
+    (старт последнего эпизода), open_cnt (открытых периодов).
+    Эквивалент _merge_periods: период начинает новый эпизод, если он позже
+    максимального конца всех предыдущих (открытый = now) больше чем на GRACE_HOURS.
+    """
+    p = k.period
+    lid = k.period_fk
+    prev_end = func.max(func.coalesce(p.ended_at, now)).over(
+        partition_by=lid, order_by=(p.started_at, p.id), rows=(None, -1),
+    )
+    marked = (
+        select(
+            lid.label("lid"),
+            p.started_at.label("st"),
+            p.ended_at.label("en"),
+            prev_end.label("prev_end"),
+        )
+        .where(lid.in_(select(k.landing.id).where(k.landing.in_advertising.is_(True))))
+        .subquery("marked")
+    )
+    is_new = case(
+        (or_(marked.c.prev_end.is_(None),
+             marked.c.st > func.date_add(marked.c.prev_end, text(f"INTERVAL {GRACE_HOURS} HOUR"))), 1),
+        else_=0,
+    )
+    return (
+        select(
+            marked.c.lid,
+            func.sum(is_new).label("cycles"),
+            func.max(case((is_new == 1, marked.c.st))).label("episode_start"),
+            func.sum(case((marked.c.en.is_(None), 1), else_=0)).label("open_cnt"),
+        )
+        .group_by(marked.c.lid)
+        .subquery("ep")
+    )
+
+
+def build_snapshot(db: Session, kind: str, now: Optional[datetime] = None) -> AdPerformanceSnapshot:
+    """Метрики всех лендингов вида kind, которые сейчас в рекламе (in_advertising + открытый период)."""
+    k = _KINDS[kind]
+    started = time.monotonic()
+    now = now or datetime.utcnow()
+    L, A = k.landing, k.assignment
+
+    ep = _episodes(k, now)
+    first5 = (
+        select(func.count(Purchase.id))
+        .where(
+            k.purchase_fk == L.id,
+            Purchase.from_ad.is_(True),
+            Purchase.created_at >= ep.c.episode_start,
+            Purchase.created_at < func.least(
+                func.date_add(ep.c.episode_start, text(f"INTERVAL {FIRST_DAYS} DAY")), now,
+            ),
+        )
+        .scalar_subquery()
+    )
+    q = (
+        select(
+            L.id, L.landing_name, L.language, L.sales_count, L.ad_flag_expires_at,
+            ep.c.cycles, ep.c.episode_start,
+            A.staff_id, AdStaff.name.label("staff_name"),
+            A.account_id, AdAccount.name.label("account_name"),
+            first5.label("first5"),
+        )
+        .select_from(L)
+        .join(ep, ep.c.lid == L.id)
+        .outerjoin(A, k.assignment_fk == L.id)
+        .outerjoin(AdStaff, AdStaff.id == A.staff_id)
+        .outerjoin(AdAccount, AdAccount.id == A.account_id)
+        .where(L.in_advertising.is_(True), ep.c.open_cnt > 0)
+    )
+    base = db.execute(q).all()
+
+    ids = [r.id for r in base]
+    recent = traffic_rollup.aggregate(
+        db, kind, targets=ids, start_dt=now - timedelta(days=RECENT_DAYS), end_dt=now, by_target=True,
+    )
+    lifetime = traffic_rollup.aggregate(db, kind, targets=ids, by_target=True)
+
+    rows = []
+    for r in base:
+        rec = recent.get((r.id, None)) or {}
+        exp = r.ad_flag_expires_at
+        rows.append(AdPerformanceRow(
+            id=r.id,
+            landing_name=r.landing_name,
+            language=r.language,
+            sales_count=r.sales_count or 0,
+            stage_started_at=r.episode_start,
+            cycle_no=int(r.cycles or 0),
+            ad_purchases_first_5_days=int(r.first5 or 0),
+            ad_purchases_last_10_days=int(rec.get("ad_purchases", 0)),
+            ad_visits_last_10_days=int(rec.get("ad_hits", 0)),
+            total_purchases_last_10_days=int(rec.get("purchases", 0)),
+            ad_purchases_lifetime=int((lifetime.get((r.id, None)) or {}).get("ad_purchases", 0)),
+            hours_left=None if exp is None else int((exp - now).total_seconds() // 3600),
+            staff_id=r.staff_id,
+            staff_name=r.staff_name,
+            account_id=r.account_id,
+            account_name=r.account_name,
+        ))
+
+    logger.info("ad performance snapshot %s: %d landings in %.1f ms",
+                kind, len(rows), (time.monotonic() - started) * 1000)
+    return AdPerformanceSnapshot(kind=kind, as_of=now, rows=rows, built_at=time.monotonic())
+
+
+_snapshots: Dict[str, AdPerformanceSnapshot] = {}
+_snapshot_lock = threading.Lock()
+_listener_pid: Optional[int] = None
+_rds: Optional[redis.Redis] = None
+_INSTANCE_ID = uuid.uuid4().hex
+
+
+def _is_fresh(snapshot: Optional[AdPerformanceSnapshot]) -> bool:
+    return snapshot is not None and time.monotonic() - snapshot.built_at < AD_PERFORMANCE_TTL
+
+
+def get_snapshot(db: Session, kind: str) -> AdPerformanceSnapshot:
+    """Текущий снимок вида kind; пересобирается одним потоком, если устарел."""
+    _ensure_listener()
+    snapshot = _snapshots.get(kind)
+    if _is_fresh(snapshot):
+        return snapshot
+    with _snapshot_lock:
+        snapshot = _snapshots.get(kind)
+        if not _is_fresh(snapshot):
+            snapshot = _snapshots[kind] = build_snapshot(db, kind)
+        return snapshot
+
+
+def _drop(kind: Optional[str]) -> None:
+    if kind is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(kind, None)
+
+
+def _redis() -> redis.Redis:
+    global _rds
+    if _rds is None:
+        _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+    return _rds
+
+
+def invalidate(kind: Optional[str] = None) -> None:
+    """
+    Сбрасывает снимок (kind=None — все виды) в своём воркере и рассылает
+    сброс остальным. Ошибки Redis не пробрасываются: остальные догонят по TTL.
+    """
+    _drop(kind)
+    try:
+        _redis().publish(AD_PERFORMANCE_CHANNEL, json.dumps({"kind": kind, "origin": _INSTANCE_ID}))
+    except Exception as e:
+        logger.warning("ad performance invalidate publish failed (%s): %s", kind, e)
+
+
+def _listen_forever() -> None:
+    while True:
+        try:
+            r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+            pubsub = r.pubsub(ignore_subscribe_messages=False)
+            pubsub.subscribe(AD_PERFORMANCE_CHANNEL)
+            for message in pubsub.listen():
+                if message.get("type") == "subscribe":
+                    # (Пере)подключились — сбросы за время разрыва могли потеряться
+                    _drop(None)
+                    continue
+                if message.get("type") != "message":
+                    continue
+                try:
+                    payload = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                if payload.get("origin") == _INSTANCE_ID:
+                    continue
+                _drop(payload.get("kind"))
+        except Exception as e:
+            logger.warning("ad performance invalidation listener error: %s; retry in 5s", e)
+            time.sleep(5)
+
+
+def _ensure_listener() -> None:
+    """Подписчик — один daemon-поток на процесс (после fork запускается заново)."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _snapshot_lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+    threading.Thread(target=_listen_forever, name="ad-performance-invalidation", daemon=True).start()
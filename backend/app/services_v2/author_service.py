@@ -6,6 +6,7 @@ from typing import List, Optional
 from sqlalchemy import func, literal_column
 
 from .book_service import books_in_landing
+from .catalog_snapshot import get_catalog_snapshot, publish_catalog_change, KIND_AUTHOR, KIND_ALL
 from ..models.models_v2 import Author, Landing, Book, BookLanding
 from ..schemas_v2.author import AuthorCreate, AuthorUpdate, AuthorResponsePage, AuthorResponse
 
@@ -43,13 +44,6 @@ def list_authors_by_page(
     base_query = (
         db.query(Author)
         .join(popularity_sub, popularity_sub.c.author_id == Author.id)
-        .options(  # нужны курсы для courses_count
-            selectinload(Author.landings)
-            .selectinload(Landing.courses),
-            selectinload(Author.landings)
-            .selectinload(Landing.tags),
-            selectinload(Author.books).selectinload(Book.landings),
-        )
         .order_by(*order_columns)
     )
     if language:
@@ -66,45 +60,11 @@ def list_authors_by_page(
     # 5) Подсчитываем общее число страниц
     total_pages = ceil(total / size) if total else 0
 
-    def safe_price(value) -> float:
-        try:
-            return float(value)
-        except Exception:
-            return float("inf")  # некорректная цена → бесконечность
-
+    # Счётчики и теги — предпосчитанные в снапшоте каталога (только видимые лендинги)
+    snapshot = get_catalog_snapshot(db)
     items: List[AuthorResponse] = []
     for a in authors:
-        # 1) минимальная цена по каждому course_id
-        min_price_by_course: Dict[int, float] = {}
-        for l in a.landings:
-            price = safe_price(l.new_price)
-            for c in l.courses:
-                cid = c.id
-                if price < min_price_by_course.get(cid, float("inf")):
-                    min_price_by_course[cid] = price
-
-        # 2) оставляем только «дешёвые» лендинги
-        kept_landings: List[Landing] = []
-        for l in a.landings:
-            price = safe_price(l.new_price)
-            has_cheaper_alt = any(
-                price > min_price_by_course.get(c.id, price)
-                for c in l.courses
-            )
-            if not has_cheaper_alt:
-                kept_landings.append(l)
-
-        # 3) уникальные курсы и теги
-        unique_course_ids: Set[int] = {c.id for l in kept_landings for c in l.courses}
-        unique_tags: Set[str] = {t.name for l in kept_landings for t in l.tags}
-
-        # 4) КНИГИ: считаем только те, у которых есть хотя бы один видимый BookLanding
-        visible_books_count = len({
-            b.id
-            for b in a.books
-            if any(not bl.is_hidden for bl in b.landings)
-        })
-
+        counters = snapshot.author_counters(a.id)
         items.append(
             AuthorResponse(
                 id=a.id,
@@ -112,9 +72,9 @@ def list_authors_by_page(
                 description=a.description,
                 language=a.language,
                 photo=a.photo,
-                courses_count=len(unique_course_ids),
-                books_count=visible_books_count or None,
-                tags=sorted(unique_tags),
+                courses_count=counters.cheapest_courses,
+                books_count=counters.books or None,
+                tags=list(counters.cheapest_tags),
             )
         )
     return {
@@ -141,6 +101,7 @@ def create_author(db: Session, author_data: AuthorCreate) -> Author:
     db.add(new_author)
     db.commit()
     db.refresh(new_author)
+    publish_catalog_change(KIND_AUTHOR, [new_author.id])
     return new_author
 
 def update_author(db: Session, author_id: int, update_data: AuthorUpdate) -> Author:
@@ -169,6 +130,7 @@ def update_author(db: Session, author_id: int, update_data: AuthorUpdate) -> Aut
         author.language = update_data.language
     db.commit()
     db.refresh(author)
+    publish_catalog_change(KIND_AUTHOR, [author.id])
     return author
 
 def delete_author(db: Session, author_id: int) -> None:
@@ -179,12 +141,14 @@ def delete_author(db: Session, author_id: int) -> None:
     author.landings = []
     db.delete(author)
     db.commit()
+    # Автор пропадает из связок всех его лендингов и книг — проще пересобрать снапшот
+    publish_catalog_change(KIND_ALL)
 
 from sqlalchemy.orm import Session, selectinload
-from typing import Dict, Tuple, Set, List
+from typing import Dict, Tuple, List
 
 from sqlalchemy.orm import selectinload
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional
 
 def get_author_full_detail(db: Session, author_id: int) -> dict | None:
     author = (
@@ -218,7 +182,7 @@ def get_author_full_detail(db: Session, author_id: int) -> dict | None:
     # 2) Минимальная new-цена по каждому курсу
     min_price_by_course: Dict[int, float] = {}
     for l in author.landings:
-        price = safe_price(l.new_price)
+        price = safe_price(l.new_price_num)
         for c in l.courses:
             cid = c.id
             min_price_by_course[cid] = min(min_price_by_course.get(cid, float("inf")), price)
@@ -226,7 +190,7 @@ def get_author_full_detail(db: Session, author_id: int) -> dict | None:
     # 3) Оставляем самые дешёвые лендинги по курсам
     kept_landings: List[Landing] = []
     for l in author.landings:
-        price = safe_price(l.new_price)
+        price = safe_price(l.new_price_num)
         if not any(price > min_price_by_course[c.id] for c in l.courses):
             kept_landings.append(l)
 
@@ -236,8 +200,8 @@ def get_author_full_detail(db: Session, author_id: int) -> dict | None:
     landing_ids: List[int] = []
 
     for l in kept_landings:
-        p_new = safe_price(l.new_price)
-        p_old = safe_price(l.old_price)
+        p_new = safe_price(l.new_price_num)
+        p_old = safe_price(l.old_price_num)
 
         total_new_price_courses += p_new
         total_old_price_courses += p_old
@@ -460,13 +424,6 @@ def list_authors_search_paginated(
     base_query = (
         db.query(Author)
           .join(popularity_sub, popularity_sub.c.author_id == Author.id)
-          .options(
-              selectinload(Author.landings)
-                .selectinload(Landing.courses),
-              selectinload(Author.landings)
-                .selectinload(Landing.tags),
-                selectinload(Author.books).selectinload(Book.landings),
-          )
           .filter(Author.name.ilike(f"%{search}%"))
           .order_by(
               popularity_sub.c.popularity.desc(),
@@ -483,39 +440,11 @@ def list_authors_search_paginated(
     offset = (page - 1) * size
     authors = base_query.offset(offset).limit(size).all()
 
-    # ---------- 5. вычисляем courses_count ---------------------------------
+    # ---------- 5. courses_count / books_count / теги из снапшота ----------
+    snapshot = get_catalog_snapshot(db)
     items: List[AuthorResponse] = []
     for a in authors:
-        # a) минимальная цена по каждому курсу
-        min_price_by_course: Dict[int, float] = {}
-        for l in a.landings:
-            price = safe_price(l.new_price)
-            for c in l.courses:
-                if price < min_price_by_course.get(c.id, float("inf")):
-                    min_price_by_course[c.id] = price
-
-        # b) «дорогие» дубликаты отбрасываем
-        kept_landings = [
-            l for l in a.landings
-            if not any(
-                safe_price(l.new_price) > min_price_by_course.get(c.id, safe_price(l.new_price))
-                for c in l.courses
-            )
-        ]
-
-        # c) уникальные курсы
-        unique_course_ids: Set[int] = {
-            c.id for l in kept_landings for c in l.courses
-        }
-        unique_tags: Set[str] = {
-            t.name for l in kept_landings for t in l.tags
-        }
-        visible_books_count = len({
-            b.id
-            for b in a.books
-            if any(not bl.is_hidden for bl in b.landings)
-        })
-
+        counters = snapshot.author_counters(a.id)
         items.append(
             AuthorResponse(
                 id=a.id,
@@ -523,10 +452,10 @@ def list_authors_search_paginated(
                 description=a.description,
                 language=a.language,
                 photo=a.photo,
-                courses_count=len(unique_course_ids),
-                books_count=visible_books_count or None,
-                tags = sorted(unique_tags)
-        )
+                courses_count=counters.cheapest_courses,
+                books_count=counters.books or None,
+                tags=list(counters.cheapest_tags),
+            )
         )
 
     # ---------- 6. финальный ответ -----------------------------------------
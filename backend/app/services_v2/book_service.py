@@ -18,6 +18,7 @@ from ..schemas_v2.book import (
 )
 from ..utils.s3 import generate_presigned_url
 from ..utils.ip_utils import is_facebook_bot_ip
+from . import traffic_rollup
 
 log = logging.getLogger(__name__)
 
@@ -421,16 +422,13 @@ def track_book_ad_visit(
 ):
     """
     Отслеживает визит с рекламы на книжный лендинг с метаданными (fbp, fbc, ip).
-    Загорает флаг только после порога уникальных IP за окно BOOK_AD_UNIQUE_IP_WINDOW.
-    Если активная реклама не набирает порог — выключает её.
-    
-    При высокой конкуренции за блокировку row-lock:
-    - Визит ВСЕГДА записывается (это главное)
-    - Обновление флага рекламы пропускается при блокировке (eventual consistency)
-    - Визиты от ботов (по IP и User-Agent) игнорируются
+    Визит уходит в буфер (services_v2.visit_ingest) и записывается пачкой;
+    флаг рекламы по порогу уникальных IP за окно BOOK_AD_UNIQUE_IP_WINDOW
+    обновляется там же, один раз на лендинг за пачку (apply_book_ad_visits).
+    Визиты от ботов (по IP и User-Agent) игнорируются.
     """
-    from sqlalchemy.exc import OperationalError
     from ..utils.ip_utils import is_bot_user_agent
+    from .visit_ingest import record_visit, KIND_BOOK_AD_VISIT
     
     # Фильтруем ботов по User-Agent
     if is_bot_user_agent(user_agent):
@@ -441,59 +439,68 @@ def track_book_ad_visit(
     if is_facebook_bot_ip(ip):
         log.debug("Skipping book ad visit from Facebook bot IP: %s", ip)
         return
-    
-    now = datetime.utcnow()
-    visit = BookAdVisit(
-        book_landing_id=book_landing_id,
-        fbp=fbp,
-        fbc=fbc,
-        ip_address=(ip.strip() if ip else None),
-        visited_at=now,
-    )
-    db.add(visit)
-    db.flush()
 
-    try:
-        # nowait=True — не ждём освобождения блокировки, сразу ошибка при конкуренции
-        book_landing = (
-            db.query(BookLanding)
-              .filter(BookLanding.id == book_landing_id)
-              .with_for_update(nowait=True)
-              .first()
-        )
-    except OperationalError as e:
-        # Блокировка занята другим запросом — коммитим визит и выходим
-        # Статус рекламы обновит следующий успешный запрос
-        log.warning(f"Lock contention for book_landing_id={book_landing_id}, skipping ad flag update: {e}")
-        db.commit()
-        return
-    
-    if not book_landing:
-        db.commit()
-        return
+    record_visit(db, KIND_BOOK_AD_VISIT, book_landing_id, fbp=fbp, fbc=fbc, ip=ip)
 
-    unique_count = _unique_ip_count_recent(db, book_landing_id, now)
 
-    if not book_landing.in_advertising:
-        if unique_count >= BOOK_AD_MIN_UNIQUE_IPS:
-            book_landing.in_advertising = True
-            book_landing.ad_flag_expires_at = now + BOOK_AD_TTL
-            open_book_ad_period_if_needed(db, book_landing_id, started_by=None)
-        else:
-            # не достигли порога — убедимся, что открытых периодов нет
-            _close_book_ad_period_if_open(db, book_landing_id, ended_by=None)
-    else:
-        if unique_count < BOOK_AD_MIN_UNIQUE_IPS:
-            book_landing.in_advertising = False
-            book_landing.ad_flag_expires_at = None
-            _close_book_ad_period_if_open(db, book_landing_id, ended_by=None)
+def apply_book_ad_visits(
+    db: Session,
+    last_seen: Dict[int, datetime],
+    unique_counts: Dict[int, int],
+    *,
+    nowait: bool = False,
+) -> int:
+    """
+    Пакетное обновление рекламного флага книжных лендингов (без commit).
+
+    last_seen     — {book_landing_id: время последнего рекламного визита в пачке};
+    unique_counts — {book_landing_id: уникальные IP за окно} для лендингов с
+                    визитами через track-ad: загорает флаг после порога, а
+                    активную рекламу без порога выключает. Остальные
+                    (from_ad-визиты страницы) лишь продлевают TTL включённой рекламы.
+    Возвращает число обработанных лендингов.
+    """
+    if not last_seen:
+        return 0
+    book_landings = (
+        db.query(BookLanding)
+          .filter(BookLanding.id.in_(list(last_seen)))
+          .order_by(BookLanding.id)
+          .with_for_update(nowait=nowait)
+          .all()
+    )
+    for book_landing in book_landings:
+        now = last_seen[book_landing.id]
+        unique_count = unique_counts.get(book_landing.id)
+
+        if unique_count is None:
+            # визит страницы с рекламы: только продлеваем TTL уже включённой рекламы
+            if book_landing.in_advertising:
+                open_book_ad_period_if_needed(db, book_landing.id, started_by=None)
+                new_exp = now + BOOK_AD_TTL
+                if not book_landing.ad_flag_expires_at or book_landing.ad_flag_expires_at < new_exp:
+                    book_landing.ad_flag_expires_at = new_exp
+            continue
+
+        if not book_landing.in_advertising:
+            if unique_count >= BOOK_AD_MIN_UNIQUE_IPS:
+                book_landing.in_advertising = True
+                book_landing.ad_flag_expires_at = now + BOOK_AD_TTL
+                open_book_ad_period_if_needed(db, book_landing.id, started_by=None)
+            else:
+                # не достигли порога — убедимся, что открытых периодов нет
+                _close_book_ad_period_if_open(db, book_landing.id, ended_by=None)
         else:
-            open_book_ad_period_if_needed(db, book_landing_id, started_by=None)
-            new_exp = now + BOOK_AD_TTL
-            if not book_landing.ad_flag_expires_at or book_landing.ad_flag_expires_at < new_exp:
-                book_landing.ad_flag_expires_at = new_exp
-
-    db.commit()
+            if unique_count < BOOK_AD_MIN_UNIQUE_IPS:
+                book_landing.in_advertising = False
+                book_landing.ad_flag_expires_at = None
+                _close_book_ad_period_if_open(db, book_landing.id, ended_by=None)
+            else:
+                open_book_ad_period_if_needed(db, book_landing.id, started_by=None)
+                new_exp = now + BOOK_AD_TTL
+                if not book_landing.ad_flag_expires_at or book_landing.ad_flag_expires_at < new_exp:
+                    book_landing.ad_flag_expires_at = new_exp
+    return len(book_landings)
 
 
 def check_and_reset_book_ad_flag(book_landing: BookLanding, db: Session):
@@ -618,33 +625,32 @@ def get_book_purchases_by_language_per_day(
     Возвращает статистику покупок книжных лендингов по языкам с разбивкой по дням
     за период [start_dt, end_dt).
     """
-    day_col = func.date(Purchase.created_at)
-
-    rows = (
-        db.query(
-            day_col.label("day"),
-            BookLanding.language.label("language"),
-            func.count(Purchase.id).label("purchase_count"),
-            func.coalesce(func.sum(Purchase.amount), 0).label("total_amount"),
-        )
-        .join(Purchase, Purchase.book_landing_id == BookLanding.id)
-        .filter(
-            Purchase.created_at >= start_dt,
-            Purchase.created_at < end_dt,
-        )
-        .group_by(day_col, BookLanding.language)
-        .order_by(day_col)
-        .all()
+    # покупки по (лендинг, день) из почасовых роллапов, язык — текущий язык лендинга
+    rows = traffic_rollup.aggregate(
+        db, traffic_rollup.KIND_BOOK_LANDING,
+        start_dt=start_dt, end_dt=end_dt, granularity="day", by_target=True,
     )
+    landing_ids = {lid for (lid, _), acc in rows.items() if acc["purchases"]}
+    languages = dict(
+        db.query(BookLanding.id, BookLanding.language).filter(BookLanding.id.in_(landing_ids)).all()
+    ) if landing_ids else {}
+
+    totals: dict[date, dict[str, list]] = defaultdict(dict)
+    for (lid, day_dt), acc in rows.items():
+        if not acc["purchases"] or lid not in languages:
+            continue
+        cell = totals[day_dt.date()].setdefault(languages[lid], [0, 0.0])
+        cell[0] += acc["purchases"]
+        cell[1] += acc["amount"]
 
     stats: dict[date, dict[str, dict[str, str | int]]] = defaultdict(dict)
-
-    for row in rows:
-        stats[row.day][row.language] = {
-            "language": row.language,
-            "count": row.purchase_count,
-            "total_amount": f"{row.total_amount:.2f} $",
-        }
+    for day, per_lang in totals.items():
+        for language, (count, amount) in per_lang.items():
+            stats[day][language] = {
+                "language": language,
+                "count": count,
+                "total_amount": f"{amount:.2f} $",
+            }
 
     data = []
     current = start_dt.date()
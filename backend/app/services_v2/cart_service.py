@@ -52,7 +52,7 @@ def add_landing(db: Session, user: User, landing_id: int) -> Cart:
         cart_id   = cart.id,
         item_type = CartItemType.LANDING,
         landing_id= landing_id,
-        price     = _safe_price(landing.new_price),
+        price     = _safe_price(landing.new_price_num),
         added_at = datetime.utcnow(),
     )
     db.add(item)
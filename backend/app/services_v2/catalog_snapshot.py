@@ -0,0 +1,957 @@
+"""
+In-process снапшот публичного каталога (курсовые и книжные лендинги).
+
+Каталог маленький и почти не меняется, поэтому каждый воркер держит у себя
+версионированный снапшот: компактные записи на __slots__ + готовые индексы
+(язык, тег, автор, издатель, формат, отсортированная цена) и заранее
+посчитанные порядки для всех сортировок карточек. Листинги /v2/cards
+фильтруются пересечением индексов и отдаются без обращения к БД.
+
+Актуальность:
+  • админские пути записи вызывают publish_catalog_change(kind, ids) после
+    commit — событие применяется локально и рассылается остальным воркерам
+    через Redis pub/sub (канал CATALOG_CHANNEL);
+  • получив событие, воркер при следующем чтении перечитывает из БД только
+    затронутые строки и пересобирает индексы (новая версия снапшота);
+  • раз в CATALOG_SNAPSHOT_TTL секунд — полная пересборка как страховка от
+    записей в обход ORM (миграции, raw SQL) и от дрейфа sales_count.
+"""
+
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Optional, List, Dict, Set, Tuple, Iterable, Callable
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models.models_v2 import (
+    Landing, BookLanding, Book, Author, Tag, Publisher, BookFile,
+    landing_authors, landing_tags, landing_course,
+    book_landing_books, book_authors, book_tags, book_publishers,
+)
+from . import facet_engine
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+CATALOG_CHANNEL = os.getenv("CATALOG_CHANNEL", "catalog:invalidate")
+CATALOG_SNAPSHOT_TTL = int(os.getenv("CATALOG_SNAPSHOT_TTL", "300"))
+
+# Виды событий: что перечитывать из БД
+KIND_LANDING = "landing"
+KIND_BOOK_LANDING = "book_landing"
+KIND_BOOK = "book"
+KIND_AUTHOR = "author"
+KIND_COURSE = "course"
+KIND_ALL = "all"
+
+_YEAR_RE = re.compile(r"^[0-9]{4}")
+_LEADING_DIGITS_RE = re.compile(r"^[0-9]+")
+
+_INSTANCE_ID = uuid.uuid4().hex
+_versions = itertools.count(1)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Записи ════════════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+class AuthorRecord:
+    __slots__ = ("id", "name", "photo", "language", "description")
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.photo = row.photo
+        self.language = (row.language or "").upper()
+        self.description = row.description
+
+
+class LandingRecord:
+    __slots__ = (
+        "id", "language", "landing_name", "page_name", "text", "preview_photo",
+        "old_price", "new_price", "price", "lessons_count", "lessons_total",
+        "duration_minutes", "sales_count", "created_at",
+        "author_ids", "tag_ids", "course_ids",
+    )
+
+    def __init__(self, row):
+        self.id = row.id
+        self.language = (row.language or "").upper()
+        self.landing_name = row.landing_name
+        self.page_name = row.page_name
+        self.text = _text(row.landing_name, row.page_name)
+        self.preview_photo = row.preview_photo
+        self.old_price = row.old_price
+        self.new_price = row.new_price
+        self.price = float(row.new_price_num) if row.new_price_num is not None else None
+        self.lessons_count = row.lessons_count
+        self.lessons_total = int(row.lessons_total or 0)
+        self.duration_minutes = int(row.duration_minutes or 0)
+        self.sales_count = row.sales_count
+        self.created_at = row.created_at
+        self.author_ids: Tuple[int, ...] = ()
+        self.tag_ids: Tuple[int, ...] = ()
+        self.course_ids: Tuple[int, ...] = ()
+
+
+class BookRecord:
+    __slots__ = (
+        "id", "title", "cover_url", "publication_date", "page_count", "year", "sort_year",
+        "author_ids", "tag_ids", "publisher_ids", "formats",
+    )
+
+    def __init__(self, row):
+        self.id = row.id
+        self.title = row.title
+        self.cover_url = row.cover_url
+        self.publication_date = row.publication_date
+        self.page_count = row.page_count
+        pd = row.publication_date
+        # year — для фильтра (REGEXP '^[0-9]{4}'), sort_year — как CAST(LEFT(pd, 4) AS INT) в MySQL
+        self.year = int(pd[:4]) if pd and _YEAR_RE.match(pd) else None
+        if pd is None:
+            self.sort_year = None
+        else:
+            m = _LEADING_DIGITS_RE.match(pd[:4])
+            self.sort_year = int(m.group(0)) if m else 0
+        self.author_ids: Tuple[int, ...] = ()
+        self.tag_ids: Tuple[int, ...] = ()
+        self.publisher_ids: Tuple[int, ...] = ()
+        self.formats: frozenset = frozenset()
+
+
+class BookLandingRecord:
+    __slots__ = (
+        "id", "language", "landing_name", "page_name", "text",
+        "old_price", "new_price", "price", "sales_count", "updated_at", "book_ids",
+        # агрегаты по книгам — пересчитываются при индексации
+        "author_ids", "tag_ids", "publisher_ids", "formats", "years",
+        "pages_total", "min_year", "max_year", "publication_date", "main_image",
+    )
+
+    def __init__(self, row):
+        self.id = row.id
+        self.language = (row.language or "").upper()
+        self.landing_name = row.landing_name
+        self.page_name = row.page_name
+        self.text = _text(row.landing_name, row.page_name)
+        self.old_price = row.old_price
+        self.new_price = row.new_price
+        self.price = float(row.new_price) if row.new_price is not None else None
+        self.sales_count = row.sales_count
+        self.updated_at = row.updated_at
+        self.book_ids: Tuple[int, ...] = ()
+        self.author_ids: Optional[Tuple[int, ...]] = None   # None — агрегаты ещё не посчитаны
+
+    def clone(self) -> "BookLandingRecord":
+        """Копия для новой версии снапшота с непосчитанными агрегатами."""
+        other = BookLandingRecord.__new__(BookLandingRecord)
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name, None))
+        other.author_ids = None
+        return other
+
+    def aggregate(self, books: Dict[int, BookRecord]) -> None:
+        authors: Dict[int, None] = {}
+        tags: Dict[int, None] = {}
+        publishers: Dict[int, None] = {}
+        formats: Set[str] = set()
+        years: List[int] = []
+        sort_years: List[int] = []
+        pages = None
+        self.publication_date = None
+        self.main_image = None
+        for book_id in self.book_ids:
+            book = books.get(book_id)
+            if book is None:
+                continue
+            authors.update(dict.fromkeys(book.author_ids))
+            tags.update(dict.fromkeys(book.tag_ids))
+            publishers.update(dict.fromkeys(book.publisher_ids))
+            formats |= book.formats
+            if book.year is not None:
+                years.append(book.year)
+            if book.sort_year is not None:
+                sort_years.append(book.sort_year)
+            pages = (pages or 0) + int(book.page_count or 0)
+            if self.publication_date is None and book.publication_date:
+                self.publication_date = book.publication_date
+            if self.main_image is None and book.cover_url:
+                self.main_image = book.cover_url
+        self.author_ids = tuple(authors)
+        self.tag_ids = tuple(tags)
+        self.publisher_ids = tuple(publishers)
+        self.formats = frozenset(formats)
+        self.years = tuple(years)
+        self.pages_total = pages
+        self.min_year = min(sort_years) if sort_years else None
+        self.max_year = max(sort_years) if sort_years else None
+
+
+class AuthorCounters:
+    """
+    Счётчики контента автора в разрезе языка (только видимые лендинги):
+
+      • courses — уникальные курсы всех лендингов автора;
+      • cheapest_courses — курсы лендингов, не дороже остальных лендингов тех же
+        курсов (логика get_author_full_detail: дорогие дубли курсов не считаются);
+      • books — книги хотя бы с одним книжным лендингом;
+      • priced_books — книги хотя бы с одним книжным лендингом с ценой;
+      • tags — имена тегов всех курсовых лендингов (статистика автора на
+        странице лендинга);
+      • cheapest_tags — имена тегов только «дешёвых» лендингов (те же, что дают
+        cheapest_courses; так теги считают списки авторов).
+    """
+
+    __slots__ = ("courses", "cheapest_courses", "books", "priced_books", "tags", "cheapest_tags")
+
+    def __init__(self, courses=0, cheapest_courses=0, books=0, priced_books=0, tags=(), cheapest_tags=()):
+        self.courses = courses
+        self.cheapest_courses = cheapest_courses
+        self.books = books
+        self.priced_books = priced_books
+        self.tags: Tuple[str, ...] = tags
+        self.cheapest_tags: Tuple[str, ...] = cheapest_tags
+
+
+_NO_COUNTERS = AuthorCounters()
+
+
+def _text(*parts: Optional[str]) -> str:
+    return "\0".join((p or "").casefold() for p in parts)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Загрузка из БД ════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def _grouped_pairs(db: Session, table, key: str, value: str, ids: Optional[Iterable[int]]) -> Dict[int, List[int]]:
+    """{key_id: [value_id, ...]} в порядке строк связки (как у selectinload без order_by)."""
+    stmt = select(table.c[key], table.c[value])
+    if ids is not None:
+        stmt = stmt.where(table.c[key].in_(list(ids)))
+    out: Dict[int, List[int]] = defaultdict(list)
+    for k, v in db.execute(stmt).all():
+        out[k].append(v)
+    return out
+
+
+def _load_authors(db: Session, ids: Optional[Iterable[int]] = None) -> Dict[int, AuthorRecord]:
+    q = db.query(Author.id, Author.name, Author.photo, Author.language, Author.description)
+    if ids is not None:
+        q = q.filter(Author.id.in_(list(ids)))
+    return {r.id: AuthorRecord(r) for r in q.all()}
+
+
+def _load_landings(db: Session, ids: Optional[Iterable[int]] = None) -> Dict[int, LandingRecord]:
+    """Только видимые лендинги; скрытые/удалённые из ids просто не вернутся."""
+    q = db.query(
+        Landing.id, Landing.language, Landing.landing_name, Landing.page_name,
+        Landing.preview_photo, Landing.old_price, Landing.new_price, Landing.new_price_num,
+        Landing.lessons_count, Landing.lessons_total, Landing.duration_minutes,
+        Landing.sales_count, Landing.created_at,
+    ).filter(Landing.is_hidden.is_(False))
+    if ids is not None:
+        q = q.filter(Landing.id.in_(list(ids)))
+    records = {r.id: LandingRecord(r) for r in q.all()}
+    if not records:
+        return records
+    scope = None if ids is None else list(records)
+    authors = _grouped_pairs(db, landing_authors, "landing_id", "author_id", scope)
+    tags = _grouped_pairs(db, landing_tags, "landing_id", "tag_id", scope)
+    courses = _grouped_pairs(db, landing_course, "landing_id", "course_id", scope)
+    for rec in records.values():
+        rec.author_ids = tuple(authors.get(rec.id, ()))
+        rec.tag_ids = tuple(tags.get(rec.id, ()))
+        rec.course_ids = tuple(courses.get(rec.id, ()))
+    return records
+
+
+def _load_books(db: Session, ids: Optional[Iterable[int]] = None) -> Dict[int, BookRecord]:
+    q = db.query(Book.id, Book.title, Book.cover_url, Book.publication_date, Book.page_count)
+    if ids is not None:
+        q = q.filter(Book.id.in_(list(ids)))
+    records = {r.id: BookRecord(r) for r in q.all()}
+    if not records:
+        return records
+    scope = None if ids is None else list(records)
+    authors = _grouped_pairs(db, book_authors, "book_id", "author_id", scope)
+    tags = _grouped_pairs(db, book_tags, "book_id", "tag_id", scope)
+    publishers = _grouped_pairs(db, book_publishers, "book_id", "publisher_id", scope)
+    files_q = db.query(BookFile.book_id, BookFile.file_format).filter(BookFile.s3_url.isnot(None))
+    if scope is not None:
+        files_q = files_q.filter(BookFile.book_id.in_(scope))
+    formats: Dict[int, Set[str]] = defaultdict(set)
+    for book_id, fmt in files_q.all():
+        formats[book_id].add(getattr(fmt, "value", fmt))
+    for rec in records.values():
+        rec.author_ids = tuple(authors.get(rec.id, ()))
+        rec.tag_ids = tuple(tags.get(rec.id, ()))
+        rec.publisher_ids = tuple(publishers.get(rec.id, ()))
+        rec.formats = frozenset(formats.get(rec.id, ()))
+    return records
+
+
+def _load_book_landings(db: Session, ids: Optional[Iterable[int]] = None) -> Dict[int, BookLandingRecord]:
+    q = db.query(
+        BookLanding.id, BookLanding.language, BookLanding.landing_name, BookLanding.page_name,
+        BookLanding.old_price, BookLanding.new_price, BookLanding.sales_count, BookLanding.updated_at,
+    ).filter(BookLanding.is_hidden.is_(False))
+    if ids is not None:
+        q = q.filter(BookLanding.id.in_(list(ids)))
+    records = {r.id: BookLandingRecord(r) for r in q.all()}
+    if not records:
+        return records
+    scope = None if ids is None else list(records)
+    books = _grouped_pairs(db, book_landing_books, "book_landing_id", "book_id", scope)
+    for rec in records.values():
+        rec.book_ids = tuple(books.get(rec.id, ()))
+    return records
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Снапшот ═══════════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def _ordered(
+    records: Iterable,
+    value: Callable,
+    desc: bool,
+    nulls_last: bool = True,
+) -> Tuple[int, ...]:
+    """
+    Порядок как у ORDER BY value [DESC], id [DESC].
+
+    nulls_last=True — для `value IS NULL, value ...`; False — MySQL-поведение
+    голого ASC (NULL первыми).
+    """
+    present: List[Tuple[object, int]] = []
+    missing: List[int] = []
+    for rec in records:
+        v = value(rec)
+        if v is None:
+            missing.append(rec.id)
+        else:
+            present.append((v, rec.id))
+    present.sort(reverse=desc)
+    missing.sort(reverse=desc)
+    head = [rec_id for _, rec_id in present]
+    return tuple(head + missing) if nulls_last else tuple(missing + head)
+
+
+class CatalogSnapshot:
+    """Неизменяемая версия каталога; патч создаёт новый экземпляр."""
+
+    def __init__(
+        self,
+        landings: Dict[int, LandingRecord],
+        book_landings: Dict[int, BookLandingRecord],
+        books: Dict[int, BookRecord],
+        authors: Dict[int, AuthorRecord],
+        tag_names: Dict[int, str],
+        publisher_names: Dict[int, str],
+    ):
+        self.version = next(_versions)
+        self.built_at = time.monotonic()
+        self.landings = landings
+        self.book_landings = book_landings
+        self.books = books
+        self.authors = authors
+        self.tag_names = tag_names
+        self.publisher_names = publisher_names
+        self._index_landings()
+        self._index_book_landings()
+        self._index_authors()
+
+    # ─────────────── индексы ───────────────
+
+    def _index_landings(self) -> None:
+        by_language: Dict[str, Set[int]] = defaultdict(set)
+        by_tag: Dict[int, Set[int]] = defaultdict(set)
+        by_author: Dict[int, Set[int]] = defaultdict(set)
+        by_course: Dict[int, Set[int]] = defaultdict(set)
+        for rec in self.landings.values():
+            by_language[rec.language].add(rec.id)
+            for tag_id in rec.tag_ids:
+                by_tag[tag_id].add(rec.id)
+            for author_id in rec.author_ids:
+                by_author[author_id].add(rec.id)
+            for course_id in rec.course_ids:
+                by_course[course_id].add(rec.id)
+        self.landing_by_language = dict(by_language)
+        self.landing_by_tag = dict(by_tag)
+        self.landing_by_author = dict(by_author)
+        self.landing_by_course = dict(by_course)
+        self.landing_prices = sorted(
+            (rec.price, rec.id) for rec in self.landings.values() if rec.price is not None
+        )
+        # Самый дешёвый видимый лендинг курса (как get_cheapest_landing_for_course)
+        self.cheapest_landing_by_course = {
+            course_id: self.cheapest_landing(course_id) for course_id in self.landing_by_course
+        }
+
+        recs = self.landings.values()
+        created = lambda r: r.created_at
+        self.landing_orders = {
+            "price_asc": _ordered(recs, lambda r: r.price, desc=False, nulls_last=False),
+            "price_desc": _ordered(recs, lambda r: r.price, desc=True),
+            "popular_asc": _ordered(recs, lambda r: r.sales_count, desc=False),
+            "popular_desc": _ordered(recs, lambda r: r.sales_count, desc=True),
+            "new_asc": _ordered(recs, created, desc=False),
+            "new_desc": _ordered(recs, created, desc=True),
+            "duration_asc": _ordered(recs, lambda r: r.duration_minutes, desc=False),
+            "duration_desc": _ordered(recs, lambda r: r.duration_minutes, desc=True),
+            "lessons_asc": _ordered(recs, lambda r: r.lessons_total, desc=False),
+            "lessons_desc": _ordered(recs, lambda r: r.lessons_total, desc=True),
+        }
+
+    def _index_book_landings(self) -> None:
+        by_language: Dict[str, Set[int]] = defaultdict(set)
+        by_tag: Dict[int, Set[int]] = defaultdict(set)
+        by_author: Dict[int, Set[int]] = defaultdict(set)
+        by_publisher: Dict[int, Set[int]] = defaultdict(set)
+        by_format: Dict[str, Set[int]] = defaultdict(set)
+        by_book: Dict[int, Set[int]] = defaultdict(set)
+        for rec in self.book_landings.values():
+            # Агрегаты считаются один раз на запись: записи, перешедшие из
+            # прошлой версии, уже посчитаны и читаются её потоками — не трогаем
+            if rec.author_ids is None:
+                rec.aggregate(self.books)
+            by_language[rec.language].add(rec.id)
+            for tag_id in rec.tag_ids:
+                by_tag[tag_id].add(rec.id)
+            for author_id in rec.author_ids:
+                by_author[author_id].add(rec.id)
+            for publisher_id in rec.publisher_ids:
+                by_publisher[publisher_id].add(rec.id)
+            for fmt in rec.formats:
+                by_format[fmt].add(rec.id)
+            for book_id in rec.book_ids:
+                by_book[book_id].add(rec.id)
+        self.book_landing_by_language = dict(by_language)
+        self.book_landing_by_tag = dict(by_tag)
+        self.book_landing_by_author = dict(by_author)
+        self.book_landing_by_publisher = dict(by_publisher)
+        self.book_landing_by_format = dict(by_format)
+        self.book_landing_by_book = dict(by_book)
+        self.book_landing_prices = sorted(
+            (rec.price, rec.id) for rec in self.book_landings.values() if rec.price is not None
+        )
+
+        recs = self.book_landings.values()
+        pages = lambda r: r.pages_total or 0
+        updated = lambda r: r.updated_at
+        self.book_landing_orders = {
+            "price_asc": _ordered(recs, lambda r: r.price, desc=False, nulls_last=False),
+            "price_desc": _ordered(recs, lambda r: r.price, desc=True),
+            "pages_asc": _ordered(recs, pages, desc=False),
+            "pages_desc": _ordered(recs, pages, desc=True),
+            "year_asc": _ordered(recs, lambda r: r.min_year, desc=False),
+            "year_desc": _ordered(recs, lambda r: r.max_year, desc=True),
+            "new_asc": _ordered(recs, updated, desc=False),
+            "new_desc": _ordered(recs, updated, desc=True),
+            "popular_asc": _ordered(recs, lambda r: r.sales_count, desc=False),
+            "popular_desc": _ordered(recs, lambda r: r.sales_count, desc=True),
+        }
+
+    def _index_authors(self) -> None:
+        books_by_author: Dict[int, Set[int]] = defaultdict(set)
+        for book in self.books.values():
+            for author_id in book.author_ids:
+                books_by_author[author_id].add(book.id)
+        self.books_by_author = dict(books_by_author)
+
+        # Счётчики для «все языки» и для каждого языка, где у автора есть контент
+        counters: Dict[Tuple[int, Optional[str]], AuthorCounters] = {}
+        for author_id in set(self.landing_by_author) | set(self.books_by_author):
+            languages: Set[str] = {
+                self.landings[i].language for i in self.landing_by_author.get(author_id, ())
+            }
+            for book_id in self.books_by_author.get(author_id, ()):
+                languages |= {
+                    self.book_landings[i].language for i in self.book_landing_by_book.get(book_id, ())
+                }
+            counters[(author_id, None)] = self._count_author(author_id, None)
+            for language in languages:
+                counters[(author_id, language)] = self._count_author(author_id, frozenset((language,)))
+        self._author_counters = counters
+
+    def _count_author(self, author_id: int, languages: Optional[frozenset]) -> AuthorCounters:
+        inf = float("inf")
+        landings = [
+            self.landings[i] for i in self.landing_by_author.get(author_id, ())
+            if languages is None or self.landings[i].language in languages
+        ]
+        min_price_by_course: Dict[int, float] = {}
+        for rec in landings:
+            price = rec.price if rec.price is not None else inf
+            for course_id in rec.course_ids:
+                if price < min_price_by_course.get(course_id, inf):
+                    min_price_by_course[course_id] = price
+        courses: Set[int] = set()
+        cheapest: Set[int] = set()
+        tags: Set[str] = set()
+        cheapest_tags: Set[str] = set()
+        for rec in landings:
+            names = [self.tag_names[t] for t in rec.tag_ids if t in self.tag_names]
+            courses.update(rec.course_ids)
+            tags.update(names)
+            price = rec.price if rec.price is not None else inf
+            if not any(price > min_price_by_course.get(c, inf) for c in rec.course_ids):
+                cheapest.update(rec.course_ids)
+                cheapest_tags.update(names)
+
+        books = priced_books = 0
+        for book_id in self.books_by_author.get(author_id, ()):
+            book_landings = [
+                self.book_landings[i] for i in self.book_landing_by_book.get(book_id, ())
+                if languages is None or self.book_landings[i].language in languages
+            ]
+            if not book_landings:
+                continue
+            books += 1
+            if any(bl.price is not None for bl in book_landings):
+                priced_books += 1
+
+        return AuthorCounters(
+            courses=len(courses),
+            cheapest_courses=len(cheapest),
+            books=books,
+            priced_books=priced_books,
+            tags=tuple(sorted(tags)),
+            cheapest_tags=tuple(sorted(cheapest_tags)),
+        )
+
+    def author_counters(self, author_id: int, languages: Optional[Iterable[str]] = None) -> AuthorCounters:
+        """
+        Счётчики автора; languages=None — все языки.
+
+        Один язык (и «все») — готовое значение из индекса; несколько языков
+        не раскладываются на сумму (минимум цены курса берётся по всем языкам
+        сразу), поэтому считаются по снапшоту на лету.
+        """
+        langs = frozenset(l.upper() for l in languages) if languages else None
+        if langs is None or len(langs) == 1:
+            key = (author_id, next(iter(langs)) if langs else None)
+            return self._author_counters.get(key, _NO_COUNTERS)
+        return self._count_author(author_id, langs)
+
+    # ─────────────── запросы ───────────────
+
+    def cheapest_landing(self, course_id: int, tag_ids: Optional[Set[int]] = None) -> Optional[LandingRecord]:
+        """Лендинг курса с минимальной ценой (без цены — последними, затем по id)."""
+        best = None
+        best_key = None
+        for landing_id in self.landing_by_course.get(course_id, ()):
+            rec = self.landings[landing_id]
+            if tag_ids is not None and tag_ids.isdisjoint(rec.tag_ids):
+                continue
+            key = (rec.price is None, rec.price or 0.0, rec.id)
+            if best_key is None or key < best_key:
+                best, best_key = rec, key
+        return best
+
+    @staticmethod
+    def _narrow(current: Optional[Set[int]], ids: Set[int]) -> Set[int]:
+        return set(ids) if current is None else current & ids
+
+    @staticmethod
+    def _union(index: Dict, keys: Iterable) -> Set[int]:
+        out: Set[int] = set()
+        for key in keys:
+            out |= index.get(key, set())
+        return out
+
+    @staticmethod
+    def _price_ids(prices: List[Tuple[float, int]], price_from, price_to) -> Set[int]:
+        lo = bisect_left(prices, (float(price_from), -1)) if price_from is not None else 0
+        hi = (
+            bisect_right(prices, (float(price_to), float("inf")))
+            if price_to is not None else len(prices)
+        )
+        return {landing_id for _, landing_id in prices[lo:hi]}
+
+    def query_landings(
+        self,
+        *,
+        language: Optional[str] = None,
+        tags: Optional[List[int]] = None,
+        author_ids: Optional[List[int]] = None,
+        price_from: Optional[float] = None,
+        price_to: Optional[float] = None,
+        lessons_from: Optional[int] = None,
+        lessons_to: Optional[int] = None,
+        q: Optional[str] = None,
+        sort: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 20,
+    ) -> Tuple[int, List[LandingRecord]]:
+        """Фильтры и сортировки — как build_landing_base_query + landing_cards_v2."""
+        ids: Optional[Set[int]] = None
+        if language:
+            ids = self._narrow(ids, self.landing_by_language.get(language.upper(), set()))
+        if tags:
+            ids = self._narrow(ids, self._union(self.landing_by_tag, tags))
+        if author_ids:
+            ids = self._narrow(ids, self._union(self.landing_by_author, author_ids))
+        if price_from is not None or price_to is not None:
+            ids = self._narrow(ids, self._price_ids(self.landing_prices, price_from, price_to))
+
+        needle = q.strip().casefold() if q else None
+        lessons = lessons_from is not None or lessons_to is not None
+
+        def matches(rec: LandingRecord) -> bool:
+            if needle and needle not in rec.text:
+                return False
+            if lessons:
+                if not rec.course_ids:
+                    return False
+                if lessons_from is not None and rec.lessons_total < lessons_from:
+                    return False
+                if lessons_to is not None and rec.lessons_total > lessons_to:
+                    return False
+            return True
+
+        order = self.landing_orders.get(sort or "new_desc", self.landing_orders["new_desc"])
+        return self._page(order, ids, self.landings, matches, offset, limit)
+
+    def query_book_landings(
+        self,
+        *,
+        language: Optional[str] = None,
+        tags: Optional[List[int]] = None,
+        formats: Optional[List[str]] = None,
+        publisher_ids: Optional[List[int]] = None,
+        author_ids: Optional[List[int]] = None,
+        year_from: Optional[int] = None,
+        year_to: Optional[int] = None,
+        price_from=None,
+        price_to=None,
+        pages_from: Optional[int] = None,
+        pages_to: Optional[int] = None,
+        q: Optional[str] = None,
+        sort: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 20,
+    ) -> Tuple[int, List[BookLandingRecord]]:
+        """Фильтры и сортировки — как build_book_landing_base_query + book_landing_cards_v2."""
+        # new_price IS NOT NULL — всё, что есть в индексе цен
+        ids: Set[int] = self._price_ids(self.book_landing_prices, price_from, price_to)
+        if language:
+            ids &= self.book_landing_by_language.get(language.upper(), set())
+        if tags:
+            ids &= self._union(self.book_landing_by_tag, tags)
+        if formats:
+            ids &= self._union(self.book_landing_by_format, formats)
+        if publisher_ids:
+            ids &= self._union(self.book_landing_by_publisher, publisher_ids)
+        if author_ids:
+            ids &= self._union(self.book_landing_by_author, author_ids)
+
+        needle = q.strip().casefold() if q else None
+        pages = pages_from is not None or pages_to is not None
+
+        def matches(rec: BookLandingRecord) -> bool:
+            if needle and needle not in rec.text:
+                return False
+            # Два независимых EXISTS по книгам — как в SQL-версии
+            if year_from and not any(y >= year_from for y in rec.years):
+                return False
+            if year_to and not any(y <= year_to for y in rec.years):
+                return False
+            if pages:
+                if rec.pages_total is None:
+                    return False
+                if pages_from is not None and rec.pages_total < pages_from:
+                    return False
+                if pages_to is not None and rec.pages_total > pages_to:
+                    return False
+            return True
+
+        order = self.book_landing_orders.get(sort or "new_desc", self.book_landing_orders["new_desc"])
+        return self._page(order, ids, self.book_landings, matches, offset, limit)
+
+    @staticmethod
+    def _page(order, ids, records, matches, offset, limit):
+        total = 0
+        page = []
+        for rec_id in order:
+            if ids is not None and rec_id not in ids:
+                continue
+            rec = records[rec_id]
+            if not matches(rec):
+                continue
+            if offset <= total < offset + limit:
+                page.append(rec)
+            total += 1
+        return total, page
+
+    # ─────────────── карточки ───────────────
+
+    def landing_card(self, rec: LandingRecord) -> dict:
+        """То же, что landings._serialize_landing_card, но из записи снапшота."""
+        first_tag = self.tag_names.get(rec.tag_ids[0]) if rec.tag_ids else None
+        return {
+            "id": rec.id,
+            "first_tag": first_tag,
+            "landing_name": rec.landing_name or "",
+            "authors": [
+                {"id": a.id, "name": a.name, "photo": a.photo}
+                for a in (self.authors.get(i) for i in rec.author_ids) if a is not None
+            ],
+            "slug": rec.page_name,
+            "lessons_count": rec.lessons_count,
+            "main_image": rec.preview_photo,
+            "old_price": rec.old_price,
+            "new_price": rec.new_price,
+            "course_ids": list(rec.course_ids),
+        }
+
+    def book_landing_card(self, rec: BookLandingRecord) -> dict:
+        """То же, что books._serialize_book_card, но из записи снапшота."""
+        tags = [
+            {"id": i, "name": self.tag_names[i]} for i in rec.tag_ids if i in self.tag_names
+        ]
+        return {
+            "id": rec.id,
+            "landing_name": rec.landing_name or "",
+            "slug": rec.page_name,
+            "language": rec.language,
+            "old_price": (str(rec.old_price) if rec.old_price is not None else None),
+            "new_price": (str(rec.new_price) if rec.new_price is not None else None),
+            "total_pages": rec.pages_total if rec.pages_total else None,
+            "publishers": [
+                {"id": i, "name": self.publisher_names[i]}
+                for i in rec.publisher_ids if i in self.publisher_names
+            ],
+            "authors": [
+                {"id": a.id, "name": a.name, "photo": a.photo}
+                for a in (self.authors.get(i) for i in rec.author_ids) if a is not None
+            ],
+            "tags": tags,
+            "first_tag": tags[0]["name"] if tags else None,
+            "main_image": rec.main_image,
+            "book_ids": [i for i in rec.book_ids if i in self.books],
+            "available_formats": sorted(rec.formats),
+            "publication_date": rec.publication_date,
+        }
+
+
+def _build_snapshot(db: Session) -> CatalogSnapshot:
+    started = time.monotonic()
+    snapshot = CatalogSnapshot(
+        landings=_load_landings(db),
+        book_landings=_load_book_landings(db),
+        books=_load_books(db),
+        authors=_load_authors(db),
+        tag_names={r.id: r.name for r in db.query(Tag.id, Tag.name).all()},
+        publisher_names={r.id: r.name for r in db.query(Publisher.id, Publisher.name).all()},
+    )
+    logger.info(
+        "catalog snapshot v%s built: landings=%s book_landings=%s books=%s in %.1f ms",
+        snapshot.version, len(snapshot.landings), len(snapshot.book_landings),
+        len(snapshot.books), (time.monotonic() - started) * 1000,
+    )
+    return snapshot
+
+
+def _patch_snapshot(db: Session, base: CatalogSnapshot, changes: Dict[str, Set[int]]) -> CatalogSnapshot:
+    """Перечитывает только затронутые строки и собирает новую версию снапшота."""
+    landings = dict(base.landings)
+    book_landings = dict(base.book_landings)
+    books = dict(base.books)
+    authors = dict(base.authors)
+
+    landing_ids = set(changes.get(KIND_LANDING, ()))
+    for course_id in changes.get(KIND_COURSE, ()):
+        landing_ids |= base.landing_by_course.get(course_id, set())
+    if landing_ids:
+        fresh = _load_landings(db, landing_ids)
+        for landing_id in landing_ids:
+            landings.pop(landing_id, None)
+        landings.update(fresh)
+
+    book_ids = set(changes.get(KIND_BOOK, ()))
+    book_landing_ids = set(changes.get(KIND_BOOK_LANDING, ()))
+    if book_landing_ids:
+        fresh = _load_book_landings(db, book_landing_ids)
+        for bl_id in book_landing_ids:
+            book_landings.pop(bl_id, None)
+        book_landings.update(fresh)
+        # Книги, которые появились в лендингах впервые
+        book_ids |= {b for rec in fresh.values() for b in rec.book_ids if b not in books}
+    if book_ids:
+        fresh = _load_books(db, book_ids)
+        for book_id in book_ids:
+            books.pop(book_id, None)
+        books.update(fresh)
+        # Лендинги изменённых книг пересчитывают агрегаты — на копиях,
+        # записи прошлой версии остаются неизменными
+        for bl_id in set().union(*(base.book_landing_by_book.get(b, ()) for b in book_ids)):
+            rec = book_landings.get(bl_id)
+            if rec is not None and rec.author_ids is not None:
+                book_landings[bl_id] = rec.clone()
+
+    author_ids = set(changes.get(KIND_AUTHOR, ()))
+    author_ids |= {
+        a for rec in itertools.chain(landings.values(), books.values())
+        for a in rec.author_ids if a not in authors
+    }
+    if author_ids:
+        fresh = _load_authors(db, author_ids)
+        for author_id in author_ids:
+            authors.pop(author_id, None)
+        authors.update(fresh)
+
+    # Новые теги/издатели — справочники маленькие, перечитываем целиком
+    tag_names = base.tag_names
+    if any(t not in tag_names for rec in itertools.chain(landings.values(), books.values()) for t in rec.tag_ids):
+        tag_names = {r.id: r.name for r in db.query(Tag.id, Tag.name).all()}
+    publisher_names = base.publisher_names
+    if any(p not in publisher_names for rec in books.values() for p in rec.publisher_ids):
+        publisher_names = {r.id: r.name for r in db.query(Publisher.id, Publisher.name).all()}
+
+    snapshot = CatalogSnapshot(
+        landings=landings,
+        book_landings=book_landings,
+        books=books,
+        authors=authors,
+        tag_names=tag_names,
+        publisher_names=publisher_names,
+    )
+    # TTL полной пересборки отсчитывается от последней полной сборки, а не от патча
+    snapshot.built_at = base.built_at
+    logger.info(
+        "catalog snapshot v%s patched from v%s: %s",
+        snapshot.version, base.version, {k: len(v) for k, v in changes.items()},
+    )
+    return snapshot
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Кэш и инвалидация ═════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_snapshot: Optional[CatalogSnapshot] = None
+_build_lock = threading.Lock()
+_pending_lock = threading.Lock()
+_pending: Dict[str, Set[int]] = defaultdict(set)
+_pending_full = False
+_listener_pid: Optional[int] = None
+_rds: Optional[redis.Redis] = None
+
+
+def note_catalog_change(kind: str, ids: Optional[Iterable[int]] = None) -> None:
+    """Помечает изменения для применения при следующем чтении снапшота (без БД)."""
+    global _pending_full
+    with _pending_lock:
+        if kind == KIND_ALL or ids is None:
+            _pending_full = True
+        else:
+            _pending[kind].update(int(i) for i in ids)
+    facet_engine.invalidate_facet_indexes()
+
+
+def _redis() -> redis.Redis:
+    global _rds
+    if _rds is None:
+        _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+    return _rds
+
+
+def publish_catalog_change(kind: str, ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Вызывается админскими путями записи ПОСЛЕ commit.
+
+    Применяет изменение в своём воркере и рассылает его остальным через Redis.
+    Ошибки Redis не пробрасываются: остальные воркеры догонят по TTL.
+    """
+    ids = None if ids is None else [int(i) for i in ids]
+    note_catalog_change(kind, ids)
+    try:
+        _redis().publish(CATALOG_CHANNEL, json.dumps({"kind": kind, "ids": ids, "origin": _INSTANCE_ID}))
+    except Exception as e:
+        logger.warning("catalog change publish failed (%s %s): %s", kind, ids, e)
+
+
+def _listen_forever() -> None:
+    while True:
+        try:
+            r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+            pubsub = r.pubsub(ignore_subscribe_messages=False)
+            pubsub.subscribe(CATALOG_CHANNEL)
+            for message in pubsub.listen():
+                if message.get("type") == "subscribe":
+                    # (Пере)подключились — события за время разрыва могли потеряться
+                    note_catalog_change(KIND_ALL)
+                    continue
+                if message.get("type") != "message":
+                    continue
+                try:
+                    payload = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                if payload.get("origin") == _INSTANCE_ID:
+                    continue
+                note_catalog_change(payload.get("kind") or KIND_ALL, payload.get("ids"))
+        except Exception as e:
+            logger.warning("catalog invalidation listener error: %s; retry in 5s", e)
+            time.sleep(5)
+
+
+def _ensure_listener() -> None:
+    """Подписчик — один daemon-поток на процесс (после fork запускается заново)."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _pending_lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+    threading.Thread(target=_listen_forever, name="catalog-invalidation", daemon=True).start()
+
+
+def get_catalog_snapshot(db: Session) -> CatalogSnapshot:
+    """Актуальная версия снапшота; сборка/патч — под локом, одним потоком."""
+    global _snapshot, _pending_full
+    _ensure_listener()
+
+    snapshot = _snapshot
+    stale = snapshot is None or time.monotonic() - snapshot.built_at >= CATALOG_SNAPSHOT_TTL
+    if not stale and not _pending_full and not _pending:
+        return snapshot
+
+    with _build_lock:
+        with _pending_lock:
+            full = _pending_full
+            changes = {k: set(v) for k, v in _pending.items()}
+            _pending_full = False
+            _pending.clear()
+        snapshot = _snapshot
+        try:
+            if snapshot is None or full or time.monotonic() - snapshot.built_at >= CATALOG_SNAPSHOT_TTL:
+                _snapshot = _build_snapshot(db)
+            elif changes:
+                _snapshot = _patch_snapshot(db, snapshot, changes)
+        except Exception:
+            # Изменения не должны потеряться — следующий запрос соберёт снапшот целиком
+            with _pending_lock:
+                _pending_full = True
+            if snapshot is None:
+                raise
+            logger.exception("catalog snapshot refresh failed; serving v%s", snapshot.version)
+        return _snapshot
@@ -7,6 +7,9 @@ from sqlalchemy import func
 from fastapi import HTTPException
 from ..models.models_v2 import Course
 from ..schemas_v2.course import CourseUpdate, CourseCreate
+from .filter_aggregation_service import refresh_landing_metrics_for_courses
+from .catalog_snapshot import publish_catalog_change, KIND_COURSE
+from . import lesson_video_index
 
 
 
@@ -88,9 +91,14 @@ def update_course(db: Session, course_id: int, update_data: CourseUpdate) -> Cou
         new_sections[str(idx)] = section_val.dict()
 
     course.sections = new_sections
+    db.flush()
+    lesson_video_index.sync_courses(db, [course.id])
+    # Пересчитываем lessons_total у лендингов, в которые входит курс
+    refresh_landing_metrics_for_courses(db, [course.id])
 
     db.commit()
     db.refresh(course)
+    publish_catalog_change(KIND_COURSE, [course.id])
     return course
 
 def create_course(db: Session, course_data: CourseCreate) -> Course:
@@ -101,6 +109,8 @@ def create_course(db: Session, course_data: CourseCreate) -> Course:
         sections = course_data.sections if course_data.sections else {}
     )
     db.add(new_course)
+    db.flush()
+    lesson_video_index.sync_courses(db, [new_course.id])
     db.commit()
     db.refresh(new_course)
     # Если имя не было передано, обновляем его по шаблону "Course name {id}"
@@ -117,4 +127,6 @@ def delete_course(db: Session, course_id: int) -> None:
     # Очистка связей с пользователями (ассоциативная таблица users_courses)
     course.users = []
     db.delete(course)
+    db.flush()
+    lesson_video_index.sync_courses(db, [course_id])
     db.commit()
@@ -0,0 +1,275 @@
+"""
+Общий планировщик отправки писем: token bucket в Redis на провайдера и кампанию.
+
+Раньше темп задавали module-global _last_send_time + Lock в
+utils.email_sender.common (свой в каждом процессе), rate_limit у celery-задач
+(на воркер) и time.sleep между письмами — лимиты не делились между воркерами,
+а задача спала, занимая слот.
+
+Здесь:
+  • ведро провайдера (email:tb:p:<provider>) — общий лимит писем в час
+    (EMAIL_BUCKET_PER_HOUR / EMAIL_MARKETING_BUCKET_PER_HOUR) с ёмкостью BURST;
+  • ведро кампании (email:tb:c:<provider>:<campaign>) — доля share от лимита
+    провайдера: одна кампания не выбирает весь лимит (fair sharing);
+  • приоритет — резерв floor: кампания с приоритетом p берёт токены, только
+    пока в ведре провайдера их больше floor(p) — остаток достаётся более
+    приоритетным. Оба ведра списываются атомарно одним Lua-скриптом по
+    времени Redis (TIME), поэтому лимит общий для всех воркеров.
+
+enqueue_email() — единая точка для поштучных писем кампаний: ставит задачу
+tasks.email_dispatch.dispatch_email, которая резервирует токен и отправляет;
+если свободного токена нет — резерв берётся в долг на ближайший свободный слот,
+и задача перепланируется ровно на него (retry с countdown), а не спит и не
+просыпается вместе с остальными ожидающими.
+Результат отправки (ok/не ok) передаётся в колбэк on_result вызывающей задачи
+(пометка send_count / статуса в БД). Пачечные рассылки (NY2026 через Mailgun
+bulk) берут сразу несколько токенов через acquire(..., partial=True).
+"""
+
+import importlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import redis
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+PENDING_TTL = int(os.getenv("EMAIL_DISPATCH_PENDING_TTL_SEC", str(6 * 3600)))
+# Горизонт резерва: ETA-задача дольше visibility_timeout брокера (Redis — 1 ч)
+# выдаётся повторно и письмо уходит дважды, а дольше PENDING_TTL — истекает
+# dedup и выборка ставит письмо ещё раз. Дальше горизонта слот не резервируется.
+MAX_RESERVE_SECONDS = min(int(os.getenv("EMAIL_DISPATCH_MAX_RESERVE_SEC", "1800")), PENDING_TTL // 2)
+
+DISPATCH_TASK = "app.tasks.email_dispatch.dispatch_email"
+DISPATCH_QUEUE = "email"
+
+PROVIDER_TRANSACTIONAL = "transactional"
+PROVIDER_MARKETING = "marketing"
+
+# доля ёмкости ведра провайдера, которую кампания с данным приоритетом оставляет другим
+PRIORITY_FLOOR = {0: 0.0, 1: 0.1, 2: 0.3}
+
+
+@dataclass(frozen=True)
+class Campaign:
+    provider: str
+    priority: int   # 0 — самый высокий
+    share: float    # доля лимита провайдера для ведра кампании
+
+
+CAMPAIGNS: Dict[str, Campaign] = {
+    "abandoned_checkout": Campaign(PROVIDER_TRANSACTIONAL, priority=0, share=0.5),
+    "big_cart": Campaign(PROVIDER_TRANSACTIONAL, priority=1, share=0.4),
+    "referral": Campaign(PROVIDER_TRANSACTIONAL, priority=2, share=0.4),
+    "ny2026": Campaign(PROVIDER_MARKETING, priority=1, share=1.0),
+}
+
+_TAKE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local n = tonumber(ARGV[1])
+local mode = tonumber(ARGV[2])
+local p_rate, p_cap, p_floor = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local c_rate, c_cap = tonumber(ARGV[6]), tonumber(ARGV[7])
+local max_wait = tonumber(ARGV[8])
+
+local function level(key, rate, cap)
+  local v = redis.call('HMGET', key, 't', 'ts')
+  local tokens, ts = tonumber(v[1]), tonumber(v[2])
+  if tokens == nil or ts == nil then return cap end
+  return math.min(cap, tokens + math.max(0, now - ts) * rate)
+end
+
+local pt = level(KEYS[1], p_rate, p_cap)
+local ct = level(KEYS[2], c_rate, c_cap)
+local avail = math.floor(math.min(pt - p_floor, ct))
+local grant = 0
+local wait = 0
+if avail >= n then
+  grant = n
+elseif mode == 1 and avail > 0 then
+  grant = avail
+elseif mode == 2 then
+  -- резерв: токены списываются в долг, слот — момент, когда долг покроется;
+  -- слот дальше max_wait не выдаём — долг ограничен горизонтом
+  local slot = math.max((n + p_floor - pt) / p_rate, (n - ct) / c_rate, 0)
+  if slot <= max_wait then
+    grant = n
+    wait = slot
+  end
+end
+pt = pt - grant
+ct = ct - grant
+redis.call('HSET', KEYS[1], 't', tostring(pt), 'ts', tostring(now))
+redis.call('HSET', KEYS[2], 't', tostring(ct), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 86400)
+redis.call('EXPIRE', KEYS[2], 86400)
+
+if grant == 0 then
+  local need = n
+  if mode == 1 then need = 1 end
+  wait = math.max((need + p_floor - pt) / p_rate, (need - ct) / c_rate, 0)
+end
+return {grant, tostring(wait)}
+"""
+
+_rds: Optional[redis.Redis] = None
+_take_script = None
+
+
+def _redis() -> redis.Redis:
+    global _rds, _take_script
+    if _rds is None:
+        _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+        _take_script = _rds.register_script(_TAKE_LUA)
+    return _rds
+
+
+def _provider_limits(provider: str) -> Tuple[str, float, float]:
+    """(ключ ведра, токенов в секунду, ёмкость) — ключ привязан к домену/хосту отправки."""
+    if provider == PROVIDER_MARKETING:
+        per_hour = settings.EMAIL_MARKETING_BUCKET_PER_HOUR
+        burst = settings.EMAIL_MARKETING_BUCKET_BURST
+        domain = (settings.MAILGUN_MARKETING_DOMAIN or settings.MAILGUN_DOMAIN or "").strip()
+    else:
+        per_hour = settings.EMAIL_BUCKET_PER_HOUR
+        burst = settings.EMAIL_BUCKET_BURST
+        domain = (settings.MAILGUN_DOMAIN or "").strip()
+    if settings.MAILGUN_API_KEY and domain:
+        key = f"mailgun:{domain}"
+    else:
+        key = f"smtp:{settings.EMAIL_HOST}"
+    return key, max(float(per_hour), 1.0) / 3600.0, max(float(burst), 1.0)
+
+
+def acquire(
+    campaign: str, n: int = 1, *, partial: bool = False, reserve: bool = False,
+) -> Tuple[int, float]:
+    """
+    Берёт n токенов кампании. Возвращает (выдано, через сколько секунд повторить,
+    если не выдано ничего). partial=True — выдать сколько есть (0..n).
+    reserve=True — токены выдаются в долг, а wait — через сколько секунд
+    наступит зарезервированный слот (0 — слать сейчас): следующий ожидающий
+    получает слот позже, а не тот же самый. Слот дальше MAX_RESERVE_SECONDS
+    не резервируется — (0, wait), как без резерва.
+    Redis недоступен — пропускаем без ограничения (отправка важнее темпа).
+    """
+    c = CAMPAIGNS[campaign]
+    key, rate, cap = _provider_limits(c.provider)
+    share = min(max(c.share, 0.01), 1.0)
+    try:
+        _redis()
+        grant, wait = _take_script(
+            keys=[f"email:tb:p:{key}", f"email:tb:c:{key}:{campaign}"],
+            args=[int(n), 1 if partial else (2 if reserve else 0),
+                  rate, cap, cap * PRIORITY_FLOOR.get(c.priority, 0.0),
+                  rate * share, max(1.0, cap * share), MAX_RESERVE_SECONDS],
+        )
+        return int(grant), float(wait)
+    except redis.RedisError as e:
+        logger.warning("[email_dispatch] token bucket unavailable, sending unpaced: %s", e)
+        return int(n), 0.0
+
+
+def _pending_key(campaign: str, dedup_key: str) -> str:
+    return f"email:dispatch:pending:{campaign}:{dedup_key}"
+
+
+def enqueue_email(
+    campaign: str,
+    sender: str,
+    *,
+    kwargs: Dict[str, Any],
+    dedup_key: Optional[str] = None,
+    on_result: Optional[str] = None,
+    context: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    Ставит письмо кампании в очередь отправки.
+
+    sender — имя функции utils.email_sender (send_big_cart_reminder_email, ...)
+    или "module.path:function", если письмо надо собрать в воркере отправки
+    (например, выдать пароль в момент отправки, а не класть его в брокер);
+    kwargs — её аргументы (JSON-сериализуемые).
+    on_result — "module.path:function", вызывается после попытки как
+    fn(ok: bool, context: dict) в воркере отправки.
+    dedup_key — письмо с тем же ключом уже в очереди → False, повторно не ставим
+    (выборки кампаний идут каждый час, а письмо может ждать токен дольше).
+    """
+    if campaign not in CAMPAIGNS:
+        raise ValueError(f"Unknown email campaign: {campaign}")
+    if dedup_key:
+        try:
+            if not _redis().set(_pending_key(campaign, dedup_key), "1", nx=True, ex=PENDING_TTL):
+                return False
+        except redis.RedisError as e:
+            logger.warning("[email_dispatch] dedup unavailable for %s: %s", dedup_key, e)
+
+    from ..celery_app import celery
+
+    celery.send_task(
+        DISPATCH_TASK,
+        kwargs={
+            "campaign": campaign,
+            "sender": sender,
+            "kwargs": kwargs,
+            "dedup_key": dedup_key,
+            "on_result": on_result,
+            "context": context or {},
+        },
+        queue=DISPATCH_QUEUE,
+    )
+    return True
+
+
+def is_pending(campaign: str, dedup_key: str) -> bool:
+    """Письмо с этим ключом уже ждёт отправки (выборку можно пропустить)."""
+    try:
+        return bool(_redis().exists(_pending_key(campaign, dedup_key)))
+    except redis.RedisError:
+        return False
+
+
+def touch(campaign: str, dedup_key: Optional[str]) -> None:
+    """Продлевает dedup письма, которое ещё ждёт слота (выборка не поставит его повторно)."""
+    if not dedup_key:
+        return
+    try:
+        _redis().expire(_pending_key(campaign, dedup_key), PENDING_TTL)
+    except redis.RedisError:
+        pass
+
+
+def release(campaign: str, dedup_key: Optional[str]) -> None:
+    if not dedup_key:
+        return
+    try:
+        _redis().delete(_pending_key(campaign, dedup_key))
+    except redis.RedisError:
+        pass
+
+
+def _import_path(path: str) -> Callable:
+    module_name, _, func_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def resolve_sender(sender: str) -> Callable:
+    """Функция отправки: имя из utils.email_sender или "module.path:function"."""
+    if ":" in sender:
+        return _import_path(sender)
+    from ..utils import email_sender
+    return getattr(email_sender, sender)
+
+
+def report_result(on_result: Optional[str], ok: bool, context: Dict[str, Any]) -> None:
+    """Вызывает колбэк "module.path:function" вызывающей задачи."""
+    if not on_result:
+        return
+    _import_path(on_result)(ok, context)
+
@@ -5,9 +5,10 @@ Email Suppression Service
 
 import logging
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Iterable, Optional, Set
 
 import requests
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm import Session
 
 from ..core.config import settings
@@ -19,6 +20,7 @@ logger = logging.getLogger(__name__)
 SOFT_BOUNCE_THRESHOLD = 3          # После 3 soft bounce → hard bounce
 SOFT_BOUNCE_WINDOW_DAYS = 7        # Окно для подсчета soft bounce
 THROTTLE_WINDOW_HOURS = 24         # Throttling suppression истекает через 24 часа
+BULK_CHUNK = 1000                  # адресов в одном IN / INSERT для массовых функций
 
 
 def is_email_suppressed(db: Session, email: str) -> bool:
@@ -64,6 +66,76 @@ def is_email_suppressed(db: Session, email: str) -> bool:
     return True
 
 
+def suppressed_emails(db: Session, emails: Iterable[str]) -> Set[str]:
+    """
+    Массовый вариант is_email_suppressed: какие из emails заблокированы.
+    Один IN-запрос на BULK_CHUNK адресов; истёкшие throttle-записи удаляются
+    одним DELETE (как и в поштучной проверке).
+    """
+    emails = sorted({(e or "").lower().strip() for e in emails if e})
+    now = datetime.utcnow()
+    throttle_since = now - timedelta(hours=THROTTLE_WINDOW_HOURS)
+
+    blocked: Set[str] = set()
+    expired: list[str] = []
+    for start in range(0, len(emails), BULK_CHUNK):
+        rows = (
+            db.query(
+                EmailSuppression.email,
+                EmailSuppression.type,
+                EmailSuppression.created_at,
+                EmailSuppression.soft_bounce_count,
+            )
+            .filter(EmailSuppression.email.in_(emails[start:start + BULK_CHUNK]))
+            .all()
+        )
+        for email, s_type, created_at, soft_count in rows:
+            if s_type == SuppressionType.THROTTLED:
+                if created_at < throttle_since:
+                    expired.append(email)
+                else:
+                    blocked.add(email)
+            elif s_type == SuppressionType.SOFT_BOUNCE:
+                if soft_count >= SOFT_BOUNCE_THRESHOLD:
+                    blocked.add(email)
+            else:
+                blocked.add(email)
+
+    if expired:
+        db.query(EmailSuppression).filter(
+            EmailSuppression.email.in_(expired),
+            EmailSuppression.type == SuppressionType.THROTTLED,
+        ).delete(synchronize_session=False)
+        db.commit()
+        logger.info("Throttle suppression expired for %d emails, removed", len(expired))
+    return blocked
+
+
+def add_invalid_bulk(db: Session, errors: Dict[str, str], source: str = "validation") -> int:
+    """
+    Массово помечает адреса как INVALID: один INSERT ... ON DUPLICATE KEY UPDATE
+    на BULK_CHUNK адресов. Для существующих записей — как в add_to_suppression:
+    тип перезаписывается, error/source обновляются, code сохраняется.
+    """
+    rows = [
+        {"email": (email or "").lower().strip(), "type": SuppressionType.INVALID,
+         "error": error, "source": source, "soft_bounce_count": 0}
+        for email, error in errors.items() if email
+    ]
+    for start in range(0, len(rows), BULK_CHUNK):
+        stmt = mysql_insert(EmailSuppression).values(rows[start:start + BULK_CHUNK])
+        stmt = stmt.on_duplicate_key_update(
+            type=stmt.inserted.type,
+            error=stmt.inserted.error,
+            source=stmt.inserted.source,
+        )
+        db.execute(stmt)
+    if rows:
+        db.commit()
+        logger.info("Added %d emails to suppression list: type=%s", len(rows), SuppressionType.INVALID.value)
+    return len(rows)
+
+
 def add_to_suppression(
     db: Session,
     email: str,
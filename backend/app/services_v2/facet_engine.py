@@ -0,0 +1,854 @@
+"""
+Facet-движок для метаданных фильтров каталога (курсы / книги / авторы).
+
+aggregate_*_filters из filter_aggregation_service на каждый запрос
+пересобирают базовый запрос по разу на каждый фасет (с исключённым фасетом),
+вытаскивают списки ID в Python и добивают отдельными top-N / filtered-count
+запросами — десяток с лишним полных проходов по таблицам на одну карточку.
+
+Здесь вместо этого:
+  • раз в FACET_INDEX_TTL секунд строим компактный in-process индекс
+    (несколько bulk-SELECT по таблицам и связкам, без ORM-объектов);
+  • на запрос считаем ВСЕ фасеты за один проход по индексу: для каждого
+    элемента проверяем предикаты измерений и увеличиваем счётчики фасета,
+    если прошли все остальные измерения (классическая схема «все кроме себя»).
+
+Результат совпадает с aggregate_*_filters (они остаются эталоном, см.
+scripts/bench_facets.py). Отличия:
+  • поиск q — casefold-подстрока вместо SQL ILIKE (символы % и _ в q
+    трактуются буквально);
+  • данные могут отставать от БД не больше чем на TTL; немедленный
+    сброс — invalidate_facet_indexes().
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Set, Tuple, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models.models_v2 import (
+    BookLanding, Book, Author, Tag, Publisher, Landing,
+    BookFile, BookFileFormat, book_authors, book_tags, book_publishers,
+    landing_authors, landing_tags, book_landing_books, landing_course,
+)
+from ..schemas_v2.common import (
+    FilterOption, MultiselectFilter, RangeFilter,
+    CatalogFiltersMetadata, SelectedFilters,
+    SelectedMultiselectValues, SelectedRangeValues,
+)
+from .filter_aggregation_service import (
+    _prepend_selected_options,
+    _get_sort_options,
+    _get_author_sort_options,
+    _get_landing_sort_options,
+)
+
+logger = logging.getLogger(__name__)
+
+FACET_INDEX_TTL = int(os.getenv("FACET_INDEX_TTL", "60"))
+
+_YEAR_RE = re.compile(r"^[0-9]{4}")
+
+# Ключ None в словарях «по языку» — без фильтра по языку
+LangKey = Optional[str]
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Индекс ════════════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+@dataclass
+class _LandingRow:
+    id: int
+    language: str
+    price: Optional[float]
+    lessons_total: int
+    has_courses: bool
+    text: str                      # landing_name + "\0" + page_name, casefold
+    author_ids: Set[int] = field(default_factory=set)
+    tag_ids: Set[int] = field(default_factory=set)
+
+
+@dataclass
+class _BookLandingRow:
+    id: int
+    language: str
+    price: Optional[float]
+    text: str
+    tag_ids: Set[int] = field(default_factory=set)
+    formats: Set[str] = field(default_factory=set)
+    publisher_ids: Set[int] = field(default_factory=set)
+    author_ids: Set[int] = field(default_factory=set)
+    years: List[int] = field(default_factory=list)
+    pages_total: Optional[int] = None      # None — у лендинга нет ни одной книги
+
+
+@dataclass
+class _AuthorRow:
+    id: int
+    language: str
+    name_cf: str
+    landing_tag_ids: Set[int] = field(default_factory=set)      # теги видимых лендингов
+    book_tag_ids: Set[int] = field(default_factory=set)         # теги всех книг
+    courses: Dict[LangKey, int] = field(default_factory=dict)
+    books: Dict[LangKey, int] = field(default_factory=dict)
+
+
+@dataclass
+class FacetSnapshot:
+    built_at: float
+    author_names: Dict[int, str]
+    tag_names: Dict[int, str]
+    publisher_names: Dict[int, str]
+
+    landings: List[_LandingRow]
+    landing_author_totals: Dict[LangKey, Counter]
+    landing_tag_totals: Dict[LangKey, Counter]
+    landing_price_range: Dict[LangKey, Tuple[float, float]]
+    landing_lessons_range: Dict[LangKey, Tuple[int, int]]
+
+    book_landings: List[_BookLandingRow]
+    book_publisher_totals: Counter
+    book_author_totals: Counter
+    book_tag_totals: Counter
+    book_year_range: Optional[Tuple[int, int]]
+    book_price_range: Optional[Tuple[float, float]]
+    book_pages_range: Optional[Tuple[int, int]]
+
+    authors: List[_AuthorRow]
+    author_tag_totals: Counter
+    author_courses_range: Dict[LangKey, Tuple[int, int]]
+    author_books_range: Dict[LangKey, Tuple[int, int]]
+
+
+def _lang(value: Optional[str]) -> str:
+    return (value or "").upper()
+
+
+def _text(*parts: Optional[str]) -> str:
+    return "\0".join((p or "").casefold() for p in parts)
+
+
+def _minmax(values: Iterable) -> Optional[Tuple[Any, Any]]:
+    lo = hi = None
+    for v in values:
+        if lo is None or v < lo:
+            lo = v
+        if hi is None or v > hi:
+            hi = v
+    return None if lo is None else (lo, hi)
+
+
+def _per_language(rows: Iterable, key) -> Dict[LangKey, list]:
+    """Раскладывает значения key(row) по языку + общий список под ключом None."""
+    out: Dict[LangKey, list] = defaultdict(list)
+    for row in rows:
+        value = key(row)
+        if value is None:
+            continue
+        out[None].append(value)
+        out[row.language].append(value)
+    return out
+
+
+def _pairs(db: Session, table, left: str, right: str) -> List[Tuple[int, int]]:
+    return db.execute(select(table.c[left], table.c[right])).all()
+
+
+def _build_snapshot(db: Session) -> FacetSnapshot:
+    started = time.monotonic()
+
+    author_rows = db.query(Author.id, Author.name, Author.language).all()
+    author_names = {r.id: r.name for r in author_rows}
+    tag_names = {r.id: r.name for r in db.query(Tag.id, Tag.name).all()}
+    publisher_names = {r.id: r.name for r in db.query(Publisher.id, Publisher.name).all()}
+
+    # ─────────────── Курсовые лендинги ───────────────
+    all_landings = db.query(
+        Landing.id, Landing.language, Landing.is_hidden, Landing.new_price_num,
+        Landing.lessons_total, Landing.landing_name, Landing.page_name,
+    ).all()
+    landing_lang = {r.id: _lang(r.language) for r in all_landings}
+
+    la_pairs = _pairs(db, landing_authors, "landing_id", "author_id")
+    lt_pairs = _pairs(db, landing_tags, "landing_id", "tag_id")
+    lc_pairs = _pairs(db, landing_course, "landing_id", "course_id")
+
+    landing_courses: Dict[int, Set[int]] = defaultdict(set)
+    for landing_id, course_id in lc_pairs:
+        landing_courses[landing_id].add(course_id)
+
+    landings: Dict[int, _LandingRow] = {
+        r.id: _LandingRow(
+            id=r.id,
+            language=landing_lang[r.id],
+            price=float(r.new_price_num) if r.new_price_num is not None else None,
+            lessons_total=int(r.lessons_total or 0),
+            has_courses=r.id in landing_courses,
+            text=_text(r.landing_name, r.page_name),
+        )
+        for r in all_landings if not r.is_hidden
+    }
+    for landing_id, author_id in la_pairs:
+        if landing_id in landings and author_id in author_names:
+            landings[landing_id].author_ids.add(author_id)
+    for landing_id, tag_id in lt_pairs:
+        if landing_id in landings and tag_id in tag_names:
+            landings[landing_id].tag_ids.add(tag_id)
+
+    landing_author_totals: Dict[LangKey, Counter] = defaultdict(Counter)
+    landing_tag_totals: Dict[LangKey, Counter] = defaultdict(Counter)
+    for row in landings.values():
+        for key in (None, row.language):
+            landing_author_totals[key].update(row.author_ids)
+            landing_tag_totals[key].update(row.tag_ids)
+
+    landing_price_range = {
+        k: _minmax(v) for k, v in _per_language(
+            landings.values(), lambda r: r.price if r.price is not None and r.price > 0 else None
+        ).items()
+    }
+    landing_lessons_range = {
+        k: _minmax(v) for k, v in _per_language(
+            landings.values(), lambda r: r.lessons_total if r.has_courses else None
+        ).items()
+    }
+
+    # ─────────────── Книжные лендинги ───────────────
+    all_book_landings = db.query(
+        BookLanding.id, BookLanding.language, BookLanding.is_hidden, BookLanding.new_price,
+        BookLanding.landing_name, BookLanding.page_name,
+    ).all()
+    book_landing_lang = {r.id: _lang(r.language) for r in all_book_landings}
+    book_landings: Dict[int, _BookLandingRow] = {
+        r.id: _BookLandingRow(
+            id=r.id,
+            language=book_landing_lang[r.id],
+            price=float(r.new_price) if r.new_price is not None else None,
+            text=_text(r.landing_name, r.page_name),
+        )
+        for r in all_book_landings if not r.is_hidden
+    }
+
+    books = {r.id: r for r in db.query(Book.id, Book.publication_date, Book.page_count).all()}
+    book_years: Dict[int, int] = {}
+    for r in books.values():
+        if r.publication_date and _YEAR_RE.match(r.publication_date):
+            book_years[r.id] = int(r.publication_date[:4])
+
+    ba_pairs = _pairs(db, book_authors, "book_id", "author_id")
+    bt_pairs = _pairs(db, book_tags, "book_id", "tag_id")
+    bp_pairs = _pairs(db, book_publishers, "book_id", "publisher_id")
+    blb_pairs = _pairs(db, book_landing_books, "book_landing_id", "book_id")
+    file_rows = (
+        db.query(BookFile.book_id, BookFile.file_format)
+        .filter(BookFile.s3_url.isnot(None))
+        .distinct()
+        .all()
+    )
+
+    book_authors_map: Dict[int, Set[int]] = defaultdict(set)
+    for book_id, author_id in ba_pairs:
+        if author_id in author_names:
+            book_authors_map[book_id].add(author_id)
+    book_tags_map: Dict[int, Set[int]] = defaultdict(set)
+    for book_id, tag_id in bt_pairs:
+        if tag_id in tag_names:
+            book_tags_map[book_id].add(tag_id)
+    book_publishers_map: Dict[int, Set[int]] = defaultdict(set)
+    for book_id, publisher_id in bp_pairs:
+        if publisher_id in publisher_names:
+            book_publishers_map[book_id].add(publisher_id)
+    book_formats_map: Dict[int, Set[str]] = defaultdict(set)
+    for book_id, fmt in file_rows:
+        book_formats_map[book_id].add(fmt.value if hasattr(fmt, "value") else str(fmt))
+
+    book_landing_ids_by_book: Dict[int, Set[int]] = defaultdict(set)
+    year_values: List[int] = []
+    for bl_id, book_id in blb_pairs:
+        book_landing_ids_by_book[book_id].add(bl_id)
+        row = book_landings.get(bl_id)
+        book = books.get(book_id)
+        if row is None or book is None:
+            continue
+        row.tag_ids |= book_tags_map.get(book_id, set())
+        row.formats |= book_formats_map.get(book_id, set())
+        row.publisher_ids |= book_publishers_map.get(book_id, set())
+        row.author_ids |= book_authors_map.get(book_id, set())
+        if book_id in book_years:
+            row.years.append(book_years[book_id])
+            year_values.append(book_years[book_id])
+        row.pages_total = (row.pages_total or 0) + int(book.page_count or 0)
+
+    book_publisher_totals: Counter = Counter()
+    book_author_totals: Counter = Counter()
+    book_tag_totals: Counter = Counter()
+    for row in book_landings.values():
+        book_publisher_totals.update(row.publisher_ids)
+        book_author_totals.update(row.author_ids)
+        book_tag_totals.update(row.tag_ids)
+
+    # ─────────────── Авторы ───────────────
+    authors: Dict[int, _AuthorRow] = {
+        r.id: _AuthorRow(id=r.id, language=_lang(r.language), name_cf=(r.name or "").casefold())
+        for r in author_rows
+    }
+    author_courses: Dict[int, Dict[LangKey, Set[int]]] = defaultdict(lambda: defaultdict(set))
+    for landing_id, author_id in la_pairs:
+        author = authors.get(author_id)
+        if author is None:
+            continue
+        if landing_id not in landings:
+            continue
+        author.landing_tag_ids |= landings[landing_id].tag_ids
+        course_ids = landing_courses.get(landing_id)
+        if course_ids:
+            author_courses[author_id][None] |= course_ids
+            author_courses[author_id][landing_lang[landing_id]] |= course_ids
+
+    author_books: Dict[int, Dict[LangKey, Set[int]]] = defaultdict(lambda: defaultdict(set))
+    for book_id, author_id in ba_pairs:
+        author = authors.get(author_id)
+        if author is None:
+            continue
+        author.book_tag_ids |= book_tags_map.get(book_id, set())
+        for bl_id in book_landing_ids_by_book.get(book_id, ()):
+            if bl_id in book_landings:
+                author_books[author_id][None].add(book_id)
+                author_books[author_id][book_landing_lang[bl_id]].add(book_id)
+
+    author_tag_totals: Counter = Counter()
+    for author in authors.values():
+        author_tag_totals.update(author.landing_tag_ids)
+        author_tag_totals.update(author.book_tag_ids)
+        author.courses = {k: len(v) for k, v in author_courses.get(author.id, {}).items()}
+        author.books = {k: len(v) for k, v in author_books.get(author.id, {}).items()}
+
+    def _count_ranges(attr: str) -> Dict[LangKey, Tuple[int, int]]:
+        values: Dict[LangKey, List[int]] = defaultdict(list)
+        for author in authors.values():
+            for key, cnt in getattr(author, attr).items():
+                values[key].append(cnt)
+        return {k: _minmax(v) for k, v in values.items()}
+
+    snapshot = FacetSnapshot(
+        built_at=time.monotonic(),
+        author_names=author_names,
+        tag_names=tag_names,
+        publisher_names=publisher_names,
+        landings=list(landings.values()),
+        landing_author_totals=dict(landing_author_totals),
+        landing_tag_totals=dict(landing_tag_totals),
+        landing_price_range=landing_price_range,
+        landing_lessons_range=landing_lessons_range,
+        book_landings=list(book_landings.values()),
+        book_publisher_totals=book_publisher_totals,
+        book_author_totals=book_author_totals,
+        book_tag_totals=book_tag_totals,
+        book_year_range=_minmax(year_values),
+        book_price_range=_minmax(r.price for r in book_landings.values() if r.price is not None),
+        book_pages_range=_minmax(
+            r.pages_total for r in book_landings.values() if r.pages_total is not None
+        ),
+        authors=list(authors.values()),
+        author_tag_totals=author_tag_totals,
+        author_courses_range=_count_ranges("courses"),
+        author_books_range=_count_ranges("books"),
+    )
+    logger.info(
+        "facet index built: landings=%s book_landings=%s authors=%s in %.1f ms",
+        len(snapshot.landings), len(snapshot.book_landings), len(snapshot.authors),
+        (time.monotonic() - started) * 1000,
+    )
+    return snapshot
+
+
+_snapshot: Optional[FacetSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def _is_fresh(snapshot: Optional[FacetSnapshot]) -> bool:
+    return snapshot is not None and time.monotonic() - snapshot.built_at < FACET_INDEX_TTL
+
+
+def get_facet_snapshot(db: Session) -> FacetSnapshot:
+    """Текущий индекс; пересобирается одним потоком, если устарел."""
+    global _snapshot
+    snapshot = _snapshot
+    if _is_fresh(snapshot):
+        return snapshot
+    with _snapshot_lock:
+        if not _is_fresh(_snapshot):
+            _snapshot = _build_snapshot(db)
+        return _snapshot
+
+
+def invalidate_facet_indexes() -> None:
+    """Сбрасывает индекс — следующий запрос фильтров построит его заново."""
+    global _snapshot
+    _snapshot = None
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Общие помощники ═══════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def _in_range(value, value_from, value_to) -> bool:
+    """SQL-семантика `col >= from AND col <= to`: NULL не проходит ни одну границу."""
+    if value_from is None and value_to is None:
+        return True
+    if value is None:
+        return False
+    if value_from is not None and value < value_from:
+        return False
+    if value_to is not None and value > value_to:
+        return False
+    return True
+
+
+def _as_float(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def _q(current_filters: Dict[str, Any]) -> Optional[str]:
+    q = current_filters.get('q')
+    return q.strip().casefold() if q else None
+
+
+def _top_ids(totals: Counter, names: Dict[int, str], limit: int) -> List[int]:
+    """Топ-N по общему количеству; порядок — как ORDER BY total_cnt DESC, name."""
+    return sorted(
+        totals,
+        key=lambda i: (-totals[i], (names.get(i) or "").casefold(), i),
+    )[:limit]
+
+
+def _multiselect(
+    top_ids: List[int],
+    names: Dict[int, str],
+    counts: Counter,
+    selected_ids: Optional[List[int]],
+) -> Tuple[List[FilterOption], Optional[SelectedMultiselectValues]]:
+    base_options = [
+        FilterOption(id=i, name=names[i], count=counts.get(i, 0))
+        for i in top_ids
+    ]
+    if not selected_ids:
+        return base_options, None
+    selected_options = [
+        FilterOption(id=i, name=names[i], count=counts.get(i, 0))
+        for i in sorted(set(selected_ids)) if i in names
+    ]
+    return (
+        _prepend_selected_options(base_options, selected_options),
+        SelectedMultiselectValues(options=selected_options),
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Курсовые лендинги ═════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def facet_landing_filters(
+    db: Session,
+    current_filters: Dict[str, Any],
+    filter_limit: int = 50,
+    include_recommend: bool = False,
+) -> CatalogFiltersMetadata:
+    """
+    То же, что aggregate_landing_filters, но за один проход по индексу.
+
+    current_filters — те же ключи, что передаются в build_landing_base_query.
+    """
+    snap = get_facet_snapshot(db)
+    filters = {}
+    selected = SelectedFilters()
+
+    language = _lang(current_filters.get('language')) or None
+    q = _q(current_filters)
+    tags = set(current_filters.get('tags') or [])
+    author_ids = set(current_filters.get('author_ids') or [])
+    price_from = _as_float(current_filters.get('price_from'))
+    price_to = _as_float(current_filters.get('price_to'))
+    lessons_from = current_filters.get('lessons_from')
+    lessons_to = current_filters.get('lessons_to')
+    lessons_filter = lessons_from is not None or lessons_to is not None
+
+    author_counts: Counter = Counter()
+    tag_counts: Counter = Counter()
+
+    for row in snap.landings:
+        # Измерения, которые не являются фасетами-мультиселектами, — общие
+        if language and row.language != language:
+            continue
+        if q and q not in row.text:
+            continue
+        if not _in_range(row.price, price_from, price_to):
+            continue
+        if lessons_filter and not (
+            row.has_courses and _in_range(row.lessons_total, lessons_from, lessons_to)
+        ):
+            continue
+        tag_ok = not tags or not tags.isdisjoint(row.tag_ids)
+        author_ok = not author_ids or not author_ids.isdisjoint(row.author_ids)
+        if tag_ok:
+            author_counts.update(row.author_ids)
+        if author_ok:
+            tag_counts.update(row.tag_ids)
+
+    # ═══════════════════ Authors ═══════════════════
+    author_totals = snap.landing_author_totals.get(language, Counter())
+    total_authors = len(author_totals) if language else len(snap.author_names)
+    options, selected.authors = _multiselect(
+        _top_ids(author_totals, snap.author_names, filter_limit),
+        snap.author_names, author_counts, current_filters.get('author_ids'),
+    )
+    filters['authors'] = MultiselectFilter(
+        label="Авторы",
+        param_name="author_ids",
+        options=options,
+        has_more=total_authors > filter_limit,
+        total_count=total_authors,
+        search_endpoint="/api/filters/authors/search?context=courses"
+    )
+
+    # ═══════════════════ Tags ═══════════════════
+    tag_totals = snap.landing_tag_totals.get(language, Counter())
+    total_tags = len(tag_totals) if language else len(snap.tag_names)
+    options, selected.tags = _multiselect(
+        _top_ids(tag_totals, snap.tag_names, filter_limit),
+        snap.tag_names, tag_counts, current_filters.get('tags'),
+    )
+    filters['tags'] = MultiselectFilter(
+        label="Теги",
+        param_name="tags",
+        options=options,
+        has_more=total_tags > filter_limit,
+        total_count=total_tags,
+        search_endpoint="/api/filters/tags/search?context=courses"
+    )
+
+    # ═══════════════════ Price Range ═══════════════════
+    price_range = snap.landing_price_range.get(language)
+    if price_range:
+        filters['price'] = RangeFilter(
+            label="Цена",
+            param_name_from="price_from",
+            param_name_to="price_to",
+            min=price_range[0],
+            max=price_range[1],
+            unit="USD"
+        )
+    if price_from is not None or price_to is not None:
+        selected.price = SelectedRangeValues(value_from=price_from, value_to=price_to)
+
+    # ═══════════════════ Lessons Range ═══════════════════
+    lessons_range = snap.landing_lessons_range.get(language)
+    if lessons_range:
+        filters['lessons'] = RangeFilter(
+            label="Количество уроков",
+            param_name_from="lessons_from",
+            param_name_to="lessons_to",
+            min=lessons_range[0],
+            max=lessons_range[1],
+            unit="lessons"
+        )
+    if lessons_filter:
+        selected.lessons = SelectedRangeValues(
+            value_from=int(lessons_from) if lessons_from is not None else None,
+            value_to=int(lessons_to) if lessons_to is not None else None
+        )
+
+    has_selected = any([selected.authors, selected.tags, selected.price, selected.lessons])
+
+    return CatalogFiltersMetadata(
+        filters=filters,
+        available_sorts=_get_landing_sort_options(include_recommend=include_recommend),
+        selected=selected if has_selected else None
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Книжные лендинги ══════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def facet_book_filters(
+    db: Session,
+    current_filters: Dict[str, Any],
+    filter_limit: int = 50,
+) -> CatalogFiltersMetadata:
+    """
+    То же, что aggregate_book_filters, но за один проход по индексу.
+
+    current_filters — те же ключи, что передаются в build_book_landing_base_query.
+    """
+    snap = get_facet_snapshot(db)
+    filters = {}
+    selected = SelectedFilters()
+
+    language = _lang(current_filters.get('language')) or None
+    q = _q(current_filters)
+    tags = set(current_filters.get('tags') or [])
+    formats = set(current_filters.get('formats') or [])
+    publisher_ids = set(current_filters.get('publisher_ids') or [])
+    author_ids = set(current_filters.get('author_ids') or [])
+    year_from = current_filters.get('year_from')
+    year_to = current_filters.get('year_to')
+    price_from = _as_float(current_filters.get('price_from'))
+    price_to = _as_float(current_filters.get('price_to'))
+    pages_from = current_filters.get('pages_from')
+    pages_to = current_filters.get('pages_to')
+    pages_filter = pages_from is not None or pages_to is not None
+
+    publisher_counts: Counter = Counter()
+    author_counts: Counter = Counter()
+    tag_counts: Counter = Counter()
+    format_counts: Counter = Counter()
+
+    for row in snap.book_landings:
+        if row.price is None:
+            continue
+        if language and row.language != language:
+            continue
+        if q and q not in row.text:
+            continue
+        # Условия по году — два независимых EXISTS, как в build_book_landing_base_query
+        if year_from and not any(y >= year_from for y in row.years):
+            continue
+        if year_to and not any(y <= year_to for y in row.years):
+            continue
+        if not _in_range(row.price, price_from, price_to):
+            continue
+        if pages_filter and not _in_range(row.pages_total, pages_from, pages_to):
+            continue
+
+        dims = (
+            not tags or not tags.isdisjoint(row.tag_ids),
+            not formats or not formats.isdisjoint(row.formats),
+            not publisher_ids or not publisher_ids.isdisjoint(row.publisher_ids),
+            not author_ids or not author_ids.isdisjoint(row.author_ids),
+        )
+        failed = dims.count(False)
+        if failed > 1:
+            continue
+        tag_ok, format_ok, publisher_ok, author_ok = dims
+        # Элемент учитывается в фасете, если прошёл все ОСТАЛЬНЫЕ измерения
+        if failed == 0 or not tag_ok:
+            tag_counts.update(row.tag_ids)
+        if failed == 0 or not format_ok:
+            format_counts.update(row.formats)
+        if failed == 0 or not publisher_ok:
+            publisher_counts.update(row.publisher_ids)
+        if failed == 0 or not author_ok:
+            author_counts.update(row.author_ids)
+
+    # ═══════════════════ Publishers ═══════════════════
+    total_publishers = len(snap.publisher_names)
+    options, selected.publishers = _multiselect(
+        _top_ids(snap.book_publisher_totals, snap.publisher_names, filter_limit),
+        snap.publisher_names, publisher_counts, current_filters.get('publisher_ids'),
+    )
+    filters['publishers'] = MultiselectFilter(
+        label="Издатели",
+        param_name="publisher_ids",
+        options=options,
+        has_more=total_publishers > filter_limit,
+        total_count=total_publishers,
+        search_endpoint="/api/filters/publishers/search?context=books"
+    )
+
+    # ═══════════════════ Authors ═══════════════════
+    total_authors = len(snap.author_names)
+    options, selected.authors = _multiselect(
+        _top_ids(snap.book_author_totals, snap.author_names, filter_limit),
+        snap.author_names, author_counts, current_filters.get('author_ids'),
+    )
+    filters['authors'] = MultiselectFilter(
+        label="Авторы",
+        param_name="author_ids",
+        options=options,
+        has_more=total_authors > filter_limit,
+        total_count=total_authors,
+        search_endpoint="/api/filters/authors/search?context=books"
+    )
+
+    # ═══════════════════ Tags ═══════════════════
+    total_tags = len(snap.tag_names)
+    options, selected.tags = _multiselect(
+        _top_ids(snap.book_tag_totals, snap.tag_names, filter_limit),
+        snap.tag_names, tag_counts, current_filters.get('tags'),
+    )
+    filters['tags'] = MultiselectFilter(
+        label="Теги",
+        param_name="tags",
+        options=options,
+        has_more=total_tags > filter_limit,
+        total_count=total_tags,
+        search_endpoint="/api/filters/tags/search?context=books"
+    )
+
+    # ═══════════════════ Formats ═══════════════════
+    format_options = [
+        FilterOption(value=fmt.value, name=fmt.value, count=format_counts.get(fmt.value, 0))
+        for fmt in BookFileFormat
+    ]
+    selected_formats = current_filters.get('formats') or []
+    if selected_formats:
+        selected.formats = SelectedMultiselectValues(
+            options=[opt for opt in format_options if opt.value in selected_formats]
+        )
+    filters['formats'] = MultiselectFilter(
+        label="Форматы",
+        param_name="formats",
+        options=format_options
+    )
+
+    # ═══════════════════ Year Range ═══════════════════
+    if snap.book_year_range and all(snap.book_year_range):
+        filters['year'] = RangeFilter(
+            label="Год публикации",
+            param_name_from="year_from",
+            param_name_to="year_to",
+            min=snap.book_year_range[0],
+            max=snap.book_year_range[1],
+            unit="year"
+        )
+    if year_from is not None or year_to is not None:
+        selected.year = SelectedRangeValues(value_from=year_from, value_to=year_to)
+
+    # ═══════════════════ Price Range ═══════════════════
+    if snap.book_price_range and all(snap.book_price_range):
+        filters['price'] = RangeFilter(
+            label="Цена",
+            param_name_from="price_from",
+            param_name_to="price_to",
+            min=snap.book_price_range[0],
+            max=snap.book_price_range[1],
+            unit="USD"
+        )
+    if price_from is not None or price_to is not None:
+        selected.price = SelectedRangeValues(value_from=price_from, value_to=price_to)
+
+    # ═══════════════════ Pages Range ═══════════════════
+    if snap.book_pages_range:
+        filters['pages'] = RangeFilter(
+            label="Количество страниц",
+            param_name_from="pages_from",
+            param_name_to="pages_to",
+            min=snap.book_pages_range[0],
+            max=snap.book_pages_range[1],
+            unit="pages"
+        )
+    if pages_filter:
+        selected.pages = SelectedRangeValues(value_from=pages_from, value_to=pages_to)
+
+    has_selected = any([
+        selected.publishers, selected.authors, selected.tags, selected.formats,
+        selected.year, selected.price, selected.pages
+    ])
+
+    # Порядок ключей важен фронтенду: tags → publishers → authors → остальные
+    preferred_order = ["tags", "publishers", "authors"]
+    ordered_head = {k: filters[k] for k in preferred_order if k in filters}
+    ordered_tail = {k: v for k, v in filters.items() if k not in preferred_order}
+
+    return CatalogFiltersMetadata(
+        filters={**ordered_head, **ordered_tail},
+        available_sorts=_get_sort_options(),
+        selected=selected if has_selected else None
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Авторы ════════════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def facet_author_filters(
+    db: Session,
+    current_filters: Dict[str, Any],
+    filter_limit: int = 50,
+) -> CatalogFiltersMetadata:
+    """
+    То же, что aggregate_author_filters, но за один проход по индексу.
+
+    current_filters — те же ключи, что передаются в build_author_base_query.
+    """
+    snap = get_facet_snapshot(db)
+    filters = {}
+    selected = SelectedFilters()
+
+    language = _lang(current_filters.get('language')) or None
+    q = _q(current_filters)
+    courses_from = current_filters.get('courses_from')
+    courses_to = current_filters.get('courses_to')
+    books_from = current_filters.get('books_from')
+    books_to = current_filters.get('books_to')
+
+    # Фасет один (tags), поэтому сам фильтр по тегам на счётчики не влияет
+    tag_counts: Counter = Counter()
+    for author in snap.authors:
+        if language and author.language != language:
+            continue
+        if q and q not in author.name_cf:
+            continue
+        if not _in_range(author.courses.get(language, 0), courses_from, courses_to):
+            continue
+        if not _in_range(author.books.get(language, 0), books_from, books_to):
+            continue
+        tag_counts.update(author.landing_tag_ids)
+        tag_counts.update(author.book_tag_ids)
+
+    # ═══════════════════ Tags ═══════════════════
+    total_tags = len(snap.tag_names)
+    options, selected.tags = _multiselect(
+        _top_ids(snap.author_tag_totals, snap.tag_names, filter_limit),
+        snap.tag_names, tag_counts, current_filters.get('tags'),
+    )
+    filters['tags'] = MultiselectFilter(
+        label="Теги",
+        param_name="tags",
+        options=options,
+        has_more=total_tags > filter_limit,
+        total_count=total_tags,
+        search_endpoint="/api/filters/tags/search?context=authors"
+    )
+
+    # ═══════════════════ Courses / Books Range ═══════════════════
+    courses_range = snap.author_courses_range.get(language)
+    if courses_range:
+        filters['courses'] = RangeFilter(
+            label="Количество курсов",
+            param_name_from="courses_from",
+            param_name_to="courses_to",
+            min=courses_range[0],
+            max=courses_range[1],
+            unit="courses"
+        )
+    books_range = snap.author_books_range.get(language)
+    if books_range:
+        filters['books'] = RangeFilter(
+            label="Количество книг",
+            param_name_from="books_from",
+            param_name_to="books_to",
+            min=books_range[0],
+            max=books_range[1],
+            unit="books"
+        )
+
+    return CatalogFiltersMetadata(
+        filters=filters,
+        available_sorts=_get_author_sort_options(),
+        selected=selected if selected.tags else None
+    )
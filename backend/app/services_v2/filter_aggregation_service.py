@@ -9,7 +9,7 @@
 
 from typing import Optional, List, Dict, Any
 from sqlalchemy.orm import Session, Query, selectinload
-from sqlalchemy import func, cast, Integer, and_, or_, exists, select, literal, Numeric as SqlNumeric
+from sqlalchemy import func, cast, Integer, and_, or_, exists, select, literal
 from decimal import Decimal
 
 import re
@@ -17,8 +17,11 @@ import re
 from ..models.models_v2 import (
     BookLanding, Book, Author, Tag, Publisher, Landing, Course,
     BookFile, book_authors, book_tags, book_publishers,
-    landing_authors, landing_tags, book_landing_books, landing_course
+    landing_authors, landing_tags, book_landing_books, landing_course,
+    LessonVideo, normalize_price,
 )
+from . import lesson_video_index
+from .lesson_video_index import ENTITY_COURSE
 from ..schemas_v2.common import (
     FilterOption, MultiselectFilter, RangeFilter, 
     SortOption, CatalogFiltersMetadata,
@@ -757,11 +760,11 @@ def aggregate_book_filters(
     
     # ═══════════════════ Price Range (всегда показываем) ═══════════════════
     # Получаем общий диапазон цен из ВСЕХ книжных лендингов (без фильтров)
-    # Явный CAST к DECIMAL для корректного числового сравнения (избегаем строковой сортировки)
+    # new_price у BookLanding уже DECIMAL — без CAST, чтобы работал индекс
     price_range = (
         db.query(
-            func.min(cast(BookLanding.new_price, SqlNumeric(10, 2))).label('min_price'),
-            func.max(cast(BookLanding.new_price, SqlNumeric(10, 2))).label('max_price')
+            func.min(BookLanding.new_price).label('min_price'),
+            func.max(BookLanding.new_price).label('max_price')
         )
         .filter(BookLanding.is_hidden.is_(False))
         .filter(BookLanding.new_price.isnot(None))
@@ -1443,6 +1446,110 @@ def calculate_landing_duration_minutes(db: Session, landing_id: int) -> int:
     return parse_duration_to_minutes(landing.duration)
 
 
+def apply_landing_metrics(landing: Landing) -> None:
+    """
+    Пересчитывает материализованные поля lessons_total / duration_minutes
+    у ORM-объекта лендинга (по уже загруженным landing.courses).
+
+    Вызывается в create/update лендинга перед commit.
+    """
+    landing.lessons_total = sum(
+        count_lessons_from_sections(c.sections) for c in (landing.courses or [])
+    )
+    landing.duration_minutes = parse_duration_to_minutes(landing.duration)
+
+
+def refresh_landing_metrics(
+    db: Session,
+    landing_ids: Optional[List[int]] = None,
+    batch_size: int = 500,
+) -> int:
+    """
+    Пакетно пересчитывает lessons_total / duration_minutes
+    и числовые цены new_price_num / old_price_num.
+
+    ORM-записи цен синхронизируются сами (Landing._sync_price_num);
+    здесь догоняем строки, изменённые сырым SQL (миграции, импорт).
+    Уроки считаются по индексу lesson_videos (строка на урок курса),
+    а не разбором Course.sections — индекс курса должен быть актуален.
+    Пока индекс не построен (после миграции 008 до первого rebuild) —
+    прежний разбор Course.sections (count_lessons_from_sections).
+
+    Args:
+        landing_ids: ID лендингов; None — все лендинги (бэкфилл)
+        batch_size: размер пачки (одна пачка = 2 SELECT + bulk UPDATE)
+
+    Returns:
+        Количество обработанных лендингов. Коммит — на вызывающей стороне.
+    """
+    if landing_ids is None:
+        landing_ids = [lid for (lid,) in db.query(Landing.id).order_by(Landing.id).all()]
+    landing_ids = sorted(set(landing_ids))
+
+    use_index = lesson_video_index.is_built(db)
+    processed = 0
+    for start in range(0, len(landing_ids), batch_size):
+        chunk = landing_ids[start:start + batch_size]
+
+        if use_index:
+            lessons: Dict[int, int] = dict(
+                db.query(landing_course.c.landing_id, func.count(LessonVideo.id))
+                .join(LessonVideo, and_(
+                    LessonVideo.entity_type == ENTITY_COURSE,
+                    LessonVideo.entity_id == landing_course.c.course_id,
+                ))
+                .filter(landing_course.c.landing_id.in_(chunk))
+                .group_by(landing_course.c.landing_id)
+                .all()
+            )
+        else:
+            lessons = {}
+            for landing_id, sections in (
+                db.query(landing_course.c.landing_id, Course.sections)
+                .join(Course, Course.id == landing_course.c.course_id)
+                .filter(landing_course.c.landing_id.in_(chunk))
+                .all()
+            ):
+                lessons[landing_id] = lessons.get(landing_id, 0) + count_lessons_from_sections(sections)
+
+        mappings = [
+            {
+                "id": landing_id,
+                "lessons_total": lessons.get(landing_id, 0),
+                "duration_minutes": parse_duration_to_minutes(duration),
+                "new_price_num": normalize_price(new_price),
+                "old_price_num": normalize_price(old_price),
+            }
+            for landing_id, duration, new_price, old_price in (
+                db.query(Landing.id, Landing.duration, Landing.new_price, Landing.old_price)
+                .filter(Landing.id.in_(chunk))
+                .all()
+            )
+        ]
+        if mappings:
+            db.bulk_update_mappings(Landing, mappings)
+        processed += len(mappings)
+
+    return processed
+
+
+def refresh_landing_metrics_for_courses(db: Session, course_ids: List[int]) -> int:
+    """
+    Пересчитывает метрики всех лендингов, в которые входят указанные курсы.
+    Используется после изменения Course.sections.
+    """
+    if not course_ids:
+        return 0
+    landing_ids = [
+        lid for (lid,) in
+        db.query(landing_course.c.landing_id)
+        .filter(landing_course.c.course_id.in_(course_ids))
+        .distinct()
+        .all()
+    ]
+    return refresh_landing_metrics(db, landing_ids) if landing_ids else 0
+
+
 def build_landing_base_query(
     db: Session,
     language: Optional[str] = None,
@@ -1496,69 +1603,27 @@ def build_landing_base_query(
             Landing.authors.any(Author.id.in_(author_ids))
         )
     
-    # Фильтр по цене (new_price - строка, кастим к числу)
+    # Фильтр по цене (числовая копия new_price, индекс is_hidden+language+new_price_num)
     if price_from is not None:
-        base = base.filter(
-            cast(Landing.new_price, SqlNumeric(10, 2)) >= price_from
-        )
+        base = base.filter(Landing.new_price_num >= price_from)
     if price_to is not None:
-        base = base.filter(
-            cast(Landing.new_price, SqlNumeric(10, 2)) <= price_to
-        )
+        base = base.filter(Landing.new_price_num <= price_to)
     
-    # Фильтр по количеству уроков
-    # Уроки считаются из JSON поля sections связанных курсов
+    # Фильтр по количеству уроков (материализованное поле lessons_total)
+    # Как и раньше, учитываем только лендинги, к которым привязан хотя бы один курс
     if lessons_from is not None or lessons_to is not None:
-        # Получаем ID лендингов, соответствующих фильтру по урокам
-        landing_ids_with_lessons = _get_landing_ids_by_lessons_count(
-            db, lessons_from, lessons_to
-        )
-        if landing_ids_with_lessons is not None:
-            base = base.filter(Landing.id.in_(landing_ids_with_lessons))
+        base = base.filter(_landing_has_courses())
+        if lessons_from is not None:
+            base = base.filter(Landing.lessons_total >= lessons_from)
+        if lessons_to is not None:
+            base = base.filter(Landing.lessons_total <= lessons_to)
     
     return base
 
 
-def _get_landing_ids_by_lessons_count(
-    db: Session,
-    lessons_from: Optional[int],
-    lessons_to: Optional[int],
-) -> Optional[List[int]]:
-    """
-    Возвращает список ID лендингов, у которых сумма уроков попадает в диапазон.
-    
-    Уроки считаются из JSON поля sections всех связанных курсов.
-    """
-    if lessons_from is None and lessons_to is None:
-        return None
-    
-    # Получаем все видимые лендинги с их курсами
-    landings_data = (
-        db.query(Landing.id, Course.sections)
-        .join(landing_course, Landing.id == landing_course.c.landing_id)
-        .join(Course, landing_course.c.course_id == Course.id)
-        .filter(Landing.is_hidden.is_(False))
-        .all()
-    )
-    
-    # Группируем по landing_id и считаем уроки
-    from collections import defaultdict
-    landing_lessons: Dict[int, int] = defaultdict(int)
-    
-    for landing_id, sections in landings_data:
-        lessons_count = count_lessons_from_sections(sections)
-        landing_lessons[landing_id] += lessons_count
-    
-    # Фильтруем по диапазону
-    result_ids = []
-    for landing_id, total_lessons in landing_lessons.items():
-        if lessons_from is not None and total_lessons < lessons_from:
-            continue
-        if lessons_to is not None and total_lessons > lessons_to:
-            continue
-        result_ids.append(landing_id)
-    
-    return result_ids
+def _landing_has_courses():
+    """EXISTS-условие: у лендинга есть хотя бы один курс."""
+    return exists().where(landing_course.c.landing_id == Landing.id)
 
 
 def _calculate_lessons_range(db: Session, language: Optional[str] = None) -> Dict[str, Optional[int]]:
@@ -1571,39 +1636,26 @@ def _calculate_lessons_range(db: Session, language: Optional[str] = None) -> Dic
     
     Возвращает: {'min': N, 'max': M}
     """
-    from collections import defaultdict
-    
-    # Получаем все видимые лендинги с их курсами
     query = (
-        db.query(Landing.id, Course.sections)
-        .join(landing_course, Landing.id == landing_course.c.landing_id)
-        .join(Course, landing_course.c.course_id == Course.id)
+        db.query(
+            func.min(Landing.lessons_total).label('min_lessons'),
+            func.max(Landing.lessons_total).label('max_lessons'),
+        )
         .filter(Landing.is_hidden.is_(False))
+        .filter(_landing_has_courses())
     )
     
     # Фильтруем по языку, если указан
     if language:
         query = query.filter(Landing.language == language)
     
-    landings_data = query.all()
-    
-    if not landings_data:
-        return {'min': None, 'max': None}
-    
-    # Группируем по landing_id и считаем уроки
-    landing_lessons: Dict[int, int] = defaultdict(int)
-    
-    for landing_id, sections in landings_data:
-        lessons_count = count_lessons_from_sections(sections)
-        landing_lessons[landing_id] += lessons_count
-    
-    if not landing_lessons:
+    row = query.first()
+    if not row or row.min_lessons is None:
         return {'min': None, 'max': None}
     
-    lessons_counts = list(landing_lessons.values())
     return {
-        'min': min(lessons_counts),
-        'max': max(lessons_counts)
+        'min': int(row.min_lessons),
+        'max': int(row.max_lessons)
     }
 
 
@@ -1914,17 +1966,13 @@ def aggregate_landing_filters(
     )
     
     # ═══════════════════ Price Range ═══════════════════
-    # Явный CAST для числового сравнения
     price_query = (
         db.query(
-            func.min(cast(Landing.new_price, SqlNumeric(10, 2))).label('min_price'),
-            func.max(cast(Landing.new_price, SqlNumeric(10, 2))).label('max_price')
+            func.min(Landing.new_price_num).label('min_price'),
+            func.max(Landing.new_price_num).label('max_price')
         )
         .filter(Landing.is_hidden.is_(False))
-        .filter(Landing.new_price.isnot(None))
-        .filter(Landing.new_price != '')
-        .filter(Landing.new_price != '0')  # Исключаем нулевые цены
-        .filter(cast(Landing.new_price, SqlNumeric(10, 2)) > 0)  # Дополнительная проверка
+        .filter(Landing.new_price_num > 0)  # Исключаем пустые и нулевые цены
     )
     
     # Фильтруем по языку, если указан
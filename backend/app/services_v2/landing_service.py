@@ -6,14 +6,17 @@ import time
 from typing import List, Optional
 
 from sqlalchemy import (
-    func, or_, desc, Date, cast, select,
+    func, or_, desc, Date, cast,
 )
-from sqlalchemy.types import Float
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import Session, Query
+from sqlalchemy.orm import Session, Query, selectinload
 from fastapi import HTTPException
 
-from .preview_service import get_or_schedule_preview
+from .preview_service import get_previews_batch
+from .filter_aggregation_service import apply_landing_metrics
+from .catalog_snapshot import get_catalog_snapshot, publish_catalog_change, KIND_LANDING
+from .recommendation_service import get_copurchase_matrix
+from . import lesson_video_index, traffic_rollup
 from ..utils.ip_utils import is_facebook_bot_ip
 from ..models.models_v2 import (
     Landing,
@@ -56,10 +59,17 @@ def landing_to_card(landing: Landing) -> dict:
         "course_ids": [c.id for c in landing.courses],
     }
 
+# Связи, которые читает landing_to_card, — одним selectin-запросом на связь
+_CARD_LOAD_OPTIONS = (
+    selectinload(Landing.tags),
+    selectinload(Landing.authors),
+    selectinload(Landing.courses),
+)
+
 # 3. Формула процента скидки, пригодная в ORDER BY
 def _discount_expr():
-    old = cast(Landing.__table__.c.old_price, Float())
-    new = cast(Landing.__table__.c.new_price, Float())
+    old = Landing.__table__.c.old_price_num
+    new = Landing.__table__.c.new_price_num
     return ((old - new) / old) * 100
 
 
@@ -233,6 +243,8 @@ def create_landing(db: Session, landing_data: LandingCreate) -> Landing:
         is_hidden=landing_data.is_hidden or False,
     )
     db.add(new_landing)
+    db.flush()
+    lesson_video_index.sync_landings(db, [new_landing.id])
     db.commit()
     db.refresh(new_landing)
     # Привязка авторов через ассоциативную таблицу landing_authors
@@ -251,8 +263,11 @@ def create_landing(db: Session, landing_data: LandingCreate) -> Landing:
     # Если landing_name не задано, обновляем его автоматически
     if not new_landing.landing_name:
         new_landing.landing_name = f"Landing name {new_landing.id}"
-        db.commit()
-        db.refresh(new_landing)
+    # Материализованные метрики для каталога (lessons_total / duration_minutes)
+    apply_landing_metrics(new_landing)
+    db.commit()
+    db.refresh(new_landing)
+    publish_catalog_change(KIND_LANDING, [new_landing.id])
     return new_landing
 
 
@@ -280,6 +295,8 @@ def update_landing(db: Session, landing_id: int, update_data: LandingUpdate) ->
                     {k: v.dict() if hasattr(v, "dict") else v for k, v in lesson_item.items()}
                     for lesson_item in update_data.lessons_info
                 ]
+                db.flush()
+                lesson_video_index.sync_landings(db, [landing.id])
             if update_data.preview_photo is not None:
                 landing.preview_photo = update_data.preview_photo
             if update_data.sales_count is not None:
@@ -301,8 +318,10 @@ def update_landing(db: Session, landing_id: int, update_data: LandingUpdate) ->
                 landing.lessons_count = update_data.lessons_count
             if update_data.is_hidden is not None:
                 landing.is_hidden = update_data.is_hidden
+            apply_landing_metrics(landing)
             db.commit()
             db.refresh(landing)
+            publish_catalog_change(KIND_LANDING, [landing.id])
             return landing
         except OperationalError as e:
             db.rollback()
@@ -323,7 +342,10 @@ def delete_landing(db: Session, landing_id: int) -> None:
     landing.authors = []
     landing.tags = []
     db.delete(landing)
+    db.flush()
+    lesson_video_index.sync_landings(db, [landing_id])
     db.commit()
+    publish_catalog_change(KIND_LANDING, [landing_id])
 
 
 
@@ -426,36 +448,33 @@ def get_purchases_by_language_per_day(
     Период полуоткрытый: [start_dt, end_dt)
     """
 
-    # 1. Получаем дату транзакции без времени
-    day_col = func.date(Purchase.created_at)          # DATE(created_at) — MySQL/PG
-    # day_col = cast(Purchase.created_at, Date)       # Cross‑DB ANSI‑вариант
-
-    rows = (
-        db.query(
-            day_col.label("day"),
-            Landing.language.label("language"),
-            func.count(Purchase.id).label("purchase_count"),
-            func.coalesce(func.sum(Purchase.amount), 0).label("total_amount"),
-        )
-        .join(Purchase, Purchase.landing_id == Landing.id)
-        .filter(
-            Purchase.created_at >= start_dt,
-            Purchase.created_at <  end_dt,
-        )
-        .group_by(day_col, Landing.language)
-        .order_by(day_col)
-        .all()
+    # 1. Покупки по (лендинг, день) из почасовых роллапов, язык — текущий язык лендинга
+    rows = traffic_rollup.aggregate(
+        db, traffic_rollup.KIND_LANDING,
+        start_dt=start_dt, end_dt=end_dt, granularity="day", by_target=True,
     )
+    landing_ids = {lid for (lid, _), acc in rows.items() if acc["purchases"]}
+    languages = dict(
+        db.query(Landing.id, Landing.language).filter(Landing.id.in_(landing_ids)).all()
+    ) if landing_ids else {}
 
     # 2. Сводим в stats[date][language] -> {...}
-    stats: dict[date, dict[str, dict[str, str | int]]] = defaultdict(dict)
+    totals: dict[date, dict[str, list]] = defaultdict(dict)
+    for (lid, day_dt), acc in rows.items():
+        if not acc["purchases"] or lid not in languages:
+            continue
+        cell = totals[day_dt.date()].setdefault(languages[lid], [0, 0.0])
+        cell[0] += acc["purchases"]
+        cell[1] += acc["amount"]
 
-    for r in rows:
-        stats[r.day][r.language] = {
-            "language": r.language,                       # ➜ добавили
-            "count":    r.purchase_count,
-            "total_amount": f"{r.total_amount:.2f} $",
-        }
+    stats: dict[date, dict[str, dict[str, str | int]]] = defaultdict(dict)
+    for day, per_lang in totals.items():
+        for language, (count, amount) in per_lang.items():
+            stats[day][language] = {
+                "language": language,                       # ➜ добавили
+                "count":    count,
+                "total_amount": f"{amount:.2f} $",
+            }
 
     # 3. Заполняем диапазон дней, чтобы не было «дыр»
     data = []
@@ -699,8 +718,6 @@ def _unique_ip_count_recent(db, landing_id: int, now: datetime) -> int:
     )
     return int(q.scalar() or 0)
 
-from sqlalchemy import func
-
 def track_ad_visit(
     db: Session,
     landing_id: int,
@@ -710,13 +727,14 @@ def track_ad_visit(
     user_agent: str | None = None,
 ):
     """
-    При высокой конкуренции за блокировку row-lock:
-    - Визит ВСЕГДА записывается (это главное)
-    - Обновление флага рекламы пропускается при блокировке (eventual consistency)
-    - Визиты от ботов (по IP и User-Agent) игнорируются
+    Визит с рекламы. Визит уходит в буфер (services_v2.visit_ingest) и
+    записывается пачкой; флаг рекламы/TTL/период обновляются там же,
+    один раз на лендинг за пачку (apply_ad_visits).
+    Визиты от ботов (по IP и User-Agent) игнорируются.
     """
     import logging
     from ..utils.ip_utils import is_bot_user_agent
+    from .visit_ingest import record_visit, KIND_AD_VISIT
     log = logging.getLogger(__name__)
     
     # Фильтруем ботов по User-Agent
@@ -728,67 +746,54 @@ def track_ad_visit(
     if is_facebook_bot_ip(ip):
         log.debug("Skipping ad visit from Facebook bot IP: %s", ip)
         return
-    
-    now = datetime.utcnow()
 
-    # 1) лог визита (fbp/fbc оставляем для аналитики, но не используем в логике включения)
-    visit = AdVisit(
-        landing_id=landing_id,
-        fbp=fbp,
-        fbc=fbc,
-        ip_address=(ip.strip() if ip else None),
-    )
-    db.add(visit)
-    db.flush()  # чтобы запись учлась в последующих запросах этой транзакции
-
-    # 2) работаем с лендингом под блокировкой
-    try:
-        # nowait=True — не ждём освобождения блокировки, сразу ошибка при конкуренции
-        landing = (
-            db.query(Landing)
-              .filter(Landing.id == landing_id)
-              .with_for_update(nowait=True)
-              .first()
-        )
-    except OperationalError as e:
-        # Блокировка занята другим запросом — коммитим визит и выходим
-        log.warning(f"Lock contention for landing_id={landing_id}, skipping ad flag update: {e}")
-        db.commit()
-        return
-    
-    if not landing:
-        db.commit()  # сохраним хотя бы визит
-        return
+    # fbp/fbc оставляем для аналитики, но не используем в логике включения
+    record_visit(db, KIND_AD_VISIT, landing_id, fbp=fbp, fbc=fbc, ip=ip)
 
-    # 3) считаем уникальные IP за окно
-    window_start = now - UNIQUE_WINDOW
-    uniq_count = (
-        db.query(func.count(func.distinct(AdVisit.ip_address)))
-          .filter(
-              AdVisit.landing_id == landing_id,
-              AdVisit.visited_at >= window_start,
-              AdVisit.ip_address.isnot(None),
-              AdVisit.ip_address != ""
-          )
-          .scalar()
-    ) or 0
 
-    # 4) логика флага и периодов
-    if not landing.in_advertising:
-        # зажигаем только после порога уникальных IP
-        if uniq_count >= MIN_UNIQUE_IPS:
-            landing.in_advertising = True
-            _open_ad_period_if_needed(db, landing_id, started_by=None)
-            landing.ad_flag_expires_at = now + AD_TTL
-        # иначе — ничего не включаем, только записали визит
-    else:
-        # уже в рекламе: страховочно убедимся в открытом периоде и продлим TTL
-        _open_ad_period_if_needed(db, landing_id, started_by=None)
-        new_ttl = now + AD_TTL
-        if not landing.ad_flag_expires_at or landing.ad_flag_expires_at < new_ttl:
-            landing.ad_flag_expires_at = new_ttl
-
-    db.commit()
+def apply_ad_visits(
+    db: Session,
+    last_seen: dict[int, datetime],
+    unique_counts: dict[int, int],
+    *,
+    nowait: bool = False,
+) -> int:
+    """
+    Пакетное обновление рекламного флага по пачке визитов (без commit).
+
+    last_seen     — {landing_id: время последнего рекламного визита в пачке};
+    unique_counts — {landing_id: уникальные IP за окно} только для лендингов
+                    с визитами через track-ad: они могут ЗАЖЕЧЬ рекламу после
+                    порога MIN_UNIQUE_IPS. Остальные (from_ad-визиты страницы)
+                    лишь продлевают TTL, если реклама уже включена.
+    Строки лендингов блокируются одним запросом в порядке id.
+    Возвращает число обработанных лендингов.
+    """
+    if not last_seen:
+        return 0
+    landings = (
+        db.query(Landing)
+          .filter(Landing.id.in_(list(last_seen)))
+          .order_by(Landing.id)
+          .with_for_update(nowait=nowait)
+          .all()
+    )
+    for landing in landings:
+        now = last_seen[landing.id]
+        if not landing.in_advertising:
+            # зажигаем только после порога уникальных IP
+            if unique_counts.get(landing.id, 0) >= MIN_UNIQUE_IPS:
+                landing.in_advertising = True
+                _open_ad_period_if_needed(db, landing.id, started_by=None)
+                landing.ad_flag_expires_at = now + AD_TTL
+            # иначе — ничего не включаем, только записали визит
+        else:
+            # уже в рекламе: страховочно убедимся в открытом периоде и продлим TTL
+            _open_ad_period_if_needed(db, landing.id, started_by=None)
+            new_ttl = now + AD_TTL
+            if not landing.ad_flag_expires_at or landing.ad_flag_expires_at < new_ttl:
+                landing.ad_flag_expires_at = new_ttl
+    return len(landings)
 
 
 def get_cheapest_landing_for_course(
@@ -800,7 +805,8 @@ def get_cheapest_landing_for_course(
     """
     Возвращает объект Landing с минимальным new_price
     для заданного course_id. Скрытые лендинги (is_hidden=True)
-    игнорируются.  new_price приводим к float для корректного сравнения.
+    игнорируются. Сравнение — по числовой копии new_price_num в SQL,
+    лендинги без валидной цены идут последними.
     """
     query = (
         db.query(Landing)
@@ -813,17 +819,14 @@ def get_cheapest_landing_for_course(
     if tags:
         query = query.join(Landing.tags).filter(Tag.name.in_(tags))
 
-    rows = query.all()
-    if not rows:
-        return None
-
-    def _price(landing: Landing) -> float:
-        try:
-            return float(landing.new_price)
-        except Exception:
-            return float("inf")
-
-    return min(rows, key=_price)
+    return (
+        query.order_by(
+            Landing.new_price_num.is_(None),
+            Landing.new_price_num.asc(),
+            Landing.id.asc(),
+        )
+        .first()
+    )
 
 def _fallback_landing_cards(
     db: Session,
@@ -865,57 +868,47 @@ def get_recommended_landing_cards(
         query = _apply_sort(query, "popular")
 
         total = query.count()
-        landings = query.offset(skip).limit(limit).all()
+        landings = query.options(*_CARD_LOAD_OPTIONS).offset(skip).limit(limit).all()
         return {"total": total, "cards": [landing_to_card(l) for l in landings]}
 
     # --- COLLAB FILTERING ---
-    similar_users = (
-        db.query(users_courses.c.user_id)
-          .filter(
-              users_courses.c.course_id.in_(b_courses),
-              users_courses.c.user_id != user_id,
-          )
-          .distinct()
-          .subquery()
-    )
+    # Скоры курсов — вектором по предпосчитанной матрице совместных покупок,
+    # самый дешёвый лендинг курса — из снапшота каталога (без запросов к БД).
+    matrix = get_copurchase_matrix()
+    recommended_courses = matrix.recommend(b_courses) if matrix is not None else []
 
-    overlap = func.count(func.distinct(users_courses.c.user_id))
-    score   = (cast(func.count(), Float) / func.nullif(overlap, 0)).label("score")
-
-    rec_q = (
-        db.query(users_courses.c.course_id.label("cid"), score)
-          .filter(
-              users_courses.c.user_id.in_(select(similar_users)),
-              ~users_courses.c.course_id.in_(b_courses),
-          )
-          .group_by(users_courses.c.course_id)
-          .order_by(score.desc())
-    )
+    snapshot = get_catalog_snapshot(db)
+    tag_ids = None
+    if tags:
+        wanted = set(tags)
+        tag_ids = {tid for tid, name in snapshot.tag_names.items() if name in wanted}
 
     # 1) собираем CF-лендинги (уникальные, с учётом language и исключая купленные лендинги)
     cf_ids: list[int] = []
     seen_cf: set[int] = set()
+    lang = language.upper() if language else None
 
-    for row in rec_q.yield_per(200):
-        landing = get_cheapest_landing_for_course(db, row.cid, tags=tags)
-        if not landing:
-            continue
-        if language and landing.language != language.upper():
+    for cid in recommended_courses:
+        if tag_ids is None:
+            record = snapshot.cheapest_landing_by_course.get(cid)
+        else:
+            record = snapshot.cheapest_landing(cid, tag_ids)
+        if record is None:
             continue
-        if landing.id in seen_cf:
+        if lang and record.language != lang:
             continue
-        if landing.id in b_landings:
+        if record.id in seen_cf or record.id in b_landings:
             continue
-
-        seen_cf.add(landing.id)
-        cf_ids.append(landing.id)
+        seen_cf.add(record.id)
+        cf_ids.append(record.id)
 
     # 2) фолбэк‑запрос popular по языку, исключая купленные и уже найденные CF
     query_fb = _apply_common_filters(
         _base_landing_query(db), language=language, tags=tags
     )
     query_fb = _exclude_bought(query_fb, b_courses, b_landings)
-    query_fb = query_fb.filter(~Landing.id.in_(cf_ids))   # <-- импортируйте вашу модель Landing
+    if cf_ids:
+        query_fb = query_fb.filter(~Landing.id.in_(cf_ids))
     query_fb = _apply_sort(query_fb, "popular")
 
     # сколько популярок останется после исключения CF
@@ -925,26 +918,22 @@ def get_recommended_landing_cards(
     total = len(cf_ids) + fallback_total
 
     # 3) пагинация по объединённому списку
-
     cards: list = []
 
-    # сначала срез по CF
+    # сначала срез по CF — карточки прямо из снапшота
     if skip < len(cf_ids):
-        cf_slice = cf_ids[skip : skip + limit]
-        if cf_slice:
-            # достаём объекты лендингов по cf_slice в исходном порядке
-            # (если нет удобного батч‑запроса с сохранением порядка — грузим поштучно)
-            for lid in cf_slice:
-                l = db.query(Landing).get(lid)
-                if l:
-                    cards.append(landing_to_card(l))
-
-    # если места ещё есть — добираем fallback
+        for lid in cf_ids[skip : skip + limit]:
+            cards.append(snapshot.landing_card(snapshot.landings[lid]))
+
+    # если места ещё есть — добираем fallback одним запросом со связями
     remaining = limit - len(cards)
     if remaining > 0:
         # сколько нужно пропустить во фолбэке
         fb_skip = max(0, skip - len(cf_ids))
-        fb_landings = query_fb.offset(fb_skip).limit(remaining).all()
+        fb_landings = (
+            query_fb.options(*_CARD_LOAD_OPTIONS)
+                    .offset(fb_skip).limit(remaining).all()
+        )
         cards.extend(landing_to_card(l) for l in fb_landings)
 
     return {"total": total, "cards": cards}
@@ -1001,14 +990,20 @@ def get_landing_detail_with_previews(db: Session, landing_id: int) -> dict:
     lessons_src = landing.lessons_info or []          # JSON → list[dict]
     lessons_out = []
 
+    previews = get_previews_batch(db, [
+        lesson.get("link") or lesson.get("video_link")
+        for item in lessons_src
+        for lesson in item.values()
+    ])
+
     for item in lessons_src:
         key, lesson = next(iter(item.items()))
         lesson_copy = copy.deepcopy(lesson)
 
         video_link = lesson_copy.get("link") or lesson_copy.get("video_link")
         # если ссылки нет — просто передаём как есть
-        if video_link:
-            lesson_copy["preview"] = get_or_schedule_preview(db, video_link)
+        if video_link and video_link in previews:
+            lesson_copy["preview"] = previews[video_link]
 
         lessons_out.append({key: lesson_copy})
 
@@ -0,0 +1,349 @@
+"""
+Индекс уроков/видео lesson_videos, производный от courses.sections и landings.lessons_info.
+
+Ссылки на видео хранятся только внутри JSON курса и лендинга. Раньше каждый
+потребитель разбирал все JSON заново: скан video_maintenance, /health/check/stream
+(грузил все Course и Landing), db_url_rewrite (LIKE по CAST(json AS CHAR)),
+storage_links (REGEXP_REPLACE по таблицам целиком), счётчики уроков.
+
+Здесь одна строка на урок: (entity_type, entity_id, section, lesson_index) →
+название, исходная ссылка, нормализованный S3 key, sha1(key), хост и признак
+«наш mp4». Поддержка:
+  • sync(db, entity_type, ids) — пересобрать строки сущностей из их текущего
+    JSON в БД (в транзакции вызывающего, без commit). Вызывается сервисами
+    записи курса/лендинга и переписывателями ссылок после сырого SQL;
+    удалённая сущность просто теряет строки;
+  • rebuild(db) — полный проход пачками + чистка сирот (задача
+    tasks.lesson_videos.rebuild_lesson_video_index, ночью как страховка от
+    правок JSON в обход сервисов: парсеры, миграции, ручной SQL).
+Чтение: owners_for_key(s) / entities_on_hosts / our_video_keys / lessons_per_course —
+индексные запросы вместо разбора JSON.
+"""
+
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..core.storage import S3_BUCKET, key_from_public_or_endpoint_url
+from ..models.models_v2 import Course, Landing, LessonVideo
+
+logger = logging.getLogger(__name__)
+
+ENTITY_COURSE = "course"
+ENTITY_LANDING = "landing"
+
+REBUILD_CHUNK = int(os.getenv("LESSON_VIDEO_REBUILD_CHUNK", "500"))
+INSERT_CHUNK = 1000
+
+
+# ─────────────────────────── разбор ссылок ───────────────────────────
+
+def is_our_video_ref(v: str) -> bool:
+    """
+    Фильтр ссылок из БД (courses.sections / landings.lessons_info):
+    - только mp4
+    - только наши домены (cloud/cdn) или r2 endpoint
+    - сторонние источники (boomstream/youtube/...) игнорируем
+    """
+    if not v:
+        return False
+    s = str(v).strip()
+    if not s:
+        return False
+    if "://" not in s:
+        return s.lower().endswith(".mp4")
+    try:
+        u = urlparse(s)
+        host = (u.hostname or "").lower()
+        path = (u.path or "").lower()
+        if not path.endswith(".mp4"):
+            return False
+        if host.endswith(".r2.cloudflarestorage.com"):
+            return True
+        if host.endswith(".dent-s.com") or host.endswith(".med-g.com"):
+            return True
+        return False
+    except Exception:
+        return False
+
+
+def normalize_ref_to_key(v: str) -> str:
+    """
+    Превращает URL/ключ из БД в key, понятный video_maintenance:
+    - для публичных cloud/cdn URL -> key_from_public_or_endpoint_url
+    - для r2 endpoint URL: /<bucket>/<key> -> <key>
+    - снимаем %xx
+    """
+    s = str(v).strip()
+    if not s:
+        return s
+    if "://" not in s:
+        return unquote(s.lstrip("/"))
+    try:
+        u = urlparse(s)
+        host = (u.hostname or "").lower()
+        if host.endswith(".r2.cloudflarestorage.com"):
+            path = unquote((u.path or "").lstrip("/"))
+            # ожидаемый path-style: /<bucket>/<key>
+            if path.lower().startswith(f"{S3_BUCKET.lower()}/"):
+                return path[len(S3_BUCKET) + 1 :]
+            return path
+        k = key_from_public_or_endpoint_url(s)
+        return unquote(k.lstrip("/"))
+    except Exception:
+        return unquote(key_from_public_or_endpoint_url(s).lstrip("/"))
+
+
+def key_hash(key: str) -> str:
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _host_of(v: str) -> Optional[str]:
+    if "://" not in v:
+        return None
+    try:
+        return (urlparse(v).hostname or "").lower() or None
+    except Exception:
+        return None
+
+
+def _clip(v: Any, n: int) -> Optional[str]:
+    if v is None:
+        return None
+    return str(v)[:n]
+
+
+# ─────────────────────────── разбор JSON ───────────────────────────
+
+def course_lessons(sections: Any) -> Iterator[dict]:
+    """
+    Уроки из Course.sections: dict {"1": {"section_name", "lessons": [...]}} или list секций.
+    Каждый элемент lessons — отдельный урок (как в count_lessons_from_sections).
+    """
+    if isinstance(sections, dict):
+        items = list(sections.items())
+    elif isinstance(sections, list):
+        items = [(str(i), sec) for i, sec in enumerate(sections, start=1)]
+    else:
+        return
+    for sec_key, sec in items:
+        if not isinstance(sec, dict):
+            continue
+        lessons = sec.get("lessons", [])
+        if not isinstance(lessons, list):
+            continue
+        for idx, lesson in enumerate(lessons):
+            lesson = lesson if isinstance(lesson, dict) else {}
+            yield {
+                "section": sec_key,
+                "section_name": sec.get("section_name"),
+                "lesson_index": idx,
+                "lesson_name": lesson.get("lesson_name"),
+                "video_url": lesson.get("video_link"),
+            }
+
+
+def landing_lessons(lessons_info: Any) -> Iterator[dict]:
+    """Уроки из Landing.lessons_info: [{"lesson1": {"name", "link", ...}}, ...]."""
+    if not isinstance(lessons_info, list):
+        return
+    idx = 0
+    for item in lessons_info:
+        if not isinstance(item, dict):
+            continue
+        for _, payload in item.items():
+            if not isinstance(payload, dict):
+                continue
+            yield {
+                "section": None,
+                "section_name": None,
+                "lesson_index": idx,
+                "lesson_name": payload.get("name"),
+                "video_url": payload.get("link"),
+            }
+            idx += 1
+
+
+_SOURCES = {
+    ENTITY_COURSE: (Course, Course.sections, course_lessons),
+    ENTITY_LANDING: (Landing, Landing.lessons_info, landing_lessons),
+}
+
+
+def _rows(entity_type: str, entity_id: int, payload: Any, now: datetime) -> List[dict]:
+    extract = _SOURCES[entity_type][2]
+    out = []
+    for lesson in extract(payload):
+        url = lesson["video_url"]
+        url = url.strip() if isinstance(url, str) else ""
+        key = normalize_ref_to_key(url) if url else ""
+        out.append({
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "section": _clip(lesson["section"], 64),
+            "section_name": _clip(lesson["section_name"], 255),
+            "lesson_index": lesson["lesson_index"],
+            "lesson_name": _clip(lesson["lesson_name"], 255),
+            "video_url": url or None,
+            "video_key": key or None,
+            "key_hash": key_hash(key) if key else None,
+            "source_host": _clip(_host_of(url), 255) if url else None,
+            "is_ours": bool(url) and is_our_video_ref(url),
+            "updated_at": now,
+        })
+    return out
+
+
+# ─────────────────────────── запись ───────────────────────────
+
+def sync(db: Session, entity_type: str, ids: Iterable[int]) -> int:
+    """
+    Пересобирает строки индекса для сущностей ids по их текущему JSON в БД.
+    Работает в транзакции вызывающего (commit — на его стороне); вызывать после
+    flush/UPDATE. Несуществующие сущности просто теряют строки. Возвращает число строк.
+    """
+    ids = sorted({int(i) for i in ids if i is not None})
+    if not ids:
+        return 0
+    model, column, _ = _SOURCES[entity_type]
+    now = datetime.utcnow()
+    rows: List[dict] = []
+    for obj_id, payload in db.query(model.id, column).filter(model.id.in_(ids)).all():
+        rows.extend(_rows(entity_type, int(obj_id), payload, now))
+
+    db.query(LessonVideo).filter(
+        LessonVideo.entity_type == entity_type,
+        LessonVideo.entity_id.in_(ids),
+    ).delete(synchronize_session=False)
+    for i in range(0, len(rows), INSERT_CHUNK):
+        db.bulk_insert_mappings(LessonVideo, rows[i:i + INSERT_CHUNK])
+    return len(rows)
+
+
+def sync_courses(db: Session, course_ids: Iterable[int]) -> int:
+    return sync(db, ENTITY_COURSE, course_ids)
+
+
+def sync_landings(db: Session, landing_ids: Iterable[int]) -> int:
+    return sync(db, ENTITY_LANDING, landing_ids)
+
+
+def rebuild(db: Session, *, chunk: int = REBUILD_CHUNK) -> dict:
+    """Полная пересборка: все курсы и лендинги пачками по chunk (commit на пачку) + чистка сирот."""
+    stats: Dict[str, Any] = {}
+    for entity_type, (model, _, _) in _SOURCES.items():
+        entities = rows = 0
+        last_id = 0
+        while True:
+            ids = [
+                i for (i,) in
+                db.query(model.id).filter(model.id > last_id).order_by(model.id.asc()).limit(chunk).all()
+            ]
+            if not ids:
+                break
+            rows += sync(db, entity_type, ids)
+            db.commit()
+            entities += len(ids)
+            last_id = ids[-1]
+
+        orphans = (
+            db.query(LessonVideo)
+              .filter(
+                  LessonVideo.entity_type == entity_type,
+                  ~LessonVideo.entity_id.in_(db.query(model.id)),
+              )
+              .delete(synchronize_session=False)
+        )
+        db.commit()
+        stats[entity_type] = {"entities": entities, "rows": rows, "orphans_deleted": int(orphans or 0)}
+    logger.info("lesson_videos rebuilt: %s", stats)
+    return stats
+
+
+# ─────────────────────────── чтение ───────────────────────────
+
+def is_built(db: Session) -> bool:
+    """Индекс заполнен (после миграции 008 до первого rebuild — пуст)."""
+    return db.query(LessonVideo.id).limit(1).first() is not None
+
+
+def owners_for_keys(db: Session, keys_or_urls: Iterable[str]) -> Dict[str, List[int]]:
+    """{entity_type: [entity_id]} — кто ссылается хотя бы на один из keys (URL тоже принимаются)."""
+    hashes = {key_hash(k) for k in (normalize_ref_to_key(v or "") for v in keys_or_urls) if k}
+    if not hashes:
+        return {}
+    out: Dict[str, List[int]] = {}
+    rows = (
+        db.query(LessonVideo.entity_type, LessonVideo.entity_id)
+          .filter(LessonVideo.key_hash.in_(sorted(hashes)))
+          .distinct()
+          .all()
+    )
+    for entity_type, entity_id in rows:
+        out.setdefault(entity_type, []).append(int(entity_id))
+    return out
+
+
+def owners_for_key(db: Session, key_or_url: str) -> Dict[str, List[int]]:
+    """{entity_type: [entity_id]} — кто ссылается на key (URL тоже принимается)."""
+    return owners_for_keys(db, [key_or_url])
+
+
+def source_hosts(db: Session) -> List[str]:
+    return [h for (h,) in db.query(LessonVideo.source_host).filter(LessonVideo.source_host.isnot(None)).distinct().all()]
+
+
+def entities_on_hosts(db: Session, hosts: Iterable[str]) -> Dict[str, List[int]]:
+    """{entity_type: [entity_id]} — у кого есть ссылки на любой из hosts."""
+    hosts = list(hosts)
+    if not hosts:
+        return {}
+    out: Dict[str, List[int]] = {}
+    rows = (
+        db.query(LessonVideo.entity_type, LessonVideo.entity_id)
+          .filter(LessonVideo.source_host.in_(hosts))
+          .distinct()
+          .all()
+    )
+    for entity_type, entity_id in rows:
+        out.setdefault(entity_type, []).append(int(entity_id))
+    return out
+
+
+def our_video_keys(db: Session) -> Dict[str, Tuple[str, int]]:
+    """
+    Все наши mp4-ключи: key -> (entity_type, entity_id) первого владельца
+    (курсы раньше лендингов, по возрастанию id). HLS-ключи пропускаются.
+    """
+    found: Dict[str, Tuple[str, int]] = {}
+    rows = (
+        db.query(LessonVideo.video_key, LessonVideo.entity_type, LessonVideo.entity_id)
+          .filter(LessonVideo.is_ours.is_(True))
+          .order_by(LessonVideo.entity_type.asc(), LessonVideo.entity_id.asc(), LessonVideo.id.asc())
+          .yield_per(5000)
+    )
+    for key, entity_type, entity_id in rows:
+        if not key or "/.hls/" in key or key in found:
+            continue
+        found[key] = (entity_type, int(entity_id))
+    return found
+
+
+def lessons_per_course(db: Session, course_ids: Iterable[int]) -> Dict[int, int]:
+    """{course_id: число уроков} по индексу."""
+    course_ids = list(course_ids)
+    if not course_ids:
+        return {}
+    rows = (
+        db.query(LessonVideo.entity_id, func.count(LessonVideo.id))
+          .filter(LessonVideo.entity_type == ENTITY_COURSE, LessonVideo.entity_id.in_(course_ids))
+          .group_by(LessonVideo.entity_id)
+          .all()
+    )
+    return {int(cid): int(n) for cid, n in rows}
@@ -0,0 +1,416 @@
+"""
+Асинхронная раздача PDF из S3 с поддержкой Range (GET /api/books/{id}/pdf).
+
+  • HEAD объекта (размер, ETag, Content-Type, x-amz-meta-*) кэшируется по ключу
+    на META_TTL_SECONDS — Range-запросы PDF.js не делают HEAD в S3 каждый раз;
+  • тело читается блоками CHUNK_SIZE, выровненными по границе блока; блоки
+    Range-запросов кладутся в LRU процесса, ограниченный CACHE_MAX_BYTES
+    (ключ — key + ETag, поэтому перезалитый файл не смешивается со старым);
+  • подряд идущие блоки, которых нет в кэше, забираются одним GET с Range,
+    а байты уходят клиенту по мере прихода, не дожидаясь целого блока;
+  • S3 вызывается через httpx по presigned URL: подпись boto3 считает локально,
+    сетевой ввод-вывод не занимает поток threadpool на всё время передачи;
+  • multi-range (multipart/byteranges), If-None-Match → 304, If-Range, 416;
+  • первый GET в S3 делается до отправки заголовков 200/206: сбой S3 — 502,
+    а не оборванное тело с уже отданным статусом;
+  • GET идёт с If-Match: ETag из закэшированной meta — если файл перезалили
+    до истечения META_TTL_SECONDS, S3 отвечает 412, meta сбрасывается и ответ
+    строится заново по свежей.
+"""
+
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from ..core.storage import S3_BUCKET, s3_client
+from .book_service import PDF_CACHE_CONTROL, PDF_CONTENT_DISPOSITION
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", str(1024 * 1024)))                # 1–4 MiB
+CACHE_MAX_BYTES = int(os.getenv("PDF_CHUNK_CACHE_BYTES", str(256 * 1024 * 1024)))
+META_TTL_SECONDS = int(os.getenv("PDF_META_TTL_SECONDS", "300"))
+META_MAX_KEYS = 4096
+MAX_RANGES = 16
+PRESIGN_EXPIRES = 600
+
+# Metadata S3 → заголовки ответа (как раньше в stream_book_pdf)
+_META_HEADERS = {
+    "asset": "X-Book-Pdf-Asset",
+    "pages": "X-Book-Preview-Pages",
+    "book-id": "X-Book-Id",
+    "book-slug": "X-Book-Slug",
+}
+
+_s3 = s3_client(signature_version="s3v4", max_pool_connections=50)
+_http: Optional[httpx.AsyncClient] = None
+
+
+def _client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http
+
+
+def _presign(operation: str, key: str) -> str:
+    return _s3.generate_presigned_url(
+        operation, Params={"Bucket": S3_BUCKET, "Key": key}, ExpiresIn=PRESIGN_EXPIRES,
+    )
+
+
+class UpstreamError(Exception):
+    """S3 не отдал тело (сеть или неожиданный статус)."""
+
+
+class StaleObjectError(UpstreamError):
+    """ETag объекта в S3 уже не тот, что в закэшированной meta (файл перезалит)."""
+
+
+# ═══════════════════ Кэши (только из event loop — без блокировок) ═════════════
+
+
+class ObjectMeta:
+    __slots__ = ("key", "size", "etag", "content_type", "metadata", "fetched_at")
+
+    def __init__(self, key: str, size: int, etag: str, content_type: str, metadata: Dict[str, str]):
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type
+        self.metadata = metadata
+        self.fetched_at = time.monotonic()
+
+
+class ChunkCache:
+    """LRU блоков {(key, etag, index): bytes}, ограниченный суммарным размером."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: "OrderedDict[Tuple[str, str, int], bytes]" = OrderedDict()
+
+    def __contains__(self, item) -> bool:
+        return item in self._data
+
+    def get(self, item) -> Optional[bytes]:
+        data = self._data.get(item)
+        if data is not None:
+            self._data.move_to_end(item)
+        return data
+
+    def put(self, item, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        old = self._data.pop(item, None)
+        if old is not None:
+            self.size -= len(old)
+        self._data[item] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size -= len(evicted)
+
+
+_meta: "OrderedDict[str, ObjectMeta]" = OrderedDict()
+_chunks = ChunkCache(CACHE_MAX_BYTES)
+
+
+async def get_object_meta(key: str) -> ObjectMeta:
+    cached = _meta.get(key)
+    if cached is not None and time.monotonic() - cached.fetched_at < META_TTL_SECONDS:
+        _meta.move_to_end(key)
+        return cached
+
+    try:
+        resp = await _client().head(_presign("head_object", key))
+    except httpx.HTTPError as e:
+        logger.error("S3 HEAD error for %s: %s", key, e)
+        raise HTTPException(status_code=502, detail="Failed to fetch PDF metadata")
+    if resp.status_code == 404:
+        _meta.pop(key, None)
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if resp.status_code >= 300:
+        logger.error("S3 HEAD %s for %s", resp.status_code, key)
+        raise HTTPException(status_code=502, detail="Failed to fetch PDF metadata")
+
+    meta = ObjectMeta(
+        key=key,
+        size=int(resp.headers.get("content-length") or 0),
+        etag=resp.headers.get("etag") or "",
+        content_type=resp.headers.get("content-type") or "application/pdf",
+        metadata={
+            name[len("x-amz-meta-"):]: value
+            for name, value in resp.headers.items()
+            if name.startswith("x-amz-meta-")
+        },
+    )
+    _meta[key] = meta
+    _meta.move_to_end(key)
+    while len(_meta) > META_MAX_KEYS:
+        _meta.popitem(last=False)
+    return meta
+
+
+# ═══════════════════ Чтение диапазона через кэш блоков ════════════════════════
+
+
+def _chunk_len(meta: ObjectMeta, index: int) -> int:
+    return min(CHUNK_SIZE, meta.size - index * CHUNK_SIZE)
+
+
+def _forget_meta(meta: ObjectMeta) -> None:
+    if _meta.get(meta.key) is meta:
+        del _meta[meta.key]
+
+
+async def _open_run(meta: ObjectMeta, span_start: int, span_end: int) -> httpx.Response:
+    """GET с Range и If-Match по ETag meta; ответ открыт потоком, закрывает вызывающий."""
+    headers = {"Range": f"bytes={span_start}-{span_end}"}
+    if meta.etag:
+        headers["If-Match"] = meta.etag
+    client = _client()
+    request = client.build_request("GET", _presign("get_object", meta.key), headers=headers)
+    try:
+        resp = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        logger.error("S3 GET error for %s (%s): %s", meta.key, headers["Range"], e)
+        raise UpstreamError(str(e)) from e
+    if resp.status_code == 206 or (resp.status_code == 200 and span_start == 0):
+        return resp
+    await resp.aclose()
+    if resp.status_code == 412:
+        logger.info("S3 object %s changed since HEAD (ETag %s), dropping cached metadata", meta.key, meta.etag)
+        _forget_meta(meta)
+        raise StaleObjectError(meta.key)
+    logger.error("S3 GET %s for %s (%s)", resp.status_code, meta.key, headers["Range"])
+    raise UpstreamError(f"S3 GET failed with status {resp.status_code}")
+
+
+async def _fetch_run(meta: ObjectMeta, first: int, last: int, start: int, end: int, fill: bool) -> AsyncIterator[bytes]:
+    """Один GET на блоки first..last; отдаёт пересечение с [start, end], складывает блоки в кэш."""
+    span_start = first * CHUNK_SIZE
+    span_end = min((last + 1) * CHUNK_SIZE, meta.size) - 1
+    resp = await _open_run(meta, span_start, span_end)
+    try:
+        pos = span_start
+        index = first
+        buf = bytearray()
+        async for piece in resp.aiter_raw():
+            piece_end = pos + len(piece) - 1
+            lo, hi = max(pos, start), min(piece_end, end)
+            if lo <= hi:
+                yield piece if (lo == pos and hi == piece_end) else piece[lo - pos:hi - pos + 1]
+            pos += len(piece)
+            if fill:
+                buf += piece
+                while index <= last and len(buf) >= _chunk_len(meta, index):
+                    n = _chunk_len(meta, index)
+                    _chunks.put((meta.key, meta.etag, index), bytes(buf[:n]))
+                    del buf[:n]
+                    index += 1
+            if pos > span_end:
+                break
+    finally:
+        await resp.aclose()
+
+
+async def iter_object_range(meta: ObjectMeta, start: int, end: int, fill: bool = True) -> AsyncIterator[bytes]:
+    """Байты [start, end] объекта: попадания — из кэша, промахи — сериями из S3."""
+    index, last = start // CHUNK_SIZE, end // CHUNK_SIZE
+    while index <= last:
+        data = _chunks.get((meta.key, meta.etag, index))
+        if data is not None:
+            chunk_start = index * CHUNK_SIZE
+            lo = max(start, chunk_start) - chunk_start
+            hi = min(end, chunk_start + len(data) - 1) - chunk_start + 1
+            yield data if (lo == 0 and hi == len(data)) else data[lo:hi]
+            index += 1
+            continue
+        run_end = index
+        while run_end < last and (meta.key, meta.etag, run_end + 1) not in _chunks:
+            run_end += 1
+        async for piece in _fetch_run(meta, index, run_end, start, end, fill):
+            yield piece
+        index = run_end + 1
+
+
+# ═══════════════════ HTTP-семантика ═══════════════════════════════════════════
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Диапазоны из заголовка Range, отсортированные и слитые.
+    None — заголовка нет или он некорректен (отдаём весь файл), [] — невыполним (416).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else start
+                if end < start:
+                    return None
+                if not last:
+                    end = size - 1
+            else:
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not etag:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+async def _primed(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Забирает первый кусок body сейчас (ошибка S3 всплывает до отправки
+    заголовков) и возвращает итератор, который отдаст его и остальное.
+    """
+    try:
+        head = await body.__anext__()
+    except StopAsyncIteration:
+        return _empty()
+
+    async def rest() -> AsyncIterator[bytes]:
+        try:
+            yield head
+            async for piece in body:
+                yield piece
+        finally:
+            await body.aclose()
+
+    return rest()
+
+
+async def build_pdf_response(meta: ObjectMeta, request_headers: Mapping[str, str]) -> Response:
+    """
+    Ответ 200/206/304/416 на запрос к объекту meta. S3 недоступен — 502;
+    объект перезалит после HEAD — один повтор со свежей meta.
+    """
+    try:
+        try:
+            return await _build_pdf_response(meta, request_headers)
+        except StaleObjectError:
+            meta = await get_object_meta(meta.key)
+            return await _build_pdf_response(meta, request_headers)
+    except UpstreamError:
+        raise HTTPException(status_code=502, detail="Failed to fetch PDF")
+
+
+async def _build_pdf_response(meta: ObjectMeta, request_headers: Mapping[str, str]) -> Response:
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": PDF_CONTENT_DISPOSITION,
+        "Cache-Control": PDF_CACHE_CONTROL,
+    }
+    if meta.etag:
+        headers["ETag"] = meta.etag
+    for name, header in _META_HEADERS.items():
+        if meta.metadata.get(name):
+            headers[header] = meta.metadata[name]
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, meta.etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and if_range and if_range.strip() != meta.etag:
+        range_header = None
+    ranges = parse_range(range_header, meta.size)
+
+    if ranges is None:
+        headers["Content-Length"] = str(meta.size)
+        body = await _primed(iter_object_range(meta, 0, meta.size - 1, fill=False)) if meta.size else _empty()
+        return StreamingResponse(body, status_code=200, headers=headers, media_type=meta.content_type)
+
+    if not ranges:
+        headers["Content-Range"] = f"bytes */{meta.size}"
+        return Response(status_code=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{meta.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            await _primed(iter_object_range(meta, start, end)), status_code=206, headers=headers, media_type=meta.content_type,
+        )
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        (
+            f"\r\n--{boundary}\r\nContent-Type: {meta.content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{meta.size}\r\n\r\n"
+        ).encode("latin-1")
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    headers["Content-Length"] = str(
+        sum(len(p) for p in parts) + sum(end - start + 1 for start, end in ranges) + len(closing)
+    )
+
+    first_body = await _primed(iter_object_range(meta, *ranges[0]))
+
+    async def multipart() -> AsyncIterator[bytes]:
+        for i, (part, (start, end)) in enumerate(zip(parts, ranges)):
+            yield part
+            body = first_body if i == 0 else iter_object_range(meta, start, end)
+            async for piece in body:
+                yield piece
+        yield closing
+
+    return StreamingResponse(
+        multipart(), status_code=206, headers=headers,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+    )
+
+
+async def _empty() -> AsyncIterator[bytes]:
+    return
+    yield
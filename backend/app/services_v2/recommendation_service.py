@@ -0,0 +1,219 @@
+"""
+Коллаборативные рекомендации курсов по матрице совместных покупок.
+
+Офлайн (Celery, app.tasks.recommendations.build_copurchase_matrix):
+  • из users_courses строится разреженная матрица курс×курс
+    C[a, b] = число пользователей, купивших и a, и b;
+  • по каждой строке оставляется TOP_NEIGHBORS самых сильных соседей;
+  • результат (CSR: indptr / indices / data) кладётся в Redis.
+
+Онлайн (get_recommended_landing_cards):
+  • матрица держится в памяти воркера и перечитывается из Redis, только
+    когда задача выложила новую версию;
+  • скор курса = Σ C[b, c] по купленным курсам b — одна векторная
+    операция (bincount по склеенным строкам CSR);
+  • курс → самый дешёвый видимый лендинг берётся из снапшота каталога.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Iterable
+
+import numpy as np
+import redis
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models.models_v2 import users_courses
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+MATRIX_KEY = "reco:copurchase"
+MATRIX_VERSION_KEY = "reco:copurchase:version"
+TOP_NEIGHBORS = int(os.getenv("RECO_TOP_NEIGHBORS", "200"))
+USERS_PER_CHUNK = int(os.getenv("RECO_USERS_PER_CHUNK", "5000"))
+RELOAD_CHECK_SECONDS = int(os.getenv("RECO_RELOAD_CHECK_SECONDS", "60"))
+# матрица ещё не выложена — не ходим в Redis на каждый запрос, но и не ждём минуту
+ABSENT_CHECK_SECONDS = int(os.getenv("RECO_ABSENT_CHECK_SECONDS", "10"))
+
+
+class CoPurchaseMatrix:
+    """Разреженная матрица совместных покупок в формате CSR."""
+
+    __slots__ = ("version", "course_ids", "position", "indptr", "indices", "data")
+
+    def __init__(self, version: str, course_ids, indptr, indices, data):
+        self.version = version
+        self.course_ids = np.asarray(course_ids, dtype=np.int64)
+        self.position: Dict[int, int] = {int(c): i for i, c in enumerate(self.course_ids)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+
+    def recommend(self, bought_course_ids: Iterable[int]) -> List[int]:
+        """course_id по убыванию Σ совместных покупок с bought (купленные исключены)."""
+        bought = {int(c) for c in bought_course_ids}
+        rows = [self.position[c] for c in bought if c in self.position]
+        if not rows:
+            return []
+        segments = [np.arange(self.indptr[r], self.indptr[r + 1]) for r in rows]
+        picked = np.concatenate(segments)
+        if picked.size == 0:
+            return []
+        scores = np.bincount(self.indices[picked], weights=self.data[picked], minlength=len(self.course_ids))
+        candidates = np.flatnonzero(scores)
+        candidate_ids = self.course_ids[candidates]
+        keep = ~np.isin(candidate_ids, np.fromiter(bought, dtype=np.int64, count=len(bought)))
+        candidates, candidate_ids = candidates[keep], candidate_ids[keep]
+        # Тай-брейк по course_id — порядок детерминирован между воркерами
+        order = np.lexsort((candidate_ids, -scores[candidates]))
+        return candidate_ids[order].tolist()
+
+    def to_payload(self) -> dict:
+        return {
+            "version": self.version,
+            "course_ids": self.course_ids.tolist(),
+            "indptr": self.indptr.tolist(),
+            "indices": self.indices.tolist(),
+            "data": self.data.astype(np.int64).tolist(),
+        }
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "CoPurchaseMatrix":
+        return cls(payload["version"], payload["course_ids"], payload["indptr"],
+                   payload["indices"], payload["data"])
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Офлайн-сборка ═════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+
+def _pair_counts(user_idx: np.ndarray, course_idx: np.ndarray, n_courses: int):
+    """
+    (коды пар a*n+b, число пользователей) для одного блока пользователей.
+    user_idx отсортирован; пары внутри пользователя строятся без Python-циклов.
+    """
+    _, starts, sizes = np.unique(user_idx, return_index=True, return_counts=True)
+    per_elem = np.repeat(sizes, sizes)                       # размер группы для каждого элемента
+    group_start = np.repeat(starts, sizes)                   # начало группы для каждого элемента
+    left = np.repeat(np.arange(len(user_idx)), per_elem)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(per_elem) - per_elem, per_elem)
+    right = np.repeat(group_start, per_elem) + offsets
+    a = course_idx[left]
+    b = course_idx[right]
+    mask = a != b
+    return np.unique(a[mask] * n_courses + b[mask], return_counts=True)
+
+
+def build_copurchase_matrix(db: Session, *, top_neighbors: int = TOP_NEIGHBORS) -> CoPurchaseMatrix:
+    started = time.monotonic()
+    rows = db.execute(select(users_courses.c.user_id, users_courses.c.course_id)).all()
+    version = str(int(time.time()))
+    if not rows:
+        return CoPurchaseMatrix(version, [], [0], [], [])
+
+    pairs = np.asarray(rows, dtype=np.int64)
+    _, user_idx = np.unique(pairs[:, 0], return_inverse=True)
+    course_ids, course_idx = np.unique(pairs[:, 1], return_inverse=True)
+    n_courses = len(course_ids)
+
+    order = np.argsort(user_idx, kind="stable")
+    user_idx, course_idx = user_idx[order], course_idx[order]
+
+    # Блоками пользователей — число пар растёт как Σ k², память держим ограниченной
+    codes_parts, counts_parts = [], []
+    bounds = np.searchsorted(user_idx, np.arange(0, user_idx[-1] + USERS_PER_CHUNK + 1, USERS_PER_CHUNK))
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if lo == hi:
+            continue
+        codes, counts = _pair_counts(user_idx[lo:hi], course_idx[lo:hi], n_courses)
+        codes_parts.append(codes)
+        counts_parts.append(counts)
+
+    if codes_parts:
+        codes = np.concatenate(codes_parts)
+        counts = np.concatenate(counts_parts)
+        order = np.argsort(codes, kind="stable")
+        codes, counts = codes[order], counts[order]
+        codes, first = np.unique(codes, return_index=True)
+        counts = np.add.reduceat(counts, first)
+    else:
+        codes = counts = np.zeros(0, dtype=np.int64)
+
+    src, dst = codes // n_courses, codes % n_courses
+    # Внутри строки — по убыванию count, затем по id соседа; оставляем top_neighbors
+    order = np.lexsort((dst, -counts, src))
+    src, dst, counts = src[order], dst[order], counts[order]
+    row_start = np.searchsorted(src, np.arange(n_courses))
+    rank = np.arange(len(src)) - row_start[src]
+    keep = rank < top_neighbors
+    src, dst, counts = src[keep], dst[keep], counts[keep]
+    indptr = np.searchsorted(src, np.arange(n_courses + 1))
+
+    matrix = CoPurchaseMatrix(version, course_ids, indptr, dst, counts)
+    logger.info(
+        "co-purchase matrix built: users=%s courses=%s nnz=%s in %.1f ms",
+        int(user_idx[-1]) + 1, n_courses, len(dst), (time.monotonic() - started) * 1000,
+    )
+    return matrix
+
+
+def publish_copurchase_matrix(matrix: CoPurchaseMatrix) -> None:
+    pipe = _redis().pipeline()
+    pipe.set(MATRIX_KEY, json.dumps(matrix.to_payload(), separators=(",", ":")))
+    pipe.set(MATRIX_VERSION_KEY, matrix.version)
+    pipe.execute()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ═══════════════════ Онлайн-кэш ════════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_matrix: Optional[CoPurchaseMatrix] = None
+_checked_at: Optional[float] = None
+_lock = threading.Lock()
+_rds: Optional[redis.Redis] = None
+
+
+def _redis() -> redis.Redis:
+    global _rds
+    if _rds is None:
+        _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+    return _rds
+
+
+def _is_fresh() -> bool:
+    if _checked_at is None:
+        return False
+    ttl = RELOAD_CHECK_SECONDS if _matrix is not None else ABSENT_CHECK_SECONDS
+    return time.monotonic() - _checked_at < ttl
+
+
+def get_copurchase_matrix() -> Optional[CoPurchaseMatrix]:
+    """
+    Матрица из памяти воркера; раз в RELOAD_CHECK_SECONDS сверяется версия
+    в Redis и при смене перечитывается payload. Ошибки Redis — работаем со старой.
+    Отсутствие матрицы тоже кэшируется (на ABSENT_CHECK_SECONDS).
+    """
+    global _matrix, _checked_at
+    if _is_fresh():
+        return _matrix
+    with _lock:
+        if _is_fresh():
+            return _matrix
+        try:
+            r = _redis()
+            version = r.get(MATRIX_VERSION_KEY)
+            if version and (_matrix is None or _matrix.version != version):
+                raw = r.get(MATRIX_KEY)
+                if raw:
+                    _matrix = CoPurchaseMatrix.from_payload(json.loads(raw))
+        except Exception as e:
+            logger.warning("co-purchase matrix reload failed: %s", e)
+        _checked_at = time.monotonic()
+        return _matrix
@@ -0,0 +1,176 @@
+"""
+Поисковый индекс глобального поиска (/api/search/v2) поверх снапшота каталога.
+
+Вместо `ILIKE '%q%'` по авторам/лендингам/книгам (ведущий wildcard индекс не
+использует) каждый воркер держит триграммный инвертированный индекс:
+
+  • документ — склейка искомых полей сущности в нижнем регистре
+    (курс: название, slug, имена авторов; книжный лендинг: название, slug,
+    названия книг и имена их авторов; автор: имя);
+  • кандидаты — пересечение постинг-листов триграмм запроса, затем точная
+    проверка вхождения подстроки (та же семантика, что у ILIKE '%q%');
+  • запросы короче трёх символов проверяются прямым проходом по документам.
+
+Индекс привязан к версии CatalogSnapshot. Когда снапшот патчится
+(publish_catalog_change), индекс переразбивает на триграммы только документы,
+текст которых изменился; постинг-листы копируются при записи, поэтому читатели
+старой версии не видят частично обновлённого индекса.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Set, Optional, Iterable
+
+from sqlalchemy.orm import Session
+
+from .catalog_snapshot import CatalogSnapshot, get_catalog_snapshot
+
+logger = logging.getLogger(__name__)
+
+GRAM = 3
+
+
+def _grams(text: str) -> Set[str]:
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def _doc(*parts: Optional[str]) -> str:
+    return "\0".join((p or "").casefold() for p in parts)
+
+
+class TextIndex:
+    """Триграммный индекс {id: текст}; неизменяем, update() возвращает новую версию."""
+
+    __slots__ = ("docs", "postings")
+
+    def __init__(self, docs: Dict[int, str], postings: Optional[Dict[str, Set[int]]] = None):
+        self.docs = docs
+        if postings is None:
+            postings = defaultdict(set)
+            for doc_id, text in docs.items():
+                for gram in _grams(text):
+                    postings[gram].add(doc_id)
+            postings = dict(postings)
+        self.postings = postings
+
+    def update(self, docs: Dict[int, str]) -> "TextIndex":
+        changed = [i for i, text in docs.items() if self.docs.get(i) != text]
+        removed = [i for i in self.docs if i not in docs]
+        if not changed and not removed:
+            return TextIndex(docs, self.postings)
+        if len(changed) + len(removed) > len(docs) // 2:
+            return TextIndex(docs)
+
+        postings = dict(self.postings)
+        touched: Dict[str, Set[int]] = {}
+
+        def edit(gram: str) -> Set[int]:
+            ids = touched.get(gram)
+            if ids is None:
+                ids = touched[gram] = set(postings.get(gram, ()))
+            return ids
+
+        for doc_id in itertools.chain(removed, changed):
+            old = self.docs.get(doc_id)
+            if old is not None:
+                for gram in _grams(old):
+                    edit(gram).discard(doc_id)
+        for doc_id in changed:
+            for gram in _grams(docs[doc_id]):
+                edit(gram).add(doc_id)
+        for gram, ids in touched.items():
+            if ids:
+                postings[gram] = ids
+            else:
+                postings.pop(gram, None)
+        return TextIndex(docs, postings)
+
+    def match(self, needle: str, scope: Optional[Iterable[int]] = None) -> Set[int]:
+        """id документов, содержащих needle (уже casefold); scope — предварительный отбор."""
+        if not needle:
+            return set()
+        if len(needle) < GRAM:
+            pool = self.docs if scope is None else scope
+            return {i for i in pool if needle in self.docs.get(i, "")}
+        lists = []
+        for gram in _grams(needle):
+            ids = self.postings.get(gram)
+            if not ids:
+                return set()
+            lists.append(ids)
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for ids in lists[1:]:
+            candidates &= ids
+            if not candidates:
+                return candidates
+        if scope is not None:
+            candidates &= set(scope)
+        docs = self.docs
+        return {i for i in candidates if needle in docs[i]}
+
+
+class SearchIndex:
+    """Индексы поиска для одной версии снапшота каталога."""
+
+    def __init__(self, snapshot: CatalogSnapshot, previous: Optional["SearchIndex"] = None):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+
+        authors = snapshot.authors
+        books = snapshot.books
+
+        author_docs = {a.id: _doc(a.name) for a in authors.values()}
+
+        landing_docs: Dict[int, str] = {}
+        for rec in snapshot.landings.values():
+            names = [authors[i].name for i in rec.author_ids if i in authors]
+            landing_docs[rec.id] = _doc(rec.landing_name, rec.page_name, *names)
+
+        # Книжный лендинг без книг в поиск не попадает (в SQL-версии был INNER JOIN books)
+        book_landing_docs: Dict[int, str] = {}
+        for rec in snapshot.book_landings.values():
+            rec_books = [books[i] for i in rec.book_ids if i in books]
+            if not rec_books:
+                continue
+            parts = [rec.landing_name, rec.page_name]
+            parts.extend(b.title for b in rec_books)
+            parts.extend(authors[i].name for i in rec.author_ids if i in authors)
+            book_landing_docs[rec.id] = _doc(*parts)
+
+        if previous is None:
+            self.authors = TextIndex(author_docs)
+            self.landings = TextIndex(landing_docs)
+            self.book_landings = TextIndex(book_landing_docs)
+        else:
+            self.authors = previous.authors.update(author_docs)
+            self.landings = previous.landings.update(landing_docs)
+            self.book_landings = previous.book_landings.update(book_landing_docs)
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index(db: Session) -> SearchIndex:
+    """Индекс для актуальной версии снапшота; перестраивается инкрементально."""
+    global _index
+    snapshot = get_catalog_snapshot(db)
+    index = _index
+    if index is not None and index.version == snapshot.version:
+        return index
+    with _index_lock:
+        index = _index
+        if index is not None and index.version >= snapshot.version:
+            return index
+        started = time.monotonic()
+        _index = SearchIndex(snapshot, previous=index)
+        logger.info(
+            "search index v%s built (%s) in %.1f ms",
+            snapshot.version, "incremental" if index is not None else "full",
+            (time.monotonic() - started) * 1000,
+        )
+        return _index
@@ -1,18 +1,21 @@
-from typing import List, Optional, Dict, Any
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import or_
+from typing import List, Optional, Dict, Any, Tuple
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+import base64
+import heapq
 import math
 
-from ..models.models_v2 import Author, Landing, BookLanding, Book
+from .catalog_snapshot import AuthorRecord
+from .search_index import get_search_index
 
 # === Настройки скоринга ===
 TITLE_WEIGHT = 1.0   # видимое название
 SLUG_WEIGHT  = 0.35  # slug/page_name имеет пониженный вес
 
-# === Утилиты ===
-def _ilike(s: str) -> str:
-    return f"%{s.strip()}%"
+DEFAULT_LIMIT = 50
+TYPE_RANK = {"author": 0, "landing": 1, "book_landing": 2}
 
+# === Утилиты ===
 def _norm(s: Optional[str]) -> str:
     return (s or "").strip().lower()
 
@@ -30,26 +33,6 @@ def clip(text: str | None, limit: int = 100, keep_words: bool = True, ellipsis:
     # жёсткая обрезка посимвольно
     return text[: limit - len(ellipsis)] + ellipsis
 
-def _first_book(bl):
-    """Вернёт первую связанную книгу у BookLanding, либо None."""
-    try:
-        bs = getattr(bl, "books", None) or []
-        return bs[0] if bs else None
-    except Exception:
-        return None
-
-def safe_price(v) -> float:
-    """Парсинг цены в float; нечисловые значения -> +inf."""
-    try:
-        if v is None:
-            return float("inf")
-        if isinstance(v, (int, float)):
-            return float(v)
-        s = str(v).strip().replace(",", ".")
-        return float(s)
-    except Exception:
-        return float("inf")
-
 def _text_score(field: Optional[str], q: str, tokens: List[str]) -> int:
     """Скоринг текста: exact > startswith > contains + бонусы за токены."""
     if not field:
@@ -67,81 +50,27 @@ def _text_score(field: Optional[str], q: str, tokens: List[str]) -> int:
             base += 8
     return base
 
-def _authors_score(authors: List["Author"], q: str, tokens: List[str], scale: float = 1.0) -> int:
+def _authors_score(authors: List[AuthorRecord], q: str, tokens: List[str], scale: float = 1.0) -> int:
     sc = 0
     for a in authors or []:
         sc += int(_text_score(a.name, q, tokens) * scale)
     return sc
 
-def _author_content_counts_like_detail(a: Author, langs: Optional[List[str]]) -> tuple[int, int]:
-    """
-    Подсчёт (courses_count, books_count) по логике из get_author_full_detail:
-    - landings: убираем скрытые, применяем фильтр языков;
-      считаем min цену по каждому course_id, оставляем лендинги,
-      у которых цена не хуже min для всех их курсов; собираем уникальные course_id.
-    - books: считаем книги, у которых есть хотя бы один видимый book_landing
-      нужного языка с конечной (числовой) ценой.
-    """
-    # --- 1) ЛЕНДИНГИ АВТОРА (курсы) ---
-    visible_landings: List[Landing] = []
-    for l in (a.landings or []):
-        if l.is_hidden:
-            continue
-        if langs and (l.language or "").upper() not in langs:
-            continue
-        visible_landings.append(l)
-
-    # min цена по каждому course_id
-    min_price_by_course: Dict[int, float] = {}
-    for l in visible_landings:
-        price = safe_price(l.new_price)
-        for c in (l.courses or []):
-            cid = c.id
-            prev = min_price_by_course.get(cid, float("inf"))
-            if price < prev:
-                min_price_by_course[cid] = price
-
-    # оставляем лендинги, цена которых не выше min для любого их курса
-    kept_landings: List[Landing] = []
-    for l in visible_landings:
-        price = safe_price(l.new_price)
-        # если у лендинга есть хоть один курс с более дешёвым лендингом — выкидываем
-        if any(price > min_price_by_course.get(c.id, float("inf")) for c in (l.courses or [])):
-            continue
-        kept_landings.append(l)
-
-    # уникальные course_id из оставшихся лендингов
-    course_ids = set()
-    for l in kept_landings:
-        for c in (l.courses or []):
-            if getattr(c, "id", None) is not None:
-                course_ids.add(c.id)
-    courses_count = len(course_ids)
-
-    # --- 2) КНИГИ АВТОРА ---
-    books_count = 0
-    for b in (getattr(a, "books", []) or []):
-        # видимые книжные лендинги нужного языка
-        visible_bl = []
-        for bl in (b.landings or []):
-            if bl.is_hidden:
-                continue
-            if langs and (bl.language or "").upper() not in langs:
-                continue
-            visible_bl.append(bl)
-
-        if not visible_bl:
-            continue
+def _author_brief(a: AuthorRecord) -> Dict[str, Any]:
+    return {"id": a.id, "name": a.name, "photo": a.photo, "language": a.language}
 
-        # минимальная цена по книге среди видимых лендингов
-        price_min = min(safe_price(bl.new_price) for bl in visible_bl)
-        if price_min == float("inf"):
-            # у книги нет валидной цены ни на одном видимом лендинге — не считаем такую книгу
-            continue
+# === Курсор ===
+def _encode_cursor(key: Tuple[int, int, int]) -> str:
+    raw = ":".join(str(x) for x in key).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-        books_count += 1
-
-    return courses_count, books_count
+def _decode_cursor(cursor: str) -> Tuple[int, int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        neg_score, rank, item_id = (int(x) for x in raw.split(":"))
+        return neg_score, rank, item_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 # === Основная функция ===
 def search_everything(
@@ -150,222 +79,166 @@ def search_everything(
     q: str,
     types: Optional[List[str]] = None,        # ["authors", "landings", "book_landings"]
     languages: Optional[List[str]] = None,    # ["EN","RU","ES","PT","AR","IT"]
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Глобальный поиск с «умом»:
-    - Ищет авторов/курсы(лендинги)/книжные лендинги.
+    - Ищет авторов/курсы(лендинги)/книжные лендинги по in-process индексу
+      (search_index), семантика совпадения — как у ILIKE '%q%'.
     - Если найден автор, добавляет его курсы и книжные лендинги.
     - Фильтр языков влияет на счётчики и выдачу.
     - Фильтр типов влияет ТОЛЬКО на выдачу (счётчики — без учёта типов).
-    - Без лимита: возвращаем все результаты (в трёх массивах).
+    - Выдача — top-k по общему рейтингу (score, тип, id) с курсорной пагинацией:
+      next_cursor передаётся в следующий запрос.
     - Снижен вес совпадения по slug (page_name).
     """
-    q_like = _ilike(q)
     qn = _norm(q)
+    needle = q.strip().casefold()
     tokens = [t for t in qn.split() if t]
 
     langs: Optional[List[str]] = None
     if languages:
         langs = [x.strip().upper() for x in languages if x and x.strip()]
 
-    # --- 1) Поиск базовых совпадений ---
-    # Авторы — с предзагрузкой нужных связей, чтобы корректно посчитать courses_count/books_count
-    authors_q = (
-        db.query(Author)
-          .options(
-              selectinload(Author.landings).selectinload(Landing.courses),
-              selectinload(Author.books).selectinload(Book.landings),
-          )
-          .filter(Author.name.ilike(q_like))
-    )
-    if langs:
-        authors_q = authors_q.filter(Author.language.in_(langs))
-    authors = authors_q.all()
+    index = get_search_index(db)
+    snapshot = index.snapshot
+    authors_by_id = snapshot.authors
+    books_by_id = snapshot.books
 
-    landings_q = (
-        db.query(Landing)
-          .outerjoin(Landing.authors)
-          .filter(Landing.is_hidden.is_(False))
-          .filter(
-              or_(
-                  Landing.landing_name.ilike(q_like),
-                  Landing.page_name.ilike(q_like),   # slug в фильтре остаётся; вес режем в скоринге
-                  Author.name.ilike(q_like),
-              )
-          )
-          .distinct()
-    )
+    # --- 1) Поиск базовых совпадений ---
+    author_ids = index.authors.match(needle)
     if langs:
-        landings_q = landings_q.filter(Landing.language.in_(langs))
-    landings = landings_q.all()
+        author_ids = {i for i in author_ids if authors_by_id[i].language in langs}
 
-    book_landings_q = (
-        db.query(BookLanding)
-        .join(BookLanding.books)  # <-- books (многие-к-многим / один-ко-многим)
-        .outerjoin(Book.authors)
-        .filter(BookLanding.is_hidden.is_(False))
-        .filter(
-            or_(
-                BookLanding.landing_name.ilike(q_like),
-                BookLanding.page_name.ilike(q_like),
-                Book.title.ilike(q_like),  # по названию книги
-                Author.name.ilike(q_like),  # по авторам книги
-            )
-        )
-        .distinct()
-    )
-    if langs:
-        book_landings_q = book_landings_q.filter(BookLanding.language.in_(langs))
-    book_landings = book_landings_q.all()
+    landing_ids = index.landings.match(needle)
+    book_landing_ids = index.book_landings.match(needle)
 
     # --- 2) «Ум»: если нашли авторов — доклеиваем их контент ---
-    if authors:
-        author_ids = [a.id for a in authors]
-
-        extra_landings_q = (
-            db.query(Landing)
-              .join(Landing.authors)
-              .filter(Landing.is_hidden.is_(False), Author.id.in_(author_ids))
-              .distinct()
-        )
-        if langs:
-            extra_landings_q = extra_landings_q.filter(Landing.language.in_(langs))
-        extra_landings = extra_landings_q.all()
-
-        extra_book_landings_q = (
-            db.query(BookLanding)
-            .join(BookLanding.books)
-            .join(Book.authors)
-            .filter(BookLanding.is_hidden.is_(False), Author.id.in_(author_ids))
-            .distinct()
-        )
-        if langs:
-            extra_book_landings_q = extra_book_landings_q.filter(BookLanding.language.in_(langs))
-        extra_book_landings = extra_book_landings_q.all()
-
-        # дедупликация по id
-        l_ids = {l.id for l in landings}
-        for l in extra_landings:
-            if l.id not in l_ids:
-                landings.append(l)
-        bl_ids = {bl.id for bl in book_landings}
-        for bl in extra_book_landings:
-            if bl.id not in bl_ids:
-                book_landings.append(bl)
-
-    # --- 3) Нормализуем, считаем счётчики (без учёта фильтра типов) и скорим ---
-    scored_items: List[Dict[str, Any]] = []
-
-    # Авторы — добавляем courses_count / books_count по «детальной» логике
-    for a in authors:
-        score = _text_score(a.name, qn, tokens)
-        courses_count, books_count = _author_content_counts_like_detail(a, langs)
-
-        scored_items.append({
-            "type": "author",
-            "id": a.id,
-            "name": a.name,
-            "photo": a.photo,
-            "language": a.language,
-            "description": clip(a.description, 100),
-            "courses_count": courses_count,
-            "books_count": books_count,
-            "_score": score,
-            "_tie": (0, a.id),
-        })
-
-    # Курсы (лендинги) — пониженный вес slug
-    for l in landings:
-        title_s = _text_score(l.landing_name, qn, tokens)
-        slug_s  = _text_score(l.page_name, qn, tokens)
-        score   = int(TITLE_WEIGHT * title_s + SLUG_WEIGHT * slug_s)
-        score  += _authors_score(list(l.authors or []), qn, tokens, scale=0.8)
-        try:
-            score += int(math.log10(max(int(getattr(l, "sales_count", 0) or 0), 1)))
-        except Exception:
-            pass
-        scored_items.append({
-            "type": "landing",
-            "id": l.id,
-            "landing_name": l.landing_name,
-            "page_name": l.page_name,
-            "preview_photo": l.preview_photo,
-            "old_price": l.old_price,
-            "new_price": l.new_price,
-            "language": l.language,
-            "authors": [{"id": au.id, "name": au.name, "photo": au.photo, "language": au.language} for au in (l.authors or [])],
-            "_score": score,
-            "_tie": (1, l.id),
-        })
+    for author_id in author_ids:
+        landing_ids |= snapshot.landing_by_author.get(author_id, set())
+        book_landing_ids |= {
+            i for i in snapshot.book_landing_by_author.get(author_id, ())
+            if i in index.book_landings.docs
+        }
 
-    # Книжные лендинги — пониженный вес slug, приоритет видимых названий
-    for bl in book_landings:
-        b = _first_book(bl)
-
-        title_s = _text_score(bl.landing_name, qn, tokens)
-        book_title_s = _text_score(b.title if b else None, qn, tokens)
-        slug_s = _text_score(bl.page_name, qn, tokens)
-        score = max(title_s, book_title_s) + int(SLUG_WEIGHT * slug_s)
-
-        book_authors = list((b.authors if b else []) or [])
-        scored_items.append({
-            "type": "book_landing",
-            "id": bl.id,
-            "landing_name": bl.landing_name,
-            "page_name": bl.page_name,
-            "preview_photo": b.cover_url,
-            "old_price": bl.old_price,
-            "new_price": bl.new_price,
-            "language": bl.language,
-            "book_title": b.title if b else None,
-            "cover_url": b.cover_url if b else None,
-            "authors": [{"id": au.id, "name": au.name, "photo": au.photo, "language": au.language} for au in
-                        book_authors],
-            "_score": score,
-            "_tie": (2, bl.id),
-        })
+    if langs:
+        landing_ids = {i for i in landing_ids if snapshot.landings[i].language in langs}
+        book_landing_ids = {i for i in book_landing_ids if snapshot.book_landings[i].language in langs}
 
     # Счётчики (зависят только от q и languages)
     counts_all = {
-        "authors":      sum(1 for it in scored_items if it["type"] == "author"),
-        "landings":     sum(1 for it in scored_items if it["type"] == "landing"),
-        "book_landings":sum(1 for it in scored_items if it["type"] == "book_landing"),
+        "authors": len(author_ids),
+        "landings": len(landing_ids),
+        "book_landings": len(book_landing_ids),
     }
     total_all = sum(counts_all.values())
 
-    # --- 4) Фильтр по типам влияет только на выдачу, не на counts ---
-    filtered_items = scored_items
+    # --- 3) Фильтр по типам влияет только на выдачу, не на counts ---
+    tset = {"author", "landing", "book_landing"}
     if types:
-        tset = {t.lower() for t in types}
         type_map = {"authors": "author", "landings": "landing", "book_landings": "book_landing"}
-        tset = {type_map.get(t, t) for t in tset}
-        filtered_items = [it for it in scored_items if it["type"] in tset]
+        tset = {type_map.get(t.lower(), t.lower()) for t in types}
+
+    # --- 4) Скоринг: ключ рейтинга (-score, тип, id) ---
+    keys: List[Tuple[int, int, int]] = []
 
-    # --- 5) Сортировка и раскладка по массивам, БЕЗ ЛИМИТА ---
-    filtered_items.sort(key=lambda it: (-it["_score"], it["_tie"]))
+    if "author" in tset:
+        for author_id in author_ids:
+            score = _text_score(authors_by_id[author_id].name, qn, tokens)
+            keys.append((-score, TYPE_RANK["author"], author_id))
 
+    # Курсы (лендинги) — пониженный вес slug
+    if "landing" in tset:
+        for landing_id in landing_ids:
+            l = snapshot.landings[landing_id]
+            title_s = _text_score(l.landing_name, qn, tokens)
+            slug_s  = _text_score(l.page_name, qn, tokens)
+            score   = int(TITLE_WEIGHT * title_s + SLUG_WEIGHT * slug_s)
+            score  += _authors_score([authors_by_id[i] for i in l.author_ids if i in authors_by_id], qn, tokens, scale=0.8)
+            try:
+                score += int(math.log10(max(int(l.sales_count or 0), 1)))
+            except Exception:
+                pass
+            keys.append((-score, TYPE_RANK["landing"], landing_id))
+
+    # Книжные лендинги — пониженный вес slug, приоритет видимых названий
+    if "book_landing" in tset:
+        for bl_id in book_landing_ids:
+            bl = snapshot.book_landings[bl_id]
+            b = next((books_by_id[i] for i in bl.book_ids if i in books_by_id), None)
+            title_s = _text_score(bl.landing_name, qn, tokens)
+            book_title_s = _text_score(b.title if b else None, qn, tokens)
+            slug_s = _text_score(bl.page_name, qn, tokens)
+            score = max(title_s, book_title_s) + int(SLUG_WEIGHT * slug_s)
+            keys.append((-score, TYPE_RANK["book_landing"], bl_id))
+
+    # --- 5) Top-k после курсора ---
+    if cursor:
+        after = _decode_cursor(cursor)
+        keys = [k for k in keys if k > after]
+    page = heapq.nsmallest(limit + 1, keys)
+    truncated = len(page) > limit
+    page = page[:limit]
+
+    # --- 6) Сериализация только отданной страницы ---
     authors_out: List[Dict[str, Any]] = []
     landings_out: List[Dict[str, Any]] = []
     book_landings_out: List[Dict[str, Any]] = []
 
-    def _strip_private(it: Dict[str, Any]) -> Dict[str, Any]:
-        return {k: v for k, v in it.items() if not k.startswith("_")}
-
-    for it in filtered_items:
-        if it["type"] == "author":
-            authors_out.append(_strip_private(it))
-        elif it["type"] == "landing":
-            landings_out.append(_strip_private(it))
+    for _, rank, item_id in page:
+        if rank == TYPE_RANK["author"]:
+            a = authors_by_id[item_id]
+            # Счётчики предпосчитаны в снапшоте (логика get_author_full_detail)
+            counters = snapshot.author_counters(item_id, langs)
+            authors_out.append({
+                "type": "author",
+                "id": a.id,
+                "name": a.name,
+                "photo": a.photo,
+                "language": a.language,
+                "description": clip(a.description, 100),
+                "courses_count": counters.cheapest_courses,
+                "books_count": counters.priced_books,
+            })
+        elif rank == TYPE_RANK["landing"]:
+            l = snapshot.landings[item_id]
+            landings_out.append({
+                "type": "landing",
+                "id": l.id,
+                "landing_name": l.landing_name,
+                "page_name": l.page_name,
+                "preview_photo": l.preview_photo,
+                "old_price": l.old_price,
+                "new_price": l.new_price,
+                "language": l.language,
+                "authors": [_author_brief(authors_by_id[i]) for i in l.author_ids if i in authors_by_id],
+            })
         else:
-            book_landings_out.append(_strip_private(it))
+            bl = snapshot.book_landings[item_id]
+            b = next((books_by_id[i] for i in bl.book_ids if i in books_by_id), None)
+            book_authors = [authors_by_id[i] for i in (b.author_ids if b else ()) if i in authors_by_id]
+            book_landings_out.append({
+                "type": "book_landing",
+                "id": bl.id,
+                "landing_name": bl.landing_name,
+                "page_name": bl.page_name,
+                "preview_photo": b.cover_url if b else None,
+                "old_price": bl.old_price,
+                "new_price": bl.new_price,
+                "language": bl.language,
+                "book_title": b.title if b else None,
+                "cover_url": b.cover_url if b else None,
+                "authors": [_author_brief(au) for au in book_authors],
+            })
 
-    returned = len(filtered_items)   # отдаём всё
     return {
         "counts": counts_all,        # только язык (и q), НЕ зависят от types
         "total": total_all,
-        "returned": returned,
-        "limit": returned,           # для совместимости со схемой
-        "truncated": False,
+        "returned": len(page),
+        "limit": limit,
+        "truncated": truncated,
+        "next_cursor": _encode_cursor(page[-1]) if truncated else None,
         "authors": authors_out,
         "landings": landings_out,
         "book_landings": book_landings_out,
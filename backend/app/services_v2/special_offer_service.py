@@ -4,7 +4,7 @@ import random
 from collections import Counter
 from typing import List, Optional, Tuple
 
-from sqlalchemy import func, case, Float, cast
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session, selectinload
 
 from .user_service import add_partial_course_to_user
@@ -35,7 +35,7 @@ def _cheapest_landings_for_purchased(db: Session, user: User) -> list[Landing]:
             Landing.is_hidden.is_(False),
         )
         .options(selectinload(Landing.tags))
-        .order_by(cast(Landing.new_price, Float))
+        .order_by(Landing.new_price_num.is_(None), Landing.new_price_num)
         .all()
     )
 
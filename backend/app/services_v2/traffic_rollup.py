@@ -0,0 +1,535 @@
+"""
+Почасовые роллапы трафика и покупок лендингов (курсовых и книжных).
+
+Дашборды /analytics и ad_control раньше на каждый запрос делали GROUP BY /
+COUNT(*) по сырым landing_visits, book_landing_visits, ad_visits,
+book_ad_visits и purchases. Теперь:
+
+• traffic_hourly (kind, target_id, bucket) — счётчики за час:
+  visits, ad_visits (from_ad), ad_hits (track-ad), purchases, ad_purchases, amount;
+• traffic_totals (kind, target_id) — те же счётчики за всё время + first_visit_at;
+• traffic_rollup_state (source) — high-water mark: строки источника с
+  id <= last_id уже учтены; seen_id / seen_at — максимальный id, замеченный
+  предыдущим refresh, и когда он был замечен.
+
+refresh() (задача tasks.traffic_rollup.refresh_traffic_rollups, раз в минуту)
+берёт строки id > last_id и прибавляет их к бакетам в той же транзакции, где
+сдвигается last_id, — повтор после сбоя не задвоит счётчики. Граница — не
+текущий MAX(id), а seen_id, замеченный не меньше SAFETY_LAG назад: транзакции
+с меньшими id к этому моменту закоммичены. Время события (visited_at) для
+этого не годится — визиты пишутся из буфера (visit_ingest) пачками, и ts
+строки может быть намного старше момента вставки.
+
+Чтение (aggregate / series / totals / by_target) = бакеты + «хвост» — сырые
+строки с id > last_id (диапазон по PK, обычно единицы строк), поэтому ответы
+точные и без ожидания следующего refresh. Стоимость — O(бакетов), а не O(событий).
+Бакеты берутся только за целые часы окна; неполные крайние часы (окно не с
+начала часа) досчитываются по сырым строкам — не больше часа на край.
+
+rebuild(since) пересчитывает бакеты с начала часа since из сырых таблиц —
+ночная сверка последних дней (удалённые покупки, поздние коммиты);
+first_visit_at при этом уточняется только по пересчитанному диапазону id.
+rebuild(None) — полный пересчёт истории.
+Язык лендинга в роллап не пишется: при чтении он берётся из landings /
+book_landings, как и раньше (JOIN по текущему языку лендинга).
+"""
+
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, case, func, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from ..models.models_v2 import (
+    AdVisit, BookAdVisit, BookLandingVisit, LandingVisit, Purchase,
+    TrafficHourly, TrafficRollupState, TrafficTotal,
+)
+
+logger = logging.getLogger(__name__)
+
+KIND_LANDING = "landing"
+KIND_BOOK_LANDING = "book_landing"
+
+METRICS = ("visits", "ad_visits", "ad_hits", "purchases", "ad_purchases", "amount")
+
+MAX_ROWS = int(os.getenv("TRAFFIC_ROLLUP_MAX_ROWS", "200000"))    # id источника за один refresh
+# сколько должен «отлежаться» замеченный MAX(id), прежде чем refresh его учтёт
+SAFETY_LAG = timedelta(seconds=int(os.getenv("TRAFFIC_ROLLUP_LAG_SEC", "30")))
+REBUILD_ID_MARGIN = timedelta(days=1)   # id ~ монотонны по времени; запас на визиты из буфера
+
+
+def _flag_sum(col):
+    return func.sum(case((col.is_(True), 1), else_=0))
+
+
+class _Source:
+    """Исходная таблица: какие счётчики она даёт и к каким лендингам относится."""
+
+    def __init__(self, name, model, ts_col, targets, metrics, first_visit=False):
+        self.name = name
+        self.model = model
+        self.ts_col = ts_col
+        self.targets = targets          # [(kind, колонка id лендинга)]
+        self.metrics = metrics          # [(метрика, агрегат)]
+        self.first_visit = first_visit  # источник визитов → traffic_totals.first_visit_at
+
+
+_SOURCES: List[_Source] = [
+    _Source(
+        "landing_visits", LandingVisit, LandingVisit.visited_at,
+        [(KIND_LANDING, LandingVisit.landing_id)],
+        [("visits", func.count()), ("ad_visits", _flag_sum(LandingVisit.from_ad))],
+        first_visit=True,
+    ),
+    _Source(
+        "book_landing_visits", BookLandingVisit, BookLandingVisit.visited_at,
+        [(KIND_BOOK_LANDING, BookLandingVisit.book_landing_id)],
+        [("visits", func.count()), ("ad_visits", _flag_sum(BookLandingVisit.from_ad))],
+        first_visit=True,
+    ),
+    _Source(
+        "ad_visits", AdVisit, AdVisit.visited_at,
+        [(KIND_LANDING, AdVisit.landing_id)],
+        [("ad_hits", func.count())],
+    ),
+    _Source(
+        "book_ad_visits", BookAdVisit, BookAdVisit.visited_at,
+        [(KIND_BOOK_LANDING, BookAdVisit.book_landing_id)],
+        [("ad_hits", func.count())],
+    ),
+    _Source(
+        "purchases", Purchase, Purchase.created_at,
+        [(KIND_LANDING, Purchase.landing_id), (KIND_BOOK_LANDING, Purchase.book_landing_id)],
+        [
+            ("purchases", func.count()),
+            ("ad_purchases", _flag_sum(Purchase.from_ad)),
+            ("amount", func.coalesce(func.sum(Purchase.amount), 0)),
+        ],
+    ),
+]
+
+
+# ═══════════════════════════ бакеты ═══════════════════════════
+
+def bucket_expr(ts_col, granularity: str):
+    if granularity == "day":
+        return func.date(ts_col)  # 'YYYY-MM-DD'
+    return func.date_format(ts_col, '%Y-%m-%d %H:00:00')  # 'YYYY-MM-DD HH:00:00'
+
+
+def coerce_bucket(v, granularity: str) -> datetime:
+    if isinstance(v, datetime):
+        return v.replace(minute=0, second=0, microsecond=0) if granularity == "hour" \
+            else v.replace(hour=0, minute=0, second=0, microsecond=0)
+    if isinstance(v, date):
+        return datetime(v.year, v.month, v.day)
+    # MySQL DATE_FORMAT -> str
+    if len(v) == 19:
+        return datetime.strptime(v, "%Y-%m-%d %H:%M:%S")
+    return datetime.strptime(v, "%Y-%m-%d")
+
+
+def _floor_hour(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(dt: datetime) -> datetime:
+    floor = _floor_hour(dt)
+    return floor if floor == dt else floor + timedelta(hours=1)
+
+
+# ═══════════════════════════ наполнение ═══════════════════════════
+
+def _lock_states(db: Session) -> Dict[str, TrafficRollupState]:
+    """Строки high-water mark под FOR UPDATE: refresh/rebuild идут по одному."""
+    names = [s.name for s in _SOURCES]
+    db.execute(
+        mysql_insert(TrafficRollupState.__table__).prefix_with("IGNORE"),
+        [{"source": n, "last_id": 0} for n in names],
+    )
+    rows = (
+        db.query(TrafficRollupState)
+          .filter(TrafficRollupState.source.in_(names))
+          .order_by(TrafficRollupState.source)
+          .with_for_update()
+          .all()
+    )
+    return {r.source: r for r in rows}
+
+
+def _roll_range(db: Session, src: _Source, lo: int, hi: int, *, since: Optional[datetime] = None,
+                totals: bool = True) -> int:
+    """Прибавляет строки src с id в (lo, hi] (и ts >= since) к бакетам. Возвращает число бакетов."""
+    touched = 0
+    hour = bucket_expr(src.ts_col, "hour").label("b")
+    aggs = [expr.label(name) for name, expr in src.metrics]
+    if src.first_visit:
+        aggs.append(func.min(src.ts_col).label("first_ts"))
+
+    for kind, target_col in src.targets:
+        q = (
+            db.query(target_col.label("tid"), hour, *aggs)
+              .filter(src.model.id > lo, src.model.id <= hi, target_col.isnot(None))
+        )
+        if since is not None:
+            q = q.filter(src.ts_col >= since)
+        rows = q.group_by(target_col, hour).all()
+        if not rows:
+            continue
+
+        names = [name for name, _ in src.metrics]
+        hourly = [
+            {"kind": kind, "target_id": r.tid, "bucket": coerce_bucket(r.b, "hour"),
+             **{n: getattr(r, n) or 0 for n in names}}
+            for r in rows
+        ]
+        stmt = mysql_insert(TrafficHourly.__table__)
+        stmt = stmt.on_duplicate_key_update({n: getattr(TrafficHourly, n) + stmt.inserted[n] for n in names})
+        db.execute(stmt, hourly)
+        touched += len(hourly)
+
+        if not totals:
+            continue
+        per_target: Dict[int, dict] = {}
+        for r in rows:
+            t = per_target.setdefault(r.tid, {"kind": kind, "target_id": r.tid, **dict.fromkeys(names, 0)})
+            for n in names:
+                t[n] += getattr(r, n) or 0
+            if src.first_visit:
+                prev = t.get("first_visit_at")
+                t["first_visit_at"] = r.first_ts if prev is None or r.first_ts < prev else prev
+        stmt = mysql_insert(TrafficTotal.__table__)
+        update = {n: getattr(TrafficTotal, n) + stmt.inserted[n] for n in names}
+        if src.first_visit:
+            update["first_visit_at"] = func.least(
+                func.coalesce(TrafficTotal.first_visit_at, stmt.inserted.first_visit_at),
+                stmt.inserted.first_visit_at,
+            )
+        db.execute(stmt.on_duplicate_key_update(update), list(per_target.values()))
+    return touched
+
+
+def refresh(db: Session, *, max_rows: int = MAX_ROWS) -> dict:
+    """
+    Учитывает новые строки всех источников (не больше max_rows id на источник).
+    Коммитит сам. Возвращает {source: {"from", "to", "buckets"}}.
+    """
+    now = datetime.utcnow()
+    stats: dict = {}
+    try:
+        states = _lock_states(db)
+        for src in _SOURCES:
+            state = states[src.name]
+            lo = int(state.last_id or 0)
+            seen = int(state.seen_id or 0)
+            if seen > lo and state.seen_at is not None and state.seen_at <= now - SAFETY_LAG:
+                hi = min(seen, lo + max_rows)
+                buckets = _roll_range(db, src, lo, hi)
+                state.last_id = hi
+                stats[src.name] = {"from": lo, "to": hi, "buckets": buckets}
+                lo = hi
+            if seen <= lo:
+                # замеченное учтено — запоминаем новый максимум, учтём его в следующий раз
+                top = db.query(func.max(src.model.id)).scalar() or 0
+                if top > lo:
+                    state.seen_id, state.seen_at = top, now
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return stats
+
+
+def _first_id_since(db: Session, src: _Source, since: datetime, hi: int) -> int:
+    """Бинарный поиск по PK: id, начиная с которого строки (почти наверняка) не старше since."""
+    target = since - REBUILD_ID_MARGIN
+    lo_id, hi_id = 0, hi
+    while lo_id < hi_id:
+        mid = (lo_id + hi_id) // 2
+        row = (
+            db.query(src.model.id, src.ts_col)
+              .filter(src.model.id >= mid)
+              .order_by(src.model.id)
+              .first()
+        )
+        if row is None or row[1] >= target:
+            hi_id = mid
+        else:
+            lo_id = row[0] + 1
+    return max(lo_id - 1, 0)
+
+
+def rebuild(db: Session, since: Optional[datetime] = None, *, chunk: int = MAX_ROWS) -> dict:
+    """
+    Пересчитывает бакеты с начала часа since (None — всю историю) и traffic_totals.
+    since задан — учитываются строки до текущего last_id (дальше продолжит refresh);
+    полный пересчёт сдвигает last_id до свежих строк. Коммитит сам.
+    """
+    since = _floor_hour(since) if since is not None else None
+    now = datetime.utcnow()
+    stats: dict = {}
+    ranges: Dict[str, Tuple[int, int]] = {}
+    try:
+        states = _lock_states(db)
+
+        q = db.query(TrafficHourly)
+        if since is not None:
+            q = q.filter(TrafficHourly.bucket >= since)
+        q.delete(synchronize_session=False)
+
+        for src in _SOURCES:
+            state = states[src.name]
+            if since is None:
+                # незакоммиченные соседи последних id, если были, досчитает ночная сверка
+                hi = max(db.query(func.max(src.model.id)).scalar() or 0, int(state.last_id or 0))
+                lo = 0
+                state.seen_id, state.seen_at = hi, now
+            else:
+                hi = int(state.last_id or 0)
+                lo = _first_id_since(db, src, since, hi) if hi else 0
+            buckets = 0
+            for start in range(lo, hi, chunk):
+                buckets += _roll_range(db, src, start, min(start + chunk, hi), since=since, totals=False)
+            state.last_id = hi
+            ranges[src.name] = (lo, hi)
+            stats[src.name] = {"from": lo, "to": hi, "buckets": buckets}
+
+        _rebuild_totals(db, None if since is None else ranges)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return stats
+
+
+def _rebuild_totals(db: Session, ranges: Optional[Dict[str, Tuple[int, int]]] = None) -> None:
+    """
+    traffic_totals = суммы почасовых бакетов; first_visit_at — MIN по сырым визитам.
+    ranges=None — MIN по всей таблице визитов (полный пересчёт); иначе прежний
+    first_visit_at сохраняется и уточняется только строками из (lo, hi] источника.
+    """
+    kept: Dict[Tuple[str, int], datetime] = {}
+    if ranges is not None:
+        kept = {
+            (kind, tid): first
+            for kind, tid, first in db.query(TrafficTotal.kind, TrafficTotal.target_id, TrafficTotal.first_visit_at)
+                                      .filter(TrafficTotal.first_visit_at.isnot(None))
+        }
+    db.query(TrafficTotal).delete(synchronize_session=False)
+    sums = [func.sum(getattr(TrafficHourly, n)) for n in METRICS]
+    cols = [TrafficTotal.kind, TrafficTotal.target_id] + [getattr(TrafficTotal, n) for n in METRICS]
+    sel = (
+        db.query(TrafficHourly.kind, TrafficHourly.target_id, *sums)
+          .group_by(TrafficHourly.kind, TrafficHourly.target_id)
+          .statement
+    )
+    db.execute(TrafficTotal.__table__.insert().from_select(cols, sel))
+
+    firsts = dict(kept)
+    for src in _SOURCES:
+        if not src.first_visit:
+            continue
+        for kind, target_col in src.targets:
+            q = db.query(target_col, func.min(src.ts_col)).filter(target_col.isnot(None))
+            if ranges is not None:
+                lo, hi = ranges.get(src.name, (0, 0))
+                if lo >= hi:
+                    continue
+                q = q.filter(src.model.id > lo, src.model.id <= hi)
+            for tid, first in q.group_by(target_col).all():
+                if first is not None and ((kind, tid) not in firsts or first < firsts[(kind, tid)]):
+                    firsts[(kind, tid)] = first
+
+    t = TrafficTotal.__table__
+    by_kind: Dict[str, List[dict]] = defaultdict(list)
+    for (kind, tid), first in firsts.items():
+        by_kind[kind].append({"tid": tid, "fv": first})
+    for kind, params in by_kind.items():
+        db.execute(
+            t.update()
+             .where(t.c.kind == kind, t.c.target_id == bindparam("tid"))
+             .values(first_visit_at=bindparam("fv")),
+            params,
+        )
+
+
+# ═══════════════════════════ чтение ═══════════════════════════
+
+def _last_ids(db: Session) -> Dict[str, int]:
+    return {src: int(last_id or 0) for src, last_id in db.query(TrafficRollupState.source, TrafficRollupState.last_id)}
+
+
+def _target_clause(col, targets):
+    if targets is None:
+        return None
+    if isinstance(targets, int):
+        return col == targets
+    if isinstance(targets, (list, tuple, set, frozenset)):
+        return col.in_(list(targets))
+    return col.in_(targets)   # подзапрос
+
+
+def aggregate(
+    db: Session,
+    kind: str,
+    *,
+    targets=None,
+    start_dt: Optional[datetime] = None,
+    end_dt: Optional[datetime] = None,
+    granularity: Optional[str] = None,
+    by_target: bool = False,
+) -> Dict[Tuple[Optional[int], Optional[datetime]], Dict[str, float]]:
+    """
+    Счётчики METRICS, сгруппированные по (target_id | None, бакет | None).
+    targets: id | список id | подзапрос | None (все лендинги вида kind).
+    Без окна и гранулярности читается traffic_totals, иначе — traffic_hourly.
+    """
+    out: Dict[tuple, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    if isinstance(targets, (list, tuple, set, frozenset)) and not targets:
+        return out
+    windowed = start_dt is not None or end_dt is not None or granularity is not None
+
+    # бакеты — только за целые часы; неполные крайние часы — из сырых строк (id <= last_id)
+    full_lo = _ceil_hour(start_dt) if start_dt is not None else None
+    full_hi = _floor_hour(end_dt) if end_dt is not None else None
+    edges: List[Tuple[Optional[datetime], Optional[datetime]]] = []
+    if start_dt is not None and end_dt is not None and full_lo > full_hi:
+        edges.append((start_dt, end_dt))       # окно внутри одного часа
+    else:
+        if start_dt is not None and full_lo != start_dt:
+            edges.append((start_dt, full_lo))
+        if end_dt is not None and full_hi != end_dt:
+            edges.append((full_hi, end_dt))
+
+    def key(row, has_tid: bool, has_b: bool):
+        tid = row.tid if has_tid else None
+        b = coerce_bucket(row.b, granularity) if has_b else None
+        return tid, b
+
+    # 1) бакеты
+    table = TrafficHourly if windowed else TrafficTotal
+    cols, group = [], []
+    if by_target:
+        cols.append(table.target_id.label("tid"))
+        group.append(table.target_id)
+    if granularity:
+        b = bucket_expr(TrafficHourly.bucket, granularity).label("b")
+        cols.append(b)
+        group.append(b)
+    q = db.query(*cols, *[func.sum(getattr(table, n)).label(n) for n in METRICS]).filter(table.kind == kind)
+    clause = _target_clause(table.target_id, targets)
+    if clause is not None:
+        q = q.filter(clause)
+    if full_lo is not None:
+        q = q.filter(TrafficHourly.bucket >= full_lo)
+    if full_hi is not None:
+        q = q.filter(TrafficHourly.bucket < full_hi)
+    if group:
+        q = q.group_by(*group)
+    for row in q.all():
+        acc = out[key(row, by_target, bool(granularity))]
+        for n in METRICS:
+            acc[n] += getattr(row, n) or 0
+
+    # 2) сырые строки: хвост (id > last_id, диапазон по PK) за всё окно
+    #    и уже учтённые (id <= last_id) за неполные крайние часы — отдельными запросами
+    last_ids = _last_ids(db)
+    for src in _SOURCES:
+        for src_kind, target_col in src.targets:
+            if src_kind != kind:
+                continue
+            last_id = last_ids.get(src.name, 0)
+            ts = src.ts_col
+            window = [ts >= start_dt] if start_dt is not None else []
+            if end_dt is not None:
+                window.append(ts < end_dt)
+            parts = [and_(src.model.id > last_id, *window)]
+            if edges:
+                parts.append(and_(src.model.id <= last_id, or_(*[and_(ts >= a, ts < b) for a, b in edges])))
+
+            cols, group = [], []
+            if by_target:
+                cols.append(target_col.label("tid"))
+                group.append(target_col)
+            if granularity:
+                b = bucket_expr(ts, granularity).label("b")
+                cols.append(b)
+                group.append(b)
+            for part in parts:
+                q = (
+                    db.query(*cols, *[expr.label(name) for name, expr in src.metrics])
+                      .filter(part, target_col.isnot(None))
+                )
+                clause = _target_clause(target_col, targets)
+                if clause is not None:
+                    q = q.filter(clause)
+                if group:
+                    q = q.group_by(*group)
+                for row in q.all():
+                    if not by_target and not granularity and not row[0]:
+                        continue   # пустой агрегат без GROUP BY
+                    acc = out[key(row, by_target, bool(granularity))]
+                    for name, _ in src.metrics:
+                        acc[name] += getattr(row, name) or 0
+
+    for acc in out.values():
+        acc["amount"] = float(acc["amount"])
+        for n in METRICS:
+            if n != "amount":
+                acc[n] = int(acc[n])
+    return out
+
+
+def series(db: Session, kind: str, targets, start_dt: datetime, end_dt: datetime,
+           granularity: str) -> Dict[str, Dict[datetime, float]]:
+    """{метрика: {бакет: значение}} за [start_dt, end_dt)."""
+    out: Dict[str, Dict[datetime, float]] = {n: {} for n in METRICS}
+    rows = aggregate(db, kind, targets=targets, start_dt=start_dt, end_dt=end_dt, granularity=granularity)
+    for (_, b), acc in rows.items():
+        for n in METRICS:
+            if acc[n]:
+                out[n][b] = acc[n]
+    return out
+
+
+def totals(db: Session, kind: str, targets=None, *, start_dt: Optional[datetime] = None,
+           end_dt: Optional[datetime] = None) -> Dict[str, float]:
+    """Суммы METRICS за всё время (или за окно) по всем targets вместе."""
+    rows = aggregate(db, kind, targets=targets, start_dt=start_dt, end_dt=end_dt)
+    return rows.get((None, None)) or dict.fromkeys(METRICS, 0)
+
+
+def by_target(db: Session, kind: str, targets: Iterable[int], metric: str, *,
+              start_dt: Optional[datetime] = None, end_dt: Optional[datetime] = None) -> Dict[int, int]:
+    """{target_id: metric} — ненулевые значения за окно (или за всё время)."""
+    targets = list(targets)
+    if not targets:
+        return {}
+    rows = aggregate(db, kind, targets=targets, start_dt=start_dt, end_dt=end_dt, by_target=True)
+    return {tid: acc[metric] for (tid, _), acc in rows.items() if acc[metric]}
+
+
+def first_visit_at(db: Session, kind: str, target_id: int) -> Optional[datetime]:
+    first = (
+        db.query(TrafficTotal.first_visit_at)
+          .filter(TrafficTotal.kind == kind, TrafficTotal.target_id == target_id)
+          .scalar()
+    )
+    if first is not None:
+        return first
+    last_ids = _last_ids(db)
+    for src in _SOURCES:
+        if not src.first_visit:
+            continue
+        for src_kind, target_col in src.targets:
+            if src_kind == kind:
+                return (
+                    db.query(func.min(src.ts_col))
+                      .filter(src.model.id > last_ids.get(src.name, 0), target_col == target_id)
+                      .scalar()
+                )
+    return None
@@ -1,6 +1,7 @@
 # app/services_v2/hls_validator.py
 import io
 import json
+import logging
 import os
 import re
 import tempfile
@@ -9,7 +10,6 @@ import urllib
 import uuid
 from dataclasses import dataclass, field
 from enum import Enum, auto
-from functools import lru_cache
 from typing import Optional, List, Dict, Tuple
 
 import boto3
@@ -18,8 +18,11 @@ import requests
 
 # =============== S3 / ENV =================
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, s3_client
+from ..utils import s3_meta_index
+from ..utils.hls_publish import HLSPublisher
 
 s3 = s3_client(signature_version="s3v4")
+logger = logging.getLogger(__name__)
 
 # =============== Problem / Fix ============
 
@@ -64,18 +67,9 @@ HLS_DIR_RE_NEW    = re.compile(r"/\.hls/([^/]+-[0-9a-f]{8})/playlist\.m3u8$", re
 
 # =============== S3 helpers (с кэшем) =====
 
-@lru_cache(maxsize=512)
-def _s3_head_cached(key: str) -> bool:
-    try:
-        s3.head_object(Bucket=S3_BUCKET, Key=key)
-        return True
-    except ClientError:
-        return False
-
 def s3_exists(key: str) -> bool:
-    if not key:
-        return False
-    return _s3_head_cached(key)
+    # общий индекс метаданных (Redis): ответ без HEAD, если ключ уже известен
+    return s3_meta_index.exists(key, client=s3)
 
 def s3_get_text(key: str) -> Optional[str]:
     try:
@@ -85,19 +79,17 @@ def s3_get_text(key: str) -> Optional[str]:
         return None
 
 def s3_put_text(key: str, text: str, content_type: str = "application/vnd.apple.mpegurl") -> None:
-    # Важно: после записи инвалидация кэша head()
+    body = text.encode("utf-8")
     s3.put_object(
         Bucket=S3_BUCKET,
         Key=key,
-        Body=text.encode("utf-8"),
+        Body=body,
         ContentType=content_type,
         CacheControl="public, max-age=3600",
         ACL='public-read'  # Делаем файлы публичными
     )
-    try:
-        _s3_head_cached.cache_clear()
-    except Exception:
-        pass
+    # Важно: после записи обновляем индекс метаданных (write-through)
+    s3_meta_index.record(key, size=len(body), content_type=content_type, metadata={}, acl="public-read")
 
 def url_from_key(key: str, encode: bool = False) -> str:
     """
@@ -608,30 +600,11 @@ def _make_hls_full_reencode(in_url: str, out_dir: str, timeout: int) -> None:
     ]
     _run_ffmpeg(cmd, timeout)
 
-def _upload_dir_to_s3(local_dir: str, s3_dir_key: str) -> None:
-    for root, _, files in os.walk(local_dir):
-        for f in files:
-            if f == ".DS_Store":
-                continue
-            local = os.path.join(root, f)
-            rel   = os.path.relpath(local, local_dir).replace("\\", "/")
-            key   = f"{s3_dir_key.rstrip('/')}/{rel}"
-            ct    = "application/vnd.apple.mpegurl" if f.endswith(".m3u8") else "video/MP2T"
-            # Кэширование: плейлисты - 1 час, сегменты - 1 день
-            cc    = "public, max-age=3600" if f.endswith(".m3u8") else "public, max-age=86400"
-            with open(local, "rb") as fp:
-                s3.put_object(
-                    Bucket=S3_BUCKET,
-                    Key=key,
-                    Body=fp.read(),
-                    ContentType=ct,
-                    CacheControl=cc,
-                    ACL='public-read'  # ВАЖНО: делаем файлы публичными!
-                )
-    try:
-        _s3_head_cached.cache_clear()
-    except Exception:
-        pass
+def _hls_extra_args(name: str) -> dict:
+    ct = "application/vnd.apple.mpegurl" if name.endswith(".m3u8") else "video/MP2T"
+    # Кэширование: плейлисты - 1 час, сегменты - 1 день
+    cc = "public, max-age=3600" if name.endswith(".m3u8") else "public, max-age=86400"
+    return {"ContentType": ct, "CacheControl": cc, "ACL": "public-read"}  # ВАЖНО: делаем файлы публичными!
 
 # =============== «умные» фиксы (rebuild/audio) ===
 
@@ -656,12 +629,16 @@ def fix_rebuild_hls(
     ffmpeg_timeout: int = 1800,
     prefer_in_url: bool = True,
     forbid_full_reencode: bool = True,
-) -> None:
+) -> dict:
     """
-    Пересборка HLS из исходного MP4.
+    Пересборка HLS из исходного MP4; возвращает метрики загрузки (HLSPublisher.stats).
       • читаем источник по CDN-URL;
       • по умолчанию НЕ делаем полный ре-энкод видео (copy), аудио → AAC;
-      • если видео не h264/avc1 и forbid_full_reencode=False — делаем «лёгкий» полный ре-энкод.
+      • если видео не h264/avc1 и forbid_full_reencode=False — делаем «лёгкий» полный ре-энкод;
+      • hls_dir_key пуст — сегменты уходят в S3 по ходу ffmpeg; пересборка на месте
+        (префикс не пуст) грузит всё после успешного ffmpeg, старый плейлист
+        до этого раздаёт прежние сегменты;
+      • ffmpeg упал — удаляются только новые ключи этого запуска (HLSPublisher).
     """
     in_url = url_from_key(src_mp4_key) if prefer_in_url else url_from_key(src_mp4_key)
 
@@ -669,15 +646,23 @@ def fix_rebuild_hls(
     vcodec, _acodec = _probe_codecs_from_url(in_url)
     allow_full = (vcodec not in ("h264", "avc1")) and (not forbid_full_reencode)
 
+    # Плейлист — последним; сегменты по ходу ffmpeg — только в пустой префикс (utils.hls_publish)
     with tempfile.TemporaryDirectory() as tmpdir:
-        try:
-            _make_hls_copy_aac(in_url, tmpdir, ffmpeg_timeout)
-        except Exception as fast_err:
-            if allow_full:
-                _make_hls_full_reencode(in_url, tmpdir, ffmpeg_timeout)
-            else:
-                raise fast_err
-        _upload_dir_to_s3(tmpdir, hls_dir_key)
+        with HLSPublisher(tmpdir, hls_dir_key, client=s3, extra_args_for=_hls_extra_args) as publisher:
+            try:
+                _make_hls_copy_aac(in_url, tmpdir, ffmpeg_timeout)
+            except Exception as fast_err:
+                if allow_full:
+                    _make_hls_full_reencode(in_url, tmpdir, ffmpeg_timeout)
+                else:
+                    raise fast_err
+            stats = publisher.finish()
+    logger.info(
+        "[HLS] rebuilt %s → %s: files=%s bytes=%s in %.1fs (%.2f MB/s), tail after ffmpeg %.1fs",
+        src_mp4_key, hls_dir_key, stats["files"], stats["bytes"], stats["seconds"],
+        stats["mb_per_s"], stats["tail_seconds"] or 0.0,
+    )
+    return stats
 
 def fix_force_audio_reencode(
     src_mp4_key: str,
@@ -685,12 +670,12 @@ def fix_force_audio_reencode(
     ffmpeg_timeout: int = 1800,
     prefer_in_url: bool = True,
     forbid_full_reencode: bool = True,
-) -> None:
+) -> dict:
     """
     Принудительно гарантируем корректное AAC-аудио.
     Реализовано тем же путём, что и rebuild (видео copy + аудио AAC).
     """
-    fix_rebuild_hls(
+    return fix_rebuild_hls(
         src_mp4_key=src_mp4_key,
         hls_dir_key=hls_dir_key,
         ffmpeg_timeout=ffmpeg_timeout,
@@ -702,15 +687,13 @@ def fix_force_audio_reencode(
 
 def write_status_json(hls_dir_key: str, data: dict) -> None:
     key = f"{hls_dir_key.rstrip('/')}/status.json"
+    body = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
     s3.put_object(
         Bucket=S3_BUCKET,
         Key=key,
-        Body=json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"),
+        Body=body,
         ContentType="application/json",
         CacheControl="public, max-age=60",
         ACL='public-read'  # Делаем файлы публичными
     )
-    try:
-        _s3_head_cached.cache_clear()
-    except Exception:
-        pass
+    s3_meta_index.record(key, size=len(body), content_type="application/json", metadata={}, acl="public-read")
@@ -0,0 +1,390 @@
+"""
+Буфер приёма визитов лендингов (курсовых и книжных).
+
+Раньше каждый просмотр страницы делал INSERT + commit, а рекламные визиты
+ещё и SELECT … FOR UPDATE NOWAIT по строке лендинга и COUNT(DISTINCT ip)
+по окну ad_visits — при всплесках рекламного трафика всё упиралось в одну
+«горячую» строку. Теперь:
+
+• record_visit() — кладёт событие в Redis stream STREAM_KEY (XADD, MAXLEN ~),
+  а IP рекламного визита — в почасовой HyperLogLog лендинга
+  (visits:hll:<kind>:<id>:<час>); запрос к БД на горячем пути не нужен;
+• flush() (задача tasks.visit_flush.flush_visits, beat каждые несколько секунд)
+  читает пачку событий, вставляет их многострочными INSERT-ами в
+  landing_visits / book_landing_visits / ad_visits / book_ad_visits и
+  один раз на лендинг за пачку обновляет флаг рекламы, TTL и период
+  (landing_service.apply_ad_visits / book_service.apply_book_ad_visits);
+• число уникальных IP за окно — PFCOUNT по почасовым HLL окна (погрешность
+  HLL ~1 %, окно округляется вниз до начала часа, т.е. может захватить
+  до часа лишнего). При ошибке Redis — прежний COUNT(DISTINCT) по БД.
+
+Если Redis недоступен (или VISIT_INGEST_ASYNC=0), record_visit() пишет визит
+сразу в БД тем же кодом, что и flush(), без ожидания row-lock (NOWAIT):
+визит сохраняется всегда, обновление флага при конкуренции пропускается.
+
+Строковые поля (fbp, fbc, ip) обрезаются до размера колонки ещё при приёме.
+Если пачка всё же падает на данных, flush() повторяет её по одному событию;
+события, которые не пишутся и поштучно, уходят в DEAD_STREAM_KEY (с текстом
+ошибки) и удаляются из основного stream — одно битое событие не блокирует
+очередь. Ошибки соединения/блокировок (OperationalError) не разбираются
+поштучно: пачка остаётся в stream до следующего flush.
+"""
+
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import redis
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+
+from ..models.models_v2 import AdVisit, BookAdVisit, BookLanding, BookLandingVisit, Landing, LandingVisit
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+ASYNC_ENABLED = os.getenv("VISIT_INGEST_ASYNC", "1") not in ("0", "false", "False")
+STREAM_KEY = os.getenv("VISIT_STREAM_KEY", "visits:stream")
+STREAM_MAXLEN = int(os.getenv("VISIT_STREAM_MAXLEN", "1000000"))
+FLUSH_BATCH = int(os.getenv("VISIT_FLUSH_BATCH", "2000"))
+DEAD_STREAM_KEY = os.getenv("VISIT_DEAD_STREAM_KEY", "visits:dead")
+DEAD_STREAM_MAXLEN = int(os.getenv("VISIT_DEAD_STREAM_MAXLEN", "100000"))
+FLUSH_LOCK_KEY = "visits:flush:lock"
+FLUSH_LOCK_TTL = 120
+
+# снимаем lock, только если он всё ещё наш
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Виды событий
+KIND_LANDING_VISIT = "lv"        # landing_visits (+ продление TTL, если from_ad)
+KIND_BOOK_LANDING_VISIT = "blv"  # book_landing_visits
+KIND_AD_VISIT = "ad"             # ad_visits (+ порог уникальных IP)
+KIND_BOOK_AD_VISIT = "bad"       # book_ad_visits
+
+_VISIT_TABLES = {
+    KIND_LANDING_VISIT: (LandingVisit, "landing_id"),
+    KIND_BOOK_LANDING_VISIT: (BookLandingVisit, "book_landing_id"),
+    KIND_AD_VISIT: (AdVisit, "landing_id"),
+    KIND_BOOK_AD_VISIT: (BookAdVisit, "book_landing_id"),
+}
+
+_HLL = "visits:hll:"
+_HOUR = 3600
+
+# ошибки, при которых события не виноваты — пачку не разбираем, повторим позже
+_TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+_rds: Optional[redis.Redis] = None
+
+
+def _redis() -> Optional[redis.Redis]:
+    global _rds
+    if _rds is None:
+        try:
+            _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+        except Exception as e:
+            logger.warning("[visits] redis unavailable: %s", e)
+            return None
+    return _rds
+
+
+def _clip(kind: str, column: str, value: Optional[str]) -> Optional[str]:
+    """Строка, обрезанная до длины колонки таблицы визитов kind."""
+    if not value:
+        return value
+    model, _ = _VISIT_TABLES[kind]
+    length = getattr(model.__table__.c[column].type, "length", None)
+    return value[:length] if length else value
+
+
+def _unique_window(kind: str) -> timedelta:
+    if kind == KIND_BOOK_AD_VISIT:
+        from .book_service import BOOK_AD_UNIQUE_IP_WINDOW
+        return BOOK_AD_UNIQUE_IP_WINDOW
+    from .landing_service import UNIQUE_IP_WINDOW
+    return UNIQUE_IP_WINDOW
+
+
+def _hll_key(kind: str, target_id: int, hour: int) -> str:
+    return f"{_HLL}{kind}:{target_id}:{hour}"
+
+
+def _hll_keys(kind: str, target_id: int, now_ts: float) -> List[str]:
+    window = _unique_window(kind).total_seconds()
+    first = int((now_ts - window) // _HOUR)
+    last = int(now_ts // _HOUR)
+    return [_hll_key(kind, target_id, h) for h in range(first, last + 1)]
+
+
+# ═══════════════════════════ приём ═══════════════════════════
+
+def record_visit(
+    db: Session,
+    kind: str,
+    target_id: int,
+    *,
+    from_ad: bool = False,
+    fbp: str | None = None,
+    fbc: str | None = None,
+    ip: str | None = None,
+) -> bool:
+    """
+    Принимает визит. True — событие в буфере (запишет flush), False — Redis
+    недоступен и визит записан в БД синхронно.
+    """
+    now_ts = time.time()
+    event = {"k": kind, "id": str(int(target_id)), "ts": f"{now_ts:.3f}"}
+    if kind in (KIND_LANDING_VISIT, KIND_BOOK_LANDING_VISIT):
+        event["ad"] = "1" if from_ad else "0"
+    else:
+        ip = (ip or "").strip()
+        for name, column, value in (("fbp", "fbp", fbp), ("fbc", "fbc", fbc), ("ip", "ip_address", ip)):
+            if value:
+                event[name] = _clip(kind, column, value)
+
+    r = _redis() if ASYNC_ENABLED else None
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            if event.get("ip"):
+                hour = int(now_ts // _HOUR)
+                key = _hll_key(kind, target_id, hour)
+                pipe.pfadd(key, event["ip"])
+                pipe.expire(key, int(_unique_window(kind).total_seconds()) + 2 * _HOUR)
+            pipe.xadd(STREAM_KEY, event, maxlen=STREAM_MAXLEN, approximate=True)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning("[visits] enqueue failed, writing synchronously: %s", e)
+
+    try:
+        _apply(db, [event], nowait=True, use_hll=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return False
+
+
+# ═══════════════════════════ сброс ═══════════════════════════
+
+def flush(db: Session, *, batch_size: int = FLUSH_BATCH, max_batches: int = 20) -> dict:
+    """
+    Переносит накопленные события в БД пачками по batch_size.
+    Один flush одновременно (Redis-лок); события удаляются из stream
+    только после commit (или переноса в DEAD_STREAM_KEY), так что при
+    падении пачка будет прочитана снова.
+    """
+    r = _redis()
+    if r is None:
+        return {"skipped": "redis"}
+
+    token = uuid.uuid4().hex
+    if not r.set(FLUSH_LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_TTL):
+        return {"skipped": "locked"}
+
+    stats = {"events": 0, "batches": 0, "inserted": 0, "ad_updates": 0, "dead": 0}
+    try:
+        for _ in range(max(1, max_batches)):
+            entries = r.xrange(STREAM_KEY, "-", "+", count=batch_size)
+            if not entries:
+                break
+            ids = [entry_id for entry_id, _ in entries]
+            try:
+                res = _apply(db, [fields for _, fields in entries], nowait=False, use_hll=True)
+                db.commit()
+            except _TRANSIENT_ERRORS:
+                db.rollback()
+                raise
+            except Exception as e:
+                db.rollback()
+                logger.warning("[visits] batch of %d failed, retrying one by one: %s", len(entries), e)
+                res = _apply_one_by_one(db, r, entries)
+                stats["dead"] += res["dead"]
+            r.xdel(STREAM_KEY, *ids)
+            r.expire(FLUSH_LOCK_KEY, FLUSH_LOCK_TTL)
+
+            stats["events"] += len(entries)
+            stats["batches"] += 1
+            stats["inserted"] += res["inserted"]
+            stats["ad_updates"] += res["ad_updates"]
+            if len(entries) < batch_size:
+                break
+    finally:
+        r.register_script(_RELEASE_LOCK_LUA)(keys=[FLUSH_LOCK_KEY], args=[token])
+
+    stats["pending"] = int(r.xlen(STREAM_KEY) or 0)
+    return stats
+
+
+def _apply_one_by_one(db: Session, r: redis.Redis, entries: List[tuple]) -> dict:
+    """
+    Пачка не записалась: каждое событие — отдельной транзакцией. Не записанные
+    уходят в DEAD_STREAM_KEY. Ошибка соединения — записанные удаляются из
+    stream, остальные остаются, исключение пробрасывается.
+    """
+    res = {"inserted": 0, "ad_updates": 0, "dead": 0}
+    done: List[str] = []
+    try:
+        for entry_id, fields in entries:
+            try:
+                one = _apply(db, [fields], nowait=False, use_hll=True)
+                db.commit()
+            except _TRANSIENT_ERRORS:
+                db.rollback()
+                raise
+            except Exception as e:
+                db.rollback()
+                logger.error("[visits] event %s moved to %s: %s", entry_id, DEAD_STREAM_KEY, e)
+                r.xadd(
+                    DEAD_STREAM_KEY,
+                    {**fields, "src_id": entry_id, "error": str(e)[:500]},
+                    maxlen=DEAD_STREAM_MAXLEN, approximate=True,
+                )
+                res["dead"] += 1
+            else:
+                res["inserted"] += one["inserted"]
+                res["ad_updates"] += one["ad_updates"]
+            done.append(entry_id)
+    except Exception:
+        if done:
+            r.xdel(STREAM_KEY, *done)
+        raise
+    return res
+
+
+def _existing_ids(db: Session, model, ids: Iterable[int]) -> set:
+    ids = set(ids)
+    if not ids:
+        return set()
+    return {row[0] for row in db.query(model.id).filter(model.id.in_(ids)).all()}
+
+
+def _apply(db: Session, events: List[dict], *, nowait: bool, use_hll: bool) -> dict:
+    """
+    Пишет пачку событий и обновляет рекламные флаги (без commit).
+      • визиты — по одному многострочному INSERT на таблицу;
+      • события удалённых лендингов отбрасываются (иначе пачку уронит FK);
+      • флаг/TTL/период — один раз на лендинг, время — последнего визита.
+    """
+    from .book_service import apply_book_ad_visits
+    from .landing_service import apply_ad_visits
+
+    rows: Dict[str, List[dict]] = defaultdict(list)
+    for ev in events:
+        kind = ev.get("k")
+        if kind not in _VISIT_TABLES:
+            logger.warning("[visits] unknown event kind %r", kind)
+            continue
+        try:
+            target_id = int(ev["id"])
+            visited_at = datetime.utcfromtimestamp(float(ev["ts"]))
+        except (KeyError, TypeError, ValueError):
+            logger.warning("[visits] malformed event %r", ev)
+            continue
+        _, fk = _VISIT_TABLES[kind]
+        row = {fk: target_id, "visited_at": visited_at}
+        if kind in (KIND_LANDING_VISIT, KIND_BOOK_LANDING_VISIT):
+            row["from_ad"] = ev.get("ad") == "1"
+        else:
+            row.update(
+                fbp=_clip(kind, "fbp", ev.get("fbp")),
+                fbc=_clip(kind, "fbc", ev.get("fbc")),
+                ip_address=_clip(kind, "ip_address", ev.get("ip")) or None,
+            )
+        rows[kind].append(row)
+
+    landing_ids = _existing_ids(
+        db, Landing, (r["landing_id"] for k in (KIND_LANDING_VISIT, KIND_AD_VISIT) for r in rows[k])
+    )
+    book_landing_ids = _existing_ids(
+        db, BookLanding,
+        (r["book_landing_id"] for k in (KIND_BOOK_LANDING_VISIT, KIND_BOOK_AD_VISIT) for r in rows[k]),
+    )
+
+    inserted = 0
+    for kind, (model, fk) in _VISIT_TABLES.items():
+        alive = landing_ids if fk == "landing_id" else book_landing_ids
+        batch = [r for r in rows[kind] if r[fk] in alive]
+        if batch:
+            db.execute(insert(model.__table__), batch)
+            inserted += len(batch)
+
+    # последнее время рекламной активности по лендингу
+    def last_seen(kinds: Iterable[str], fk: str, alive: set, only_from_ad: bool) -> Dict[int, datetime]:
+        out: Dict[int, datetime] = {}
+        for kind in kinds:
+            for r in rows[kind]:
+                if r[fk] not in alive or (only_from_ad and not r.get("from_ad", True)):
+                    continue
+                if r[fk] not in out or out[r[fk]] < r["visited_at"]:
+                    out[r[fk]] = r["visited_at"]
+        return out
+
+    ad_touch = last_seen((KIND_LANDING_VISIT, KIND_AD_VISIT), "landing_id", landing_ids, True)
+    ad_ids = {r["landing_id"] for r in rows[KIND_AD_VISIT] if r["landing_id"] in landing_ids}
+    book_touch = last_seen(
+        (KIND_BOOK_LANDING_VISIT, KIND_BOOK_AD_VISIT), "book_landing_id", book_landing_ids, True
+    )
+    book_ad_ids = {r["book_landing_id"] for r in rows[KIND_BOOK_AD_VISIT] if r["book_landing_id"] in book_landing_ids}
+
+    ad_updates = 0
+    try:
+        if ad_touch:
+            uniq = unique_ip_counts(db, KIND_AD_VISIT, {i: ad_touch[i] for i in ad_ids}, use_hll=use_hll)
+            ad_updates += apply_ad_visits(db, ad_touch, uniq, nowait=nowait)
+        if book_touch:
+            uniq = unique_ip_counts(db, KIND_BOOK_AD_VISIT, {i: book_touch[i] for i in book_ad_ids}, use_hll=use_hll)
+            ad_updates += apply_book_ad_visits(db, book_touch, uniq, nowait=nowait)
+    except OperationalError as e:
+        if not nowait:
+            raise
+        # синхронный фолбэк: строка лендинга занята — визиты сохраняем, флаг обновит следующий визит
+        logger.warning("[visits] lock contention, skipping ad flag update: %s", e)
+
+    return {"inserted": inserted, "ad_updates": ad_updates}
+
+
+# ═══════════════════════════ уникальные IP ═══════════════════════════
+
+def unique_ip_counts(
+    db: Session,
+    kind: str,
+    at: Dict[int, datetime],
+    *,
+    use_hll: bool = True,
+) -> Dict[int, int]:
+    """
+    {id: число уникальных IP рекламных визитов за окно до at[id]}.
+    Основной источник — почасовые HLL; без Redis — COUNT(DISTINCT) по БД.
+    """
+    if not at:
+        return {}
+    r = _redis() if use_hll else None
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            order = list(at)
+            for target_id in order:
+                ts = at[target_id].replace(tzinfo=None)
+                now_ts = (ts - datetime(1970, 1, 1)).total_seconds()
+                pipe.pfcount(*_hll_keys(kind, target_id, now_ts))
+            return {target_id: int(n or 0) for target_id, n in zip(order, pipe.execute())}
+        except Exception as e:
+            logger.warning("[visits] HLL count failed, using DB: %s", e)
+
+    if kind == KIND_BOOK_AD_VISIT:
+        from .book_service import _unique_ip_count_recent
+    else:
+        from .landing_service import _unique_ip_count_recent
+    return {target_id: _unique_ip_count_recent(db, target_id, ts) for target_id, ts in at.items()}
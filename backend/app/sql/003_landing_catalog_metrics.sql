@@ -0,0 +1,16 @@
+-- ============================================
+-- Миграция: Материализованные метрики лендингов для каталога
+-- ============================================
+-- lessons_total    — сумма уроков из courses.sections всех курсов лендинга
+-- duration_minutes — поле landings.duration, распарсенное в минуты
+--
+-- После применения запустите бэкфилл:
+--   celery call app.tasks.landing_metrics.backfill_landing_metrics
+-- (или POST /api/landings/admin/metrics/backfill)
+
+ALTER TABLE landings
+    ADD COLUMN lessons_total INT NOT NULL DEFAULT 0,
+    ADD COLUMN duration_minutes INT NOT NULL DEFAULT 0;
+
+CREATE INDEX ix_landings_hidden_lessons ON landings (is_hidden, lessons_total);
+CREATE INDEX ix_landings_hidden_duration ON landings (is_hidden, duration_minutes);
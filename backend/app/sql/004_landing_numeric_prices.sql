@@ -0,0 +1,28 @@
+-- ============================================
+-- Миграция: Числовые цены лендингов + составные индексы каталога
+-- ============================================
+-- landings.new_price / old_price хранятся строками (VARCHAR), поэтому
+-- CAST(new_price AS DECIMAL) в WHERE/ORDER BY не может использовать индекс.
+-- Добавляем DECIMAL-копии, которые ORM синхронизирует при каждой записи цены.
+--
+-- book_landings.new_price / old_price уже DECIMAL(10,2) — для них только индекс.
+
+ALTER TABLE landings
+    ADD COLUMN old_price_num DECIMAL(10, 2) NULL,
+    ADD COLUMN new_price_num DECIMAL(10, 2) NULL;
+
+-- Бэкфилл: те же правила, что у models_v2.normalize_price — только
+-- неотрицательные числа без экспоненты ("49", "49.99", "49,99"), которые
+-- после округления помещаются в DECIMAL(10, 2); остальное остаётся NULL.
+UPDATE landings
+   SET new_price_num = CAST(REPLACE(TRIM(new_price), ',', '.') AS DECIMAL(10, 2))
+ WHERE REPLACE(TRIM(new_price), ',', '.') REGEXP '^[0-9]+(\\.[0-9]+)?$'
+   AND CAST(REPLACE(TRIM(new_price), ',', '.') AS DECIMAL(65, 2)) <= 99999999.99;
+
+UPDATE landings
+   SET old_price_num = CAST(REPLACE(TRIM(old_price), ',', '.') AS DECIMAL(10, 2))
+ WHERE REPLACE(TRIM(old_price), ',', '.') REGEXP '^[0-9]+(\\.[0-9]+)?$'
+   AND CAST(REPLACE(TRIM(old_price), ',', '.') AS DECIMAL(65, 2)) <= 99999999.99;
+
+CREATE INDEX ix_landings_hidden_lang_price ON landings (is_hidden, language, new_price_num);
+CREATE INDEX ix_book_landings_hidden_lang_price ON book_landings (is_hidden, language, new_price);
@@ -0,0 +1,10 @@
+-- ============================================
+-- Миграция: Индексы журнала поисковых запросов
+-- ============================================
+-- /api/search/v2 на каждый запрос ищет последнюю запись пользователя/IP
+-- (ORDER BY created_at DESC LIMIT 1). Одноколоночные индексы по user_id и
+-- ip_address требуют filesort по всем записям пользователя, который растёт
+-- вместе с search_queries; составные индексы отдают последнюю запись сразу.
+
+CREATE INDEX ix_search_queries_user_created ON search_queries (user_id, created_at);
+CREATE INDEX ix_search_queries_ip_created ON search_queries (ip_address, created_at);
@@ -0,0 +1,29 @@
+-- ============================================
+-- Миграция: Очередь задач video_maintenance
+-- ============================================
+-- tick_db раньше шёл по courses/landings одним курсором в Redis под
+-- глобальным lock'ом: одно видео за раз на весь кластер, ошибки нигде
+-- не сохранялись. Теперь сканер складывает все mp4-ключи сюда (дедуп по
+-- key_hash = sha1(video_key)), а воркеры захватывают строки через
+-- SELECT … FOR UPDATE SKIP LOCKED и пишут статус/попытки/ошибку.
+
+CREATE TABLE IF NOT EXISTS video_maintenance_jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    key_hash VARCHAR(40) NOT NULL,
+    video_key TEXT NOT NULL,
+    source VARCHAR(16),
+    source_id INT,
+    status ENUM('pending', 'running', 'done', 'error', 'failed') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    result JSON,
+    next_run_at DATETIME,
+    locked_at DATETIME,
+    locked_by VARCHAR(100),
+    finished_at DATETIME,
+    last_seen_at DATETIME,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY ux_vmj_key_hash (key_hash),
+    INDEX ix_vmj_status_next_run (status, next_run_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
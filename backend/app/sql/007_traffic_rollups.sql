@@ -0,0 +1,46 @@
+-- ============================================
+-- Миграция: Почасовые роллапы трафика и покупок для /analytics
+-- ============================================
+-- landing_traffic / book_landing_traffic / site_traffic, покупки по языкам
+-- и ad_control считали GROUP BY и COUNT(*) по сырым landing_visits,
+-- book_landing_visits, ad_visits и purchases на каждый запрос дашборда.
+-- Теперь задача app.tasks.traffic_rollup.refresh_traffic_rollups раз в минуту
+-- переносит новые строки (id > high-water mark) в почасовые бакеты,
+-- эндпоинты читают бакеты + маленький «хвост» ещё не учтённых строк.
+--
+-- После применения первый refresh сам догонит историю (пачками по
+-- TRAFFIC_ROLLUP_MAX_ROWS строк на источник за запуск); быстрее — вручную:
+--   celery call app.tasks.traffic_rollup.rebuild_traffic_rollups
+
+CREATE TABLE IF NOT EXISTS traffic_hourly (
+    kind VARCHAR(16) NOT NULL,
+    target_id INT NOT NULL,
+    bucket DATETIME NOT NULL,
+    visits INT NOT NULL DEFAULT 0,
+    ad_visits INT NOT NULL DEFAULT 0,
+    ad_hits INT NOT NULL DEFAULT 0,
+    purchases INT NOT NULL DEFAULT 0,
+    ad_purchases INT NOT NULL DEFAULT 0,
+    amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, target_id, bucket),
+    INDEX ix_traffic_hourly_kind_bucket (kind, bucket)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS traffic_totals (
+    kind VARCHAR(16) NOT NULL,
+    target_id INT NOT NULL,
+    visits INT NOT NULL DEFAULT 0,
+    ad_visits INT NOT NULL DEFAULT 0,
+    ad_hits INT NOT NULL DEFAULT 0,
+    purchases INT NOT NULL DEFAULT 0,
+    ad_purchases INT NOT NULL DEFAULT 0,
+    amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    first_visit_at DATETIME NULL,
+    PRIMARY KEY (kind, target_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS traffic_rollup_state (
+    source VARCHAR(32) NOT NULL PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
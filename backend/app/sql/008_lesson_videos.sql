@@ -0,0 +1,34 @@
+-- ============================================
+-- Миграция: Индекс уроков/видео lesson_videos
+-- ============================================
+-- Ссылки на видео жили только внутри JSON courses.sections и
+-- landings.lessons_info: скан video_maintenance, /health/check/stream,
+-- переписывание ссылок (db_url_rewrite, storage_links) и счётчики уроков
+-- каждый раз разбирали все JSON целиком (или LIKE/REGEXP по CAST AS CHAR).
+-- Теперь services_v2.lesson_video_index держит здесь строку на урок:
+-- (entity_type, entity_id, section, lesson_index) → нормализованный key,
+-- key_hash и хост. Пишется вместе с курсом/лендингом, страховка —
+-- ночной rebuild.
+--
+-- После применения заполнить:
+--   celery call app.tasks.lesson_videos.rebuild_lesson_video_index
+
+CREATE TABLE IF NOT EXISTS lesson_videos (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    entity_type VARCHAR(16) NOT NULL,
+    entity_id INT NOT NULL,
+    section VARCHAR(64),
+    section_name VARCHAR(255),
+    lesson_index INT NOT NULL,
+    lesson_name VARCHAR(255),
+    video_url TEXT,
+    video_key TEXT,
+    key_hash VARCHAR(40),
+    source_host VARCHAR(255),
+    is_ours TINYINT(1) NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX ix_lesson_videos_entity (entity_type, entity_id),
+    INDEX ix_lesson_videos_key_hash (key_hash),
+    INDEX ix_lesson_videos_source_host (source_host),
+    INDEX ix_lesson_videos_ours (is_ours, entity_type, entity_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
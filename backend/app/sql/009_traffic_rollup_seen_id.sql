@@ -0,0 +1,15 @@
+-- ============================================
+-- Миграция: граница refresh роллапов трафика по времени вставки, а не события
+-- ============================================
+-- refresh_traffic_rollups брал строки с visited_at старше минуты, считая,
+-- что время события ≈ время вставки. Визиты теперь пишутся из буфера
+-- (services_v2.visit_ingest) пачками, и строка с «старым» visited_at может
+-- вставиться позже соседей с большим id.
+-- Теперь refresh запоминает замеченный MAX(id) (seen_id, seen_at) и учитывает
+-- его только в следующем запуске, когда прошло TRAFFIC_ROLLUP_LAG_SEC.
+--
+-- После применения первый refresh только запомнит seen_id, строки учтёт второй.
+
+ALTER TABLE traffic_rollup_state
+    ADD COLUMN seen_id BIGINT NULL AFTER last_id,
+    ADD COLUMN seen_at DATETIME NULL AFTER seen_id;
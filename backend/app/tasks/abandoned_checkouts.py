@@ -1,9 +1,9 @@
 # backend/app/tasks/abandoned_checkouts.py
 
 # ────────────────────────── imports ───────────────────────────
+import hashlib
 import logging
 import os
-import time
 from datetime import datetime, timedelta
 
 from celery.utils.log import get_task_logger
@@ -15,6 +15,7 @@ from ..celery_app import celery
 from ..db.database import SessionLocal
 from ..models.models_v2 import (
     AbandonedCheckout,
+    User,
     Landing,
     Course,
     WalletTxTypes,
@@ -24,10 +25,12 @@ from ..services_v2.user_service import (
     get_user_by_email,
     create_user,
     generate_random_password,
+    hash_password,
     credit_balance,
     add_partial_course_to_user,
 )
-from ..utils.email_sender import send_abandoned_checkout_email
+from ..services_v2 import email_dispatch
+from ..utils import email_sender
 
 # ───────────────────────────────────────────────────────────────
 
@@ -43,14 +46,12 @@ CDN_PLACEHOLDER_URL = os.getenv(
 REMINDER_INTERVAL = timedelta(days=5)   # пауза между письмами
 MAX_SENDS = 7                           # максимум писем на одного лида
 
-# задержка между отправками писем (секунды) — защита от Gmail rate limit
-EMAIL_SEND_DELAY_SECONDS = 3
+EMAIL_CAMPAIGN = "abandoned_checkout"
 
 
 @celery.task(
     bind=True,
     name="app.tasks.abandoned_checkouts.process_abandoned_checkouts",
-    rate_limit="100/h",
 )
 def process_abandoned_checkouts(
     self,
@@ -66,15 +67,18 @@ def process_abandoned_checkouts(
                     → создаём нового (cleanup_abandoned=False)
                     → даём бонус 5$
                     → даём partial курс
-                    → отправляем письмо с паролем
+                    → отправляем письмо с паролем (пароль выдаётся в
+                      воркере отправки — _send_first_mail, в брокер не попадает)
             - если пользователь уже есть:
                     → НЕ даём бонус
                     → НЕ даём partial
                     → письмо без пароля (просто напоминание)
       • ПОСЛЕДУЮЩИЕ письма:
             - только напоминания, без бонусов и partial
-      • send_count увеличивается ТОЛЬКО при успешной отправке (SMTP ОК)
+      • письма ставятся в общую очередь email_dispatch (темп — token bucket);
+        send_count увеличивается ТОЛЬКО при успешной отправке (_on_mail_result)
       • если письмо НЕ ушло → send_count НЕ увеличивается (повторяем)
+      • лид, письмо которому ещё ждёт в очереди, пропускаем
       • Удаление лидов при регистрации/оплате происходит в других местах.
     """
 
@@ -124,6 +128,7 @@ def process_abandoned_checkouts(
             return
 
         # Обрабатываем лиды
+        outbox: list[tuple[str, str, dict, dict]] = []
         for lead in leads:
             try:
                 lead_id     = lead.id
@@ -135,31 +140,35 @@ def process_abandoned_checkouts(
                 logger.warning("Lead row vanished — skipping.")
                 continue
 
+            dedup_key = f"{lead_id}:{send_count}"
+            if email_dispatch.is_pending(EMAIL_CAMPAIGN, dedup_key):
+                continue
+
             # Проверяем существование пользователя
             user = get_user_by_email(db, email)
-            email_sent = False  # важно!
 
             # ────────────────────────── ПЕРВОЕ ПИСЬМО ───────────────────────────
             if send_count == 0:
                 course_info: dict = {}
-                password: str | None = None
+                created = False
 
                 if user is None:
-                    # создаём юзера → только тогда бонус и partial
-                    password = generate_random_password()
+                    # создаём юзера → только тогда бонус и partial;
+                    # этот пароль никуда не уходит — письмо выдаст новый
                     try:
                         user = create_user(
                             db,
                             email=email,
-                            password=password,
+                            password=generate_random_password(),
                             cleanup_abandoned=False,
                         )
+                        created = True
                     except ValueError:
                         # race: юзер появился между проверкой и create_user
                         user = get_user_by_email(db, email)
 
-                # Если password != None → новый юзер создан в этой таске → бонус и partial
-                if password is not None and user is not None:
+                # новый юзер создан в этой таске → бонус и partial
+                if created:
                     try:
                         credit_balance(
                             db,
@@ -190,20 +199,23 @@ def process_abandoned_checkouts(
                             )
                         course_info = _build_course_info(db, chosen_id)
 
-                # Отправляем первое письмо (с паролем только для новых пользователей)
-                try:
-                    send_abandoned_checkout_email(
-                        recipient_email=email,
-                        password=password,
-                        course_info=course_info,
-                        region=region,
-                    )
-                    logger.info("First abandoned mail sent to %s", email)
-                    email_sent = True
-                    # задержка между отправками для избежания Gmail rate limit
-                    time.sleep(EMAIL_SEND_DELAY_SECONDS)
-                except Exception as err:
-                    logger.error("SMTP error for %s: %s", email, err)
+                # Первое письмо (с паролем только для новых пользователей)
+                if created:
+                    sender = "app.tasks.abandoned_checkouts:_send_first_mail"
+                    mail_kwargs = {
+                        "lead_id": lead_id,
+                        "account_marker": _account_marker(user.password),
+                        "course_info": course_info,
+                        "region": region,
+                    }
+                else:
+                    sender = "send_abandoned_checkout_email"
+                    mail_kwargs = {
+                        "recipient_email": email,
+                        "password": None,
+                        "course_info": course_info,
+                        "region": region,
+                    }
 
             # ────────────────────────── ПОВТОРНЫЕ ПИСЬМА ─────────────────────────
             else:
@@ -219,41 +231,32 @@ def process_abandoned_checkouts(
                         chosen_id or course_ids[0],
                     )
 
-                try:
-                    send_abandoned_checkout_email(
-                        recipient_email=email,
-                        password=None,  # пароль только в первом письме
-                        course_info=course_info,
-                        region=region,
-                    )
-                    logger.info(
-                        "Reminder #%s sent to %s", send_count + 1, email
-                    )
-                    email_sent = True
-                    # задержка между отправками для избежания Gmail rate limit
-                    time.sleep(EMAIL_SEND_DELAY_SECONDS)
-                except Exception as err:
-                    logger.error(
-                        "SMTP error (reminder) for %s: %s", email, err
-                    )
+                sender = "send_abandoned_checkout_email"
+                mail_kwargs = {
+                    "recipient_email": email,
+                    "password": None,  # пароль только в первом письме
+                    "course_info": course_info,
+                    "region": region,
+                }
 
-            # ─────────────────────── обновляем send_count (ТОЛЬКО УСПЕХ) ─────────
-            if email_sent:
-                db.query(AbandonedCheckout).filter_by(id=lead_id).update(
-                    {
-                        "send_count": send_count + 1,
-                        "last_sent_at": now,
-                    }
-                )
-            else:
-                logger.warning(
-                    "Email to %s NOT SENT, send_count stays at %s (retry next run)",
-                    email,
-                    send_count,
-                )
+            outbox.append((dedup_key, sender, mail_kwargs, {
+                "lead_id": lead_id, "email": email, "send_count": send_count,
+            }))
 
         db.commit()
 
+        # ─────────── в очередь после коммита (пользователь/бонус уже видны) ──────
+        # send_count обновит _on_mail_result по факту отправки
+        for dedup_key, sender, mail_kwargs, context in outbox:
+            email_dispatch.enqueue_email(
+                EMAIL_CAMPAIGN,
+                sender,
+                kwargs=mail_kwargs,
+                dedup_key=dedup_key,
+                on_result="app.tasks.abandoned_checkouts:_on_mail_result",
+                context=context,
+            )
+
     except Exception as exc:
         db.rollback()
         logger.exception("Abandoned-checkout task failed: %s", exc)
@@ -263,6 +266,85 @@ def process_abandoned_checkouts(
 
 # ─────────────────────────── helpers ───────────────────────────
 
+def _account_marker(password_hash: str) -> str:
+    """Отпечаток хэша пароля: аккаунт не трогали с create_user в этой задаче."""
+    return hashlib.sha256(password_hash.encode("utf-8")).hexdigest()
+
+
+def _send_first_mail(
+    lead_id: int,
+    account_marker: str,
+    course_info: dict,
+    region: str,
+) -> bool | None:
+    """
+    Sender email_dispatch для первого письма новому пользователю.
+
+    Пароль генерируется здесь, в воркере отправки, и сразу записывается
+    пользователю — в kwargs задачи (брокер, result backend, логи) он не попадает.
+    Лид уже удалён или письмо уже ушло (send_count > 0) → не шлём.
+    Пароль меняется, только пока хэш тот же, что при create_user (account_marker),
+    и атомарно (UPDATE ... WHERE password = прежний хэш): если пользователь успел
+    сменить пароль или письмо доставлено повторно — письмо уходит без пароля.
+    """
+    db: Session = SessionLocal()
+    try:
+        lead = db.query(AbandonedCheckout).filter_by(id=lead_id, send_count=0).first()
+        user = get_user_by_email(db, lead.email) if lead is not None else None
+        if user is None:
+            logger.info("First abandoned mail for lead %s skipped: lead or user gone", lead_id)
+            return False
+        email = lead.email
+        password: str | None = None
+        if _account_marker(user.password) == account_marker:
+            candidate = generate_random_password()
+            updated = db.query(User).filter(
+                User.id == user.id, User.password == user.password,
+            ).update({"password": hash_password(candidate)}, synchronize_session=False)
+            db.commit()
+            if updated == 1:
+                password = candidate
+        if password is None:
+            logger.info("First abandoned mail to %s: account changed since creation, password kept", email)
+    finally:
+        db.close()
+
+    return email_sender.send_abandoned_checkout_email(
+        recipient_email=email,
+        password=password,
+        course_info=course_info,
+        region=region,
+    )
+
+
+def _on_mail_result(ok: bool, context: dict) -> None:
+    """Колбэк email_dispatch: send_count + 1 ТОЛЬКО при успешной отправке."""
+    lead_id = context["lead_id"]
+    send_count = context["send_count"]
+    if not ok:
+        logger.warning(
+            "Email to %s NOT SENT, send_count stays at %s (retry next run): %s",
+            context.get("email"), send_count, context.get("error"),
+        )
+        return
+
+    db: Session = SessionLocal()
+    try:
+        db.query(AbandonedCheckout).filter_by(id=lead_id, send_count=send_count).update(
+            {
+                "send_count": send_count + 1,
+                "last_sent_at": datetime.utcnow(),
+            }
+        )
+        db.commit()
+        if send_count == 0:
+            logger.info("First abandoned mail sent to %s", context.get("email"))
+        else:
+            logger.info("Reminder #%s sent to %s", send_count + 1, context.get("email"))
+    finally:
+        db.close()
+
+
 def _choose_course(db: Session, course_ids: list[int] | None) -> int | None:
     """Возвращает ID наиболее «популярного» курса из списка."""
     if not course_ids:
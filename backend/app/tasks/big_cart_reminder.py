@@ -1,4 +1,3 @@
-import time
 from datetime import datetime, timedelta
 
 from celery import shared_task
@@ -7,7 +6,7 @@ from sqlalchemy.orm import Session
 
 from ..db.database import SessionLocal
 from ..models.models_v2 import Cart, User
-from ..utils.email_sender import send_big_cart_reminder_email
+from ..services_v2 import email_dispatch
 from ..utils.user_language import get_user_preferred_language
 
 
@@ -23,8 +22,7 @@ MAX_BIG_CART_REMINDERS = 1
 # ограничение пачки за один прогон (~55 писем/час для 165 писем/час суммарно)
 BIG_CART_BATCH_LIMIT = 55
 
-# задержка между отправками писем (секунды) — защита от Gmail rate limit
-EMAIL_SEND_DELAY_SECONDS = 3
+EMAIL_CAMPAIGN = "big_cart"
 
 
 @shared_task(name="app.tasks.big_cart_reminder.process_big_cart_reminders")
@@ -38,9 +36,10 @@ def process_big_cart_reminders() -> int:
        - bigcart_send_count < MAX_BIG_CART_REMINDERS;
        - либо письмо ещё не слалось, либо прошло достаточно времени
          с bigcart_last_sent_at (BIG_CART_INTERVAL_HOURS);
-    3) шлём письмо;
+    3) ставим письмо в общую очередь email_dispatch (темп — token bucket);
     4) увеличиваем bigcart_send_count и обновляем bigcart_last_sent_at
-       ТОЛЬКО при успешной отправке.
+       ТОЛЬКО при успешной отправке (_on_mail_result).
+    Возвращает число поставленных в очередь писем.
     """
 
     db: Session = SessionLocal()
@@ -77,7 +76,7 @@ def process_big_cart_reminders() -> int:
             .all()
         )
 
-        sent_count = 0
+        queued = 0
 
         for cart in carts:
             user = cart.user
@@ -87,22 +86,45 @@ def process_big_cart_reminders() -> int:
 
             # Определяем предпочитаемый язык пользователя
             user_language = get_user_preferred_language(user, db)
-            ok = send_big_cart_reminder_email(user.email, user_language)
-
-            # ❗ В отличие от прошлой таски — счётчик увеличиваем
-            # ТОЛЬКО если отправка реально прошла.
-            if ok:
-                cart.bigcart_send_count += 1
-                cart.bigcart_last_sent_at = now
-                sent_count += 1
-                # задержка между отправками для избежания Gmail rate limit
-                time.sleep(EMAIL_SEND_DELAY_SECONDS)
+            if email_dispatch.enqueue_email(
+                EMAIL_CAMPAIGN,
+                "send_big_cart_reminder_email",
+                kwargs={"recipient_email": user.email, "region": user_language},
+                dedup_key=f"{cart.id}:{cart.bigcart_send_count}",
+                on_result="app.tasks.big_cart_reminder:_on_mail_result",
+                context={"cart_id": cart.id, "send_count": cart.bigcart_send_count},
+            ):
+                queued += 1
 
         db.commit()
-        return sent_count
+        return queued
 
     except Exception:
         db.rollback()
         raise
     finally:
         db.close()
+
+
+def _on_mail_result(ok: bool, context: dict) -> None:
+    """
+    Колбэк email_dispatch. ❗ Счётчик увеличиваем ТОЛЬКО если отправка
+    реально прошла — иначе корзина попадёт в следующий прогон.
+    """
+    if not ok:
+        return
+    db: Session = SessionLocal()
+    try:
+        db.query(Cart).filter(
+            Cart.id == context["cart_id"],
+            Cart.bigcart_send_count == context["send_count"],
+        ).update(
+            {
+                Cart.bigcart_send_count: Cart.bigcart_send_count + 1,
+                Cart.bigcart_last_sent_at: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -19,6 +19,7 @@ from celery import shared_task
 from sqlalchemy.orm import Session
 
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, public_url_for_key, s3_client
+from ..utils import s3_upload
 from ..db.database import SessionLocal
 from ..models.models_v2 import Book, BookFile, BookFileFormat
 
@@ -791,9 +792,9 @@ def generate_book_formats(book_id: int) -> dict:
                     epub_key = _formats_key_from_pdf(pdf_key, "epub")
                     filename = os.path.basename(epub_key)
                     try:
-                        s3.upload_file(
-                            local_epub_path, S3_BUCKET, epub_key,
-                            ExtraArgs={
+                        s3_upload.upload_file(
+                            local_epub_path, bucket=S3_BUCKET, key=epub_key, client=s3,
+                            extra_args={
                                 "ACL": "public-read",
                                 "ContentType": _content_type_for("epub"),
                                 "ContentDisposition": _make_content_disposition(filename),
@@ -881,9 +882,9 @@ def generate_book_formats(book_id: int) -> dict:
                         mobi_key = _formats_key_from_pdf(pdf_key, "mobi")
                         filename = os.path.basename(mobi_key)
                         try:
-                            s3.upload_file(
-                                out_mobi, S3_BUCKET, mobi_key,
-                                ExtraArgs={
+                            s3_upload.upload_file(
+                                out_mobi, bucket=S3_BUCKET, key=mobi_key, client=s3,
+                                extra_args={
                                     "ACL": "public-read",
                                     "ContentType": _content_type_for("mobi"),
                                     "ContentDisposition": _make_content_disposition(filename),
@@ -957,9 +958,9 @@ def generate_book_formats(book_id: int) -> dict:
                         azw3_key = _formats_key_from_pdf(pdf_key, "azw3")
                         filename = os.path.basename(azw3_key)
                         try:
-                            s3.upload_file(
-                                out_azw3, S3_BUCKET, azw3_key,
-                                ExtraArgs={
+                            s3_upload.upload_file(
+                                out_azw3, bucket=S3_BUCKET, key=azw3_key, client=s3,
+                                extra_args={
                                     "ACL": "public-read",
                                     "ContentType": _content_type_for("azw3"),
                                     "ContentDisposition": _make_content_disposition(filename),
@@ -1033,9 +1034,9 @@ def generate_book_formats(book_id: int) -> dict:
                         fb2_key = _formats_key_from_pdf(pdf_key, "fb2")
                         filename = os.path.basename(fb2_key)
                         try:
-                            s3.upload_file(
-                                out_fb2, S3_BUCKET, fb2_key,
-                                ExtraArgs={
+                            s3_upload.upload_file(
+                                out_fb2, bucket=S3_BUCKET, key=fb2_key, client=s3,
+                                extra_args={
                                     "ACL": "public-read",
                                     "ContentType": _content_type_for("fb2"),
                                     "ContentDisposition": _make_content_disposition(filename),
@@ -1172,9 +1173,9 @@ def _convert_pdf_direct_formats(
         key = _formats_key_from_pdf(pdf_key, ext)
         filename = os.path.basename(key)
         try:
-            s3.upload_file(
-                out_path, S3_BUCKET, key,
-                ExtraArgs={
+            s3_upload.upload_file(
+                out_path, bucket=S3_BUCKET, key=key, client=s3,
+                extra_args={
                     "ACL": "public-read",
                     "ContentType": _content_type_for(ext),
                     "ContentDisposition": _make_content_disposition(filename),
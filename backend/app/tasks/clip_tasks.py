@@ -25,6 +25,7 @@ from celery.exceptions import SoftTimeLimitExceeded
 # S3 / ENV
 # =========================
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, s3_client
+from ..utils import s3_upload
 
 # =========================
 # Жёстко вшитые настройки (без ENV)
@@ -59,14 +60,7 @@ HARD_SLOW_GUARD_SEC = 45          # жёсткий предохранитель
 s3 = s3_client(signature_version="s3v4")
 s3_v4 = s3
 
-# ===== NEW: разные конфиги для upload / download =====
-TRANSFER_CFG_UPLOAD = TransferConfig(
-    multipart_threshold=DEFAULT_PART,
-    multipart_chunksize=DEFAULT_PART,
-    max_concurrency=2,
-    use_threads=True,
-)
-
+# ===== download; upload — через utils.s3_upload =====
 TRANSFER_CFG_DOWNLOAD = TransferConfig(
     multipart_threshold=DEFAULT_PART,
     multipart_chunksize=DEFAULT_PART,
@@ -298,12 +292,12 @@ def _apply_faststart(bucket: str, key: str, mime: str) -> Tuple[bool, str]:
 
         # 3. Загружаем обратно в S3 (перезаписываем)
         try:
-            s3.upload_file(
+            s3_upload.upload_file(
                 dst_path,
-                bucket,
-                key,
-                ExtraArgs={"ContentType": mime, "ContentDisposition": "inline"},
-                Config=TRANSFER_CFG_UPLOAD,
+                bucket=bucket,
+                key=key,
+                extra_args={"ContentType": mime, "ContentDisposition": "inline"},
+                client=s3,
             )
         except Exception as e:
             return False, f"upload failed: {e}"
@@ -327,81 +321,22 @@ def multipart_upload_from_pipe(
     min_ok_bytes: int = MIN_OK_BYTES,
 ) -> int:
     """
-    Читает байты из pipe и грузит в S3 через MPU.
+    Читает байты из pipe и грузит в S3 через MPU (utils.s3_upload: части уходят
+    параллельно, пока ffmpeg продолжает писать).
     ВАЖНО: если суммарно пришло < min_ok_bytes — делаем AbortMultipartUpload и
     ВОЗВРАЩАЕМ 0 вместо исключения. Таким образом, вызывающий код сможет
     корректно уйти на фолбэк, а задача не упадёт.
     """
-    mpu = s3.create_multipart_upload(
-        Bucket=bucket,
-        Key=key,
-        ContentType=content_type,
-        ContentDisposition=content_disposition,
+    return s3_upload.upload_stream(
+        pipe,
+        bucket=bucket,
+        key=key,
+        extra_args={"ContentType": content_type, "ContentDisposition": content_disposition},
+        client=s3,
+        part_size=part_size,
+        progress_cb=progress_cb,
+        min_ok_bytes=min_ok_bytes,
     )
-    upload_id = mpu["UploadId"]
-    parts = []
-    part_no = 1
-    sent_total = 0
-    buf = bytearray()
-
-    try:
-        READ_CHUNK = 1024 * 1024
-        while True:
-            chunk = pipe.read(READ_CHUNK)
-            if not chunk:
-                break
-            buf += chunk
-            if progress_cb:
-                progress_cb(len(chunk))
-
-            while len(buf) >= part_size:
-                payload = bytes(buf[:part_size])
-                del buf[:part_size]
-                resp = s3.upload_part(
-                    Bucket=bucket,
-                    Key=key,
-                    PartNumber=part_no,
-                    UploadId=upload_id,
-                    Body=payload,
-                )
-                parts.append({"ETag": resp["ETag"], "PartNumber": part_no})
-                sent_total += len(payload)
-                part_no += 1
-
-        if buf:
-            resp = s3.upload_part(
-                Bucket=bucket,
-                Key=key,
-                PartNumber=part_no,
-                UploadId=upload_id,
-                Body=bytes(buf),
-            )
-            parts.append({"ETag": resp["ETag"], "PartNumber": part_no})
-            sent_total += len(buf)
-
-        # ключевое изменение: если получили слишком мало — не кидаем исключение
-        if sent_total < max(min_ok_bytes, 1):
-            try:
-                s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
-            except Exception:
-                pass
-            return 0  # сигнализируем вызывающему коду: «ничего годного не выгрузили»
-
-        s3.complete_multipart_upload(
-            Bucket=bucket,
-            Key=key,
-            UploadId=upload_id,
-            MultipartUpload={"Parts": parts},
-        )
-        return sent_total
-
-    except Exception:
-        # при любой ошибке аккуратно абортим MPU
-        try:
-            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
-        except Exception:
-            pass
-        raise
 
 
 # =========================
@@ -788,12 +723,12 @@ def clip_video(self, src_url: str, dest_key: Optional[str] = None, force_downloa
                 raise RuntimeError(f"local result too short: {dur:.3f}s < {MIN_OK_DURATION_SEC}s")
 
             self.update_state(task_id=task_id, state="PROGRESS", meta={"stage": "uploading_result"})
-            s3.upload_file(
+            s3_upload.upload_file(
                 dst_path,
-                S3_BUCKET,
-                clip_key,
-                ExtraArgs={"ContentType": mime, "ContentDisposition": "inline"},
-                Config=TRANSFER_CFG_UPLOAD,
+                bucket=S3_BUCKET,
+                key=clip_key,
+                extra_args={"ContentType": mime, "ContentDisposition": "inline"},
+                client=s3,
             )
             uploaded3 = os.path.getsize(dst_path)
 
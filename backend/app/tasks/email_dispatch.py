@@ -0,0 +1,61 @@
+import logging
+
+from celery import shared_task
+
+from ..services_v2 import email_dispatch
+from ..utils.email_sender.common import paced_externally
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(
+    name="app.tasks.email_dispatch.dispatch_email",
+    bind=True,
+    max_retries=None,
+    acks_late=True,
+)
+def dispatch_email(
+    self,
+    campaign: str,
+    sender: str,
+    kwargs: dict,
+    dedup_key: str | None = None,
+    on_result: str | None = None,
+    context: dict | None = None,
+    reserved: bool = False,
+) -> bool:
+    """
+    Отправка одного письма кампании через общий token bucket.
+
+    Токен резервируется сразу; если слот в будущем — задача перепланируется
+    ровно на него (retry с countdown, reserved=True) и после пробуждения
+    шлёт без повторного acquire, слот воркера не занимается сном.
+    Ведро расписано дальше горизонта (MAX_RESERVE_SECONDS, меньше
+    visibility_timeout брокера) — резерва нет: задача вернётся через горизонт
+    и попробует снова, dedup письма продлевается.
+    Дальше — sender(**kwargs) без локальной паузы common и результат
+    в колбэк on_result.
+    """
+    if not reserved:
+        granted, wait = email_dispatch.acquire(campaign, reserve=True)
+        if not granted:
+            email_dispatch.touch(campaign, dedup_key)
+            raise self.retry(countdown=email_dispatch.MAX_RESERVE_SECONDS)
+        if wait > 0:
+            raise self.retry(countdown=wait, kwargs={**self.request.kwargs, "reserved": True})
+
+    try:
+        with paced_externally():
+            result = email_dispatch.resolve_sender(sender)(**kwargs)
+        # send_abandoned_checkout_email ничего не возвращает — это успех
+        ok = result is not False
+        error = None if ok else f"{sender} returned False"
+    except Exception as exc:
+        logger.exception("[email_dispatch] %s/%s failed", campaign, sender)
+        ok, error = False, str(exc)
+
+    try:
+        email_dispatch.report_result(on_result, ok, {**(context or {}), "error": error})
+    finally:
+        email_dispatch.release(campaign, dedup_key)
+    return ok
@@ -8,6 +8,7 @@ import subprocess
 import tempfile
 import time
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, Optional
@@ -25,6 +26,8 @@ from ..services_v2.video_repair_service import HLSPaths, build_fix_plan, fix_reb
     fix_force_audio_reencode, s3_exists, fix_write_alias_master, url_from_key, write_status_json, key_from_url, \
     discover_hls_for_src, Fix
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, s3_client
+from ..utils.hls_publish import HLSPublisher, HLS_UPLOAD_CONCURRENCY, delete_prefix
+from ..utils import s3_meta_index
 
 # ──────────────────────────── ENV / CONST ────────────────────────────────────
 logger = logging.getLogger(__name__)
@@ -37,6 +40,8 @@ R_SET_READY         = "hls:ready"          # успешно обработанн
 R_SET_QUEUED        = "hls:queued"         # стоят в расписании / выполняются
 R_TOTAL             = "hls:total_mp4"
 R_LAST_RECOUNT_TS   = "hls:last_recount_ts"
+R_PUBLISH_STATS     = "hls:publish_stats"  # метрики загрузки HLS по видео (последние N)
+R_PUBLISH_STATS_SIZE = 500
 
 # S3 конфиг централизован в core.storage
 _NO_KEY = ("NoSuchKey", "404")
@@ -71,6 +76,7 @@ def _copy_with_metadata(key: str, meta: dict) -> None:
         ACL="public-read",
         ContentType="video/mp4",
     )
+    s3_meta_index.drop([key])
 
 def _each_mp4_objects():
     """yield key for every .mp4 object (V4 list)."""
@@ -126,6 +132,23 @@ def hls_prefixes_for(key: str) -> tuple[str, str]:
     new = f"{base}/.hls/{stable_slug(fname)}/".lstrip("/")
     return leg, new
 
+def _hls_content_type(name: str) -> str:
+    return "application/vnd.apple.mpegurl" if name.endswith(".m3u8") else "video/MP2T"
+
+def _record_publish_stats(key: str, stats: dict) -> None:
+    """Метрики публикации HLS (лог + последние R_PUBLISH_STATS_SIZE записей в Redis)."""
+    logger.info(
+        "[HLS] published %s: files=%s bytes=%s in %.1fs (%.2f MB/s), tail after ffmpeg %.1fs",
+        key, stats["files"], stats["bytes"], stats["seconds"], stats["mb_per_s"], stats["tail_seconds"] or 0.0,
+    )
+    try:
+        pipe = rds.pipeline()
+        pipe.lpush(R_PUBLISH_STATS, json.dumps({"key": key, "ts": int(time.time()), **stats}))
+        pipe.ltrim(R_PUBLISH_STATS, 0, R_PUBLISH_STATS_SIZE - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("[HLS] failed to store publish stats: %s", e)
+
 def put_alias_master(legacy_playlist_key: str, canonical_m3u8_url: str) -> None:
     """
     Кладём маленький master.m3u8 по legacy-пути, который указывает на канонический media-плейлист.
@@ -145,6 +168,10 @@ def put_alias_master(legacy_playlist_key: str, canonical_m3u8_url: str) -> None:
         ContentType="application/vnd.apple.mpegurl",
         CacheControl="public, max-age=60",
     )
+    s3_meta_index.record(
+        legacy_playlist_key, size=len(body), content_type="application/vnd.apple.mpegurl",
+        metadata={}, acl="public-read",
+    )
 
 
 # ─────────────────────── ffmpeg (copy→fallback) ──────────────────────────────
@@ -317,15 +344,18 @@ def ensure_aliases_to_canonical(src_mp4_key: str, new_pl_key: str) -> list[str]:
     new_url = url_from_key(new_pl_key)
     updated = []
 
-    for pl_key in all_playlists:
-        # пропускаем сам canonical (с -hash) — его не трогаем
-        if HLS_DIR_RE_NEW.search(pl_key):
-            continue
+    def write_alias(pl_key: str) -> Optional[str]:
         try:
             put_alias_master(pl_key, new_url)
-            updated.append(pl_key)
+            return pl_key
         except ClientError as e:
             logger.warning("[HLS] alias write failed for %s: %s", pl_key, e)
+            return None
+
+    # пропускаем сам canonical (с -hash) — его не трогаем
+    legacy_playlists = [k for k in all_playlists if not HLS_DIR_RE_NEW.search(k)]
+    with ThreadPoolExecutor(max_workers=HLS_UPLOAD_CONCURRENCY) as pool:
+        updated.extend(k for k in pool.map(write_alias, legacy_playlists) if k)
 
     # Если legacy вообще не было — создадим его по «правильному» слугу:
     if not any(HLS_DIR_RE_LEG.search(k) and not HLS_DIR_RE_NEW.search(k) for k in all_playlists):
@@ -450,20 +480,20 @@ def process_hls_video(key: str) -> None:
 
             s3.download_file(S3_BUCKET, key, in_mp4)
 
-            ok = _make_hls(in_mp4, playlist, seg_pat)
-            if not ok:
-                _mark_hls_error(key, "ffmpeg_failed")
-                logger.error("[HLS] ffmpeg failed for %s", key)
-                return
-
-            # выгружаем в КАНОНИЧЕСКИЙ префикс
-            for fname in os.listdir(tmp):
-                if fname == "in.mp4":
-                    continue
-                src = os.path.join(tmp, fname)
-                dst = f"{new_prefix}{fname}"
-                ct = "application/vnd.apple.mpegurl" if fname.endswith(".m3u8") else "video/MP2T"
-                s3.upload_file(src, S3_BUCKET, dst, ExtraArgs={"ACL": "public-read", "ContentType": ct})
+            # выгружаем в КАНОНИЧЕСКИЙ префикс: сегменты — по мере готовности, плейлист — последним
+            with HLSPublisher(
+                tmp, new_prefix, client=s3, skip={"in.mp4"},
+                extra_args_for=lambda name: {"ACL": "public-read", "ContentType": _hls_content_type(name)},
+            ) as publisher:
+                ok = _make_hls(in_mp4, playlist, seg_pat)
+                if not ok:
+                    # без finish() publisher при выходе удалит выгруженные им новые сегменты
+                    _mark_hls_error(key, "ffmpeg_failed")
+                    logger.error("[HLS] ffmpeg failed for %s", key)
+                    return
+                stats = publisher.finish()
+
+        _record_publish_stats(key, stats)
 
         _mark_hls_ready(key)
 
@@ -706,17 +736,7 @@ def _key_from_url(url: str) -> str:
 
 def _delete_prefix(prefix: str) -> None:
     # prefix типа "path/.hls/slug/"
-    s3v4 = _s3_v4()
-    paginator = s3v4.get_paginator("list_objects_v2")
-    to_delete = []
-    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            to_delete.append({"Key": obj["Key"]})
-            if len(to_delete) >= 1000:
-                s3.delete_objects(Bucket=S3_BUCKET, Delete={"Objects": to_delete})
-                to_delete.clear()
-    if to_delete:
-        s3.delete_objects(Bucket=S3_BUCKET, Delete={"Objects": to_delete})
+    delete_prefix(prefix, client=_s3_v4())
 
 
 from typing import Dict, Any
@@ -943,6 +963,7 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
     s3_key = key_from_url(video_url)
     deleted_files = []
     errors = []
+    publish_stats = None
     
     self.update_state(state="PROGRESS", meta={"step": "cleanup", "message": "Deleting old HLS files..."})
     
@@ -957,15 +978,7 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
     
     for hls_prefix in prefixes_to_check:
         try:
-            paginator = _s3_v4().get_paginator("list_objects_v2")
-            for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=hls_prefix):
-                for obj in page.get("Contents", []):
-                    key = obj["Key"]
-                    try:
-                        s3.delete_object(Bucket=S3_BUCKET, Key=key)
-                        deleted_files.append(key)
-                    except Exception as e:
-                        logger.warning(f"Failed to delete {key}: {e}")
+            deleted_files.extend(delete_prefix(hls_prefix, client=_s3_v4()))
         except Exception as e:
             logger.warning(f"Failed to list prefix {hls_prefix}: {e}")
     
@@ -985,6 +998,7 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
             MetadataDirective="REPLACE",
             ContentType="video/mp4"
         )
+        s3_meta_index.drop([s3_key])
     except Exception as e:
         logger.warning(f"Failed to reset metadata: {e}")
         errors.append(f"Metadata reset: {e}")
@@ -1000,7 +1014,7 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
         hls_dir_key = paths.new_pl_key.rsplit("/", 1)[0] if paths.new_pl_key else None
         
         if hls_dir_key:
-            fix_rebuild_hls(
+            publish_stats = fix_rebuild_hls(
                 src_mp4_key=s3_key,
                 hls_dir_key=hls_dir_key,
                 ffmpeg_timeout=1800,
@@ -1021,13 +1035,19 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
                     CacheControl="public, max-age=60",
                     ACL='public-read'  # Делаем файлы публичными
                 )
+                s3_meta_index.record(
+                    paths.legacy_pl_key, size=len(alias_content.encode("utf-8")),
+                    content_type="application/vnd.apple.mpegurl", metadata={}, acl="public-read",
+                )
             
             # Записываем статус
             write_status_json(hls_dir_key, {
                 "rebuilt_at": datetime.utcnow().isoformat(),
                 "src_mp4_key": s3_key,
                 "deleted_old_files": len(deleted_files),
+                "publish": publish_stats,
             })
+            _record_publish_stats(s3_key, publish_stats)
             
             # Обновляем метаданные MP4
             s3.copy_object(
@@ -1038,6 +1058,7 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
                 MetadataDirective="REPLACE",
                 ContentType="video/mp4"
             )
+            s3_meta_index.drop([s3_key])
         else:
             errors.append("Could not determine HLS directory")
             
@@ -1054,6 +1075,7 @@ def force_rebuild_hls_task(self, video_url: str) -> Dict[str, Any]:
         "duration_sec": elapsed,
         "src_mp4_key": s3_key,
         "new_hls_key": paths.new_pl_key if 'paths' in dir() else None,
+        "publish": publish_stats,
     }
     
     self.update_state(
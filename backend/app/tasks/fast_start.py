@@ -12,6 +12,7 @@ from celery import shared_task, current_app
 
 # --- Configuration (from your environment) ---
 from ..core.storage import S3_BUCKET, S3_PUBLIC_HOST, s3_client
+from ..utils import s3_meta_index
 
 REDIS_URL       = os.getenv("REDIS_URL",       "redis://redis:6379/0")
 NEW_TASKS_LIMIT = int(os.getenv("NEW_TASKS_LIMIT", 15))
@@ -93,5 +94,9 @@ def process_faststart_video(key: str):
                     "Metadata": {"faststart": "true"}
                 }
             )
+            s3_meta_index.record(
+                key, size=os.path.getsize(out_mp4), content_type="video/mp4",
+                metadata={"faststart": "true"}, acl="public-read",
+            )
 
         logger.info("Faststart applied (disk) → %s", key)
\ No newline at end of file
@@ -0,0 +1,35 @@
+import logging
+
+from celery import shared_task
+
+from ..db.database import SessionLocal
+from ..services_v2 import lesson_video_index
+from ..services_v2.filter_aggregation_service import refresh_landing_metrics
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="app.tasks.landing_metrics.backfill_landing_metrics")
+def backfill_landing_metrics(landing_ids: list[int] | None = None, batch_size: int = 500):
+    """
+    Пересчитывает landings.lessons_total / duration_minutes / new_price_num / old_price_num.
+
+    • landing_ids=None — все лендинги (бэкфилл после миграции 003); перед этим
+      пересобирается индекс lesson_videos, по которому считаются уроки;
+    • запускается также раз в сутки beat-ом как страховка от правок
+      courses.sections и цен в обход ORM (миграции, импорт, video_maintenance и т.п.).
+    """
+    db = SessionLocal()
+    try:
+        if landing_ids is None:
+            lesson_video_index.rebuild(db)
+        processed = refresh_landing_metrics(db, landing_ids, batch_size=batch_size)
+        db.commit()
+        logger.info("backfill_landing_metrics: processed=%s", processed)
+        return {"processed": processed}
+    except Exception:
+        db.rollback()
+        logger.exception("backfill_landing_metrics failed")
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,31 @@
+import logging
+
+from celery import shared_task
+
+from ..db.database import SessionLocal
+from ..services_v2 import lesson_video_index
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="app.tasks.lesson_videos.rebuild_lesson_video_index")
+def rebuild_lesson_video_index(chunk: int | None = None):
+    """
+    Полная пересборка индекса lesson_videos из courses.sections / landings.lessons_info.
+
+    • бэкфилл после миграции 008;
+    • раз в сутки beat-ом как страховка от правок JSON в обход сервисов
+      (парсеры, импорт, ручной SQL).
+    """
+    db = SessionLocal()
+    try:
+        kwargs = {"chunk": chunk} if chunk else {}
+        stats = lesson_video_index.rebuild(db, **kwargs)
+        logger.info("rebuild_lesson_video_index: %s", stats)
+        return stats
+    except Exception:
+        db.rollback()
+        logger.exception("rebuild_lesson_video_index failed")
+        raise
+    finally:
+        db.close()
@@ -12,8 +12,10 @@ from ..db.database import SessionLocal
 from ..models.models_v2 import Lead, EmailCampaign, EmailCampaignRecipient, EmailCampaignRecipientStatus
 from ..services_v2.lead_campaign_service import skip_send_and_cleanup_if_user_exists, normalize_email
 from ..services_v2.email_suppression_service import get_suppression
+from ..services_v2 import email_dispatch
 from ..models.models_v2 import SuppressionType
 from ..utils import email_sender
+from ..utils.email_sender.common import paced_externally
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -32,6 +34,9 @@ def send_ny2026_tick(max_per_run: int = 1) -> dict:
     - если email уже есть в users → удаляем из leads и НЕ шлём письмо
     - если пользователя нет → резервируем recipient (для бонуса) и шлём письмо
     - бонус выдаётся позже при регистрации/покупке, но ТОЛЬКО если status=sent
+    - темп — общий token bucket маркетингового домена (email_dispatch):
+      шлём столько, сколько выдано токенов; остальным снимаем резерв,
+      их подхватит следующий тик
     """
     db: Session = SessionLocal()
     try:
@@ -63,6 +68,7 @@ def send_ny2026_tick(max_per_run: int = 1) -> dict:
         sent = 0
         skipped_user_exists = 0
         failed = 0
+        deferred = 0
 
         # Собираем кандидатов на отправку (после чисток user_exists/suppression)
         to_send_by_lang: dict[str, list[str]] = {}
@@ -152,17 +158,37 @@ def send_ny2026_tick(max_per_run: int = 1) -> dict:
             chunk_yahoo = int(getattr(settings, "NY2026_BULK_CHUNK_YAHOO", 80) or 80)
             pause_s = float(getattr(settings, "NY2026_BULK_PAUSE_SECONDS", 1.0) or 0.0)
 
-            def _send_and_mark(batch: list[str], *, chunk_size: int) -> tuple[int, int]:
-                """Returns (sent_count_increment, not_sent_count_increment)."""
+            def _release(emails_: list[str]) -> None:
+                """Снимает UNKNOWN-резерв — адреса попадут в следующий тик."""
+                db.query(EmailCampaignRecipient).filter(
+                    EmailCampaignRecipient.campaign_id == campaign.id,
+                    EmailCampaignRecipient.language == lang,
+                    EmailCampaignRecipient.status == EmailCampaignRecipientStatus.UNKNOWN,
+                    EmailCampaignRecipient.email.in_(emails_),
+                ).delete(synchronize_session=False)
+                db.commit()
+
+            def _send_and_mark(batch: list[str], *, chunk_size: int) -> tuple[int, int, int]:
+                """Returns (sent_count_increment, not_sent_count_increment, deferred_count_increment)."""
+                if not batch:
+                    return 0, 0, 0
+
+                granted, _ = email_dispatch.acquire("ny2026", len(batch), partial=True)
+                later = [x.strip().lower() for x in batch[granted:]]
+                batch = batch[:granted]
+                if later:
+                    _release(later)
                 if not batch:
-                    return 0, 0
+                    return 0, 0, len(later)
+
                 try:
-                    res = email_sender.send_new_year_campaign_email_bulk(
-                        batch,
-                        region=lang,
-                        chunk_size=max(1, min(1000, int(chunk_size))),
-                        pause_seconds_between_chunks=max(0.0, float(pause_s)),
-                    )
+                    with paced_externally():
+                        res = email_sender.send_new_year_campaign_email_bulk(
+                            batch,
+                            region=lang,
+                            chunk_size=max(1, min(1000, int(chunk_size))),
+                            pause_seconds_between_chunks=max(0.0, float(pause_s)),
+                        )
                 except Exception as e:
                     logger.warning("NY2026 bulk send failed (lang=%s): %s", lang, e)
                     res = {"ok": False, "sent": 0, "accepted_emails": []}
@@ -182,33 +208,26 @@ def send_ny2026_tick(max_per_run: int = 1) -> dict:
 
                     not_sent = [e for e in all_emails if e not in set(accepted_emails)]
                     if not_sent:
-                        db.query(EmailCampaignRecipient).filter(
-                            EmailCampaignRecipient.campaign_id == campaign.id,
-                            EmailCampaignRecipient.language == lang,
-                            EmailCampaignRecipient.status == EmailCampaignRecipientStatus.UNKNOWN,
-                            EmailCampaignRecipient.email.in_(not_sent),
-                        ).delete(synchronize_session=False)
+                        _release(not_sent)
                     db.commit()
-                    return int(res.get("sent", 0)), max(0, len(all_emails) - len(accepted_emails))
+                    return int(res.get("sent", 0)), max(0, len(all_emails) - len(accepted_emails)), len(later)
 
                 # Вообще не отправилось — удаляем UNKNOWN recipients, чтобы был повтор позже
-                db.query(EmailCampaignRecipient).filter(
-                    EmailCampaignRecipient.campaign_id == campaign.id,
-                    EmailCampaignRecipient.language == lang,
-                    EmailCampaignRecipient.status == EmailCampaignRecipientStatus.UNKNOWN,
-                    EmailCampaignRecipient.email.in_(all_emails),
-                ).delete(synchronize_session=False)
-                db.commit()
-                return 0, len(all_emails)
+                _release(all_emails)
+                return 0, len(all_emails), len(later)
 
             # Отправляем сначала Yahoo (самый строгий), потом Gmail, потом остальных
-            s1, f1 = _send_and_mark(yahoo_emails, chunk_size=chunk_yahoo)
-            s2, f2 = _send_and_mark(gmail_emails, chunk_size=chunk_gmail)
-            s3, f3 = _send_and_mark(other_emails, chunk_size=chunk_default)
+            s1, f1, d1 = _send_and_mark(yahoo_emails, chunk_size=chunk_yahoo)
+            s2, f2, d2 = _send_and_mark(gmail_emails, chunk_size=chunk_gmail)
+            s3, f3, d3 = _send_and_mark(other_emails, chunk_size=chunk_default)
             sent += (s1 + s2 + s3)
             failed += (f1 + f2 + f3)
+            deferred += (d1 + d2 + d3)
 
-        return {"status": "ok", "sent": sent, "skipped_user_exists": skipped_user_exists, "failed": failed}
+        return {
+            "status": "ok", "sent": sent, "skipped_user_exists": skipped_user_exists,
+            "failed": failed, "deferred": deferred,
+        }
     finally:
         db.close()
 
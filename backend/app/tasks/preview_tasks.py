@@ -9,14 +9,18 @@ import re
 import subprocess
 import tempfile
 import time
+import uuid
+import asyncio
 import redis
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from urllib.parse import urlsplit, urlunsplit, quote, unquote
 
 import boto3
+import httpx
 import requests
-from celery import shared_task
+from celery import group, shared_task
+from sqlalchemy import or_, update
 from sqlalchemy.exc import DataError
 from sqlalchemy.orm import Session
 from botocore.config import Config
@@ -48,8 +52,26 @@ QUEUED_TTL = 45 * 60
 
 REQUEST_TIMEOUT = 10
 
+# Проверка «живости» SUCCESS-превью (только фоновый sweeper, не запросы пользователей)
+CHECK_TTL             = timedelta(hours=6)
+SWEEP_BATCH           = 500        # строк за один keyset-шаг
+SWEEP_MAX_PER_RUN     = int(os.getenv("PREVIEW_SWEEP_MAX_PER_RUN", "3000"))   # глобальный потолок за запуск
+SWEEP_CONCURRENCY     = int(os.getenv("PREVIEW_SWEEP_CONCURRENCY", "20"))
+SWEEP_HEAD_TIMEOUT    = 4
+SWEEP_LOCK_KEY        = "preview:sweep_lock"
+SWEEP_LOCK_TTL        = 30 * 60
+
 rds = redis.Redis.from_url(REDIS_URL, decode_responses=False)
 
+# снимаем lock, только если он всё ещё наш: после истечения TTL его мог взять другой sweeper
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_release_lock = rds.register_script(_RELEASE_LOCK_LUA)
+
 s3 = s3_client(signature_version="s3v4")
 
 def _key(prefix: str, video_link: str) -> str:
@@ -211,49 +233,6 @@ def preview_url_for(video_link: str) -> tuple[str | None, bool]:
 
     return None, False
 
-@shared_task(
-    name="app.tasks.preview_tasks.check_preview_url",
-    bind=True,
-    max_retries=0
-)
-def check_preview_url(self, video_link: str) -> None:
-    """
-    Проверяет, жив ли URL превью. Если мёртв — ставит на перегенерацию.
-    Вызывается асинхронно при запросе /by-page для URL, которые давно не проверялись.
-    """
-    db: Session = SessionLocal()
-    try:
-        row = db.query(LessonPreview).filter_by(video_link=video_link).first()
-        if not row or row.status != PreviewStatus.SUCCESS:
-            return
-        
-        # Проверяем URL
-        try:
-            r = requests.head(row.preview_url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-            is_alive = r.status_code == 200
-        except requests.RequestException:
-            is_alive = False
-        
-        now = datetime.utcnow()
-        row.checked_at = now
-        
-        if not is_alive:
-            logger.warning("[check_preview_url] dead url %s → reschedule", row.preview_url)
-            row.status = PreviewStatus.FAILED
-            row.updated_at = now
-            db.commit()
-            # Ставим на перегенерацию
-            generate_preview.apply_async(
-                (video_link,),
-                task_id=hashlib.sha1(video_link.encode()).hexdigest(),
-                queue="default"
-            )
-        else:
-            db.commit()
-    finally:
-        db.close()
-
-
 @shared_task(
     name="app.tasks.preview_tasks.generate_preview",
     bind=True,
@@ -390,3 +369,105 @@ def generate_preview(self, video_link: str) -> None:
         db.close()
         if tmp_path and Path(tmp_path).exists():
             Path(tmp_path).unlink(missing_ok=True)
+
+
+async def _check_urls_alive(urls: list[str]) -> dict[str, bool]:
+    """HEAD по уникальным URL с ограничением параллелизма."""
+    sem = asyncio.Semaphore(SWEEP_CONCURRENCY)
+    limits = httpx.Limits(max_connections=SWEEP_CONCURRENCY, max_keepalive_connections=SWEEP_CONCURRENCY)
+
+    async with httpx.AsyncClient(timeout=SWEEP_HEAD_TIMEOUT, follow_redirects=True, limits=limits) as client:
+        async def check(url: str) -> bool:
+            async with sem:
+                try:
+                    r = await client.head(url)
+                    return r.status_code == 200
+                except httpx.HTTPError:
+                    return False
+
+        results = await asyncio.gather(*(check(u) for u in urls))
+    return dict(zip(urls, results))
+
+
+@shared_task(name="app.tasks.preview_tasks.sweep_preview_liveness")
+def sweep_preview_liveness(max_rows: int = SWEEP_MAX_PER_RUN) -> dict:
+    """
+    Периодическая проверка SUCCESS-превью, которые не проверялись дольше CHECK_TTL.
+
+    • строки выбираются keyset-пагинацией по id пачками SWEEP_BATCH;
+    • URL проверяются параллельно (asyncio + httpx, не больше SWEEP_CONCURRENCY);
+    • checked_at / статус обновляются пачкой, мёртвые превью — FAILED
+      и одной group-отправкой уходят в generate_preview;
+    • один sweeper одновременно (lock в Redis) и не больше max_rows проверок
+      за запуск — суммарная частота HEAD к CDN ограничена расписанием beat.
+    """
+    token = uuid.uuid4().hex.encode()
+    if not rds.set(SWEEP_LOCK_KEY, token, nx=True, ex=SWEEP_LOCK_TTL):
+        return {"status": "skipped", "reason": "locked"}
+
+    db: Session = SessionLocal()
+    checked = dead = 0
+    try:
+        stale_before = datetime.utcnow() - CHECK_TTL
+        last_id = 0
+        while checked < max_rows:
+            rows = (
+                db.query(LessonPreview.id, LessonPreview.video_link, LessonPreview.preview_url)
+                .filter(
+                    LessonPreview.status == PreviewStatus.SUCCESS,
+                    or_(LessonPreview.checked_at.is_(None), LessonPreview.checked_at < stale_before),
+                    LessonPreview.id > last_id,
+                )
+                .order_by(LessonPreview.id)
+                .limit(min(SWEEP_BATCH, max_rows - checked))
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+            checked += len(rows)
+
+            alive = asyncio.run(_check_urls_alive(list({r.preview_url for r in rows})))
+            now = datetime.utcnow()
+            alive_ids = [r.id for r in rows if alive[r.preview_url]]
+            dead_rows = [r for r in rows if not alive[r.preview_url]]
+
+            if alive_ids:
+                db.execute(
+                    update(LessonPreview)
+                    .where(LessonPreview.id.in_(alive_ids))
+                    .values(checked_at=now)
+                )
+            if dead_rows:
+                db.execute(
+                    update(LessonPreview)
+                    .where(
+                        LessonPreview.id.in_([r.id for r in dead_rows]),
+                        LessonPreview.status == PreviewStatus.SUCCESS,
+                    )
+                    .values(checked_at=now, status=PreviewStatus.FAILED, updated_at=now)
+                )
+            db.commit()
+
+            if dead_rows:
+                dead += len(dead_rows)
+                for r in dead_rows:
+                    logger.warning("[sweep_preview_liveness] dead url %s → reschedule", r.preview_url)
+                # Флаг queued — как у preview_service: повторно не ставим уже поставленные
+                pipe = rds.pipeline(transaction=False)
+                for r in dead_rows:
+                    pipe.set(_key("preview:queued", r.video_link), b"1", nx=True, ex=QUEUED_TTL)
+                to_enqueue = [r.video_link for r, ok in zip(dead_rows, pipe.execute()) if ok]
+                if to_enqueue:
+                    group(
+                        generate_preview.si(link).set(
+                            task_id=hashlib.sha1(link.encode()).hexdigest(), queue="default",
+                        )
+                        for link in to_enqueue
+                    ).apply_async()
+    finally:
+        db.close()
+        _release_lock(keys=[SWEEP_LOCK_KEY], args=[token])
+
+    logger.info("[sweep_preview_liveness] checked=%d dead=%d", checked, dead)
+    return {"status": "ok", "checked": checked, "dead": dead}
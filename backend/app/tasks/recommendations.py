@@ -0,0 +1,28 @@
+import logging
+
+from celery import shared_task
+
+from ..db.database import SessionLocal
+from ..services_v2.recommendation_service import build_copurchase_matrix, publish_copurchase_matrix
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="app.tasks.recommendations.build_copurchase_matrix")
+def build_copurchase_matrix_task():
+    """
+    Пересобирает матрицу совместных покупок курсов и выкладывает её в Redis.
+    Веб-воркеры подхватывают новую версию сами (recommendation_service).
+    """
+    db = SessionLocal()
+    try:
+        matrix = build_copurchase_matrix(db)
+        publish_copurchase_matrix(matrix)
+        logger.info("build_copurchase_matrix: version=%s courses=%s nnz=%s",
+                    matrix.version, len(matrix.course_ids), len(matrix.indices))
+        return {"version": matrix.version, "courses": len(matrix.course_ids), "nnz": len(matrix.indices)}
+    except Exception:
+        logger.exception("build_copurchase_matrix failed")
+        raise
+    finally:
+        db.close()
@@ -1,6 +1,5 @@
 # app/tasks/referral_campaign.py
 
-import time
 from datetime import datetime
 
 from celery import shared_task
@@ -9,15 +8,14 @@ from sqlalchemy import exists
 
 from ..db.database import SessionLocal
 from ..core.config import settings
-from ..utils import email_sender
+from ..services_v2 import email_dispatch
 from ..models.models_v2 import User, Invitation, ReferralCampaignEmail
 from ..utils.user_language import get_user_preferred_language
 
 # лимит за один прогон (~55 писем/час для 165 писем/час суммарно)
 MAX_HOURLY_REFERRAL_EMAILS = 55
 
-# задержка между отправками писем (секунды) — защита от Gmail rate limit
-EMAIL_SEND_DELAY_SECONDS = 3
+EMAIL_CAMPAIGN = "referral"
 
 
 def _get_session() -> Session:
@@ -36,7 +34,10 @@ def send_referral_campaign_batch(max_per_run: int | None = None) -> str:
         * ещё НЕ отправляли это письмо (нет ReferralCampaignEmail),
         * нет зарегистрированных рефералов (invited_users пустой),
         * нет отправленных инвайтов (Invitation.sender_id = user.id);
-    - шлём письмо, пишем запись в ReferralCampaignEmail.
+    - пишем запись ReferralCampaignEmail со статусом "pending" (повторно
+      пользователь не выбирается) и ставим письмо в общую очередь
+      email_dispatch; статус sent/error выставит _on_mail_result, а если
+      письмо не удалось поставить в очередь — сразу error.
     """
     limit = max_per_run or MAX_HOURLY_REFERRAL_EMAILS
     db = _get_session()
@@ -68,50 +69,63 @@ def send_referral_campaign_batch(max_per_run: int | None = None) -> str:
         if not users:
             return "No eligible users for referral campaign"
 
-        sent_count = 0
+        outbox = []
 
         for user in users:
             referral_code = user.referral_code or str(user.id)
             referral_link = f"{settings.APP_URL}/ref/{referral_code}"
 
-            status = "error"
-            error_message: str | None = None
-            sent_at = None
+            # Определяем предпочитаемый язык пользователя
+            user_language = get_user_preferred_language(user, db)
+            record = ReferralCampaignEmail(
+                user_id=user.id,
+                email=user.email,
+                status="pending",
+            )
+            db.add(record)
+            outbox.append((record, {
+                "recipient_email": user.email,
+                "referral_link": referral_link,
+                "region": user_language,
+                "bonus_percent": 50,
+            }))
+
+        db.commit()
 
+        # строки уже закоммичены (id нужен колбэку) — если постановка упала,
+        # помечаем их error, иначе они навсегда остались бы pending
+        failed = 0
+        for record, mail_kwargs in outbox:
             try:
-                # Определяем предпочитаемый язык пользователя
-                user_language = get_user_preferred_language(user, db)
-                ok = email_sender.send_referral_program_email(
-                    recipient_email=user.email,
-                    referral_link=referral_link,
-                    region=user_language,
-                    bonus_percent=50,
+                email_dispatch.enqueue_email(
+                    EMAIL_CAMPAIGN,
+                    "send_referral_program_email",
+                    kwargs=mail_kwargs,
+                    on_result="app.tasks.referral_campaign:_on_mail_result",
+                    context={"record_id": record.id},
                 )
-                if ok:
-                    status = "sent"
-                    sent_at = datetime.utcnow()
-                    sent_count += 1
-                    # задержка между отправками для избежания Gmail rate limit
-                    time.sleep(EMAIL_SEND_DELAY_SECONDS)
-                else:
-                    status = "error"
-                    error_message = "send_html_email returned False"
             except Exception as exc:
-                status = "error"
-                error_message = str(exc)
-
-            db.add(
-                ReferralCampaignEmail(
-                    user_id=user.id,
-                    email=user.email,
-                    status=status,
-                    error_message=error_message,
-                    sent_at=sent_at,
-                )
-            )
+                failed += 1
+                record.status = "error"
+                record.error_message = f"enqueue failed: {exc}"
+        if failed:
+            db.commit()
+        return f"Queued referral campaign emails: {len(outbox) - failed}, enqueue failed: {failed}"
+
+    finally:
+        db.close()
 
-        db.commit()
-        return f"Sent referral campaign emails: {sent_count}"
 
+def _on_mail_result(ok: bool, context: dict) -> None:
+    """Колбэк email_dispatch: итоговый статус записи ReferralCampaignEmail."""
+    db = _get_session()
+    try:
+        values = {"status": "sent", "sent_at": datetime.utcnow(), "error_message": None}
+        if not ok:
+            values = {"status": "error", "error_message": context.get("error")}
+        db.query(ReferralCampaignEmail).filter(
+            ReferralCampaignEmail.id == context["record_id"],
+        ).update(values, synchronize_session=False)
+        db.commit()
     finally:
         db.close()
@@ -1,10 +1,12 @@
 import logging
 import os
+import re
 from celery import shared_task
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from sqlalchemy import exc as sa_exc
 
 from ..db.database import SessionLocal  # скорректируй путь
+from ..services_v2 import lesson_video_index
 
 logger = logging.getLogger(__name__)
 
@@ -22,13 +24,24 @@ PAT_BAD = (
     r'(?:/|\?|#|$)'
 )
 
+# те же домены, но для source_host из индекса lesson_videos
+_UUID = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+HOST_OLD = re.compile(_UUID + r'\.(selstorage\.ru|s3\.twcstorage\.ru)$')
+HOST_BAD = re.compile(_UUID + r'-c(?:dn|loud)\.dent-s\.com$')
+
+_TABLES = (
+    ("landings", "lessons_info", lesson_video_index.ENTITY_LANDING),
+    ("courses", "sections", lesson_video_index.ENTITY_COURSE),
+)
+
 # Используем S3_PUBLIC_HOST из окружения (с fallback для совместимости)
 REPLACEMENT = os.getenv("S3_PUBLIC_HOST", "https://cloud.dent-s.com").rstrip('/') + '/'
 REGEXP_TIME_LIMIT_MS = 5000
 USE_HINT = True  # выключи, если MariaDB или MySQL < 8.0.21
 
 
-def _update_table(db, table: str, column: str):
+def _update_table(db, table: str, column: str, ids: list[int] | None = None):
+    """ids=None — вся таблица, иначе только строки с этими id."""
     hint = f"/*+ SET_VAR(regexp_time_limit={REGEXP_TIME_LIMIT_MS}) */ " if USE_HINT else ""
     # два прохода: сначала старые домены, затем «uuid-<public-host>»
     sql = f"""
@@ -42,13 +55,30 @@ def _update_table(db, table: str, column: str):
                        :pat_bad, :cdn, 1, 0    -- БЕЗ 'c'
                    ) AS JSON
                )
-         WHERE {column} REGEXP :pat_old
-            OR {column} REGEXP :pat_bad;
+         WHERE ({column} REGEXP :pat_old
+            OR {column} REGEXP :pat_bad)
+           {"AND id IN :ids" if ids is not None else ""};
+    """
+    params = {"pat_old": PAT_OLD, "pat_bad": PAT_BAD, "cdn": REPLACEMENT}
+    stmt = text(sql)
+    if ids is not None:
+        stmt = stmt.bindparams(bindparam("ids", expanding=True))
+        params["ids"] = ids
+    db.execute(stmt, params)
+
+
+def _affected_entities(db) -> dict[str, list[int]] | None:
     """
-    db.execute(
-        text(sql),
-        {"pat_old": PAT_OLD, "pat_bad": PAT_BAD, "cdn": REPLACEMENT}
-    )
+    {entity_type: [id]} курсов/лендингов со ссылками на старые домены — по source_host
+    индекса lesson_videos. None — индекс пуст, нужен полный проход.
+    """
+    if not lesson_video_index.is_built(db):
+        return None
+    hosts = [
+        h for h in lesson_video_index.source_hosts(db)
+        if HOST_OLD.match(h) or HOST_BAD.match(h)
+    ]
+    return lesson_video_index.entities_on_hosts(db, hosts)
 
 
 @shared_task(
@@ -60,7 +90,7 @@ def _update_table(db, table: str, column: str):
     acks_late=True,
     task_reject_on_worker_lost=True,
 )
-def replace_storage_links(self):
+def replace_storage_links(self, full_scan: bool = False):
     """
     Заменяет:
       https://<uuid>.selstorage.ru/...  или  https://<uuid>.s3.twcstorage.ru/...
@@ -68,16 +98,28 @@ def replace_storage_links(self):
       https://<uuid>-<public-host>/...
     на:
       <S3_PUBLIC_HOST>/...
-    в landings.lessons_info и courses.sections
+    в landings.lessons_info и courses.sections.
+
+    По умолчанию трогает только курсы/лендинги, у которых индекс lesson_videos
+    видит такие хосты в ссылках уроков; full_scan=True (или пустой индекс) —
+    REGEXP по таблицам целиком, как раньше (ссылки вне уроков, например превью).
     """
     db = SessionLocal()
     try:
         with db.begin():
+            targets = None if full_scan else _affected_entities(db)
             # Не трогаем SESSION-переменную: у вас только GLOBAL.
-            _update_table(db, "landings", "lessons_info")
-            _update_table(db, "courses", "sections")
+            for table, column, entity_type in _TABLES:
+                if targets is None:
+                    _update_table(db, table, column)
+                elif targets.get(entity_type):
+                    _update_table(db, table, column, targets[entity_type])
+                    lesson_video_index.sync(db, entity_type, targets[entity_type])
 
-        logger.info("replace_storage_links: success")
+        logger.info(
+            "replace_storage_links: success (%s)",
+            "full scan" if targets is None else {k: len(v) for k, v in targets.items()},
+        )
     except Exception as exc:
         logger.exception("replace_storage_links: failure")
         raise self.retry(exc=exc)
@@ -0,0 +1,54 @@
+import logging
+from datetime import datetime, timedelta
+
+from celery import shared_task
+
+from ..db.database import SessionLocal
+from ..services_v2 import traffic_rollup
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="app.tasks.traffic_rollup.refresh_traffic_rollups")
+def refresh_traffic_rollups(max_rows: int | None = None):
+    """
+    Переносит новые визиты/покупки (id > high-water mark) в почасовые роллапы
+    traffic_hourly / traffic_totals. См. services_v2.traffic_rollup.
+
+    • beat — раз в минуту; параллельные запуски ждут друг друга на строках
+      traffic_rollup_state (FOR UPDATE);
+    • после миграции 007 историю догоняет пачками по max_rows id на источник.
+    """
+    db = SessionLocal()
+    try:
+        kwargs = {"max_rows": max_rows} if max_rows else {}
+        stats = traffic_rollup.refresh(db, **kwargs)
+        if stats:
+            logger.info("refresh_traffic_rollups: %s", stats)
+        return stats
+    except Exception:
+        logger.exception("refresh_traffic_rollups failed")
+        raise
+    finally:
+        db.close()
+
+
+@shared_task(name="app.tasks.traffic_rollup.rebuild_traffic_rollups")
+def rebuild_traffic_rollups(days: int | None = None):
+    """
+    Пересчитывает роллапы из сырых таблиц.
+
+    • days=N — последние N суток (ночная сверка: удалённые покупки, поздние коммиты);
+    • days=None — вся история (бэкфилл после миграции 007).
+    """
+    db = SessionLocal()
+    try:
+        since = datetime.utcnow() - timedelta(days=days) if days else None
+        stats = traffic_rollup.rebuild(db, since)
+        logger.info("rebuild_traffic_rollups(days=%s): %s", days, stats)
+        return stats
+    except Exception:
+        logger.exception("rebuild_traffic_rollups failed")
+        raise
+    finally:
+        db.close()
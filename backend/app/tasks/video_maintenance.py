@@ -6,7 +6,7 @@ import os
 import subprocess
 import tempfile
 import time
-from datetime import timedelta
+from datetime import datetime, timedelta
 from dataclasses import asdict
 from typing import Any, Dict, List, Optional
 from urllib.parse import unquote
@@ -24,6 +24,8 @@ from ..core.storage import (
 )
 from ..core.video_maintenance_config import VIDEO_MAINTENANCE
 from ..db.database import SessionLocal
+from ..services_v2 import lesson_video_index
+from ..utils import s3_meta_index
 from ..utils.db_url_rewrite import rewrite_references_for_key
 from ..utils.s3 import generate_presigned_url
 from ..utils.video_key_normalizer import canonicalize_s3_key
@@ -57,17 +59,10 @@ def _acl_is_public_read(key: str) -> Optional[bool]:
     Возвращает:
     - True/False если удалось проверить ACL
     - None если хранилище/права не позволяют читать ACL (тогда не считаем ошибкой)
+    Ответ берётся из индекса метаданных, если ACL ключа уже известен.
     """
     try:
-        resp = s3.get_object_acl(Bucket=S3_BUCKET, Key=key)
-        grants = resp.get("Grants", []) or []
-        for g in grants:
-            gr = g.get("Grantee", {}) or {}
-            if gr.get("URI") == "http://acs.amazonaws.com/groups/global/AllUsers":
-                perm = (g.get("Permission") or "").upper()
-                if perm in ("READ", "FULL_CONTROL"):
-                    return True
-        return False
+        return s3_meta_index.acl_public(key, client=s3)
     except Exception:
         return None
 
@@ -93,6 +88,7 @@ def _ensure_public_read_acl(keys: list[str], *, dry_run: bool) -> dict:
             continue
         try:
             s3.put_object_acl(Bucket=S3_BUCKET, Key=k, ACL="public-read")
+            s3_meta_index.record(k, acl_public=True)
             fixed.append(k)
         except Exception as e:
             errors.append(f"{k}: {type(e).__name__}: {e}")
@@ -113,6 +109,7 @@ def _copy_replace_metadata(key: str, meta: dict, *, content_type: str = "video/m
         ACL="public-read",
         ContentType=content_type,
     )
+    s3_meta_index.drop([key])
 
 
 def _check_moov_position(url: str) -> dict:
@@ -161,8 +158,7 @@ def _check_moov_position(url: str) -> dict:
 R_CURSOR = "video_maint:cursor_token"
 R_LOCK_PREFIX = "video_maint:lock:"
 R_AUDIT = "video_maint:audit"
-R_DB_TICK_CURSOR = "video_maint:dbtick_cursor"
-R_DB_TICK_LOCK = "video_maint:dbtick_lock"
+R_S3_SWEEP_LOCK = "s3_meta_sweep"
 
 
 def _lock(key: str, ttl_sec: int = 60 * 30) -> bool:
@@ -176,12 +172,9 @@ def _unlock(key: str) -> None:
         pass
 
 
-def _s3_exists(key: str) -> bool:
-    try:
-        s3.head_object(Bucket=S3_BUCKET, Key=key)
-        return True
-    except ClientError:
-        return False
+def _s3_exists(key: str, *, fresh: bool = False) -> bool:
+    # fresh=True — только сеть (например, проверка результата copy_object после таймаута)
+    return s3_meta_index.exists(key, client=s3, fresh=fresh)
 
 
 def _audit(event: dict, keep_last: int = 200) -> None:
@@ -198,111 +191,12 @@ def _audit(event: dict, keep_last: int = 200) -> None:
         pass
 
 
-def _is_our_video_ref(v: str) -> bool:
-    """
-    Фильтр ссылок из БД (courses.sections / landings.lessons_info):
-    - только mp4
-    - только наши домены (cloud/cdn) или r2 endpoint
-    - сторонние источники (boomstream/youtube/...) игнорируем
-    """
-    if not v:
-        return False
-    s = str(v).strip()
-    if not s:
-        return False
-    if "://" not in s:
-        return s.lower().endswith(".mp4")
-    try:
-        from urllib.parse import urlparse
-
-        u = urlparse(s)
-        host = (u.hostname or "").lower()
-        path = (u.path or "").lower()
-        if not path.endswith(".mp4"):
-            return False
-        if host.endswith(".r2.cloudflarestorage.com"):
-            return True
-        if host.endswith(".dent-s.com") or host.endswith(".med-g.com"):
-            return True
-        return False
-    except Exception:
-        return False
-
-
-def _normalize_ref_to_key(v: str) -> str:
-    """
-    Превращает URL/ключ из БД в key, понятный video_maintenance:
-    - для публичных cloud/cdn URL -> key_from_public_or_endpoint_url
-    - для r2 endpoint URL: /<bucket>/<key> -> <key>
-    - снимаем %xx
-    """
-    s = str(v).strip()
-    if not s:
-        return s
-    if "://" not in s:
-        return unquote(s.lstrip("/"))
-    try:
-        from urllib.parse import unquote as _unq, urlparse
-
-        u = urlparse(s)
-        host = (u.hostname or "").lower()
-        if host.endswith(".r2.cloudflarestorage.com"):
-            path = _unq((u.path or "").lstrip("/"))
-            # ожидаемый path-style: /<bucket>/<key>
-            if path.lower().startswith(f"{S3_BUCKET.lower()}/"):
-                return path[len(S3_BUCKET) + 1 :]
-            return path
-        k = key_from_public_or_endpoint_url(s)
-        return _unq(k.lstrip("/"))
-    except Exception:
-        return unquote(key_from_public_or_endpoint_url(s).lstrip("/"))
-
-
-def _extract_course_video_refs(sections: Any) -> list[str]:
-    refs: list[str] = []
-    if isinstance(sections, dict):
-        section_objs = list(sections.values())
-    elif isinstance(sections, list):
-        section_objs = sections
-    else:
-        section_objs = []
-
-    for sec in section_objs:
-        if not isinstance(sec, dict):
-            continue
-        lessons = sec.get("lessons") or []
-        if not isinstance(lessons, list):
-            continue
-        for lesson in lessons:
-            if not isinstance(lesson, dict):
-                continue
-            v = lesson.get("video_link")
-            if isinstance(v, str) and v.strip():
-                refs.append(v.strip())
-    return refs
-
-
-def _extract_landing_video_refs(lessons_info: Any) -> list[str]:
-    refs: list[str] = []
-    if not isinstance(lessons_info, list):
-        return refs
-    for item in lessons_info:
-        if not isinstance(item, dict):
-            continue
-        for _, payload in item.items():
-            if not isinstance(payload, dict):
-                continue
-            v = payload.get("link")
-            if isinstance(v, str) and v.strip():
-                refs.append(v.strip())
-    return refs
-
-
 def _unique_key_if_exists(candidate_key: str, *, salt: str) -> str:
     """
     Если key уже существует — добавляем короткий hash перед расширением.
+    Проверка всегда по сети: устаревший ответ индекса здесь означал бы перезапись чужого файла.
     """
-    if not _s3_exists(candidate_key):
+    if not _s3_exists(candidate_key, fresh=True):
         return candidate_key
 
     h = hashlib.sha1(salt.encode("utf-8", "ignore")).hexdigest()[:8]
@@ -467,8 +361,8 @@ def _fix_mp4_to_compatible(
     if dry_run:
         meta_faststart = None
         try:
-            head = s3.head_object(Bucket=S3_BUCKET, Key=src_key)
-            meta_faststart = (head.get("Metadata", {}) or {}).get("faststart")
+            head = s3_meta_index.head(src_key, client=s3)
+            meta_faststart = head.metadata.get("faststart") if head else None
         except Exception:
             pass
 
@@ -563,6 +457,7 @@ def _fix_mp4_to_compatible(
             "faststart_fact": moov,
         }
 
+    # metadata перезаписывается целиком (REPLACE), поэтому берём её из S3, а не из индекса
     head = s3.head_object(Bucket=S3_BUCKET, Key=src_key)
     meta = dict(head.get("Metadata", {}) or {})
     ct = head.get("ContentType") or "video/mp4"
@@ -679,6 +574,9 @@ def _fix_mp4_to_compatible(
                 "Metadata": meta,
             },
         )
+        s3_meta_index.record(
+            src_key, size=os.path.getsize(out_mp4), content_type=ct, metadata=meta, acl="public-read",
+        )
 
     return {"status": "ok", "action": action, "full_transcode": full, "audio_reencode": audio_re, "faststart_fact": moov}
 
@@ -1013,11 +911,14 @@ def _rename_key_if_needed(
                 ACL="public-read",
                 ContentType=ct,
             )
+            s3_meta_index.record(
+                new_key, size=head.get("ContentLength"), content_type=ct, metadata=meta, acl="public-read",
+            )
             break
         except (ReadTimeoutError, EndpointConnectionError) as e:
             # возможно, копирование на стороне R2 уже завершилось, а клиент просто не дождался ответа
             try:
-                if _s3_exists(new_key):
+                if _s3_exists(new_key, fresh=True):
                     logger.warning(
                         "[video_maintenance] copy_object timeout but new_key exists; assuming success. old=%s new=%s",
                         old_key,
@@ -1062,6 +963,7 @@ def _delete_old_key(*, old_key: str, dry_run: bool) -> None:
         return
     try:
         s3.delete_object(Bucket=S3_BUCKET, Key=old_key)
+        s3_meta_index.forget([old_key])
     except Exception:
         logger.exception("[video_maintenance] failed to delete old key %s", old_key)
 
@@ -1091,89 +993,100 @@ def _process_one(
         return {"status": "skipped", "reason": "locked", "old_key": old_key}
 
     try:
-        t0 = time.time()
-        logger.info("[video_maintenance] start old_key=%s dry_run=%s delete_old_key=%s", old_key, dry_run, delete_old_key)
-        # 0) Идемпотентность: если старого key уже нет (например, delete_old_key=true в прошлом запуске),
-        # пытаемся работать по ожидаемому нормализованному key.
-        old_exists = _s3_exists(old_key)
-        resolved_old_key = old_key
-        if not old_exists:
-            candidate = canonicalize_s3_key(old_key)
-            if candidate and _s3_exists(candidate):
-                resolved_old_key = candidate
-            else:
-                # нечего чинить: файла нет ни по old_key, ни по canonical
-                return {"status": "error", "old_key": old_key, "error": "NotFound: source mp4 key missing"}
-
-        # 1) rename key
-        if (not dry_run) and (resolved_old_key != old_key):
-            # Уже переименовано ранее
-            rename = {"status": "already_renamed", "old_key": old_key, "new_key": resolved_old_key}
-            new_key = resolved_old_key
+        return _process_one_locked(old_key=old_key, dry_run=dry_run, delete_old_key=delete_old_key)
+    except ClientError as e:
+        # S3 не нашёл объект, который индекс считал существующим: сбрасываем записи,
+        # чтобы следующий прогон задачи проверил ключи по сети
+        if str((e.response or {}).get("Error", {}).get("Code")) in ("404", "NoSuchKey", "NotFound"):
+            s3_meta_index.drop([old_key, canonicalize_s3_key(old_key) or old_key])
+        raise
+    finally:
+        _unlock(old_key)
+
+
+def _process_one_locked(*, old_key: str, dry_run: bool, delete_old_key: bool) -> dict:
+    """Тело _process_one под lock'ом ключа."""
+    t0 = time.time()
+    logger.info("[video_maintenance] start old_key=%s dry_run=%s delete_old_key=%s", old_key, dry_run, delete_old_key)
+    # 0) Идемпотентность: если старого key уже нет (например, delete_old_key=true в прошлом запуске),
+    # пытаемся работать по ожидаемому нормализованному key.
+    old_exists = _s3_exists(old_key)
+    resolved_old_key = old_key
+    if not old_exists:
+        candidate = canonicalize_s3_key(old_key)
+        if candidate and _s3_exists(candidate):
+            resolved_old_key = candidate
         else:
-            rename = _rename_key_if_needed(old_key=old_key, dry_run=dry_run)
-            new_key = rename.get("new_key") or old_key
-        logger.info("[video_maintenance] rename=%s old=%s new=%s", rename.get("status"), old_key, new_key)
-
-        # 2) mp4 fix (faststart + codecs)
-        # В dry-run новый ключ ещё не создан, поэтому кодеки нужно определять по реальному (старому) объекту.
-        probe_key = (old_key if dry_run else new_key)
-        mp4_fix = _fix_mp4_to_compatible(src_key=probe_key, dry_run=dry_run)
-        if dry_run and probe_key != new_key:
-            mp4_fix = dict(mp4_fix)
-            mp4_fix["probe_key"] = probe_key
-            mp4_fix["would_apply_to_key"] = new_key
-        logger.info("[video_maintenance] mp4_action=%s key=%s", mp4_fix.get("action"), probe_key)
-
-        # 3) HLS validate/repair + alias
-        hls = _validate_and_fix_hls_for(
-            new_key,
-            dry_run=dry_run,
-            fallback_src_keys=[old_key, resolved_old_key],
-        )
-        logger.info(
-            "[video_maintenance] hls_status=%s reason=%s key=%s",
-            hls.get("status"),
-            hls.get("reason"),
-            new_key,
-        )
+            # нечего чинить: файла нет ни по old_key, ни по canonical
+            return {"status": "error", "old_key": old_key, "error": "NotFound: source mp4 key missing"}
+
+    # 1) rename key
+    if (not dry_run) and (resolved_old_key != old_key):
+        # Уже переименовано ранее
+        rename = {"status": "already_renamed", "old_key": old_key, "new_key": resolved_old_key}
+        new_key = resolved_old_key
+    else:
+        rename = _rename_key_if_needed(old_key=old_key, dry_run=dry_run)
+        new_key = rename.get("new_key") or old_key
+    logger.info("[video_maintenance] rename=%s old=%s new=%s", rename.get("status"), old_key, new_key)
+
+    # 2) mp4 fix (faststart + codecs)
+    # В dry-run новый ключ ещё не создан, поэтому кодеки нужно определять по реальному (старому) объекту.
+    probe_key = (old_key if dry_run else new_key)
+    mp4_fix = _fix_mp4_to_compatible(src_key=probe_key, dry_run=dry_run)
+    if dry_run and probe_key != new_key:
+        mp4_fix = dict(mp4_fix)
+        mp4_fix["probe_key"] = probe_key
+        mp4_fix["would_apply_to_key"] = new_key
+    logger.info("[video_maintenance] mp4_action=%s key=%s", mp4_fix.get("action"), probe_key)
+
+    # 3) HLS validate/repair + alias
+    hls = _validate_and_fix_hls_for(
+        new_key,
+        dry_run=dry_run,
+        fallback_src_keys=[old_key, resolved_old_key],
+    )
+    logger.info(
+        "[video_maintenance] hls_status=%s reason=%s key=%s",
+        hls.get("status"),
+        hls.get("reason"),
+        new_key,
+    )
 
-        # 4) DB rewrite old->new (только если rename был)
-        db_report = None
-        if new_key != old_key:
-            db = SessionLocal()
-            try:
-                with db.begin():
-                    db_report = rewrite_references_for_key(db, old_key=old_key, new_key=new_key, dry_run=dry_run)
-            finally:
-                db.close()
-            try:
-                logger.info("[video_maintenance] db_updated=%s old=%s new=%s", (db_report or {}).get("updated"), old_key, new_key)
-            except Exception:
-                pass
+    # 4) DB rewrite old->new (только если rename был)
+    db_report = None
+    if new_key != old_key:
+        db = SessionLocal()
+        try:
+            with db.begin():
+                db_report = rewrite_references_for_key(db, old_key=old_key, new_key=new_key, dry_run=dry_run)
+        finally:
+            db.close()
+        try:
+            logger.info("[video_maintenance] db_updated=%s old=%s new=%s", (db_report or {}).get("updated"), old_key, new_key)
+        except Exception:
+            pass
 
-        # 5) delete old
-        if (new_key != old_key) and delete_old_key and old_exists:
-            _delete_old_key(old_key=old_key, dry_run=dry_run)
-            logger.info("[video_maintenance] deleted_old=%s", old_key)
-
-        result = {
-            "status": "ok",
-            "old_key": old_key,
-            "new_key": new_key,
-            "rename": rename,
-            "mp4": mp4_fix,
-            "hls": hls,
-            "db": db_report,
-            "delete_old_key": bool(delete_old_key and (new_key != old_key)),
-            "public_old": public_url_for_key(old_key, public_host=S3_PUBLIC_HOST),
-            "public_new": public_url_for_key(new_key, public_host=S3_PUBLIC_HOST),
-        }
-        _audit({"ts": int(time.time()), "result": result})
-        logger.info("[video_maintenance] done old=%s new=%s sec=%.1f", old_key, new_key, time.time() - t0)
-        return result
-    finally:
-        _unlock(old_key)
+    # 5) delete old
+    if (new_key != old_key) and delete_old_key and old_exists:
+        _delete_old_key(old_key=old_key, dry_run=dry_run)
+        logger.info("[video_maintenance] deleted_old=%s", old_key)
+
+    result = {
+        "status": "ok",
+        "old_key": old_key,
+        "new_key": new_key,
+        "rename": rename,
+        "mp4": mp4_fix,
+        "hls": hls,
+        "db": db_report,
+        "delete_old_key": bool(delete_old_key and (new_key != old_key)),
+        "public_old": public_url_for_key(old_key, public_host=S3_PUBLIC_HOST),
+        "public_new": public_url_for_key(new_key, public_host=S3_PUBLIC_HOST),
+    }
+    _audit({"ts": int(time.time()), "result": result})
+    logger.info("[video_maintenance] done old=%s new=%s sec=%.1f", old_key, new_key, time.time() - t0)
+    return result
 
 
 @shared_task(name="app.tasks.video_maintenance.tick")
@@ -1300,138 +1213,305 @@ def process_list(
     return {"status": "ok", "dry_run": dry_run, "delete_old_key": delete_old_key, "results": results, "duration_sec": int(time.time() - t0)}
 
 
-@shared_task(name="app.tasks.video_maintenance.tick_db", bind=True)
-def tick_db(self) -> dict:
+# ───────────────────────────── очередь video_maintenance_jobs ─────────────────────────────
+def _job_hash(key: str) -> str:
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _scan_video_refs(db) -> Dict[str, tuple[str, int]]:
+    """
+    Все mp4-ключи из courses.sections и landings.lessons_info: key -> (source, source_id).
+    Читаем индекс lesson_videos (services_v2.lesson_video_index), а не JSON курсов/лендингов;
+    пустой индекс (сразу после миграции 008) сначала собираем.
+    """
+    if not lesson_video_index.is_built(db):
+        lesson_video_index.rebuild(db)
+    return lesson_video_index.our_video_keys(db)
+
+
+def _upsert_jobs(db, rows: list[dict]) -> None:
     """
-    Периодическая DB-driven таска:
-    - идёт по courses.sections и landings.lessons_info (по id asc)
-    - берёт небольшой батч видео за тик
-    - хранит курсор в Redis (entity/id/offset)
-    - использует lock + max_runtime, чтобы держать ровную нагрузку и не копить очередь
+    Новые ключи → pending; существующие не трогаем (кроме last_seen_at),
+    поэтому уже здоровые (done) повторный скан не переобрабатывает.
+    """
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+    from ..models.models_v2 import VideoMaintenanceJob
+
+    step = int(VIDEO_MAINTENANCE.jobs_upsert_chunk)
+    for i in range(0, len(rows), step):
+        stmt = mysql_insert(VideoMaintenanceJob).values(rows[i:i + step])
+        stmt = stmt.on_duplicate_key_update(last_seen_at=stmt.inserted.last_seen_at)
+        db.execute(stmt)
+        db.commit()
+
+
+@shared_task(name="app.tasks.video_maintenance.scan_jobs")
+def scan_jobs(requeue_failed: bool = False) -> dict:
     """
+    Сканер: извлекает и дедуплицирует все ссылки на видео из курсов/лендингов
+    и заводит по строке в video_maintenance_jobs на каждый новый ключ.
+    requeue_failed=True — вернуть failed-задачи в pending (после ручного разбора).
+    """
+    from sqlalchemy import func as sa_func
+    from ..models.models_v2 import VideoMaintenanceJob, VideoJobStatus
+
     t0 = time.time()
-    if not _lock(R_DB_TICK_LOCK, ttl_sec=60 * 20):
-        return {"status": "skipped", "reason": "locked"}
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        before = db.query(sa_func.count(VideoMaintenanceJob.id)).scalar() or 0
+        found = _scan_video_refs(db)
+        rows = [
+            {
+                "key_hash": _job_hash(key),
+                "video_key": key,
+                "source": source,
+                "source_id": source_id,
+                "last_seen_at": now,
+            }
+            for key, (source, source_id) in found.items()
+        ]
+        _upsert_jobs(db, rows)
+
+        requeued = 0
+        if requeue_failed:
+            requeued = (
+                db.query(VideoMaintenanceJob)
+                .filter(VideoMaintenanceJob.status == VideoJobStatus.FAILED)
+                .update(
+                    {
+                        VideoMaintenanceJob.status: VideoJobStatus.PENDING,
+                        VideoMaintenanceJob.attempts: 0,
+                        VideoMaintenanceJob.next_run_at: None,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
 
-    import json
-    from ..models.models_v2 import Course, Landing
+        after = db.query(sa_func.count(VideoMaintenanceJob.id)).scalar() or 0
+    finally:
+        db.close()
 
-    processed: list[dict] = []
-    cursor_raw = rds.get(R_DB_TICK_CURSOR)
-    if cursor_raw:
-        try:
-            cursor = json.loads(cursor_raw)
-        except Exception:
-            cursor = {}
-    else:
-        cursor = {}
+    result = {
+        "status": "ok",
+        "refs": len(found),
+        "new_jobs": int(after - before),
+        "requeued_failed": int(requeued),
+        "duration_sec": round(time.time() - t0, 1),
+    }
+    logger.info("[video_maintenance] scan_jobs %s", result)
+    return result
 
-    entity = cursor.get("entity") or "course"  # course|landing
-    last_id = int(cursor.get("last_id") or 0)
-    current_id = int(cursor.get("current_id") or 0)
-    offset = int(cursor.get("offset") or 0)
 
-    max_videos = int(VIDEO_MAINTENANCE.db_tick_max_videos_per_run)
-    max_runtime = int(VIDEO_MAINTENANCE.db_tick_max_runtime_sec)
+def _release_stale_jobs(db) -> int:
+    """running без движения дольше jobs_stale_running_sec — воркер умер; возвращаем в очередь."""
+    from sqlalchemy import case
+    from ..models.models_v2 import VideoMaintenanceJob as J, VideoJobStatus
 
-    def _save_cursor(*, entity_: str, last_id_: int, current_id_: int, offset_: int) -> None:
-        try:
-            rds.set(
-                R_DB_TICK_CURSOR,
-                json.dumps(
-                    {"entity": entity_, "last_id": last_id_, "current_id": current_id_, "offset": offset_},
-                    ensure_ascii=False,
+    now = datetime.utcnow()
+    n = (
+        db.query(J)
+        .filter(
+            J.status == VideoJobStatus.RUNNING,
+            J.locked_at < now - timedelta(seconds=VIDEO_MAINTENANCE.jobs_stale_running_sec),
+        )
+        .update(
+            {
+                J.status: case(
+                    (J.attempts >= VIDEO_MAINTENANCE.jobs_max_attempts, VideoJobStatus.FAILED.value),
+                    else_=VideoJobStatus.ERROR.value,
                 ),
-            )
-        except Exception:
-            pass
+                J.last_error: "stale lock: worker did not finish",
+                J.next_run_at: now,
+                J.locked_at: None,
+                J.locked_by: None,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return int(n or 0)
 
-    try:
-        db = SessionLocal()
-        try:
-            while len(processed) < max_videos and (time.time() - t0) < max_runtime:
-                # 1) найти текущую сущность, если current_id=0 (или закончились refs)
-                if entity == "course":
-                    if current_id:
-                        obj = db.query(Course).filter(Course.id == current_id).first()
-                    else:
-                        obj = db.query(Course).filter(Course.id > last_id).order_by(Course.id.asc()).first()
-                        current_id = int(getattr(obj, "id", 0) or 0) if obj else 0
-                    if not obj:
-                        # закончились курсы -> переходим на лендинги
-                        entity = "landing"
-                        last_id = 0
-                        current_id = 0
-                        offset = 0
-                        _save_cursor(entity_=entity, last_id_=last_id, current_id_=current_id, offset_=offset)
-                        continue
 
-                    refs_raw = _extract_course_video_refs(getattr(obj, "sections", None))
-                else:
-                    if current_id:
-                        obj = db.query(Landing).filter(Landing.id == current_id).first()
-                    else:
-                        obj = db.query(Landing).filter(Landing.id > last_id).order_by(Landing.id.asc()).first()
-                        current_id = int(getattr(obj, "id", 0) or 0) if obj else 0
-                    if not obj:
-                        # закончились лендинги -> начинаем с курсов сначала
-                        entity = "course"
-                        last_id = 0
-                        current_id = 0
-                        offset = 0
-                        _save_cursor(entity_=entity, last_id_=last_id, current_id_=current_id, offset_=offset)
-                        continue
+def _claim_jobs(db, *, limit: int, worker: str) -> list[tuple[int, str, int]]:
+    """
+    Захватывает до limit готовых задач: SELECT … FOR UPDATE SKIP LOCKED
+    (строки, взятые другими воркерами, пропускаются без ожидания) → running.
+    Возвращает [(id, video_key, attempts)].
+    """
+    from sqlalchemy import or_
+    from ..models.models_v2 import VideoMaintenanceJob as J, VideoJobStatus
+
+    now = datetime.utcnow()
+    rows = (
+        db.query(J.id, J.video_key, J.attempts)
+        .filter(
+            J.status.in_([VideoJobStatus.PENDING, VideoJobStatus.ERROR]),
+            or_(J.next_run_at.is_(None), J.next_run_at <= now),
+        )
+        .order_by(J.next_run_at.asc(), J.id.asc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not rows:
+        db.commit()
+        return []
+
+    db.query(J).filter(J.id.in_([r[0] for r in rows])).update(
+        {
+            J.status: VideoJobStatus.RUNNING,
+            J.locked_at: now,
+            J.locked_by: worker[:100],
+            J.attempts: J.attempts + 1,
+        },
+        synchronize_session=False,
+    )
+    db.commit()
+    return [(int(r[0]), r[1], int(r[2]) + 1) for r in rows]
 
-                    refs_raw = _extract_landing_video_refs(getattr(obj, "lessons_info", None))
-
-                # 2) фильтруем и нормализуем
-                refs = [_normalize_ref_to_key(v) for v in refs_raw if _is_our_video_ref(v)]
-                # дедуп, сохраняя порядок
-                refs = list(dict.fromkeys([r for r in refs if r]))
-
-                if offset >= len(refs):
-                    # сущность закончилась -> к следующей
-                    last_id = current_id
-                    current_id = 0
-                    offset = 0
-                    _save_cursor(entity_=entity, last_id_=last_id, current_id_=current_id, offset_=offset)
-                    continue
-
-                # 3) обработаем один элемент из текущей сущности (батч маленький, но равномерный)
-                key = refs[offset]
-                self.update_state(
-                    state="PROGRESS",
-                    meta={
-                        "phase": "db_tick",
-                        "entity": entity,
-                        "entity_id": current_id,
-                        "done": len(processed),
-                        "total": max_videos,
-                        "current": key,
-                        "offset": offset,
-                        "refs_in_entity": len(refs),
-                    },
-                )
-                try:
-                    r = _process_one(old_key=key, dry_run=False, delete_old_key=True)
-                except Exception as e:
-                    logger.exception("[video_maintenance] db_tick failed for %s", key)
-                    r = {"status": "error", "old_key": key, "error": f"{type(e).__name__}: {e}"}
-                processed.append(r)
-
-                offset += 1
-                _save_cursor(entity_=entity, last_id_=last_id, current_id_=current_id, offset_=offset)
-        finally:
-            db.close()
+
+def _job_summary(r: dict) -> dict:
+    def _field(name: str, sub: str):
+        v = r.get(name)
+        return v.get(sub) if isinstance(v, dict) else None
+
+    return {
+        "status": r.get("status"),
+        "reason": r.get("reason"),
+        "new_key": r.get("new_key"),
+        "rename": _field("rename", "status"),
+        "mp4": _field("mp4", "action"),
+        "hls": _field("hls", "status"),
+        "db_updated": _field("db", "updated"),
+    }
+
+
+def _finish_job(db, *, job_id: int, key: str, attempts: int, r: dict) -> str:
+    """Фиксирует итог прогона; возвращает новый статус задачи."""
+    from ..models.models_v2 import VideoMaintenanceJob as J, VideoJobStatus
+
+    now = datetime.utcnow()
+    cfg = VIDEO_MAINTENANCE
+    values: Dict[Any, Any] = {J.locked_at: None, J.locked_by: None, J.result: _job_summary(r)}
+    status = r.get("status")
+
+    if status == "skipped" and r.get("reason") == "locked":
+        # ключ сейчас чинит ручной прогон — это не ошибка, попытку не засчитываем
+        values.update({
+            J.status: VideoJobStatus.PENDING,
+            J.attempts: J.attempts - 1,
+            J.next_run_at: now + timedelta(seconds=cfg.jobs_locked_retry_sec),
+        })
+    elif status in ("ok", "skipped"):
+        values.update({
+            J.status: VideoJobStatus.DONE,
+            J.last_error: None,
+            J.next_run_at: None,
+            J.finished_at: now,
+        })
+    else:
+        failed = attempts >= cfg.jobs_max_attempts
+        values.update({
+            J.status: VideoJobStatus.FAILED if failed else VideoJobStatus.ERROR,
+            J.last_error: str(r.get("error") or "unknown error")[:2000],
+            J.next_run_at: None if failed else now + timedelta(seconds=cfg.jobs_retry_base_sec * 2 ** (attempts - 1)),
+            J.finished_at: now,
+        })
+
+    db.query(J).filter(J.id == job_id).update(values, synchronize_session=False)
+
+    # ключ переименован и ссылки в БД переписаны: новый ключ уже здоров,
+    # следующий скан не должен завести его как pending
+    new_key = r.get("new_key")
+    if status == "ok" and new_key and new_key != key:
+        _upsert_jobs_done(db, new_key, now)
+
+    db.commit()
+    return values[J.status].value
+
+
+def _upsert_jobs_done(db, key: str, now: datetime) -> None:
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+    from ..models.models_v2 import VideoMaintenanceJob, VideoJobStatus
+
+    stmt = mysql_insert(VideoMaintenanceJob).values(
+        key_hash=_job_hash(key),
+        video_key=key,
+        source="rename",
+        status=VideoJobStatus.DONE,
+        finished_at=now,
+        last_seen_at=now,
+    )
+    db.execute(stmt.on_duplicate_key_update(status=stmt.inserted.status, finished_at=stmt.inserted.finished_at))
+
+
+@shared_task(name="app.tasks.video_maintenance.tick_db", bind=True)
+def tick_db(self) -> dict:
+    """
+    Периодический воркер очереди video_maintenance_jobs:
+    - захватывает небольшой батч задач через SKIP LOCKED (без глобального lock'а —
+      тики на разных воркерах идут параллельно и берут разные ключи);
+    - обрабатывает их по одной, пишет статус/попытки/ошибку в таблицу;
+    - max_runtime держит ровный ритм, expires в beat не даёт копить очередь.
+    Очередь наполняет scan_jobs.
+    """
+    t0 = time.time()
+    max_videos = int(VIDEO_MAINTENANCE.db_tick_max_videos_per_run)
+    max_runtime = int(VIDEO_MAINTENANCE.db_tick_max_runtime_sec)
+    worker = f"{self.request.hostname or 'worker'}:{os.getpid()}"
+
+    processed: list[dict] = []
+    released = 0
+    db = SessionLocal()
+    try:
+        released = _release_stale_jobs(db)
+        while len(processed) < max_videos and (time.time() - t0) < max_runtime:
+            jobs = _claim_jobs(db, limit=1, worker=worker)
+            if not jobs:
+                break
+            job_id, key, attempts = jobs[0]
+            self.update_state(
+                state="PROGRESS",
+                meta={"phase": "db_tick", "job_id": job_id, "current": key, "done": len(processed), "total": max_videos},
+            )
+            try:
+                r = _process_one(old_key=key, dry_run=False, delete_old_key=True)
+            except Exception as e:
+                logger.exception("[video_maintenance] db_tick failed for %s", key)
+                r = {"status": "error", "old_key": key, "error": f"{type(e).__name__}: {e}"}
+            try:
+                r["job_status"] = _finish_job(db, job_id=job_id, key=key, attempts=attempts, r=r)
+            except Exception:
+                db.rollback()
+                logger.exception("[video_maintenance] failed to record job %s", job_id)
+            processed.append(r)
     finally:
-        _unlock(R_DB_TICK_LOCK)
+        db.close()
 
     return {
-        "status": "ok",
+        "status": "ok" if processed else "empty",
+        "worker": worker,
+        "released_stale": released,
         "processed_count": len(processed),
         "processed": processed,
-        "cursor": {"entity": entity, "last_id": last_id, "current_id": current_id, "offset": offset},
         "duration_sec": int(time.time() - t0),
     }
 
 
+@shared_task(name="app.tasks.video_maintenance.sweep_s3_meta_index")
+def sweep_s3_meta_index(prefix: str = "") -> dict:
+    """
+    Наполняет индекс метаданных S3 (utils.s3_meta_index) одним проходом
+    list_objects_v2: mp4/m3u8 и списки HLS-плейлистов становятся локальными
+    ответами для диагностики, тиков и проверок HLS.
+    """
+    if not _lock(R_S3_SWEEP_LOCK, ttl_sec=60 * 60 * 2):
+        return {"status": "skipped", "reason": "locked"}
+    try:
+        result = s3_meta_index.sweep(prefix, client=s3)
+    finally:
+        _unlock(R_S3_SWEEP_LOCK)
+    logger.info("[video_maintenance] s3 meta sweep %s", result)
+    return result
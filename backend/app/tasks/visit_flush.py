@@ -0,0 +1,32 @@
+import logging
+
+from celery import shared_task
+
+from ..db.database import SessionLocal
+from ..services_v2.visit_ingest import flush
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="app.tasks.visit_flush.flush_visits")
+def flush_visits(batch_size: int | None = None):
+    """
+    Сбрасывает буфер визитов лендингов (Redis stream) в БД многострочными INSERT-ами
+    и обновляет рекламные флаги один раз на лендинг за пачку. См. services_v2.visit_ingest.
+
+    • запускается beat-ом каждые несколько секунд; параллельные запуски
+      отсекаются Redis-локом внутри flush();
+    • если воркер лежал, накопленный хвост разбирается за несколько запусков.
+    """
+    db = SessionLocal()
+    try:
+        kwargs = {"batch_size": batch_size} if batch_size else {}
+        stats = flush(db, **kwargs)
+        if stats.get("events"):
+            logger.info("flush_visits: %s", stats)
+        return stats
+    except Exception:
+        logger.exception("flush_visits failed")
+        raise
+    finally:
+        db.close()
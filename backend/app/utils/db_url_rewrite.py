@@ -1,45 +1,54 @@
 from __future__ import annotations
 
+import json
 import logging
-from dataclasses import dataclass
-from typing import Iterable
+from dataclasses import dataclass, field
+from typing import Any, Callable, Mapping, Optional
 from urllib.parse import quote, unquote, urlparse
 
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from sqlalchemy import exc as sa_exc
 
-from ..core.config import settings
 from ..core.storage import S3_PUBLIC_HOST, public_url_for_key
 
 logger = logging.getLogger(__name__)
 
 
-_CANDIDATE_COLS_CACHE: list["ColumnRef"] | None = None
-
-
 @dataclass(frozen=True)
 class ColumnRef:
     table_name: str
     column_name: str
-    data_type: str
+    # json — JSON уроков/контента: переписываем структурно (строковые значения-ссылки);
+    # url  — в колонке целиком одна ссылка: меняем, только если её key совпал с old_key;
+    # text — свободный текст/HTML: замена подстрок (как REPLACE)
+    kind: str
 
 
-# Оптимизация: в этом проекте ссылки на медиа/видео ожидаются только в ограниченном наборе колонок.
-# Это резко ускоряет rewrite (вместо скана information_schema и апдейтов по сотням колонок).
-_ALLOWLIST_COLS: list["ColumnRef"] = [
+# В этом проекте ссылки на медиа/видео ожидаются только в ограниченном наборе колонок.
+_ALLOWLIST_COLS: list[ColumnRef] = [
     # core content
     ColumnRef("courses", "sections", "json"),
     ColumnRef("landings", "lessons_info", "json"),
     ColumnRef("landings", "course_program", "text"),
-    ColumnRef("landings", "preview_photo", "varchar"),
-    ColumnRef("lesson_previews", "video_link", "text"),
-    ColumnRef("lesson_previews", "preview_url", "varchar"),
+    ColumnRef("landings", "preview_photo", "url"),
+    ColumnRef("lesson_previews", "video_link", "url"),
+    ColumnRef("lesson_previews", "preview_url", "url"),
     # books / creatives
-    ColumnRef("book_creatives", "s3_url", "varchar"),
-    ColumnRef("book_files", "s3_url", "varchar"),
-    ColumnRef("books", "cover_url", "varchar"),
+    ColumnRef("book_creatives", "s3_url", "url"),
+    ColumnRef("book_files", "s3_url", "url"),
+    ColumnRef("books", "cover_url", "url"),
 ]
-_USE_ALLOWLIST_ONLY: bool = True
+
+# JSON-колонки уроков, владельцы ключей которых известны из индекса lesson_videos:
+# строки выбираются по id владельцев вместо LIKE-скана таблицы.
+_INDEXED_COLS: dict[tuple[str, str], str] = {
+    ("courses", "sections"): "course",
+    ("landings", "lessons_info"): "landing",
+}
+
+# сколько переименований кладём в одну OR-цепочку LIKE (для неиндексированных колонок)
+LIKE_RENAMES_PER_QUERY = 40
+UPDATE_CHUNK = 500
 
 
 def _q_ident(name: str) -> str:
@@ -47,271 +56,280 @@ def _q_ident(name: str) -> str:
     return "`" + (name or "").replace("`", "``") + "`"
 
 
-def _load_candidate_columns(db) -> list[ColumnRef]:
-    """
-    Ищем колонки, где *могут* лежать ссылки на CDN/S3 key.
-    Делается один раз за процесс (кэшируется).
-    """
-    sql = text(
-        """
-        SELECT table_name, column_name, data_type
-          FROM information_schema.columns
-         WHERE table_schema = :schema
-           AND data_type IN (
-                'json',
-                'varchar',
-                'text',
-                'longtext',
-                'mediumtext',
-                'tinytext'
-           )
-        """
-    )
-    rows = db.execute(sql, {"schema": settings.DB_NAME}).fetchall()
-    cols = [ColumnRef(r[0], r[1], (r[2] or "").lower()) for r in rows]
-    logger.info("[db_url_rewrite] discovered %d candidate columns", len(cols))
-    return cols
-
-
-def discover_candidate_columns(db) -> list[ColumnRef]:
-    global _CANDIDATE_COLS_CACHE
-    if _USE_ALLOWLIST_ONLY:
-        # Не кэшируем через information_schema вообще — используем фиксированный список.
-        # Если какой-то таблицы нет (например courses_backup), ошибки отлавливаются ниже и таблица будет пропущена.
-        return _ALLOWLIST_COLS
-    if _CANDIDATE_COLS_CACHE is None:
-        _CANDIDATE_COLS_CACHE = _load_candidate_columns(db)
-    return _CANDIDATE_COLS_CACHE
-
-
-def _drop_table_from_cache(table_name: str) -> None:
+def _is_missing_table(e: Exception) -> bool:
+    # (1146) Table doesn't exist — например, удалили courses_backup на лету;
+    # на некоторых MySQL/MariaDB прилетает как OperationalError
+    msg = str(getattr(e, "orig", e))
+    return "1146" in msg or "doesn't exist" in msg
+
+
+def _encoded_key_variants(k: str) -> list[str]:
     """
-    Если таблицу удалили/переименовали во время работы процесса, то кэш information_schema
-    становится неактуальным. Удаляем все колонки этой таблицы из кэша, чтобы не падать.
+    В проекте встречаются разные варианты percent-encoding для URL:
+    - иногда `(` и `)` остаются как есть
+    - иногда они кодируются как %28/%29 (например, когда URL копируют из браузера)
     """
-    global _CANDIDATE_COLS_CACHE
-    if not _CANDIDATE_COLS_CACHE:
-        return
-    tn = (table_name or "").lower()
-    _CANDIDATE_COLS_CACHE = [c for c in _CANDIDATE_COLS_CACHE if (c.table_name or "").lower() != tn]
+    raw = unquote((k or "").lstrip("/"))
+    variants = [
+        quote(raw, safe="/-._~()"),  # "мягкий" (скобки как есть)
+        quote(raw, safe="/-._~"),    # "строгий" (скобки тоже кодируются)
+    ]
+    # уникализируем, сохраняя порядок
+    return list(dict.fromkeys([v for v in variants if v]))
+
+
+@dataclass
+class _Rename:
+    old_raw: str
+    new_raw: str
+    # (старая форма key, новая форма key) в порядке приоритета: encoded-варианты, затем «сырой»
+    forms: list[tuple[str, str]] = field(default_factory=list)
+
+    @classmethod
+    def build(cls, old_key: str, new_key: str) -> "_Rename":
+        old_raw = unquote(old_key.strip().lstrip("/"))
+        new_raw = unquote(new_key.strip().lstrip("/"))
+        old_enc = _encoded_key_variants(old_raw)
+        new_enc = _encoded_key_variants(new_raw)
+        forms = list(zip(old_enc, new_enc)) + [(old_raw, new_raw)]
+        # JSON-escaped слеши ('\/') встречаются в тексте, сохранённом из JSON
+        forms += [(o.replace("/", r"\/"), n.replace("/", r"\/")) for o, n in forms if "/" in o]
+        return cls(old_raw, new_raw, list(dict.fromkeys(f for f in forms if f[0] != f[1])))
+
+    def like_patterns(self) -> list[str]:
+        # % и _ внутри key оставляем как есть: LIKE лишь отбирает кандидатов,
+        # точная проверка — в Python
+        return list(dict.fromkeys(f"%{o}%" for o, _ in self.forms if "\\" not in o))
+
+
+def _swap_ref(value: str, rename: _Rename) -> str:
+    """Ссылка, чей key совпал с old_key → та же ссылка с new_key (хост/кодирование сохраняем)."""
+    for old_form, new_form in rename.forms:
+        if old_form in value:
+            return value.replace(old_form, new_form)
+    # key совпал после нормализации, но в тексте в другом кодировании — собираем URL заново
+    if "://" in value:
+        u = urlparse(value.strip())
+        return public_url_for_key(rename.new_raw, public_host=f"{u.scheme}://{u.netloc}")
+    return rename.new_raw
+
+
+def _ref_rewriter(renames: Mapping[str, _Rename]) -> Callable[[str], Optional[str]]:
+    from ..services_v2.lesson_video_index import normalize_ref_to_key
+
+    def rewrite(value: str) -> Optional[str]:
+        if not value or not value.strip():
+            return None
+        rename = renames.get(normalize_ref_to_key(value))
+        return _swap_ref(value, rename) if rename else None
+
+    return rewrite
+
+
+def _text_rewriter(renames: Mapping[str, _Rename]) -> Callable[[str], Optional[str]]:
+    def rewrite(value: str) -> Optional[str]:
+        if not value:
+            return None
+        out = value
+        for rename in renames.values():
+            for old_form, new_form in rename.forms:
+                if old_form in out:
+                    out = out.replace(old_form, new_form)
+                    break
+        return out if out != value else None
+
+    return rewrite
+
+
+def _rewrite_json(node: Any, rewrite: Callable[[str], Optional[str]]) -> tuple[Any, int]:
+    """Обход JSON: меняем только строковые значения-ссылки. Возвращает (новый JSON, число замен)."""
+    if isinstance(node, str):
+        new = rewrite(node)
+        return (new, 1) if new is not None else (node, 0)
+    if isinstance(node, dict):
+        out, n = {}, 0
+        for k, v in node.items():
+            out[k], c = _rewrite_json(v, rewrite)
+            n += c
+        return out, n
+    if isinstance(node, list):
+        out_l, n = [], 0
+        for v in node:
+            nv, c = _rewrite_json(v, rewrite)
+            out_l.append(nv)
+            n += c
+        return out_l, n
+    return node, 0
+
+
+def _load_json(v: Any) -> Any:
+    if isinstance(v, (bytes, bytearray)):
+        v = v.decode("utf-8")
+    if isinstance(v, str):
+        try:
+            return json.loads(v)
+        except ValueError:
+            return None
+    return v
 
 
-def rewrite_references_for_key(
+def _table_candidates(
+    db,
+    table: str,
+    cols: list[ColumnRef],
+    renames: list[_Rename],
+    owners: Optional[dict[str, list[int]]],
+) -> list[tuple]:
+    """
+    Строки таблицы, где может встречаться любой из old_key: один SELECT (id + все колонки)
+    на пачку переименований. Индексированные JSON-колонки — по id владельцев,
+    остальные — OR-цепочка LIKE.
+    """
+    select_cols = ", ".join(_q_ident(c.column_name) for c in cols)
+    id_filters: list[int] = []
+    like_cols: list[ColumnRef] = []
+    for c in cols:
+        entity_type = _INDEXED_COLS.get((c.table_name, c.column_name))
+        if entity_type and owners is not None:
+            id_filters.extend(owners.get(entity_type, []))
+        else:
+            like_cols.append(c)
+
+    rows: dict[int, tuple] = {}
+    if id_filters:
+        stmt = text(
+            f"SELECT id, {select_cols} FROM {_q_ident(table)} WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        for r in db.execute(stmt, {"ids": sorted(set(id_filters))}).fetchall():
+            rows[r[0]] = tuple(r)
+
+    if like_cols:
+        for start in range(0, len(renames), LIKE_RENAMES_PER_QUERY):
+            patterns = [p for rn in renames[start:start + LIKE_RENAMES_PER_QUERY] for p in rn.like_patterns()]
+            where_parts, params = [], {}
+            for c in like_cols:
+                expr = _q_ident(c.column_name)
+                if c.kind == "json":
+                    expr = f"CAST({expr} AS CHAR CHARACTER SET utf8mb4)"
+                for p in patterns:
+                    pname = f"like_{len(params)}"
+                    where_parts.append(f"{expr} LIKE :{pname}")
+                    params[pname] = p
+            sql = text(f"SELECT id, {select_cols} FROM {_q_ident(table)} WHERE {' OR '.join(where_parts)}")
+            for r in db.execute(sql, params).fetchall():
+                rows[r[0]] = tuple(r)
+    return list(rows.values())
+
+
+def rewrite_references(
     db,
+    renames: Mapping[str, str],
     *,
-    old_key: str,
-    new_key: str,
     dry_run: bool = False,
 ) -> dict:
     """
-    Точечная замена ссылок/ключей в БД для одного mp4:
-    - меняем как полный URL, так и «сырой» key (если где-то хранится без хоста)
-    - поддерживаем JSON колонки через CAST(... AS CHAR) -> REPLACE -> CAST(... AS JSON)
+    Замена ссылок/ключей в БД сразу для многих mp4 (old_key → new_key):
+    - один проход на таблицу для всей пачки переименований;
+    - courses.sections / landings.lessons_info: владельцы ключей берутся из индекса
+      lesson_videos (пока он пуст — LIKE по CAST AS CHAR), JSON переписывается
+      структурно: меняются только строки, чей нормализованный key совпал с old_key;
+    - url-колонки — так же по значению целиком, text-колонки — заменой подстрок;
+    - dry_run=True ничего не пишет и отдаёт точное число строк, которые изменились бы.
+    Работает в транзакции вызывающего; индекс lesson_videos изменённых курсов/лендингов
+    пересобирается здесь же.
     """
-    if not old_key or not new_key or old_key == new_key:
-        return {"dry_run": dry_run, "updated": 0, "by_column": []}
-
-    # Учитываем, что в БД ссылки могут быть:
-    # - на разных доменах (cloud vs cdn)
-    # - с key в сыром виде (пробелы/юникод) или percent-encoded
-    def _encoded_key_variants(k: str) -> list[str]:
-        """
-        В проекте встречаются разные варианты percent-encoding для URL:
-        - иногда `(` и `)` остаются как есть
-        - иногда они кодируются как %28/%29 (например, когда URL копируют из браузера)
-        Поэтому делаем несколько вариантов encoding, чтобы надёжно матчить старые записи.
-        """
-        raw = unquote((k or "").lstrip("/"))
-        variants = [
-            quote(raw, safe="/-._~()"),  # "мягкий" (скобки как есть)
-            quote(raw, safe="/-._~"),    # "строгий" (скобки тоже кодируются)
-        ]
-        # уникализируем, сохраняя порядок
-        return list(dict.fromkeys([v for v in variants if v]))
-
-    old_key_raw = unquote(old_key.lstrip("/"))
-    new_key_raw = unquote(new_key.lstrip("/"))
-    old_key_enc_variants = _encoded_key_variants(old_key)
-    new_key_enc_variants = _encoded_key_variants(new_key)
-
-    def _host_variants(base: str) -> list[str]:
-        base = (base or "").rstrip("/")
-        out = {base}
-        try:
-            p = urlparse(base)
-            if p.scheme and p.netloc:
-                host = p.netloc
-                # cloud.<x> <-> cdn.<x> (частый кейс в проекте)
-                if host.startswith("cloud."):
-                    out.add(base.replace(host, "cdn." + host[len("cloud."):], 1))
-                if host.startswith("cdn."):
-                    out.add(base.replace(host, "cloud." + host[len("cdn."):], 1))
-        except Exception:
-            pass
-        return [u for u in out if u]
-
-    hosts = _host_variants(S3_PUBLIC_HOST)
-
-    # URL варианты: encoded и “сырой” (иногда в БД хранится без %20)
-    old_urls: list[str] = []
-    new_urls: list[str] = []
-    for h in hosts:
-        for ok in old_key_enc_variants:
-            old_urls.append(f"{h}/{ok}")
-        for nk in new_key_enc_variants:
-            new_urls.append(f"{h}/{nk}")
-        old_urls.append(f"{h}/{old_key_raw}")
-        new_urls.append(f"{h}/{new_key_raw}")
-    # выравниваем длины old/new (для zip ниже) — берём попарно только общие варианты
-    pair_count = min(len(old_urls), len(new_urls))
-    old_urls = old_urls[:pair_count]
-    new_urls = new_urls[:pair_count]
-
-    # В JSON-колонках слеши часто экранируются как '\/' (пример: https:\/\/cdn.dent-s.com\/...)
-    old_urls_json = [u.replace("/", r"\/") for u in old_urls]
-    new_urls_json = [u.replace("/", r"\/") for u in new_urls]
-
-    # Для отчёта: основной (канонический) URL
-    old_url = public_url_for_key(old_key, public_host=S3_PUBLIC_HOST)
-    new_url = public_url_for_key(new_key, public_host=S3_PUBLIC_HOST)
-
-    # Паттерны для LIKE (важен порядок: сначала наиболее вероятные)
-    like_patterns: list[str] = []
-    for u in old_urls:
-        like_patterns.append(f"%{u}%")
-    for u in old_urls_json:
-        like_patterns.append(f"%{u}%")
-    # также пробуем key как raw и encoded (если где-то хранится без хоста)
-    for ok in old_key_enc_variants:
-        like_patterns.append(f"%{ok}%")
-    like_patterns.append(f"%{old_key_raw}%")
-
-    cols = discover_candidate_columns(db)
-    updated_total = 0
-    per_col: list[dict] = []
-    skipped_missing_tables: set[str] = set()
+    from ..services_v2 import lesson_video_index
 
-    for c in cols:
-        table = _q_ident(c.table_name)
-        col = _q_ident(c.column_name)
-
-        # Собираем OR по всем паттернам (ограниченно, чтобы не раздувать запрос)
-        where_parts = []
-        params = {}
-        for i, pat in enumerate(like_patterns[:14]):  # чуть шире, чтобы хватало и JSON-escaped вариантов
-            pname = f"like_{i}"
-            where_parts.append(f"CAST({col} AS CHAR CHARACTER SET utf8mb4) LIKE :{pname}")
-            params[pname] = pat
-        where_sql = " OR ".join(where_parts) if where_parts else "1=0"
-
-        if dry_run:
-            try:
-                count_sql = text(f"SELECT COUNT(*) FROM {table} WHERE {where_sql}")
-                cnt = int(
-                    db.execute(
-                        count_sql,
-                        params,
-                    ).scalar()
-                    or 0
-                )
-                if cnt:
-                    per_col.append({"table": c.table_name, "column": c.column_name, "would_touch": cnt})
-            except sa_exc.ProgrammingError as e:
-                # (1146) Table doesn't exist — например, вы удалили courses_backup на лету
-                msg = str(getattr(e, "orig", e))
-                if "1146" in msg or "doesn't exist" in msg:
-                    skipped_missing_tables.add(c.table_name)
-                    _drop_table_from_cache(c.table_name)
-                    continue
-                raise
+    by_old: dict[str, _Rename] = {}
+    for old_key, new_key in (renames or {}).items():
+        if not old_key or not new_key:
             continue
+        rn = _Rename.build(old_key, new_key)
+        if rn.old_raw and rn.new_raw and rn.old_raw != rn.new_raw:
+            by_old[rn.old_raw] = rn
+    report: dict[str, Any] = {"dry_run": dry_run, "renames": len(by_old), "updated": 0, "by_column": []}
+    if not by_old:
+        return report
+
+    owners: Optional[dict[str, list[int]]] = None
+    if lesson_video_index.is_built(db):
+        owners = lesson_video_index.owners_for_keys(db, by_old)
+
+    rewriters = {
+        "json": _ref_rewriter(by_old),
+        "url": _ref_rewriter(by_old),
+        "text": _text_rewriter(by_old),
+    }
+    tables: dict[str, list[ColumnRef]] = {}
+    for c in _ALLOWLIST_COLS:
+        tables.setdefault(c.table_name, []).append(c)
 
-        # Готовим цепочку REPLACE: сначала URL варианты (обычные и JSON-escaped), потом key варианты.
-        # Важно: используем детерминированные имена параметров (без hash()).
-        def _chain_replace(expr: str) -> str:
-            out = expr
-            for i in range(len(old_urls)):
-                out = f"REPLACE({out}, :old_url_{i}, :new_url_{i})"
-            for i in range(len(old_urls_json)):
-                out = f"REPLACE({out}, :old_url_json_{i}, :new_url_json_{i})"
-            out = f"REPLACE({out}, :old_key_raw, :new_key_raw)"
-            out = f"REPLACE({out}, :old_key_enc, :new_key_enc)"
-            return out
-
-        # Параметры для REPLACE
-        repl_params = dict(params)
-        for i, (ou, nu) in enumerate(zip(old_urls, new_urls)):
-            repl_params[f"old_url_{i}"] = ou
-            repl_params[f"new_url_{i}"] = nu
-        for i, (ou, nu) in enumerate(zip(old_urls_json, new_urls_json)):
-            repl_params[f"old_url_json_{i}"] = ou
-            repl_params[f"new_url_json_{i}"] = nu
-        repl_params.update(
-            {
-                "old_key_raw": old_key_raw,
-                "new_key_raw": new_key_raw,
-                # Берём первый вариант в качестве "основного" для replace raw key.
-                # (остальные варианты закрываются URL-заменами выше)
-                "old_key_enc": old_key_enc_variants[0] if old_key_enc_variants else old_key_raw,
-                "new_key_enc": new_key_enc_variants[0] if new_key_enc_variants else new_key_raw,
-            }
-        )
-
-        if c.data_type == "json":
-            # Важно: предполагаем, что исходный JSON валиден. REPLACE не должен ломать структуру.
-            update_sql = text(
-                f"""
-                UPDATE {table}
-                   SET {col} = CAST({_chain_replace(f"CAST({col} AS CHAR CHARACTER SET utf8mb4)")} AS JSON)
-                 WHERE {where_sql}
-                """
-            )
-        else:
-            update_sql = text(
-                f"""
-                UPDATE {table}
-                   SET {col} = {_chain_replace(col)}
-                 WHERE {where_sql}
-                """
-            )
-
+    skipped_missing_tables: list[str] = []
+    touched: dict[str, list[int]] = {}
+    for table, cols in tables.items():
         try:
-            res = db.execute(
-                update_sql,
-                repl_params,
-            )
-        except sa_exc.ProgrammingError as e:
-            msg = str(getattr(e, "orig", e))
-            if "1146" in msg or "doesn't exist" in msg:
-                skipped_missing_tables.add(c.table_name)
-                _drop_table_from_cache(c.table_name)
+            rows = _table_candidates(db, table, cols, list(by_old.values()), owners)
+        except (sa_exc.ProgrammingError, sa_exc.OperationalError) as e:
+            if _is_missing_table(e):
+                skipped_missing_tables.append(table)
                 continue
             raise
-        except sa_exc.OperationalError as e:
-            # На некоторых MySQL/MariaDB "table doesn't exist" может прилетать как OperationalError
-            msg = str(getattr(e, "orig", e))
-            if "1146" in msg or "doesn't exist" in msg:
-                skipped_missing_tables.add(c.table_name)
-                _drop_table_from_cache(c.table_name)
+
+        for i, c in enumerate(cols, start=1):
+            rewrite = rewriters[c.kind]
+            changes: list[dict] = []
+            for r in rows:
+                value = r[i]
+                if value is None:
+                    continue
+                if c.kind == "json":
+                    new_doc, n = _rewrite_json(_load_json(value), rewrite)
+                    if n:
+                        changes.append({"_id": r[0], "_val": json.dumps(new_doc, ensure_ascii=False)})
+                else:
+                    new = rewrite(str(value))
+                    if new is not None:
+                        changes.append({"_id": r[0], "_val": new})
+            if not changes:
                 continue
-            raise
-        try:
-            rowcount = int(getattr(res, "rowcount", 0) or 0)
-        except Exception:
-            rowcount = 0
-
-        if rowcount:
-            updated_total += rowcount
-            per_col.append({"table": c.table_name, "column": c.column_name, "updated_rows": rowcount})
-
-    return {
-        "dry_run": dry_run,
-        "updated": updated_total,
-        "by_column": per_col,
-        "old_url": old_url,
-        "new_url": new_url,
-        "old_urls_considered": old_urls[:8],
-        "skipped_missing_tables": sorted(skipped_missing_tables)[:20],
-    }
 
+            if dry_run:
+                report["by_column"].append({"table": table, "column": c.column_name, "would_touch": len(changes)})
+                continue
+
+            col = _q_ident(c.column_name)
+            val = "CAST(:_val AS JSON)" if c.kind == "json" else ":_val"
+            stmt = text(f"UPDATE {_q_ident(table)} SET {col} = {val} WHERE id = :_id")
+            for start in range(0, len(changes), UPDATE_CHUNK):
+                db.execute(stmt, changes[start:start + UPDATE_CHUNK])
+            report["updated"] += len(changes)
+            report["by_column"].append({"table": table, "column": c.column_name, "updated_rows": len(changes)})
+
+            entity_type = _INDEXED_COLS.get((table, c.column_name))
+            if entity_type:
+                touched.setdefault(entity_type, []).extend(ch["_id"] for ch in changes)
+
+    for entity_type, ids in touched.items():
+        lesson_video_index.sync(db, entity_type, ids)
+
+    report["skipped_missing_tables"] = skipped_missing_tables
+    return report
 
+
+def rewrite_references_for_key(
+    db,
+    *,
+    old_key: str,
+    new_key: str,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Точечная замена ссылок/ключей в БД для одного mp4 (см. rewrite_references):
+    меняем как полный URL, так и «сырой» key (если где-то хранится без хоста).
+    """
+    if not old_key or not new_key or old_key == new_key:
+        return {"dry_run": dry_run, "updated": 0, "by_column": []}
+    report = rewrite_references(db, {old_key: new_key}, dry_run=dry_run)
+    report["old_url"] = public_url_for_key(old_key, public_host=S3_PUBLIC_HOST)
+    report["new_url"] = public_url_for_key(new_key, public_host=S3_PUBLIC_HOST)
+    return report
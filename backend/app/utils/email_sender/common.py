@@ -1,19 +1,18 @@
 import logging
 import smtplib
-import ssl
 import threading
 import time
 import json
+from contextlib import contextmanager
 from typing import Optional, Tuple
 
-from functools import lru_cache
-import dns.resolver
 import requests
 from email_validator import EmailNotValidError, validate_email
 
 from ...core.config import settings
 from ...db.database import SessionLocal
 from ...models.models_v2 import SuppressionType
+from . import mx_cache, smtp_pool
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +25,19 @@ DEFAULT_MIN_INTERVAL_SECONDS = 5.0
 
 _last_send_time: float = 0.0
 _rate_limit_lock = threading.Lock()
+# Внутри paced_externally() темп задаёт общий token bucket (services_v2.email_dispatch)
+_pacing = threading.local()
+
+
+@contextmanager
+def paced_externally():
+    """Отправки в блоке уже получили токен email_dispatch — локальную паузу не ждём."""
+    prev = getattr(_pacing, "external", False)
+    _pacing.external = True
+    try:
+        yield
+    finally:
+        _pacing.external = prev
 
 
 def _wait_for_rate_limit(min_interval_seconds: float | None = None) -> None:
@@ -35,6 +47,9 @@ def _wait_for_rate_limit(min_interval_seconds: float | None = None) -> None:
     """
     global _last_send_time
 
+    if getattr(_pacing, "external", False):
+        return
+
     if min_interval_seconds is None:
         min_interval = float(
             getattr(settings, "EMAIL_SEND_MIN_INTERVAL_SECONDS", DEFAULT_MIN_INTERVAL_SECONDS)
@@ -70,18 +85,6 @@ TRUSTED_DOMAINS = {
     "comcast.net", "san.rr.com",
 }
 
-VALIDATION_TIMEOUT = 3  # секунды
-
-
-@lru_cache(maxsize=5000)
-def _domain_has_mx(domain: str) -> bool:
-    """
-    Кешируем MX lookup по домену, чтобы на массовых рассылках не делать одинаковые DNS запросы.
-    """
-    answers = dns.resolver.resolve(domain, "MX", lifetime=VALIDATION_TIMEOUT)
-    return bool(answers)
-
-
 def _check_suppression_list(email: str) -> bool:
     """
     Проверяет, заблокирован ли email в suppression list.
@@ -144,46 +147,87 @@ def _is_throttling_error(error_message: str) -> bool:
     return any(pattern in error_lower for pattern in throttle_patterns)
 
 
+def _syntax_error(email_lower: str) -> Optional[str]:
+    """Синтаксическая проверка: текст ошибки или None."""
+    try:
+        validate_email(email_lower, check_deliverability=False)
+    except EmailNotValidError as e:
+        return f"Invalid syntax: {e}"
+    if "@" not in email_lower:
+        return "Invalid email format"
+    return None
+
+
 def _validate_email_sync(email: str) -> Tuple[bool, str]:
     """
     Синхронная валидация email перед отправкой.
-    Проверяет синтаксис и наличие MX записей.
+    Проверяет синтаксис и наличие MX записей (общий кэш в Redis, см. mx_cache).
     
     Returns:
         (is_valid, error_message)
     """
     email_lower = email.lower().strip()
     
-    # 1. Синтаксическая проверка
-    try:
-        validate_email(email_lower, check_deliverability=False)
-    except EmailNotValidError as e:
-        return False, f"Invalid syntax: {e}"
-    
-    # 2. Извлекаем домен
-    if "@" not in email_lower:
-        return False, "Invalid email format"
-    
-    domain = email_lower.split("@", 1)[1]
+    err = _syntax_error(email_lower)
+    if err:
+        return False, err
     
-    # 3. Проверка MX записей
+    return mx_cache.check_domain(email_lower.split("@", 1)[1])
+
+
+def _presend_filter(emails: list[str]) -> Tuple[list[str], list[str], list[str]]:
+    """
+    Массовый этап перед отправкой: (valid, suppressed, invalid) с сохранением порядка.
+    - suppression — одним IN-запросом на весь список (одна сессия БД);
+    - MX — по уникальным доменам параллельно, с общим кэшем в Redis;
+    - новые INVALID пишутся одним batch insert.
+    При ошибке БД, как и в поштучной проверке, не блокируем отправку.
+    """
+    from ...services_v2.email_suppression_service import add_invalid_bulk, suppressed_emails
+
+    blocked: set[str] = set()
     try:
-        if not _domain_has_mx(domain):
-            return False, f"No MX records for domain {domain}"
-    except dns.resolver.NXDOMAIN:
-        return False, f"Domain {domain} does not exist"
-    except dns.resolver.NoAnswer:
-        return False, f"No MX records for domain {domain}"
-    except dns.resolver.Timeout:
-        # При таймауте пропускаем проверку - не блокируем отправку
-        logger.warning("MX lookup timeout for %s", domain)
-        return True, ""
+        db = SessionLocal()
+        try:
+            blocked = suppressed_emails(db, emails)
+        finally:
+            db.close()
     except Exception as e:
-        # При других ошибках DNS пропускаем проверку
-        logger.warning("MX lookup error for %s: %s", domain, e)
-        return True, ""
-    
-    return True, ""
+        logger.warning("Error checking suppression list for %d emails: %s", len(emails), e)
+
+    errors: dict[str, str] = {}
+    candidates: list[str] = []
+    for em in emails:
+        if em in blocked:
+            continue
+        err = _syntax_error(em)
+        if err:
+            errors[em] = err
+        else:
+            candidates.append(em)
+
+    mx = mx_cache.check_domains(em.split("@", 1)[1] for em in candidates)
+    for em in candidates:
+        ok, err = mx.get(em.split("@", 1)[1], (True, ""))
+        if not ok:
+            errors[em] = err
+
+    for em, err in errors.items():
+        logger.info("Invalid email %s: %s", em, err)
+    if errors:
+        try:
+            db = SessionLocal()
+            try:
+                add_invalid_bulk(db, errors)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning("Error adding %d emails to suppression: %s", len(errors), e)
+
+    valid = [em for em in emails if em not in blocked and em not in errors]
+    suppressed = [em for em in emails if em in blocked]
+    invalid = [em for em in emails if em in errors]
+    return valid, suppressed, invalid
 
 
 # ────────────────────────────────────────────────────────────
@@ -429,6 +473,10 @@ def _send_via_mailgun_bulk(
         return False
 
 
+def _fill_recipient_vars(value: str | None, email: str) -> str | None:
+    return value.replace("%recipient.email%", email) if value else value
+
+
 def send_html_email_bulk(
     recipient_emails: list[str],
     subject: str,
@@ -447,7 +495,8 @@ def send_html_email_bulk(
 ) -> dict:
     """
     Массовая отправка одинакового письма.
-    - suppression + email validation (включая MX) выполняется для КАЖДОГО адреса
+    - suppression + email validation (включая MX) — одним массовым этапом
+      для всего списка (_presend_filter)
     - отправка пачками до chunk_size (<=1000)
     """
     # normalize + dedup preserve order
@@ -460,27 +509,9 @@ def send_html_email_bulk(
         seen.add(em)
         normalized.append(em)
 
-    suppressed = 0
-    invalid = 0
-    valid: list[str] = []
-    suppressed_emails: list[str] = []
-    invalid_emails: list[str] = []
-
-    for em in normalized:
-        if _check_suppression_list(em):
-            suppressed += 1
-            if return_email_lists:
-                suppressed_emails.append(em)
-            continue
-        ok, err = _validate_email_sync(em)
-        if not ok:
-            invalid += 1
-            logger.info("Invalid email %s: %s", em, err)
-            _add_to_suppression(em, SuppressionType.INVALID, err)
-            if return_email_lists:
-                invalid_emails.append(em)
-            continue
-        valid.append(em)
+    valid, suppressed_emails, invalid_emails = _presend_filter(normalized)
+    suppressed = len(suppressed_emails)
+    invalid = len(invalid_emails)
 
     if not valid:
         res = {"ok": True, "sent": 0, "suppressed": suppressed, "invalid": invalid}
@@ -532,16 +563,37 @@ def send_html_email_bulk(
             res["invalid_emails"] = invalid_emails
         return res
 
-    # SMTP fallback (slow)
-    sent = 0
-    for em in valid:
-        if _send_via_smtp(em, subject, html_body, text_body=text_body, headers=headers):
-            sent += 1
+    # SMTP fallback: MIME рендерится один раз, письма идут по постоянным
+    # соединениям пула (по одному получателю на письмо, To подставляется).
+    accepted_emails = []
+    pool = smtp_pool.get_pool()
+    if pool is None:
+        logger.error("SMTP error: EMAIL_HOST not configured")
+    else:
+        # %recipient.email% подставляет только Mailgun — здесь рендерим per-recipient
+        per_recipient = enable_recipient_variables and any(
+            "%recipient." in (part or "") for part in (subject, html_body, text_body)
+        )
+        message = None if per_recipient else smtp_pool.prepare_message(
+            settings.EMAIL_SENDER, subject, html_body, text_body=text_body, headers=headers,
+        )
+        for em in valid:
+            _wait_for_rate_limit(min_interval_seconds_override)
+            msg = message or smtp_pool.prepare_message(
+                settings.EMAIL_SENDER,
+                _fill_recipient_vars(subject, em),
+                _fill_recipient_vars(html_body, em),
+                text_body=_fill_recipient_vars(text_body, em),
+                headers=headers,
+            )
+            if _smtp_deliver(pool, msg, em):
+                accepted_emails.append(em)
+    sent = len(accepted_emails)
     res = {"ok": sent == len(valid), "sent": sent, "suppressed": suppressed, "invalid": invalid}
     if return_email_lists:
         # SMTP fallback здесь поштучный: считаем accepted_emails теми, кто реально отправился.
         # Понимание "delivered" всё равно приходит через webhooks.
-        res["accepted_emails"] = valid[:sent]
+        res["accepted_emails"] = accepted_emails
         res["suppressed_emails"] = suppressed_emails
         res["invalid_emails"] = invalid_emails
     return res
@@ -557,70 +609,28 @@ def _send_via_smtp(
     min_interval_seconds_override: float | None = None,
 ) -> bool:
     """
-    Fallback: SMTP-отправка HTML-писем.
+    Fallback: SMTP-отправка HTML-писем через пул постоянных соединений (smtp_pool).
     Работает с портами 25 (без TLS), 465 (SMTPS), 587 (STARTTLS).
     Включён rate limiter для защиты от Gmail rate limit.
     """
     # Rate limit: ждём если слишком частые отправки
     _wait_for_rate_limit(min_interval_seconds_override)
 
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    from email.header import Header
-
-    smtp_server = settings.EMAIL_HOST
-    smtp_port = int(settings.EMAIL_PORT or 0)
-    smtp_username = (getattr(settings, "EMAIL_USERNAME", "") or "").strip()
-    smtp_password = (getattr(settings, "EMAIL_PASSWORD", "") or "").strip()
-    sender_email = settings.EMAIL_SENDER
-
-    if not smtp_server:
+    pool = smtp_pool.get_pool()
+    if pool is None:
         logger.error("SMTP error: EMAIL_HOST not configured")
         return False
 
-    msg = MIMEMultipart("alternative")
-    msg["From"] = sender_email
-    msg["To"] = recipient_email
-    msg["Subject"] = Header(subject, "utf-8")
-    if headers:
-        for name, value in headers.items():
-            if name and value is not None:
-                msg[str(name)] = str(value)
-
-    msg.attach(
-        MIMEText(
-            text_body
-            or "If you see this text, your email client does not support HTML.",
-            "plain",
-            "utf-8",
-        )
+    message = smtp_pool.prepare_message(
+        settings.EMAIL_SENDER, subject, html_body, text_body=text_body, headers=headers,
     )
-    msg.attach(MIMEText(html_body, "html", "utf-8"))
+    return _smtp_deliver(pool, message, recipient_email)
 
-    ctx = ssl.create_default_context()
 
+def _smtp_deliver(pool: "smtp_pool.SMTPPool", message: "smtp_pool.PreparedMessage", recipient_email: str) -> bool:
+    """Одно письмо через пул; throttling → suppression THROTTLED (24h)."""
     try:
-        if smtp_port == 465:
-            with smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=15, context=ctx) as s:
-                if smtp_username and smtp_password:
-                    s.login(smtp_username, smtp_password)
-                s.sendmail(sender_email, [recipient_email], msg.as_string())
-
-        elif smtp_port == 587:
-            with smtplib.SMTP(smtp_server, smtp_port, timeout=15) as s:
-                s.ehlo()
-                s.starttls(context=ctx)
-                s.ehlo()
-                if smtp_username and smtp_password:
-                    s.login(smtp_username, smtp_password)
-                s.sendmail(sender_email, [recipient_email], msg.as_string())
-
-        else:
-            with smtplib.SMTP(smtp_server, smtp_port or 25, timeout=15) as s:
-                if smtp_username and smtp_password:
-                    s.login(smtp_username, smtp_password)
-                s.sendmail(sender_email, [recipient_email], msg.as_string())
-
+        pool.send(message, recipient_email)
         logger.debug("Email sent via SMTP to %s", recipient_email)
         return True
 
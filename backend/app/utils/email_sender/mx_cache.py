@@ -0,0 +1,119 @@
+"""
+Проверка MX-записей доменов получателей с общим кэшем в Redis.
+
+Раньше каждый адрес рассылки проверялся последовательным DNS-запросом, а
+кэшем служил lru_cache процесса (пропадал при рестарте воркера и не делился
+между воркерами). Здесь:
+  • email:mx:<domain> — "1" (MX есть) или "0|<причина>" (NXDOMAIN / нет MX);
+    живёт MX_OK_TTL / MX_FAIL_TTL секунд;
+  • промахи кэша резолвятся параллельно (MX_LOOKUP_CONCURRENCY потоков),
+    результаты пишутся одним pipeline.
+Таймауты и прочие ошибки DNS не кэшируются и, как и раньше, не блокируют
+отправку. Любая ошибка Redis — тихий фолбэк на прямой DNS-запрос.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import dns.resolver
+import redis
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+MX_OK_TTL = int(os.getenv("EMAIL_MX_OK_TTL_SEC", str(7 * 86400)))
+MX_FAIL_TTL = int(os.getenv("EMAIL_MX_FAIL_TTL_SEC", str(86400)))
+MX_LOOKUP_CONCURRENCY = int(os.getenv("EMAIL_MX_LOOKUP_CONCURRENCY", "20"))
+MX_LOOKUP_TIMEOUT = 3  # секунды
+
+_PREFIX = "email:mx:"
+
+_rds: Optional[redis.Redis] = None
+
+
+def _redis() -> Optional[redis.Redis]:
+    global _rds
+    if _rds is None:
+        try:
+            _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+        except Exception as e:
+            logger.warning("[mx] redis unavailable: %s", e)
+            return None
+    return _rds
+
+
+def _lookup(domain: str) -> Tuple[bool, str, bool]:
+    """(есть MX, причина отказа, кэшировать ли результат)."""
+    try:
+        answers = dns.resolver.resolve(domain, "MX", lifetime=MX_LOOKUP_TIMEOUT)
+        if answers:
+            return True, "", True
+        return False, f"No MX records for domain {domain}", True
+    except dns.resolver.NXDOMAIN:
+        return False, f"Domain {domain} does not exist", True
+    except dns.resolver.NoAnswer:
+        return False, f"No MX records for domain {domain}", True
+    except dns.resolver.Timeout:
+        # При таймауте пропускаем проверку - не блокируем отправку
+        logger.warning("MX lookup timeout for %s", domain)
+        return True, "", False
+    except Exception as e:
+        # При других ошибках DNS пропускаем проверку
+        logger.warning("MX lookup error for %s: %s", domain, e)
+        return True, "", False
+
+
+def _decode(v: str) -> Tuple[bool, str]:
+    if v == "1":
+        return True, ""
+    return False, v.split("|", 1)[1] if "|" in v else ""
+
+
+def check_domains(domains: Iterable[str]) -> Dict[str, Tuple[bool, str]]:
+    """{domain: (есть MX, причина отказа)} для уникальных доменов."""
+    domains = sorted({(d or "").strip().lower() for d in domains if d})
+    if not domains:
+        return {}
+
+    out: Dict[str, Tuple[bool, str]] = {}
+    r = _redis()
+    if r is not None:
+        try:
+            for d, v in zip(domains, r.mget([_PREFIX + d for d in domains])):
+                if v is not None:
+                    out[d] = _decode(v)
+        except Exception as e:
+            logger.warning("[mx] redis read failed: %s", e)
+
+    missing = [d for d in domains if d not in out]
+    if not missing:
+        return out
+
+    workers = max(1, min(MX_LOOKUP_CONCURRENCY, len(missing)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_lookup, missing))
+
+    to_cache = []
+    for d, (ok, err, cacheable) in zip(missing, results):
+        out[d] = (ok, err)
+        if cacheable:
+            to_cache.append((d, ok, err))
+
+    if r is not None and to_cache:
+        try:
+            pipe = r.pipeline(transaction=False)
+            for d, ok, err in to_cache:
+                if ok:
+                    pipe.set(_PREFIX + d, "1", ex=MX_OK_TTL)
+                else:
+                    pipe.set(_PREFIX + d, f"0|{err}", ex=MX_FAIL_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("[mx] redis write failed: %s", e)
+    return out
+
+
+def check_domain(domain: str) -> Tuple[bool, str]:
+    return check_domains([domain]).get((domain or "").strip().lower(), (True, ""))
@@ -0,0 +1,244 @@
+"""
+Пул постоянных SMTP-соединений для фолбэка _send_via_smtp.
+
+Раньше на каждое письмо открывалось новое TCP(+TLS)-соединение с повторным
+login, а send_html_email_bulk без Mailgun делал так для каждого получателя.
+Здесь:
+  • соединения (SMTP_SSL на 465, STARTTLS на 587, иначе plain) держатся
+    открытыми и переиспользуются — много писем за одну SMTP-сессию;
+  • перед выдачей соединение, простоявшее дольше SMTP_NOOP_AFTER, проверяется
+    NOOP; мёртвое/старое (SMTP_MAX_AGE, SMTP_MAX_MESSAGES писем) пересоздаётся;
+    обрыв на переиспользованном соединении — одна повторная попытка на свежем;
+  • потокобезопасно: соединение выдаётся одному потоку, одновременно открыто
+    не больше SMTP_POOL_SIZE; после fork (prefork-воркер Celery) пул
+    создаётся заново;
+  • prepare_message() рендерит MIME один раз на шаблон, per-recipient
+    подставляется только заголовок To (PreparedMessage.for_recipient).
+    Рендер сразу с CRLF: bytes smtplib не нормализует (как было с as_string),
+    а голый LF нарушает RFC 5321. Адрес с не-ASCII доменом уходит в IDNA,
+    с не-ASCII локальной частью — как UTF-8 с SMTPUTF8.
+"""
+
+import logging
+import os
+import smtplib
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from email import policy
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Iterator, List, Optional, Tuple
+
+from ...core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SMTP_POOL_SIZE = int(os.getenv("EMAIL_SMTP_POOL_SIZE", "4"))
+SMTP_TIMEOUT = 15              # секунды, как было в _send_via_smtp
+SMTP_NOOP_AFTER = float(os.getenv("EMAIL_SMTP_NOOP_AFTER_SEC", "15"))
+SMTP_MAX_AGE = float(os.getenv("EMAIL_SMTP_MAX_AGE_SEC", "300"))
+SMTP_MAX_MESSAGES = int(os.getenv("EMAIL_SMTP_MAX_MESSAGES", "100"))
+
+DEFAULT_TEXT_BODY = "If you see this text, your email client does not support HTML."
+
+# Header() в Subject требует compat32; CRLF — как после _fix_eols в smtplib
+_SMTP_POLICY = policy.compat32.clone(linesep="\r\n")
+
+
+def _smtp_address(recipient_email: str) -> Tuple[str, bool]:
+    """(адрес для конверта и To, нужен ли SMTPUTF8): домен — в IDNA, локальная часть как есть."""
+    if recipient_email.isascii():
+        return recipient_email, False
+    local, at, domain = recipient_email.rpartition("@")
+    try:
+        domain = domain.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    address = f"{local}{at}{domain}"
+    return address, not address.isascii()
+
+
+@dataclass(frozen=True)
+class PreparedMessage:
+    """Готовое MIME-письмо без заголовка To."""
+    sender: str
+    data: bytes
+
+    def for_recipient(self, recipient_email: str) -> bytes:
+        address, _ = _smtp_address(recipient_email)
+        return b"To: " + address.encode("utf-8") + b"\r\n" + self.data
+
+
+def prepare_message(
+    sender: str,
+    subject: str,
+    html_body: str,
+    *,
+    text_body: Optional[str] = None,
+    headers: Optional[dict] = None,
+) -> PreparedMessage:
+    msg = MIMEMultipart("alternative")
+    msg["From"] = sender
+    msg["Subject"] = Header(subject, "utf-8")
+    if headers:
+        for name, value in headers.items():
+            if name and value is not None:
+                msg[str(name)] = str(value)
+
+    msg.attach(MIMEText(text_body or DEFAULT_TEXT_BODY, "plain", "utf-8"))
+    msg.attach(MIMEText(html_body, "html", "utf-8"))
+    return PreparedMessage(sender=sender, data=msg.as_bytes(policy=_SMTP_POLICY))
+
+
+@dataclass
+class _Conn:
+    smtp: smtplib.SMTP
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    sent: int = 0
+
+    def close(self) -> None:
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPPool:
+    def __init__(self, host: str, port: int, username: str = "", password: str = "", *,
+                 size: int = SMTP_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self._idle: List[_Conn] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+
+    def _connect(self) -> _Conn:
+        ctx = ssl.create_default_context()
+        if self.port == 465:
+            s = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT, context=ctx)
+        elif self.port == 587:
+            s = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            s.ehlo()
+            s.starttls(context=ctx)
+            s.ehlo()
+        else:
+            s = smtplib.SMTP(self.host, self.port or 25, timeout=SMTP_TIMEOUT)
+        try:
+            if self.username and self.password:
+                s.login(self.username, self.password)
+        except Exception:
+            s.close()
+            raise
+        return _Conn(smtp=s)
+
+    def _is_usable(self, conn: _Conn) -> bool:
+        now = time.monotonic()
+        if now - conn.created_at > SMTP_MAX_AGE or conn.sent >= SMTP_MAX_MESSAGES:
+            return False
+        if now - conn.last_used < SMTP_NOOP_AFTER:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _take_idle(self) -> Optional[_Conn]:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn = self._idle.pop()   # LIFO: самое «тёплое» соединение
+            if self._is_usable(conn):
+                return conn
+            conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[_Conn]:
+        """Соединение в монопольное пользование; при ошибке не возвращается в пул."""
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._take_idle() or self._connect()
+            yield conn
+        except Exception:
+            if conn is not None:
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+            self._slots.release()
+
+    def send(self, message: PreparedMessage, recipient_email: str) -> None:
+        """Отправляет письмо одному получателю; ошибки SMTP пробрасываются."""
+        data = message.for_recipient(recipient_email)
+        address, utf8 = _smtp_address(recipient_email)
+        options = ["SMTPUTF8"] if utf8 else []
+        refused: Optional[Exception] = None
+        with self.connection() as conn:
+            try:
+                conn.smtp.sendmail(message.sender, [address], data, options)
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                if conn.sent == 0:
+                    raise
+                # сервер закрыл переиспользуемую сессию — одна попытка на свежей
+                logger.info("SMTP session dropped after %d messages, reconnecting: %r", conn.sent, e)
+                conn.close()
+                fresh = self._connect()
+                conn.smtp, conn.created_at, conn.sent = fresh.smtp, fresh.created_at, 0
+                conn.smtp.sendmail(message.sender, [address], data, options)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+                    smtplib.SMTPNotSupportedError) as e:
+                # отказ по конкретному письму: sendmail уже сделал RSET (или,
+                # без SMTPUTF8 у сервера, не начинал MAIL) — сессия пригодна
+                # для следующих, соединение остаётся в пуле
+                refused = e
+            conn.sent += 1
+        if refused is not None:
+            raise refused
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool: Optional[SMTPPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[SMTPPool]:
+    """Пул процесса по настройкам EMAIL_*; None — EMAIL_HOST не задан."""
+    global _pool, _pool_pid
+    host = settings.EMAIL_HOST
+    if not host:
+        return None
+    port = int(settings.EMAIL_PORT or 0)
+    username = (getattr(settings, "EMAIL_USERNAME", "") or "").strip()
+    password = (getattr(settings, "EMAIL_PASSWORD", "") or "").strip()
+
+    with _pool_lock:
+        pid = os.getpid()
+        if _pool is not None and _pool_pid == pid and \
+                (_pool.host, _pool.port, _pool.username, _pool.password) == (host, port, username, password):
+            return _pool
+        if _pool is not None and _pool_pid == pid:
+            _pool.close()
+        # после fork сокеты родителя не трогаем — просто заводим свой пул
+        _pool, _pool_pid = SMTPPool(host, port, username, password), pid
+        return _pool
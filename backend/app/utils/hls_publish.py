@@ -0,0 +1,292 @@
+"""
+Публикация HLS в S3 параллельно с работой ffmpeg.
+
+• HLSPublisher следит за локальной папкой, пока ffmpeg пишет сегменты, и
+  отдаёт готовые .ts пулу загрузки (utils.s3_upload). Сегмент считается
+  готовым, когда появился следующий (ffmpeg пишет их строго по очереди);
+  после завершения ffmpeg догружается хвост.
+• Плейлисты (.m3u8) публикуются последними — только когда все сегменты
+  уже в S3, поэтому плеер не увидит ссылок на ещё не загруженные файлы.
+• Перезаписанный файл (фолбэк ffmpeg в ту же папку) определяется по
+  (mtime, size) и грузится заново; один ключ одновременно грузится одним потоком.
+• Потоковая выгрузка — только в пустой префикс. Если под ним уже что-то
+  есть (пересборка HLS на месте), старый плейлист ещё раздаёт эти сегменты:
+  всё грузится после успешного ffmpeg, как раньше.
+• Если до finish() дело не дошло (ffmpeg упал, ошибка загрузки), выгруженные
+  этим запуском файлы удаляются из S3 при выходе из with — под префиксом
+  не остаётся сирот без плейлиста. Ключи, существовавшие до запуска, не
+  удаляются никогда.
+• delete_prefix() — удаление префикса пачками delete_objects параллельно с листингом.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from ..core.storage import S3_BUCKET
+from . import s3_meta_index, s3_upload
+
+logger = logging.getLogger(__name__)
+
+HLS_UPLOAD_CONCURRENCY = int(os.getenv("HLS_UPLOAD_CONCURRENCY", "8"))
+SCAN_INTERVAL = 0.5
+DELETE_BATCH = 1000                 # лимит delete_objects
+PLAYLIST_SUFFIX = ".m3u8"
+
+
+class HLSPublisher:
+    """
+    Использование:
+        with HLSPublisher(tmpdir, "path/.hls/slug/", extra_args_for=...) as pub:
+            run_ffmpeg(...)          # сегменты уходят в S3 по мере готовности
+            stats = pub.finish()     # хвост сегментов, затем плейлисты
+    Без finish() (ошибка ffmpeg) плейлисты не публикуются, а загруженные
+    этим publisher сегменты удаляются при выходе (discard).
+    Префикс не пуст (или его не удалось прочитать) — сегменты не стримятся,
+    всё грузит finish().
+    """
+
+    def __init__(
+        self,
+        local_dir: str,
+        s3_prefix: str,
+        *,
+        extra_args_for: Callable[[str], dict],
+        client=None,
+        bucket: str = S3_BUCKET,
+        concurrency: int = HLS_UPLOAD_CONCURRENCY,
+        skip: Iterable[str] = (),
+    ):
+        self.local_dir = local_dir
+        self.s3_prefix = s3_prefix.rstrip("/") + "/"
+        self.extra_args_for = extra_args_for
+        self.client = client
+        self.bucket = bucket
+        self.concurrency = max(1, concurrency)
+        self.skip = set(skip)
+
+        self._lock = threading.Lock()
+        self._uploaded: Dict[str, tuple] = {}
+        self._inflight: set = set()
+        self._futures: list = []
+        self._errors: list = []
+        self._stop = threading.Event()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._watcher: Optional[threading.Thread] = None
+        # rel-пути, существовавшие под префиксом до запуска; None — листинг не удался
+        self._existing: Optional[set] = None
+        self.streaming = False
+
+        self.files = 0
+        self.bytes = 0
+        self.started_at = 0.0
+        self.encode_done_at = 0.0
+        self.finished_at = 0.0
+
+    # ─────────────── жизненный цикл ───────────────
+
+    def __enter__(self) -> "HLSPublisher":
+        self.started_at = time.monotonic()
+        self._existing = self._list_existing()
+        self.streaming = self._existing == set()
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="hls-upload")
+        if self.streaming:
+            self._watcher = threading.Thread(target=self._watch, name="hls-watch", daemon=True)
+            self._watcher.start()
+        else:
+            logger.info("[HLS publish] %s is not empty — uploading after ffmpeg", self.s3_prefix)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._stop_watcher()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=exc_type is not None)
+        if not self.finished_at:
+            self.discard()
+        return False
+
+    def finish(self) -> dict:
+        """ffmpeg завершился: догружаем оставшиеся сегменты, затем плейлисты. Возвращает метрики."""
+        self.encode_done_at = time.monotonic()
+        self._stop_watcher()
+
+        while True:
+            self._drain()
+            if not self._scan(final=True, playlists=False):
+                break
+        self._drain()
+        self._raise_errors()
+
+        self._scan(final=True, playlists=True)
+        self._drain()
+        self._raise_errors()
+
+        self.finished_at = time.monotonic()
+        return self.stats()
+
+    def discard(self) -> List[str]:
+        """
+        Удаляет из S3 то, что этот publisher создал; возвращает удалённые ключи.
+        Перезаписанные ключи, существовавшие до запуска (или все — если
+        листинг не удался), не трогаем.
+        """
+        existing = self._existing
+        with self._lock:
+            keys = [
+                f"{self.s3_prefix}{rel}" for rel in self._uploaded
+                if existing is not None and rel not in existing
+            ]
+            self._uploaded.clear()
+        if not keys:
+            return []
+        client = self.client or s3_upload._default_client()
+        deleted: List[str] = []
+        for i in range(0, len(keys), DELETE_BATCH):
+            deleted.extend(_delete_keys(client, self.bucket, keys[i:i + DELETE_BATCH], self.s3_prefix))
+        s3_meta_index.forget(deleted, bucket=self.bucket)
+        logger.info("[HLS publish] discarded %d of %d uploaded file(s) under %s", len(deleted), len(keys), self.s3_prefix)
+        return deleted
+
+    def stats(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        elapsed = max(end - self.started_at, 1e-6)
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "streamed": self.streaming,
+            "seconds": round(elapsed, 2),
+            "mb_per_s": round(self.bytes / elapsed / (1024 * 1024), 2),
+            # сколько публикация заняла ПОСЛЕ окончания ffmpeg
+            "tail_seconds": round(end - self.encode_done_at, 2) if self.encode_done_at else None,
+        }
+
+    # ─────────────── внутреннее ───────────────
+
+    def _list_existing(self) -> Optional[set]:
+        client = self.client or s3_upload._default_client()
+        try:
+            existing = set()
+            paginator = client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.s3_prefix):
+                existing.update(obj["Key"][len(self.s3_prefix):] for obj in page.get("Contents", []))
+            return existing
+        except Exception as e:
+            logger.warning("[HLS publish] cannot list %s, uploading after ffmpeg: %s", self.s3_prefix, e)
+            return None
+
+    def _stop_watcher(self) -> None:
+        self._stop.set()
+        if self._watcher is not None and self._watcher.is_alive():
+            self._watcher.join()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(SCAN_INTERVAL):
+            try:
+                self._scan(final=False, playlists=False)
+            except Exception as e:  # папка может меняться прямо во время обхода
+                logger.debug("[HLS publish] scan failed: %s", e)
+
+    def _candidates(self, playlists: bool) -> List[tuple]:
+        out = []
+        for root, _, files in os.walk(self.local_dir):
+            for fname in files:
+                if fname in self.skip or fname.endswith(".tmp") or fname == ".DS_Store":
+                    continue
+                if fname.endswith(PLAYLIST_SUFFIX) != playlists:
+                    continue
+                path = os.path.join(root, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                rel = os.path.relpath(path, self.local_dir).replace("\\", "/")
+                out.append((rel, path, (st.st_mtime_ns, st.st_size)))
+        return out
+
+    def _scan(self, *, final: bool, playlists: bool) -> int:
+        candidates = self._candidates(playlists)
+        if not final and candidates:
+            # самый свежий сегмент ffmpeg, возможно, ещё пишет
+            newest = max(candidates, key=lambda c: (c[2][0], c[0]))
+            candidates = [c for c in candidates if c is not newest]
+
+        submitted = 0
+        for rel, path, sig in candidates:
+            with self._lock:
+                if self._uploaded.get(rel) == sig or rel in self._inflight:
+                    continue
+                self._inflight.add(rel)
+            self._futures.append(self._pool.submit(self._upload, rel, path, sig))
+            submitted += 1
+        return submitted
+
+    def _upload(self, rel: str, path: str, sig: tuple) -> None:
+        try:
+            n = s3_upload.upload_file(
+                path,
+                bucket=self.bucket,
+                key=f"{self.s3_prefix}{rel}",
+                extra_args=self.extra_args_for(rel),
+                client=self.client,
+            )
+            with self._lock:
+                self._uploaded[rel] = sig
+                self.files += 1
+                self.bytes += n
+        except Exception as e:
+            logger.warning("[HLS publish] upload failed %s%s: %s", self.s3_prefix, rel, e)
+            with self._lock:
+                self._errors.append((rel, e))
+        finally:
+            with self._lock:
+                self._inflight.discard(rel)
+
+    def _drain(self) -> None:
+        futures, self._futures = self._futures, []
+        wait(futures)
+
+    def _raise_errors(self) -> None:
+        if self._errors:
+            rel, exc = self._errors[0]
+            raise RuntimeError(f"HLS upload failed for {len(self._errors)} file(s), first {rel}: {exc}") from exc
+
+
+def _delete_keys(client, bucket: str, keys: List[str], prefix: str) -> List[str]:
+    """Один delete_objects (≤1000 ключей); ошибки логируются, возвращаются удалённые ключи."""
+    try:
+        resp = client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys]})
+    except Exception as e:
+        logger.warning("[HLS] delete_objects failed under %s (%d keys): %s", prefix, len(keys), e)
+        return []
+    for err in resp.get("Errors", []):
+        logger.warning("[HLS] failed to delete %s: %s", err.get("Key"), err.get("Message"))
+    return [d["Key"] for d in resp.get("Deleted", [])]
+
+
+def delete_prefix(
+    prefix: str,
+    *,
+    client,
+    bucket: str = S3_BUCKET,
+    concurrency: int = HLS_UPLOAD_CONCURRENCY,
+) -> List[str]:
+    """Удаляет все объекты под prefix; страницы листинга (≤1000 ключей) удаляются параллельно."""
+    deleted: List[str] = []
+
+    def delete_batch(keys: List[str]) -> List[str]:
+        return _delete_keys(client, bucket, keys, prefix)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="s3-delete") as pool:
+        futures = []
+        paginator = client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys = [obj["Key"] for obj in page.get("Contents", [])]
+            if keys:
+                futures.append(pool.submit(delete_batch, keys))
+        for f in futures:
+            deleted.extend(f.result())
+    s3_meta_index.forget(deleted, bucket=bucket)
+    return deleted
@@ -0,0 +1,417 @@
+"""
+Индекс метаданных объектов S3 в Redis.
+
+Диагностика, тики video_maintenance и проверки HLS раз за разом делают
+HEAD / get_object_acl / list_objects_v2 по одним и тем же ключам. Индекс
+хранит то, что уже известно о ключе, и отвечает локально:
+
+• s3meta:o:<key> (hash) — e (1/0 — есть/нет), sz, etag, ct, md (JSON Metadata,
+  там же faststart/hls), acl (1/0/u — public/private/ACL API недоступен),
+  hd (1 — поля HEAD полные), ts.
+• s3meta:ls:<prefix> (hash) — кэш листингов: поле = суффикс, значение = JSON ключей.
+
+Наполнение:
+• sweep() — массовый list_objects_v2 по бакету: размер и ETag для mp4/m3u8 и
+  списки playlist.m3u8 по каталогам .hls/ (если ETag не изменился, уже
+  известные поля HEAD/ACL сохраняются);
+• write-through: наши загрузки (utils.s3_upload), copy/ACL/delete в пайплайнах
+  вызывают record()/forget();
+• промах → сетевой запрос, результат кладётся в индекс.
+
+Записи живут OBJECT_TTL (ежедневный sweep их продлевает), «нет объекта» —
+MISSING_TTL. Любая ошибка Redis — тихий фолбэк на прямой запрос к S3.
+Индекс ведётся только для основного бакета (S3_BUCKET).
+"""
+
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+import redis
+from botocore.exceptions import ClientError
+
+from ..core.storage import S3_BUCKET, s3_client
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+OBJECT_TTL = int(os.getenv("S3_META_TTL_SEC", str(36 * 3600)))
+MISSING_TTL = int(os.getenv("S3_META_MISSING_TTL_SEC", "300"))
+LISTING_TTL = int(os.getenv("S3_META_LISTING_TTL_SEC", str(36 * 3600)))
+
+# sweep индексирует только то, что проверяют видео-пайплайны (сегменты .ts не храним)
+SWEEP_SUFFIXES = (".mp4", ".m3u8")
+PLAYLIST_NAME = "playlist.m3u8"
+
+_OBJ = "s3meta:o:"
+_LS = "s3meta:ls:"
+_NOT_FOUND_CODES = {"404", "NoSuchKey", "NotFound"}
+_ACL_UNSUPPORTED_CODES = {"AccessDenied", "NotImplemented", "MethodNotAllowed", "InvalidRequest"}
+_ALL_USERS_URI = "http://acs.amazonaws.com/groups/global/AllUsers"
+
+_rds: Optional[redis.Redis] = None
+_s3 = None
+_stats = {"hits": 0, "misses": 0}
+
+
+@dataclass
+class ObjectMeta:
+    key: str
+    size: Optional[int] = None
+    etag: Optional[str] = None
+    content_type: Optional[str] = None
+    metadata: Dict[str, str] = field(default_factory=dict)
+    acl_public: Optional[bool] = None
+
+
+def _redis() -> Optional[redis.Redis]:
+    global _rds
+    if _rds is None:
+        try:
+            _rds = redis.Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=2)
+        except Exception as e:
+            logger.warning("[s3meta] redis unavailable: %s", e)
+            return None
+    return _rds
+
+
+def _client(client=None):
+    global _s3
+    if client is not None:
+        return client
+    if _s3 is None:
+        _s3 = s3_client(signature_version="s3v4")
+    return _s3
+
+
+def _error_code(e: ClientError) -> str:
+    return str((e.response or {}).get("Error", {}).get("Code") or "")
+
+
+def _cached(key: str) -> Dict[str, str]:
+    r = _redis()
+    if r is None:
+        return {}
+    try:
+        return r.hgetall(_OBJ + key) or {}
+    except Exception:
+        return {}
+
+
+def _write(key: str, fields: Dict[str, str], ttl: int, *, replace: bool = False) -> None:
+    r = _redis()
+    if r is None:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        if replace:
+            pipe.delete(_OBJ + key)
+        pipe.hset(_OBJ + key, mapping={**fields, "ts": str(int(time.time()))})
+        pipe.expire(_OBJ + key, ttl)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("[s3meta] write failed for %s: %s", key, e)
+
+
+def _parent_prefixes(key: str) -> List[str]:
+    parts = key.split("/")[:-1]
+    return ["/".join(parts[:i]) + "/" for i in range(1, len(parts) + 1)]
+
+
+def _invalidate_listings(keys: Iterable[str]) -> None:
+    r = _redis()
+    if r is None:
+        return
+    prefixes = {p for k in keys for p in _parent_prefixes(k)}
+    if not prefixes:
+        return
+    try:
+        r.delete(*(_LS + p for p in prefixes))
+    except Exception:
+        pass
+
+
+def _to_meta(key: str, h: Dict[str, str]) -> ObjectMeta:
+    try:
+        md = json.loads(h.get("md") or "{}")
+    except ValueError:
+        md = {}
+    acl = h.get("acl")
+    return ObjectMeta(
+        key=key,
+        size=int(h["sz"]) if h.get("sz") else None,
+        etag=h.get("etag") or None,
+        content_type=h.get("ct") or None,
+        metadata=md,
+        acl_public=True if acl == "1" else False if acl == "0" else None,
+    )
+
+
+# ─────────────── чтение ───────────────
+
+def head(key: str, *, client=None, fresh: bool = False) -> Optional[ObjectMeta]:
+    """
+    Аналог head_object: ObjectMeta или None, если объекта нет.
+    Прочие ошибки S3 пробрасываются (не кэшируются).
+    """
+    if not fresh:
+        h = _cached(key)
+        if h.get("e") == "0":
+            _stats["hits"] += 1
+            return None
+        if h.get("hd") == "1":
+            _stats["hits"] += 1
+            return _to_meta(key, h)
+    _stats["misses"] += 1
+
+    try:
+        resp = _client(client).head_object(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if _error_code(e) in _NOT_FOUND_CODES:
+            _write(key, {"e": "0"}, MISSING_TTL, replace=True)
+            return None
+        raise
+
+    etag = resp.get("ETag") or ""
+    prev = _cached(key)
+    same = prev.get("etag") in (None, "", etag)   # без etag — запись нашей же загрузки
+    fields = {
+        "e": "1",
+        "hd": "1",
+        "sz": str(resp.get("ContentLength") or 0),
+        "etag": etag,
+        "ct": resp.get("ContentType") or "",
+        "md": json.dumps(resp.get("Metadata") or {}, ensure_ascii=False),
+    }
+    # ACL сохраняем, только если объект не менялся
+    _write(key, fields, OBJECT_TTL, replace=not same)
+    return _to_meta(key, {**(prev if same else {}), **fields})
+
+
+def exists(key: str, *, client=None, fresh: bool = False) -> bool:
+    """Есть ли объект. Достаточно записи sweep'а (e=1) — HEAD не нужен."""
+    if not key:
+        return False
+    if not fresh:
+        e = _cached(key).get("e")
+        if e in ("0", "1"):
+            _stats["hits"] += 1
+            return e == "1"
+    try:
+        return head(key, client=client, fresh=True) is not None
+    except ClientError:
+        return False
+
+
+def acl_public(key: str, *, client=None, fresh: bool = False) -> Optional[bool]:
+    """
+    True/False — есть ли public-read; None — ACL API не поддержан/запрещён
+    (это не значит, что файл приватный). Прочие ошибки S3 пробрасываются.
+    """
+    if not fresh:
+        acl = _cached(key).get("acl")
+        if acl in ("1", "0", "u"):
+            _stats["hits"] += 1
+            return True if acl == "1" else False if acl == "0" else None
+    _stats["misses"] += 1
+
+    try:
+        resp = _client(client).get_object_acl(Bucket=S3_BUCKET, Key=key)
+    except ClientError as e:
+        if _error_code(e) in _ACL_UNSUPPORTED_CODES:
+            _write(key, {"acl": "u"}, OBJECT_TTL)
+            return None
+        raise
+
+    public = False
+    for g in resp.get("Grants", []) or []:
+        if (g.get("Grantee") or {}).get("URI") == _ALL_USERS_URI:
+            if (g.get("Permission") or "").upper() in ("READ", "FULL_CONTROL"):
+                public = True
+                break
+    _write(key, {"e": "1", "acl": "1" if public else "0"}, OBJECT_TTL)
+    return public
+
+
+def list_keys(prefix: str, *, suffix: str = "", client=None, fresh: bool = False) -> List[str]:
+    """Ключи под prefix, оканчивающиеся на suffix (кэш листинга, сбрасывается нашими записями)."""
+    r = _redis()
+    if r is not None and not fresh:
+        try:
+            raw = r.hget(_LS + prefix, suffix)
+            if raw is not None:
+                _stats["hits"] += 1
+                return json.loads(raw)
+        except Exception:
+            pass
+    _stats["misses"] += 1
+
+    keys: List[str] = []
+    paginator = _client(client).get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []) or []:
+            if obj["Key"].endswith(suffix):
+                keys.append(obj["Key"])
+
+    if r is not None:
+        try:
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(_LS + prefix, suffix, json.dumps(keys, ensure_ascii=False))
+            pipe.expire(_LS + prefix, LISTING_TTL)
+            pipe.execute()
+        except Exception:
+            pass
+    return keys
+
+
+def stats() -> Dict[str, int]:
+    """Попадания/промахи индекса в текущем процессе."""
+    return dict(_stats)
+
+
+# ─────────────── write-through ───────────────
+
+def record(
+    key: str,
+    *,
+    bucket: str = S3_BUCKET,
+    size: Optional[int] = None,
+    content_type: Optional[str] = None,
+    metadata: Optional[dict] = None,
+    acl: Optional[str] = None,
+    acl_public: Optional[bool] = None,
+) -> None:
+    """
+    Запоминает то, что мы сами только что записали в S3 (put/upload/copy/ACL).
+    acl — canned ACL из запроса ("public-read"/"private"); acl_public — явное значение.
+    ETag после записи неизвестен (multipart) — запись считается «новой версией».
+    """
+    if bucket != S3_BUCKET:
+        return
+    fields: Dict[str, str] = {"e": "1"}
+    if size is not None:
+        fields["sz"] = str(size)
+    if size is not None and content_type is not None and metadata is not None:
+        fields.update({"hd": "1", "ct": content_type, "md": json.dumps(metadata, ensure_ascii=False)})
+    if acl is not None and acl_public is None:
+        acl_public = acl in ("public-read", "public-read-write")
+    if acl_public is not None:
+        fields["acl"] = "1" if acl_public else "0"
+    # только ACL — объект не менялся, остальные поля валидны
+    replace = bool(set(fields) - {"e", "acl"})
+    _write(key, fields, OBJECT_TTL, replace=replace)
+    if replace:
+        _invalidate_listings([key])
+
+
+def record_upload(key: str, *, bucket: str, size: int, extra_args: Optional[dict] = None) -> None:
+    """Write-through для utils.s3_upload: поля из ExtraArgs загрузки."""
+    extra = extra_args or {}
+    record(
+        key,
+        bucket=bucket,
+        size=size,
+        content_type=extra.get("ContentType") or "binary/octet-stream",
+        metadata=dict(extra.get("Metadata") or {}),
+        acl=extra.get("ACL") or "private",
+    )
+
+
+def forget(keys: Iterable[str], *, bucket: str = S3_BUCKET) -> None:
+    """Объекты удалены: помечаем как отсутствующие и сбрасываем листинги."""
+    if bucket != S3_BUCKET:
+        return
+    keys = list(keys)
+    r = _redis()
+    if r is None or not keys:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        now = str(int(time.time()))
+        for k in keys:
+            pipe.delete(_OBJ + k)
+            pipe.hset(_OBJ + k, mapping={"e": "0", "ts": now})
+            pipe.expire(_OBJ + k, MISSING_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.debug("[s3meta] forget failed: %s", e)
+    _invalidate_listings(keys)
+
+
+def drop(keys: Iterable[str]) -> None:
+    """Состояние ключей неизвестно (S3 ответил не так, как обещал индекс) — следующий запрос пойдёт в сеть."""
+    keys = list(keys)
+    r = _redis()
+    if r is None or not keys:
+        return
+    try:
+        r.delete(*(_OBJ + k for k in keys))
+    except Exception:
+        pass
+    _invalidate_listings(keys)
+
+
+# ─────────────── sweep ───────────────
+
+def sweep(prefix: str = "", *, client=None) -> dict:
+    """
+    Массовое наполнение индекса из list_objects_v2 (до 1000 ключей на запрос).
+    Для mp4/m3u8 пишет e/sz/etag; если ETag совпал с известным — поля HEAD/ACL
+    остаются, иначе запись сбрасывается. Дополнительно пишет списки
+    playlist.m3u8 для каждого каталога …/.hls/ (их читает list_keys).
+    """
+    r = _redis()
+    if r is None:
+        return {"status": "skipped", "reason": "redis_unavailable"}
+
+    t0 = time.time()
+    listed = indexed = changed = 0
+    playlists: Dict[str, List[str]] = {}
+    paginator = _client(client).get_paginator("list_objects_v2")
+
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix, PaginationConfig={"PageSize": 1000}):
+        objs = [o for o in page.get("Contents", []) or [] if o["Key"].endswith(SWEEP_SUFFIXES)]
+        listed += len(page.get("Contents", []) or [])
+        if not objs:
+            continue
+
+        pipe = r.pipeline(transaction=False)
+        for o in objs:
+            pipe.hget(_OBJ + o["Key"], "etag")
+        known = pipe.execute()
+
+        now = str(int(time.time()))
+        pipe = r.pipeline(transaction=False)
+        for o, prev_etag in zip(objs, known):
+            key = o["Key"]
+            etag = o.get("ETag") or ""
+            if prev_etag != etag:
+                pipe.delete(_OBJ + key)
+                changed += 1
+            pipe.hset(_OBJ + key, mapping={"e": "1", "sz": str(o.get("Size") or 0), "etag": etag, "ts": now})
+            pipe.expire(_OBJ + key, OBJECT_TTL)
+
+            if key.endswith("/" + PLAYLIST_NAME) and "/.hls/" in "/" + key:
+                hls_dir = key[: ("/" + key).rindex("/.hls/")] + ".hls/"
+                playlists.setdefault(hls_dir.lstrip("/"), []).append(key)
+        pipe.execute()
+        indexed += len(objs)
+
+    pipe = r.pipeline(transaction=False)
+    for hls_dir, keys in playlists.items():
+        pipe.hset(_LS + hls_dir, PLAYLIST_NAME, json.dumps(keys, ensure_ascii=False))
+        pipe.expire(_LS + hls_dir, LISTING_TTL)
+    pipe.execute()
+
+    return {
+        "status": "ok",
+        "prefix": prefix,
+        "listed": listed,
+        "indexed": indexed,
+        "changed": changed,
+        "hls_dirs": len(playlists),
+        "duration_sec": round(time.time() - t0, 1),
+    }
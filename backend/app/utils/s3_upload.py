@@ -0,0 +1,254 @@
+"""
+Потоковая загрузка в S3 (multipart) с параллельной отправкой частей.
+
+• upload_stream() — читает поток (pipe ffmpeg, файл) в заранее выделенные
+  буферы размером part_size и отдаёт части пулу потоков, пока источник
+  продолжает писать. Свободных буферов concurrency + 1: когда все части
+  в полёте, чтение ждёт — это backpressure, память ограничена.
+• Части читаются через readinto() и отправляются через memoryview —
+  без промежуточных bytes(buf[:n]) / del buf[:n].
+• Каждая часть повторяется до PART_ATTEMPTS раз (сеть, 5xx, throttling);
+  при окончательной ошибке MPU абортится.
+• upload_file() — то же для локального файла; маленькие файлы — одним put_object.
+• Успешная загрузка записывается в индекс метаданных (utils.s3_meta_index).
+
+Используется клипами (clip_tasks), пересборкой HLS (video_repair_service)
+и форматами книг (book_formats).
+"""
+
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from ..core.storage import s3_client
+from . import s3_meta_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024          # минимум S3 для всех частей, кроме последней
+DEFAULT_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+PART_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+
+_RETRYABLE_CODES = {"RequestTimeout", "SlowDown", "Throttling", "ThrottlingException", "InternalError"}
+
+
+def _default_client():
+    return s3_client(signature_version="s3v4", max_pool_connections=max(10, DEFAULT_CONCURRENCY * 2))
+
+
+class _BufferReader(io.RawIOBase):
+    """Файлоподобное представление memoryview: boto3 читает/перематывает его без копии буфера."""
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def __len__(self) -> int:
+        return len(self._view)
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, min(offset, len(self._view)))
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, ClientError):
+        err = exc.response.get("Error", {})
+        status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status >= 500 or err.get("Code") in _RETRYABLE_CODES
+    return isinstance(exc, BotoCoreError)
+
+
+def _with_retries(fn: Callable, what: str):
+    for attempt in range(1, PART_ATTEMPTS + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == PART_ATTEMPTS or not _is_retryable(e):
+                raise
+            delay = RETRY_BASE_DELAY * 2 ** (attempt - 1)
+            logger.warning("S3 %s failed (attempt %d/%d): %s — retry in %.1fs", what, attempt, PART_ATTEMPTS, e, delay)
+            time.sleep(delay)
+
+
+def _fill(stream, view: memoryview, progress_cb: Optional[Callable[[int], None]]) -> int:
+    """Заполняет view из stream; меньше len(view) — только на EOF."""
+    readinto = getattr(stream, "readinto", None)
+    filled = 0
+    while filled < len(view):
+        if readinto is not None:
+            n = readinto(view[filled:]) or 0
+        else:
+            chunk = stream.read(len(view) - filled)
+            n = len(chunk) if chunk else 0
+            view[filled:filled + n] = chunk
+        if not n:
+            break
+        filled += n
+        if progress_cb:
+            progress_cb(n)
+    return filled
+
+
+def upload_stream(
+    stream,
+    *,
+    bucket: str,
+    key: str,
+    extra_args: Optional[dict] = None,
+    client=None,
+    part_size: int = DEFAULT_PART_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    progress_cb: Optional[Callable[[int], None]] = None,
+    min_ok_bytes: int = 1,
+) -> int:
+    """
+    Грузит поток в S3 через MPU, возвращает число загруженных байт.
+    extra_args — параметры create_multipart_upload (ContentType, ACL, CacheControl, ...).
+    Если пришло меньше min_ok_bytes — MPU абортится и возвращается 0.
+    """
+    client = client or _default_client()
+    part_size = max(part_size, MIN_PART_SIZE)
+    concurrency = max(1, concurrency)
+
+    mpu = client.create_multipart_upload(Bucket=bucket, Key=key, **(extra_args or {}))
+    upload_id = mpu["UploadId"]
+
+    free: "queue.Queue[bytearray]" = queue.Queue()
+    for _ in range(concurrency + 1):
+        free.put(bytearray(part_size))
+    etags: dict = {}
+    errors: list = []
+    lock = threading.Lock()
+
+    def send(part_no: int, buf: bytearray, size: int) -> None:
+        try:
+            body = _BufferReader(memoryview(buf)[:size])
+
+            def call():
+                body.seek(0)
+                return client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id,
+                    PartNumber=part_no, Body=body, ContentLength=size,
+                )
+
+            resp = _with_retries(call, f"upload_part #{part_no} {key}")
+            with lock:
+                etags[part_no] = resp["ETag"]
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        finally:
+            free.put(buf)
+
+    total = 0
+    part_no = 0
+    futures = []
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="s3-upload")
+    try:
+        try:
+            while not errors:
+                buf = free.get()          # ждёт, пока какая-то часть не освободит буфер
+                if errors:
+                    break
+                size = _fill(stream, memoryview(buf), progress_cb)
+                if size == 0:
+                    break
+                part_no += 1
+                total += size
+                futures.append(pool.submit(send, part_no, buf, size))
+                if size < part_size:
+                    break
+            wait(futures)
+        finally:
+            pool.shutdown(wait=True)
+
+        if errors:
+            raise errors[0]
+
+        if total < max(min_ok_bytes, 1):
+            try:
+                client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception:
+                pass
+            return 0
+
+        client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"ETag": etags[n], "PartNumber": n} for n in sorted(etags)]},
+        )
+        s3_meta_index.record_upload(key, bucket=bucket, size=total, extra_args=extra_args)
+        return total
+
+    except BaseException:
+        # при любой ошибке аккуратно абортим MPU
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception:
+            pass
+        raise
+
+
+def upload_file(
+    path: str,
+    *,
+    bucket: str,
+    key: str,
+    extra_args: Optional[dict] = None,
+    client=None,
+    part_size: int = DEFAULT_PART_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> int:
+    """Грузит локальный файл; до part_size — одним put_object, больше — через upload_stream."""
+    client = client or _default_client()
+    size = os.path.getsize(path)
+    with open(path, "rb", buffering=0) as fh:
+        if size <= max(part_size, MIN_PART_SIZE):
+            def call():
+                fh.seek(0)
+                return client.put_object(Bucket=bucket, Key=key, Body=fh, ContentLength=size, **(extra_args or {}))
+
+            _with_retries(call, f"put_object {key}")
+            s3_meta_index.record_upload(key, bucket=bucket, size=size, extra_args=extra_args)
+            return size
+        return upload_stream(
+            fh, bucket=bucket, key=key, extra_args=extra_args, client=client,
+            part_size=part_size, concurrency=concurrency,
+        )
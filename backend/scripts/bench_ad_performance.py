@@ -0,0 +1,222 @@
+"""
+Бенчмарк метрик ad_control: старые карты по отдельным запросам vs ad_performance.
+
+Эталон — прежняя сборка строк /ads/quarantine, /ads/observation, /ads/overview
+и /ads/books/overview: периоды склеиваются в Python (_merge_periods), first5 —
+UNION ALL-таблица пар, каждая метрика — свой вызов traffic_rollup.by_target,
+назначения и имена — отдельными запросами. Замеряет число SQL-запросов и
+латентность эталона, холодной сборки снимка и тёплого чтения из кэша,
+а также сверяет метрики по каждому лендингу.
+
+Запуск из контейнера backend (WORKDIR /app):
+    python -m scripts.bench_ad_performance --repeat 20
+"""
+
+import argparse
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, func, literal, select, text, union_all
+
+from app.db.database import SessionLocal, engine
+from app.models.models_v2 import (
+    AdAccount, AdStaff, BookLanding, BookLandingAdAssignment, BookLandingAdPeriod,
+    Landing, LandingAdAssignment, LandingAdPeriod, Purchase,
+)
+from app.services_v2 import ad_performance, traffic_rollup
+
+LEGACY = {
+    ad_performance.KIND_LANDING: (
+        Landing, LandingAdPeriod, LandingAdPeriod.landing_id,
+        LandingAdAssignment, LandingAdAssignment.landing_id, Purchase.landing_id,
+    ),
+    ad_performance.KIND_BOOK_LANDING: (
+        BookLanding, BookLandingAdPeriod, BookLandingAdPeriod.book_landing_id,
+        BookLandingAdAssignment, BookLandingAdAssignment.book_landing_id, Purchase.book_landing_id,
+    ),
+}
+
+FIELDS = (
+    "stage_started_at", "cycle_no", "ad_purchases_first_5_days",
+    "ad_purchases_last_10_days", "ad_visits_last_10_days", "total_purchases_last_10_days",
+    "ad_purchases_lifetime", "sales_count", "staff_name", "account_name",
+)
+
+
+@contextmanager
+def count_queries():
+    counter = {'n': 0}
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['n'] += 1
+
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _on_execute)
+
+
+# ── эталон: прежние карты ad_control / book_ad_control ─────────────────────────
+
+def _merge_periods(periods, now):
+    grace = timedelta(hours=ad_performance.GRACE_HOURS)
+    merged = []
+    cur_start, cur_end = periods[0][0], periods[0][1] or now
+    for st, en in periods[1:]:
+        st2, en2 = st, (en or now)
+        if st2 - cur_end <= grace:
+            cur_end = max(cur_end, en2)
+        else:
+            merged.append((cur_start, cur_end))
+            cur_start, cur_end = st2, en2
+    merged.append((cur_start, cur_end))
+    return merged
+
+
+def _periods(db, period, fk, ids):
+    rows = (
+        db.query(fk, period.started_at, period.ended_at)
+          .filter(fk.in_(ids))
+          .order_by(fk.asc(), period.started_at.asc())
+          .all()
+    )
+    by_lid = {}
+    for lid, st, en in rows:
+        by_lid.setdefault(lid, []).append((st, en))
+    return by_lid
+
+
+def _legacy(db, kind):
+    model, period, fk, assignment, assignment_fk, purchase_fk = LEGACY[kind]
+    now = datetime.utcnow()
+
+    rows = (
+        db.query(model, period.started_at)
+          .join(period, fk == model.id)
+          .filter(model.in_advertising.is_(True), period.ended_at.is_(None))
+          .all()
+    )
+    if not rows:
+        return {}
+    ids = [m.id for (m, _) in rows]
+
+    # _active_episode_start_map + _effective_cycle_count_map — два прохода по периодам
+    start_map, cycles_map = {}, {}
+    for lid, periods in _periods(db, period, fk, ids).items():
+        merged = _merge_periods(periods, now)
+        if any(en is None for _, en in periods):
+            start_map[lid] = merged[-1][0]
+    for lid, periods in _periods(db, period, fk, ids).items():
+        cycles_map[lid] = len(_merge_periods(periods, now))
+
+    # _ad_sales_first5_map
+    first5_map = {}
+    pairs = [(lid, st) for lid, st in start_map.items()]
+    if pairs:
+        ap = union_all(*[select(literal(lid).label("lid"), literal(st).label("st")) for lid, st in pairs]).alias("ap")
+        win_end = func.least(func.date_add(ap.c.st, text("INTERVAL 5 DAY")), func.utc_timestamp())
+        first5_map = dict(
+            db.query(ap.c.lid, func.count(Purchase.id))
+              .join(Purchase, and_(
+                  purchase_fk == ap.c.lid,
+                  Purchase.from_ad.is_(True),
+                  Purchase.created_at >= ap.c.st,
+                  Purchase.created_at < win_end,
+              ))
+              .group_by(ap.c.lid)
+              .all()
+        )
+
+    # *_last10_map / *_lifetime_map — по вызову роллапа на метрику
+    since = now - timedelta(days=ad_performance.RECENT_DAYS)
+    sales10 = traffic_rollup.by_target(db, kind, ids, "ad_purchases", start_dt=since, end_dt=now)
+    visits10 = traffic_rollup.by_target(db, kind, ids, "ad_hits", start_dt=since, end_dt=now)
+    tp10 = traffic_rollup.by_target(db, kind, ids, "purchases", start_dt=since, end_dt=now)
+    lifetime = traffic_rollup.by_target(db, kind, ids, "ad_purchases")
+
+    assign_rows = db.query(assignment).filter(assignment_fk.in_(ids)).all()
+    assign_map = {getattr(a, assignment_fk.key): a for a in assign_rows}
+    staff_ids = [a.staff_id for a in assign_rows if a.staff_id is not None]
+    acc_ids = [a.account_id for a in assign_rows if a.account_id is not None]
+    staff_names = {s.id: s.name for s in db.query(AdStaff).filter(AdStaff.id.in_(staff_ids)).all()} if staff_ids else {}
+    acc_names = {a.id: a.name for a in db.query(AdAccount).filter(AdAccount.id.in_(acc_ids)).all()} if acc_ids else {}
+
+    out = {}
+    for m, _ in rows:
+        if m.id not in start_map:
+            continue
+        assign = assign_map.get(m.id)
+        out[m.id] = {
+            "stage_started_at": start_map[m.id],
+            "cycle_no": int(cycles_map.get(m.id, 0)),
+            "ad_purchases_first_5_days": int(first5_map.get(m.id, 0)),
+            "ad_purchases_last_10_days": int(sales10.get(m.id, 0)),
+            "ad_visits_last_10_days": int(visits10.get(m.id, 0)),
+            "total_purchases_last_10_days": int(tp10.get(m.id, 0)),
+            "ad_purchases_lifetime": int(lifetime.get(m.id, 0)),
+            "sales_count": m.sales_count or 0,
+            "staff_name": staff_names.get(getattr(assign, "staff_id", None)),
+            "account_name": acc_names.get(getattr(assign, "account_id", None)),
+        }
+    return out
+
+
+# ── замеры ─────────────────────────────────────────────────────────────────────
+
+def _engine(db, kind):
+    snap = ad_performance.get_snapshot(db, kind)
+    return {r.id: {f: getattr(r, f) for f in FIELDS} for r in snap.rows}
+
+
+def _cold(db, kind):
+    ad_performance.invalidate(kind)
+    return _engine(db, kind)
+
+
+def _measure(db, fn, kind, repeat):
+    timings = []
+    queries = 0
+    result = None
+    for _ in range(repeat):
+        with count_queries() as counter:
+            started = time.perf_counter()
+            result = fn(db, kind)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = counter['n']
+    return result, queries, statistics.median(timings), max(timings)
+
+
+def _diff(expected, actual) -> str:
+    """Сверка по лендингам; first5 эталона режется по utc_timestamp() БД, снимка — по своему as_of."""
+    if set(expected) != set(actual):
+        return f"DIFF ids: -{sorted(set(expected) - set(actual))[:5]} +{sorted(set(actual) - set(expected))[:5]}"
+    fields = sorted({f for lid in expected for f in FIELDS if expected[lid][f] != actual[lid][f]})
+    return "OK" if not fields else "DIFF: " + ", ".join(fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        header = f"{'kind':<13} {'impl':<8} {'landings':>8} {'queries':>7} {'p50 ms':>9} {'max ms':>9}  check"
+        print(header)
+        print("-" * len(header))
+        for kind in (ad_performance.KIND_LANDING, ad_performance.KIND_BOOK_LANDING):
+            expected, lq, lp50, lmax = _measure(db, _legacy, kind, args.repeat)
+            cold, cq, cp50, cmax = _measure(db, _cold, kind, args.repeat)
+            warm, wq, wp50, wmax = _measure(db, _engine, kind, args.repeat)
+            print(f"{kind:<13} {'legacy':<8} {len(expected):>8} {lq:>7} {lp50:>9.1f} {lmax:>9.1f}")
+            print(f"{'':<13} {'cold':<8} {len(cold):>8} {cq:>7} {cp50:>9.1f} {cmax:>9.1f}  {_diff(expected, cold)}")
+            print(f"{'':<13} {'cached':<8} {len(warm):>8} {wq:>7} {wp50:>9.3f} {wmax:>9.3f}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Бенчмарк метаданных фильтров каталога: SQL-агрегация vs facet_engine.
+
+Для набора состояний фильтров замеряет число SQL-запросов и латентность
+aggregate_*_filters (эталон) и facet_*_filters, а также сверяет результат.
+
+Запуск из контейнера backend (WORKDIR /app):
+    python -m scripts.bench_facets --repeat 20
+"""
+
+import argparse
+import statistics
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.db.database import SessionLocal, engine
+from app.services_v2 import facet_engine
+from app.services_v2.facet_engine import (
+    facet_landing_filters, facet_book_filters, facet_author_filters,
+)
+from app.services_v2.filter_aggregation_service import (
+    build_landing_base_query, aggregate_landing_filters,
+    build_book_landing_base_query, aggregate_book_filters,
+    build_author_base_query, aggregate_author_filters,
+)
+
+LANDING_STATES = [
+    {},
+    {'language': 'EN'},
+    {'language': 'EN', 'price_from': 10, 'price_to': 200},
+    {'language': 'RU', 'lessons_from': 5, 'lessons_to': 60, 'q': 'implant'},
+]
+
+BOOK_STATES = [
+    {},
+    {'language': 'EN'},
+    {'language': 'EN', 'formats': ['PDF'], 'year_from': 2015},
+    {'pages_from': 100, 'pages_to': 800, 'q': 'ortho'},
+]
+
+AUTHOR_STATES = [
+    {},
+    {'language': 'EN'},
+    {'language': 'EN', 'courses_from': 1, 'books_from': 1},
+    {'q': 'dr'},
+]
+
+
+@contextmanager
+def count_queries():
+    counter = {'n': 0}
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['n'] += 1
+
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _on_execute)
+
+
+def _sql_landing(db, filters):
+    base = build_landing_base_query(db, **filters)
+    return aggregate_landing_filters(db, base.order_by(None), filters)
+
+
+def _sql_book(db, filters):
+    base = build_book_landing_base_query(db, **filters)
+    return aggregate_book_filters(db, base.order_by(None), filters)
+
+
+def _sql_author(db, filters):
+    base = build_author_base_query(db, **filters)
+    return aggregate_author_filters(db, base, filters)
+
+
+def _measure(db, fn, filters, repeat):
+    timings = []
+    queries = 0
+    result = None
+    for _ in range(repeat):
+        with count_queries() as counter:
+            started = time.perf_counter()
+            result = fn(db, filters)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = counter['n']
+    return result, queries, statistics.median(timings), max(timings)
+
+
+def _diff(expected, actual) -> str:
+    """Сравнение без учёта порядка опций с равным total (тай-брейк top-N в SQL не детерминирован)."""
+    exp = expected.model_dump() if hasattr(expected, "model_dump") else expected.dict()
+    act = actual.model_dump() if hasattr(actual, "model_dump") else actual.dict()
+    for payload in (exp, act):
+        for flt in payload['filters'].values():
+            if flt.get('options') is not None:
+                flt['options'] = sorted(flt['options'], key=lambda o: (str(o.get('id')), str(o.get('value'))))
+    if exp == act:
+        return "OK"
+    keys = sorted(k for k in set(exp['filters']) | set(act['filters'])
+                  if exp['filters'].get(k) != act['filters'].get(k))
+    if exp['selected'] != act['selected']:
+        keys.append('selected')
+    return "DIFF: " + ", ".join(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    suites = [
+        ("landings", _sql_landing, facet_landing_filters, LANDING_STATES),
+        ("books", _sql_book, facet_book_filters, BOOK_STATES),
+        ("authors", _sql_author, facet_author_filters, AUTHOR_STATES),
+    ]
+
+    db = SessionLocal()
+    try:
+        # Холодная сборка индекса — отдельной строкой, дальше индекс тёплый
+        facet_engine.invalidate_facet_indexes()
+        with count_queries() as counter:
+            started = time.perf_counter()
+            facet_engine.get_facet_snapshot(db)
+            build_ms = (time.perf_counter() - started) * 1000
+        print(f"facet index build: {counter['n']} queries, {build_ms:.1f} ms\n")
+
+        header = f"{'context':<9} {'filters':<58} {'impl':<6} {'queries':>7} {'p50 ms':>9} {'max ms':>9}  check"
+        print(header)
+        print("-" * len(header))
+        for name, sql_fn, facet_fn, states in suites:
+            for filters in states:
+                expected, sql_q, sql_p50, sql_max = _measure(db, sql_fn, filters, args.repeat)
+                actual, fe_q, fe_p50, fe_max = _measure(db, facet_fn, filters, args.repeat)
+                label = repr(filters)[:58]
+                print(f"{name:<9} {label:<58} {'sql':<6} {sql_q:>7} {sql_p50:>9.1f} {sql_max:>9.1f}")
+                print(f"{'':<9} {'':<58} {'facet':<6} {fe_q:>7} {fe_p50:>9.1f} {fe_max:>9.1f}  "
+                      f"{_diff(expected, actual)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
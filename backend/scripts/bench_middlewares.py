@@ -0,0 +1,142 @@
+"""
+Бенчмарк стека middleware: BaseHTTPMiddleware vs чистые ASGI-middleware.
+
+Приложение вызывается напрямую через ASGI (без сети и uvicorn), поэтому
+разница — только накладные расходы middleware:
+  • req/s на простом эндпоинте /ping;
+  • time-to-first-byte и полное время стримингового ответа (имитация PDF).
+
+Запуск из контейнера backend (WORKDIR /app):
+    python -m scripts.bench_middlewares --requests 5000 --chunks 64
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middlewares.monitoring import MonitoringMiddleware
+from app.middlewares.rate_limiter import RateLimitMiddleware
+
+CHUNK = b"%" * 64 * 1024
+
+
+class _LegacyMonitoring(BaseHTTPMiddleware):
+    """Эквивалент прежнего мониторинга: замер времени вокруг call_next."""
+
+    async def dispatch(self, request, call_next):
+        start = time.time()
+        response = await call_next(request)
+        _ = time.time() - start, request.client, request.headers.get("host")
+        return response
+
+
+class _LegacyRateLimit(BaseHTTPMiddleware):
+    """Эквивалент прежнего rate limiter без Redis: разбор IP и пропуск запроса."""
+
+    async def dispatch(self, request, call_next):
+        _ = request.headers.get("x-forwarded-for") or request.client.host
+        return await call_next(request)
+
+
+def build_app(mode: str, chunks: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/pdf")
+    async def pdf():
+        async def body():
+            for _ in range(chunks):
+                await asyncio.sleep(0)
+                yield CHUNK
+        return StreamingResponse(body(), media_type="application/pdf")
+
+    if mode == "base":
+        app.add_middleware(_LegacyRateLimit)
+        app.add_middleware(_LegacyMonitoring)
+    else:
+        app.add_middleware(RateLimitMiddleware, max_requests=10 ** 9, redis_url=None)
+        app.add_middleware(MonitoringMiddleware)
+    return app
+
+
+async def call(app, path: str):
+    """(ttfb, total) одного запроса в секундах."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench"), (b"x-forwarded-for", b"10.0.0.1")],
+        "client": ("10.0.0.1", 1234), "server": ("bench", 80),
+    }
+    started = time.perf_counter()
+    first_byte = None
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal first_byte
+        if message["type"] == "http.response.body" and first_byte is None and message.get("body"):
+            first_byte = time.perf_counter()
+
+    await app(scope, receive, send)
+    finished = time.perf_counter()
+    return (first_byte or finished) - started, finished - started
+
+
+async def bench(mode: str, n_requests: int, n_streams: int, chunks: int) -> dict:
+    app = build_app(mode, chunks)
+    for _ in range(50):
+        await call(app, "/ping")
+
+    started = time.perf_counter()
+    for _ in range(n_requests):
+        await call(app, "/ping")
+    rps = n_requests / (time.perf_counter() - started)
+
+    ttfb, total = [], []
+    for _ in range(n_streams):
+        t, full = await call(app, "/pdf")
+        ttfb.append(t * 1000)
+        total.append(full * 1000)
+    return {
+        "rps": rps,
+        "ttfb_ms": statistics.median(ttfb),
+        "stream_ms": statistics.median(total),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=64, help="чанков по 64 КБ в стриминговом ответе")
+    args = parser.parse_args()
+
+    results = {
+        mode: asyncio.run(bench(mode, args.requests, args.streams, args.chunks))
+        for mode in ("base", "asgi")
+    }
+    print(f"{'stack':<6} {'req/s':>10} {'ttfb ms':>10} {'stream ms':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<6} {r['rps']:>10.0f} {r['ttfb_ms']:>10.3f} {r['stream_ms']:>10.2f}")
+    base, asgi = results["base"], results["asgi"]
+    print(f"\nthroughput x{asgi['rps'] / base['rps']:.2f}, "
+          f"ttfb x{base['ttfb_ms'] / max(asgi['ttfb_ms'], 1e-9):.2f}")
+
+
+if __name__ == "__main__":
+    main()
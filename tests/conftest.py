@@ -0,0 +1,33 @@
+import ast
+import os
+import re
+from pathlib import Path
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import Function
+
+# Settings() читает обязательные поля из окружения (.env в проде) —
+# для юнит-тестов достаточно заглушек, реальные сервисы тесты не трогают.
+_CONFIG = Path(__file__).resolve().parents[1] / "backend" / "app" / "core" / "config.py"
+for _node in ast.walk(ast.parse(_CONFIG.read_text(encoding="utf-8"))):
+    if isinstance(_node, ast.AnnAssign) and _node.value is None and isinstance(_node.target, ast.Name):
+        os.environ.setdefault(_node.target.id, "1")
+
+
+_INTERVAL = re.compile(r"INTERVAL (\d+) (HOUR|DAY)")
+
+
+@compiles(Function, "sqlite")
+def _mysql_functions_on_sqlite(element, compiler, **kw):
+    """DATE_ADD(x, INTERVAL n HOUR|DAY), LEAST, LEFT — в SQLite-эквиваленты для тестов на sqlite://."""
+    name = element.name.lower()
+    args = list(element.clauses)
+    if name == "date_add":
+        n, unit = _INTERVAL.match(args[1].text).groups()
+        shift = f"+{n} {'hours' if unit == 'HOUR' else 'days'}"
+        return f"(strftime('%Y-%m-%d %H:%M:%S', {compiler.process(args[0], **kw)}, '{shift}') || '.000000')"
+    if name == "least":
+        return f"min({', '.join(compiler.process(a, **kw) for a in args)})"
+    if name == "left":
+        return f"substr({compiler.process(args[0], **kw)}, 1, {compiler.process(args[1], **kw)})"
+    return compiler.visit_function(element, **kw)
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.models.models_v2 import AbandonedCheckout, Base, User
+from app.services_v2.user_service import verify_password
+from app.tasks import abandoned_checkouts as ac
+
+NOW = datetime(2026, 3, 20, 12, 0)
+CREATED_HASH = "$2b$12$created-by-create-user"
+
+
+@pytest.fixture
+def env(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{
+            "id": 1, "email": "lead@test", "password": CREATED_HASH, "balance": 0.0,
+            "created_at": NOW, "free_trial_used": False,
+        }])
+        conn.execute(insert(AbandonedCheckout.__table__), [{
+            "id": 7, "session_id": "s7", "email": "lead@test", "created_at": NOW, "send_count": 0,
+        }])
+    sent = []
+    monkeypatch.setattr(ac, "SessionLocal", Session)
+    monkeypatch.setattr(ac.email_sender, "send_abandoned_checkout_email", lambda **kw: sent.append(kw))
+    return Session, sent
+
+
+def _password_hash(Session):
+    with Session() as db:
+        return db.get(User, 1).password
+
+
+def test_untouched_account_gets_password(env):
+    Session, sent = env
+    ac._send_first_mail(7, ac._account_marker(CREATED_HASH), {}, "EN")
+    (mail,) = sent
+    assert mail["password"] and verify_password(mail["password"], _password_hash(Session))
+
+
+def test_changed_password_is_not_reset(env):
+    Session, sent = env
+    with Session() as db:
+        db.get(User, 1).password = "$2b$12$user-reset-it"
+        db.commit()
+    ac._send_first_mail(7, ac._account_marker(CREATED_HASH), {}, "EN")
+    assert sent[0]["password"] is None
+    assert _password_hash(Session) == "$2b$12$user-reset-it"
+
+
+def test_redelivered_message_keeps_first_password(env):
+    Session, sent = env
+    marker = ac._account_marker(CREATED_HASH)
+    ac._send_first_mail(7, marker, {}, "EN")
+    first_hash = _password_hash(Session)
+    ac._send_first_mail(7, marker, {}, "EN")
+    assert sent[1]["password"] is None
+    assert _password_hash(Session) == first_hash and verify_password(sent[0]["password"], first_hash)
+
+
+def test_lead_already_mailed_is_skipped(env):
+    Session, sent = env
+    with Session() as db:
+        db.get(AbandonedCheckout, 7).send_count = 1
+        db.commit()
+    assert ac._send_first_mail(7, ac._account_marker(CREATED_HASH), {}, "EN") is False
+    assert sent == [] and _password_hash(Session) == CREATED_HASH
@@ -0,0 +1,85 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models.models_v2 import Base, Landing, LandingAdPeriod, TrafficRollupState
+from app.services_v2 import ad_performance as ap
+from app.services_v2 import traffic_rollup
+from scripts.bench_ad_performance import _merge_periods
+
+NOW = datetime(2026, 3, 20, 12, 0)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(TrafficRollupState.__table__), [
+            {"source": s.name, "last_id": 0, "updated_at": NOW} for s in traffic_rollup._SOURCES
+        ])
+        yield session
+
+
+def _random_periods(rng, count):
+    """Периоды по часам, последний открыт; промежутки около GRACE_HOURS, чтобы проверить границу."""
+    periods = []
+    t = NOW - timedelta(days=60)
+    for i in range(count):
+        start = t + timedelta(hours=rng.choice([0, 1, ap.GRACE_HOURS - 1, ap.GRACE_HOURS, ap.GRACE_HOURS + 1, 72]))
+        end = start + timedelta(hours=rng.randint(1, 120))
+        periods.append((start, None if i == count - 1 else end))
+        # иногда следующий период начинается внутри текущего
+        t = start + timedelta(hours=rng.randint(0, 2)) if rng.random() < 0.2 else end
+    return periods
+
+
+def test_episodes_match_merge_periods(db):
+    rng = random.Random(7)
+    expected = {}
+    for lid in range(1, 41):
+        periods = _random_periods(rng, rng.randint(1, 8))
+        db.execute(insert(Landing.__table__), [{
+            "id": lid, "landing_name": f"L{lid}", "language": "EN", "in_advertising": True,
+            "sales_count": 0, "lessons_total": 0, "duration_minutes": 0, "is_hidden": False, "created_at": NOW,
+        }])
+        db.execute(insert(LandingAdPeriod.__table__), [
+            {"landing_id": lid, "started_at": st, "ended_at": en} for st, en in periods
+        ])
+        merged = _merge_periods(sorted(periods, key=lambda p: p[0]), NOW)
+        expected[lid] = (len(merged), merged[-1][0])
+
+    snap = ap.build_snapshot(db, ap.KIND_LANDING, now=NOW)
+
+    got = {r.id: (r.cycle_no, r.stage_started_at) for r in snap.rows}
+    assert got == expected
+
+
+def test_invalidate_reaches_other_workers(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(ap.redis.Redis, "from_url", classmethod(
+        lambda cls, url, **kw: fakeredis.FakeRedis(server=server, decode_responses=True)
+    ))
+    monkeypatch.setattr(ap, "_rds", None)
+    monkeypatch.setattr(ap, "_listener_pid", None)
+    monkeypatch.setattr(ap, "AD_PERFORMANCE_CHANNEL", "ad_performance:test")
+    snapshot = ap.AdPerformanceSnapshot(kind=ap.KIND_LANDING, as_of=NOW, rows=[], built_at=time.monotonic())
+    monkeypatch.setattr(ap, "_snapshots", {})
+
+    ap._ensure_listener()
+    publisher = fakeredis.FakeRedis(server=server, decode_responses=True)
+    deadline = time.monotonic() + 5
+    while not publisher.pubsub_numsub("ad_performance:test")[0][1] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)    # сброс при подписке уже прошёл
+
+    ap._snapshots[ap.KIND_LANDING] = snapshot
+    publisher.publish("ad_performance:test", '{"kind": "landing", "origin": "other-worker"}')
+    while ap.KIND_LANDING in ap._snapshots and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ap.KIND_LANDING not in ap._snapshots
@@ -0,0 +1,110 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.services_v2 import catalog_snapshot as cs
+
+
+def _book(book_id, author_ids, pd="2020"):
+    rec = cs.BookRecord(SimpleNamespace(
+        id=book_id, title=f"Book {book_id}", cover_url=f"cover{book_id}.png",
+        publication_date=pd, page_count=100,
+    ))
+    rec.author_ids = tuple(author_ids)
+    return rec
+
+
+def _book_landing(bl_id, book_ids, price=10):
+    rec = cs.BookLandingRecord(SimpleNamespace(
+        id=bl_id, language="en", landing_name=f"Landing {bl_id}", page_name=f"bl-{bl_id}",
+        old_price=None, new_price=price, sales_count=0, updated_at=datetime(2024, 1, 1),
+    ))
+    rec.book_ids = tuple(book_ids)
+    return rec
+
+
+def _author(author_id, language="en"):
+    return cs.AuthorRecord(SimpleNamespace(
+        id=author_id, name=f"Author {author_id}", photo=None, language=language, description=None,
+    ))
+
+
+def _snapshot():
+    return cs.CatalogSnapshot(
+        landings={},
+        book_landings={1: _book_landing(1, [10]), 2: _book_landing(2, [20])},
+        books={10: _book(10, [100]), 20: _book(20, [200])},
+        authors={100: _author(100), 200: _author(200), 300: _author(300)},
+        tag_names={},
+        publisher_names={},
+    )
+
+
+def test_book_landing_aggregates_books():
+    snap = _snapshot()
+    assert snap.book_landings[1].author_ids == (100,)
+    assert snap.book_landings[1].language == "EN"
+    assert snap.book_landing_by_author == {100: {1}, 200: {2}}
+
+
+def test_patch_does_not_mutate_previous_snapshot(monkeypatch):
+    base = _snapshot()
+    old_rec = base.book_landings[1]
+    untouched = base.book_landings[2]
+
+    monkeypatch.setattr(cs, "_load_books", lambda db, ids: {10: _book(10, [300])})
+    patched = cs._patch_snapshot(db=None, base=base, changes={cs.KIND_BOOK: {10}})
+
+    # прошлая версия (её читают другие потоки) осталась как была
+    assert old_rec.author_ids == (100,)
+    assert base.book_landing_by_author == {100: {1}, 200: {2}}
+    # новая версия пересчитала агрегаты на копии записи
+    assert patched.book_landings[1] is not old_rec
+    assert patched.book_landings[1].author_ids == (300,)
+    assert patched.book_landing_by_author == {300: {1}, 200: {2}}
+    # незатронутые записи переиспользуются как есть
+    assert patched.book_landings[2] is untouched
+    assert patched.version > base.version
+
+
+def test_author_language_is_normalized():
+    # фильтр поиска сравнивает с языками в верхнем регистре
+    assert _author(1, language="ru").language == "RU"
+    assert _author(2, language=None).language == ""
+
+
+def _landing(landing_id, price, course_ids, tag_ids, author_ids, language="EN"):
+    rec = cs.LandingRecord(SimpleNamespace(
+        id=landing_id, language=language, landing_name=f"L{landing_id}", page_name=f"l-{landing_id}",
+        preview_photo="", old_price=None, new_price=str(price), new_price_num=price,
+        lessons_count="", lessons_total=0, duration_minutes=0, sales_count=0,
+        created_at=datetime(2024, 1, landing_id),
+    ))
+    rec.course_ids = tuple(course_ids)
+    rec.tag_ids = tuple(tag_ids)
+    rec.author_ids = tuple(author_ids)
+    return rec
+
+
+def test_author_counters_cheapest_rule():
+    snap = cs.CatalogSnapshot(
+        landings={
+            1: _landing(1, 10, [7], [1], [100]),          # дешёвый лендинг курса 7
+            2: _landing(2, 30, [7], [2], [100]),          # дорогой дубль курса 7
+            3: _landing(3, 50, [8], [3], [100], "RU"),
+        },
+        book_landings={},
+        books={},
+        authors={100: _author(100)},
+        tag_names={1: "Implants", 2: "Surgery", 3: "Ortho"},
+        publisher_names={},
+    )
+    all_langs = snap.author_counters(100)
+    assert all_langs.courses == 2
+    assert all_langs.cheapest_courses == 2
+    assert all_langs.tags == ("Implants", "Ortho", "Surgery")
+    # списки авторов берут теги только «дешёвых» лендингов
+    assert all_langs.cheapest_tags == ("Implants", "Ortho")
+
+    en = snap.author_counters(100, ["en"])
+    assert (en.courses, en.cheapest_tags) == (1, ("Implants",))
+    assert snap.author_counters(100, ["EN", "RU"]).cheapest_tags == ("Implants", "Ortho")
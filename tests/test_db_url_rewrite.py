@@ -0,0 +1,70 @@
+import json
+
+from app.core.storage import S3_PUBLIC_HOST, public_url_for_key
+from app.utils import db_url_rewrite as rw
+
+OLD = "videos/a b (1).mp4"
+NEW = "videos/a b (1)_fixed.mp4"
+
+
+def _rewriter():
+    rn = rw._Rename.build(OLD, NEW)
+    return rw._ref_rewriter({rn.old_raw: rn})
+
+
+def test_ref_keeps_host_and_encoding():
+    rewrite = _rewriter()
+    soft = f"{S3_PUBLIC_HOST}/videos/a%20b%20(1).mp4"
+    strict = f"{S3_PUBLIC_HOST}/videos/a%20b%20%281%29.mp4"
+    assert rewrite(soft) == f"{S3_PUBLIC_HOST}/videos/a%20b%20(1)_fixed.mp4"
+    assert rewrite(strict) == f"{S3_PUBLIC_HOST}/videos/a%20b%20%281%29_fixed.mp4"
+    assert rewrite("/" + OLD) == "/" + NEW
+
+
+def test_ref_other_key_untouched():
+    rewrite = _rewriter()
+    assert rewrite(f"{S3_PUBLIC_HOST}/videos/a b (1).mp4.bak") is None
+    assert rewrite(f"{S3_PUBLIC_HOST}/videos/a%20b%20(1)") is None
+    assert rewrite("   ") is None
+
+
+def test_ref_rebuilds_url_in_unknown_encoding():
+    # key совпал после нормализации, но ни одна из форм не встречается дословно
+    rewrite = _rewriter()
+    odd = f"{S3_PUBLIC_HOST}/videos/%61%20b%20(1).mp4"
+    assert rewrite(odd) == public_url_for_key(NEW, public_host=S3_PUBLIC_HOST)
+
+
+def test_json_rewrites_only_matching_strings():
+    doc = {
+        "1": {
+            "section_name": f"see {OLD}",    # текст с key внутри — не ссылка, не трогаем
+            "lessons": [
+                {"lesson_name": "L1", "video_link": public_url_for_key(OLD, public_host=S3_PUBLIC_HOST)},
+                {"lesson_name": "L2", "video_link": public_url_for_key("videos/other.mp4", public_host=S3_PUBLIC_HOST)},
+                {"lesson_name": "L3", "video_link": OLD, "duration": 12, "extra": None},
+            ],
+        },
+    }
+    out, n = rw._rewrite_json(json.loads(json.dumps(doc)), _rewriter())
+    assert n == 2
+    lessons = out["1"]["lessons"]
+    assert lessons[0]["video_link"] == public_url_for_key(NEW, public_host=S3_PUBLIC_HOST)
+    assert lessons[1] == doc["1"]["lessons"][1]
+    assert lessons[2] == {"lesson_name": "L3", "video_link": NEW, "duration": 12, "extra": None}
+    assert out["1"]["section_name"] == doc["1"]["section_name"]
+
+
+def test_text_rewriter_replaces_escaped_forms():
+    rn = rw._Rename.build(OLD, NEW)
+    rewrite = rw._text_rewriter({rn.old_raw: rn})
+    html = '<video src="https:\\/\\/cloud\\/videos\\/a%20b%20(1).mp4">'
+    assert rewrite(html) == '<video src="https:\\/\\/cloud\\/videos\\/a%20b%20(1)_fixed.mp4">'
+    assert rewrite("<p>nothing here</p>") is None
+
+
+def test_like_patterns_skip_escaped_forms():
+    rn = rw._Rename.build(OLD, NEW)
+    patterns = rn.like_patterns()
+    assert "%videos/a%20b%20(1).mp4%" in patterns and f"%{OLD}%" in patterns
+    assert all("\\" not in p for p in patterns)
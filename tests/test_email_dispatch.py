@@ -0,0 +1,80 @@
+import fakeredis
+import pytest
+import redis
+
+from app.services_v2 import email_dispatch as ed
+
+RATE = 1.0   # токенов в секунду
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """Провайдер с ёмкостью 3 и 1 токеном/с; кампании с долей 1.0, чтобы считать только провайдера."""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(ed.redis.Redis, "from_url", classmethod(
+        lambda cls, url, **kw: fakeredis.FakeRedis(server=server, decode_responses=True)
+    ))
+    monkeypatch.setattr(ed, "_rds", None)
+    monkeypatch.setattr(ed, "_provider_limits", lambda provider: ("test", RATE, 3.0))
+    monkeypatch.setattr(ed, "CAMPAIGNS", {
+        "high": ed.Campaign(ed.PROVIDER_TRANSACTIONAL, priority=0, share=1.0),
+        "low": ed.Campaign(ed.PROVIDER_TRANSACTIONAL, priority=2, share=1.0),
+    })
+    monkeypatch.setattr(ed, "PRIORITY_FLOOR", {0: 0.0, 2: 2 / 3})
+
+
+def test_burst_then_no_grant(bucket):
+    assert [ed.acquire("high")[0] for _ in range(3)] == [1, 1, 1]
+    grant, wait = ed.acquire("high")
+    assert grant == 0 and wait == pytest.approx(1 / RATE, abs=0.05)
+    # без резерва ведро не трогается — повтор видит тот же срок
+    assert ed.acquire("high")[1] == pytest.approx(wait, abs=0.05)
+
+
+def test_reservations_get_consecutive_slots(bucket):
+    for _ in range(3):
+        assert ed.acquire("high", reserve=True) == (1, 0.0)
+    waits = [ed.acquire("high", reserve=True) for _ in range(4)]
+    assert all(g == 1 for g, _ in waits)
+    assert [w for _, w in waits] == pytest.approx([1, 2, 3, 4], abs=0.05)
+    # резервы в долг отодвигают и обычный acquire
+    assert ed.acquire("high") == (0, pytest.approx(5, abs=0.05))
+
+
+def test_reservation_horizon_is_capped(bucket, monkeypatch):
+    monkeypatch.setattr(ed, "MAX_RESERVE_SECONDS", 2)
+    for _ in range(3):
+        ed.acquire("high", reserve=True)
+    assert [ed.acquire("high", reserve=True)[0] for _ in range(2)] == [1, 1]    # слоты 1 и 2 с
+    grant, wait = ed.acquire("high", reserve=True)
+    assert grant == 0 and wait == pytest.approx(3, abs=0.05)
+    # отказ долг не увеличивает
+    assert ed.acquire("high", reserve=True) == (0, pytest.approx(3, abs=0.05))
+
+
+def test_partial_grants_what_is_left(bucket):
+    assert ed.acquire("high", 5, partial=True)[0] == 3
+    grant, wait = ed.acquire("high", 5, partial=True)
+    assert grant == 0 and wait == pytest.approx(1 / RATE, abs=0.05)
+
+
+def test_low_priority_leaves_floor_to_high(bucket):
+    # floor 2 из 3: низкий приоритет получает один токен, остаток — высокому
+    assert ed.acquire("low", 3, partial=True)[0] == 1
+    grant, wait = ed.acquire("low")
+    assert grant == 0 and wait == pytest.approx(1 / RATE, abs=0.05)
+    assert ed.acquire("high", 3, partial=True)[0] == 2
+
+
+def test_low_priority_reservation_waits_for_floor(bucket):
+    assert ed.acquire("low", reserve=True) == (1, 0.0)
+    assert ed.acquire("low", reserve=True)[1] == pytest.approx(1 / RATE, abs=0.05)
+
+
+def test_redis_down_sends_unpaced(bucket, monkeypatch):
+    def broken(*a, **kw):
+        raise redis.ConnectionError("down")
+
+    ed._redis()
+    monkeypatch.setattr(ed, "_take_script", broken)
+    assert ed.acquire("high", 4, reserve=True) == (4, 0.0)
@@ -0,0 +1,106 @@
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models.models_v2 import (
+    Author, Base, Book, BookFile, BookFileFormat, BookLanding, Course, Landing, Publisher, Tag,
+    book_authors, book_landing_books, book_publishers, book_tags,
+    landing_authors, landing_course, landing_tags,
+)
+from app.services_v2 import facet_engine
+from scripts.bench_facets import (
+    AUTHOR_STATES, BOOK_STATES, LANDING_STATES, _diff, _sql_author, _sql_book, _sql_landing,
+)
+
+NOW = datetime(2026, 3, 20, 12, 0)
+LANGS = ["EN", "RU", "ES"]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    rng = random.Random(3)
+    with Session(engine) as session:
+        session.execute(insert(Tag.__table__), [{"id": i, "name": f"tag{i}"} for i in range(1, 9)])
+        session.execute(insert(Author.__table__), [
+            {"id": i, "name": f"Dr author {i}", "language": rng.choice(LANGS)} for i in range(1, 16)
+        ])
+        session.execute(insert(Course.__table__), [{"id": i, "name": f"c{i}"} for i in range(1, 31)])
+        landings, la, lt, lc = [], set(), set(), set()
+        for lid in range(1, 61):
+            price = rng.choice([None, 0, 19, 49.5, 99, 150, 299])
+            landings.append({
+                "id": lid, "landing_name": rng.choice(["Implant basics", "Ortho", "Endo course"]) + f" {lid}",
+                "page_name": f"l-{lid}", "language": rng.choice(LANGS),
+                "new_price": None if price is None else str(price), "new_price_num": price,
+                "lessons_total": rng.randint(0, 80), "sales_count": rng.randint(0, 50),
+                "duration_minutes": 0, "is_hidden": rng.random() < 0.1, "created_at": NOW,
+            })
+            la |= {(lid, rng.randint(1, 15)) for _ in range(rng.randint(0, 3))}
+            lt |= {(lid, rng.randint(1, 8)) for _ in range(rng.randint(0, 3))}
+            lc |= {(lid, rng.randint(1, 30)) for _ in range(rng.randint(0, 2))}
+        session.execute(insert(Landing.__table__), landings)
+        session.execute(insert(landing_authors), [{"landing_id": a, "author_id": b} for a, b in sorted(la)])
+        session.execute(insert(landing_tags), [{"landing_id": a, "tag_id": b} for a, b in sorted(lt)])
+        session.execute(insert(landing_course), [{"landing_id": a, "course_id": b} for a, b in sorted(lc)])
+        _seed_books(session, rng)
+        facet_engine.invalidate_facet_indexes()
+        yield session
+    facet_engine.invalidate_facet_indexes()
+
+
+def _seed_books(session, rng):
+    session.execute(insert(Publisher.__table__), [
+        {"id": i, "name": f"pub{i}", "created_at": NOW} for i in range(1, 5)
+    ])
+    session.execute(insert(Book.__table__), [{
+        "id": bid, "title": f"Book {bid}", "slug": f"b-{bid}", "language": rng.choice(LANGS),
+        "publication_date": rng.choice([None, "2012", "2015-06-01", "2020", "n/a"]),
+        "page_count": rng.choice([None, 120, 300, 640, 900]), "created_at": NOW, "updated_at": NOW,
+    } for bid in range(1, 31)])
+    ba, bt, bp, blb, files = set(), set(), set(), set(), []
+    for bid in range(1, 31):
+        ba |= {(bid, rng.randint(1, 15)) for _ in range(rng.randint(0, 2))}
+        bt |= {(bid, rng.randint(1, 8)) for _ in range(rng.randint(0, 2))}
+        bp |= {(bid, rng.randint(1, 4)) for _ in range(rng.randint(0, 1))}
+        for fmt in rng.sample(list(BookFileFormat), rng.randint(0, 2)):
+            files.append({"book_id": bid, "file_format": fmt, "s3_url": f"s3://b/{bid}.{fmt.value}"})
+    session.execute(insert(BookLanding.__table__), [{
+        "id": blid, "page_name": f"bl-{blid}", "landing_name": rng.choice(["Ortho atlas", "Perio"]) + f" {blid}",
+        "language": rng.choice(LANGS), "new_price": rng.choice([None, 9, 25, 60]),
+        "sales_count": 0, "is_hidden": rng.random() < 0.1, "created_at": NOW, "updated_at": NOW,
+    } for blid in range(1, 21)])
+    for blid in range(1, 21):
+        blb |= {(blid, rng.randint(1, 30)) for _ in range(rng.randint(1, 3))}
+    session.execute(insert(book_authors), [{"book_id": a, "author_id": b} for a, b in sorted(ba)])
+    session.execute(insert(book_tags), [{"book_id": a, "tag_id": b} for a, b in sorted(bt)])
+    session.execute(insert(book_publishers), [{"book_id": a, "publisher_id": b} for a, b in sorted(bp)])
+    session.execute(insert(book_landing_books), [{"book_landing_id": a, "book_id": b} for a, b in sorted(blb)])
+    session.execute(insert(BookFile.__table__), files)
+
+
+EXTRA_LANDING_STATES = [
+    {"tags": [1, 2]},
+    {"language": "EN", "author_ids": [3, 4], "price_from": 20},
+    {"lessons_from": 10, "lessons_to": 40, "tags": [5]},
+]
+
+
+@pytest.mark.parametrize("filters", LANDING_STATES + EXTRA_LANDING_STATES, ids=repr)
+def test_landing_facets_match_sql(db, filters):
+    assert _diff(_sql_landing(db, filters), facet_engine.facet_landing_filters(db, filters)) == "OK"
+
+
+@pytest.mark.parametrize("filters", BOOK_STATES + [{"tags": [1], "publisher_ids": [2]}], ids=repr)
+def test_book_facets_match_sql(db, filters):
+    assert _diff(_sql_book(db, filters), facet_engine.facet_book_filters(db, filters)) == "OK"
+
+
+@pytest.mark.parametrize("filters", AUTHOR_STATES + [{"tags": [2, 3]}], ids=repr)
+def test_author_facets_match_sql(db, filters):
+    assert _diff(_sql_author(db, filters), facet_engine.facet_author_filters(db, filters)) == "OK"
+
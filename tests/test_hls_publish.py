@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from app.utils import hls_publish
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_paginator(self, name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {"Contents": [{"Key": k} for k in sorted(objects) if k.startswith(Prefix)]}
+
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [o["Key"] for o in Delete["Objects"]]
+        for k in keys:
+            self.objects.pop(k, None)
+        return {"Deleted": [{"Key": k} for k in keys]}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+
+    def upload_file(path, *, bucket, key, extra_args=None, client=None):
+        with open(path, "rb") as fh:
+            fake.objects[key] = fh.read()
+        return len(fake.objects[key])
+
+    monkeypatch.setattr(hls_publish.s3_upload, "upload_file", upload_file)
+    monkeypatch.setattr(hls_publish.s3_meta_index, "forget", lambda keys, bucket=None: None)
+    monkeypatch.setattr(hls_publish, "SCAN_INTERVAL", 0.01)
+    return fake
+
+
+def _write(tmp_path, name, data=b"x"):
+    with open(os.path.join(tmp_path, name), "wb") as fh:
+        fh.write(data)
+
+
+def test_finish_publishes_segments_then_playlist(tmp_path, s3):
+    with hls_publish.HLSPublisher(str(tmp_path), "v/.hls/a", client=s3, extra_args_for=lambda n: {}) as pub:
+        for i in range(3):
+            _write(tmp_path, f"segment_{i:03d}.ts")
+        _write(tmp_path, "playlist.m3u8")
+        stats = pub.finish()
+    assert stats["files"] == 4
+    assert set(s3.objects) == {
+        "v/.hls/a/segment_000.ts", "v/.hls/a/segment_001.ts", "v/.hls/a/segment_002.ts", "v/.hls/a/playlist.m3u8",
+    }
+
+
+def test_ffmpeg_failure_discards_published_segments(tmp_path, s3):
+    s3.objects["v/.hls/other/keep.ts"] = b"old"
+    with hls_publish.HLSPublisher(str(tmp_path), "v/.hls/a", client=s3, extra_args_for=lambda n: {}) as pub:
+        for i in range(3):
+            _write(tmp_path, f"segment_{i:03d}.ts")
+        pub._scan(final=True, playlists=False)
+        pub._drain()
+        assert len(s3.objects) == 4
+        # ffmpeg упал — finish() не вызывается
+    assert set(s3.objects) == {"v/.hls/other/keep.ts"}
+
+
+def test_exception_discards_published_segments(tmp_path, s3):
+    with pytest.raises(RuntimeError):
+        with hls_publish.HLSPublisher(str(tmp_path), "v/.hls/a", client=s3, extra_args_for=lambda n: {}) as pub:
+            _write(tmp_path, "segment_000.ts")
+            pub._scan(final=True, playlists=False)
+            pub._drain()
+            raise RuntimeError("ffmpeg exited with 1")
+    assert s3.objects == {}
+
+
+def test_rebuild_in_place_keeps_old_segments_on_failure(tmp_path, s3):
+    s3.objects.update({"v/.hls/a/segment_000.ts": b"old", "v/.hls/a/playlist.m3u8": b"old"})
+    with hls_publish.HLSPublisher(str(tmp_path), "v/.hls/a", client=s3, extra_args_for=lambda n: {}) as pub:
+        assert not pub.streaming
+        for i in range(3):
+            _write(tmp_path, f"segment_{i:03d}.ts")
+        pub._stop.wait(0.05)
+        # пока ffmpeg работает, старый плейлист раздаёт прежние сегменты
+        assert s3.objects == {"v/.hls/a/segment_000.ts": b"old", "v/.hls/a/playlist.m3u8": b"old"}
+    assert s3.objects == {"v/.hls/a/segment_000.ts": b"old", "v/.hls/a/playlist.m3u8": b"old"}
+
+
+def test_discard_never_deletes_preexisting_keys(tmp_path, s3):
+    s3.objects["v/.hls/a/segment_000.ts"] = b"old"
+    with pytest.raises(RuntimeError):
+        with hls_publish.HLSPublisher(str(tmp_path), "v/.hls/a", client=s3, extra_args_for=lambda n: {}) as pub:
+            for i in range(2):
+                _write(tmp_path, f"segment_{i:03d}.ts")
+            pub._scan(final=True, playlists=False)    # упали посреди догрузки
+            pub._drain()
+            raise RuntimeError("upload failed")
+    assert set(s3.objects) == {"v/.hls/a/segment_000.ts"}
+
+
+def test_rebuild_in_place_uploads_after_success(tmp_path, s3):
+    s3.objects["v/.hls/a/segment_000.ts"] = b"old"
+    with hls_publish.HLSPublisher(str(tmp_path), "v/.hls/a", client=s3, extra_args_for=lambda n: {}) as pub:
+        _write(tmp_path, "segment_000.ts", b"new")
+        _write(tmp_path, "playlist.m3u8")
+        stats = pub.finish()
+    assert stats["streamed"] is False
+    assert s3.objects["v/.hls/a/segment_000.ts"] == b"new" and "v/.hls/a/playlist.m3u8" in s3.objects
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models.models_v2 import Base, Course, Landing, LessonVideo, landing_course
+from app.services_v2 import filter_aggregation_service as fas
+from app.services_v2.lesson_video_index import ENTITY_COURSE
+
+NOW = datetime(2026, 3, 20, 12, 0)
+
+SECTIONS = {
+    1: {"1": {"section_name": "A", "lessons": [{"lesson_name": "a1"}, {"lesson_name": "a2"}]}},
+    2: [{"section_name": "B", "lessons": [{"lesson_name": "b1"}]}],
+}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(Course.__table__), [{"id": cid, "sections": s} for cid, s in SECTIONS.items()])
+        session.execute(insert(Landing.__table__), [{
+            "id": lid, "landing_name": f"L{lid}", "language": "EN", "duration": "1h 30m",
+            "sales_count": 0, "lessons_total": 0, "duration_minutes": 0, "is_hidden": False, "created_at": NOW,
+        } for lid in (1, 2)])
+        session.execute(insert(landing_course), [
+            {"landing_id": 1, "course_id": 1}, {"landing_id": 1, "course_id": 2}, {"landing_id": 2, "course_id": 2},
+        ])
+        yield session
+
+
+def _lessons(db, monkeypatch):
+    """lessons_total по лендингам — из маппингов, которые ушли бы в bulk_update."""
+    written = {}
+    monkeypatch.setattr(db, "bulk_update_mappings", lambda model, rows: written.update(
+        (r["id"], r["lessons_total"]) for r in rows
+    ))
+    fas.refresh_landing_metrics(db)
+    return written
+
+
+def test_empty_index_falls_back_to_sections(db, monkeypatch):
+    assert _lessons(db, monkeypatch) == {1: 3, 2: 1}
+
+
+def test_built_index_is_used(db, monkeypatch):
+    # индекс расходится с JSON — значит, посчитано по нему
+    db.execute(insert(LessonVideo.__table__), [
+        {"id": i + 1, "entity_type": ENTITY_COURSE, "entity_id": 2, "lesson_index": i, "is_ours": False, "updated_at": NOW}
+        for i in range(4)
+    ])
+    assert _lessons(db, monkeypatch) == {1: 4, 2: 4}
@@ -0,0 +1,28 @@
+from decimal import Decimal
+
+import pytest
+
+from app.models.models_v2 import normalize_price
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("49.99", Decimal("49.99")),
+    ("49,99", Decimal("49.99")),
+    (" 49 ", Decimal("49.00")),
+    ("49.995", Decimal("50.00")),          # half-up, как CAST в MySQL
+    (49.99, Decimal("49.99")),
+    (10, Decimal("10.00")),
+    (Decimal("12.345"), Decimal("12.35")),
+    ("99999999.99", Decimal("99999999.99")),
+])
+def test_valid_prices(raw, expected):
+    assert normalize_price(raw) == expected
+
+
+@pytest.mark.parametrize("raw", [
+    None, "", "  ", "abc", "$49", "-5", "1e3", "nan", "Infinity",
+    Decimal("NaN"), Decimal("Infinity"), Decimal("-1"),
+    "100000000", "99999999.995",
+])
+def test_rejected_prices(raw):
+    assert normalize_price(raw) is None
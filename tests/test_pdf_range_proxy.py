@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.services_v2 import pdf_range_proxy as proxy
+
+
+DATA = bytes(range(256)) * 40      # 10 240 байт
+
+
+class FakeS3:
+    def __init__(self, etag='"v1"', data=DATA):
+        self.etag = etag
+        self.data = data
+        self.get_status = None
+        self.gets = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={
+                "content-length": str(len(self.data)), "etag": self.etag, "content-type": "application/pdf",
+            })
+        self.gets.append(dict(request.headers))
+        if self.get_status:
+            return httpx.Response(self.get_status)
+        if_match = request.headers.get("if-match")
+        if if_match and if_match != self.etag:
+            return httpx.Response(412)
+        start, end = map(int, request.headers["range"].removeprefix("bytes=").split("-"))
+        return httpx.Response(206, stream=httpx.ByteStream(self.data[start:end + 1]))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(proxy, "_presign", lambda op, key: f"http://s3.local/{key}")
+    monkeypatch.setattr(proxy, "_http", httpx.AsyncClient(transport=httpx.MockTransport(fake.handler)))
+    monkeypatch.setattr(proxy, "_meta", type(proxy._meta)())
+    monkeypatch.setattr(proxy, "_chunks", proxy.ChunkCache(1 << 20))
+    monkeypatch.setattr(proxy, "CHUNK_SIZE", 1024)
+    return fake
+
+
+def _serve(headers):
+    async def run():
+        meta = await proxy.get_object_meta("books/1.pdf")
+        resp = await proxy.build_pdf_response(meta, headers)
+        body = b""
+        if hasattr(resp, "body_iterator"):
+            async for piece in resp.body_iterator:
+                body += piece
+        return resp, body
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=950-", [(950, 999)]),
+    ("bytes=0-10,5-20,40-50", [(0, 20), (40, 50)]),
+    ("bytes=2000-3000", []),
+    ("items=0-1", None),
+    ("bytes=9-3", None),
+])
+def test_parse_range(header, expected):
+    assert proxy.parse_range(header, 1000) == expected
+
+
+def test_single_range_spans_chunks(s3):
+    resp, body = _serve({"range": "bytes=1000-3100"})
+    assert resp.status_code == 206
+    assert resp.headers["content-range"] == f"bytes 1000-3100/{len(DATA)}"
+    assert body == DATA[1000:3101]
+    assert s3.gets[0]["if-match"] == '"v1"'
+
+    # повтор — из кэша блоков, без GET
+    s3.gets.clear()
+    _, body = _serve({"range": "bytes=1500-2047"})
+    assert body == DATA[1500:2048] and not s3.gets
+
+
+def test_multirange_body(s3):
+    resp, body = _serve({"range": "bytes=0-9,5000-5009"})
+    assert resp.status_code == 206
+    assert DATA[0:10] in body and DATA[5000:5010] in body
+    assert int(resp.headers["content-length"]) == len(body)
+
+
+def test_upstream_failure_is_502_before_headers(s3):
+    s3.get_status = 503
+    with pytest.raises(HTTPException) as exc:
+        _serve({"range": "bytes=0-99"})
+    assert exc.value.status_code == 502
+
+
+def test_reuploaded_object_refreshes_meta(s3):
+    _serve({"range": "bytes=0-9"})           # meta с ETag v1 в кэше
+    s3.etag, s3.data = '"v2"', DATA[::-1]
+    resp, body = _serve({"range": "bytes=4000-4009"})
+    assert resp.status_code == 206
+    assert resp.headers["etag"] == '"v2"'
+    assert body == s3.data[4000:4010]
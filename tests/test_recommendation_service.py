@@ -0,0 +1,105 @@
+from collections import Counter
+from itertools import permutations
+
+import fakeredis
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models.models_v2 import users_courses
+from app.services_v2 import recommendation_service as rs
+
+
+PURCHASES = [
+    (1, 10), (1, 20), (1, 30),
+    (2, 10), (2, 20),
+    (3, 20), (3, 30), (3, 40),
+    (4, 40),
+    (5, 10), (5, 40),
+]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    users_courses.create(engine)
+    with Session(engine) as session:
+        session.execute(insert(users_courses), [{"user_id": u, "course_id": c} for u, c in PURCHASES])
+        session.commit()
+        yield session
+
+
+def _brute_force_pairs():
+    by_user = {}
+    for u, c in PURCHASES:
+        by_user.setdefault(u, set()).add(c)
+    pairs = Counter()
+    for courses in by_user.values():
+        pairs.update(permutations(sorted(courses), 2))
+    return pairs
+
+
+def _matrix_pairs(matrix):
+    pairs = {}
+    for row, a in enumerate(matrix.course_ids.tolist()):
+        for k in range(matrix.indptr[row], matrix.indptr[row + 1]):
+            pairs[(a, int(matrix.course_ids[matrix.indices[k]]))] = int(matrix.data[k])
+    return pairs
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 5000])
+def test_build_matches_brute_force(db, monkeypatch, chunk):
+    monkeypatch.setattr(rs, "USERS_PER_CHUNK", chunk)
+    matrix = rs.build_copurchase_matrix(db)
+    assert _matrix_pairs(matrix) == dict(_brute_force_pairs())
+
+
+def test_top_neighbors_keeps_strongest(db):
+    matrix = rs.build_copurchase_matrix(db, top_neighbors=1)
+    pairs = _matrix_pairs(matrix)
+    # у 10: 20 — 2 покупателя, 30 и 40 — по одному
+    assert {b for (a, b) in pairs if a == 10} == {20}
+    # у 20: 10 и 30 — по 2 покупателя, при ничьей берётся меньший id
+    assert {b for (a, b) in pairs if a == 20} == {10}
+
+
+def test_recommend_scores_and_excludes_bought(db):
+    matrix = rs.build_copurchase_matrix(db)
+    # bought {10}: 20→2, 30→1, 40→1 (ничья по id)
+    assert matrix.recommend([10]) == [20, 30, 40]
+    # bought {10, 20}: 30→1+2, 40→1+1
+    assert matrix.recommend([10, 20]) == [30, 40]
+    assert matrix.recommend([999]) == []
+
+
+def test_payload_roundtrip(db):
+    matrix = rs.build_copurchase_matrix(db)
+    restored = rs.CoPurchaseMatrix.from_payload(matrix.to_payload())
+    assert restored.recommend([30]) == matrix.recommend([30])
+
+
+def test_absent_matrix_is_cached(monkeypatch):
+    server = fakeredis.FakeRedis(decode_responses=True)
+    calls = []
+    real_get = server.get
+
+    def counting_get(key):
+        calls.append(key)
+        return real_get(key)
+
+    monkeypatch.setattr(server, "get", counting_get)
+    monkeypatch.setattr(rs, "_rds", server)
+    monkeypatch.setattr(rs, "_matrix", None)
+    monkeypatch.setattr(rs, "_checked_at", None)
+    clock = [1000.0]
+    monkeypatch.setattr(rs.time, "monotonic", lambda: clock[0])
+
+    assert rs.get_copurchase_matrix() is None
+    assert rs.get_copurchase_matrix() is None
+    assert len(calls) == 1
+
+    clock[0] += rs.ABSENT_CHECK_SECONDS
+    server.set(rs.MATRIX_KEY, '{"version":"1","course_ids":[1],"indptr":[0,0],"indices":[],"data":[]}')
+    server.set(rs.MATRIX_VERSION_KEY, "1")
+    matrix = rs.get_copurchase_matrix()
+    assert matrix is not None and matrix.version == "1"
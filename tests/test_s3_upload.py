@@ -0,0 +1,117 @@
+import io
+import os
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.utils import s3_upload
+
+MIN = 1024
+
+
+class FakeS3:
+    def __init__(self, fail_part=None, fail_times=0, status=500):
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self.put = None
+        self.calls = 0
+        self._fail = (fail_part, fail_times, status)
+        self._lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key, **kw):
+        return {"UploadId": "u1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentLength):
+        part, times, status = self._fail
+        with self._lock:
+            self.calls += 1
+            if PartNumber == part and times:
+                self._fail = (part, times - 1, status)
+                raise ClientError({"Error": {"Code": "X"}, "ResponseMetadata": {"HTTPStatusCode": status}}, "UploadPart")
+        data = Body.read()
+        assert len(data) == ContentLength
+        self.parts[PartNumber] = data
+        return {"ETag": f"e{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+    def put_object(self, Bucket, Key, Body, ContentLength, **kw):
+        self.put = Body.read()
+
+
+class Trickle(io.RawIOBase):
+    """Поток, отдающий данные мелкими кусками, как pipe ffmpeg."""
+
+    def __init__(self, data, chunk=100):
+        self._data, self._pos, self._chunk = data, 0, chunk
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._chunk, len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(s3_upload, "MIN_PART_SIZE", MIN)
+    monkeypatch.setattr(s3_upload, "RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(s3_upload.s3_meta_index, "record_upload", lambda *a, **kw: None)
+
+
+@pytest.mark.parametrize("size, sizes", [
+    (MIN * 5 // 2, [MIN, MIN, MIN // 2]),
+    (MIN * 2, [MIN, MIN]),           # ровно кратно — без пустой последней части
+    (10, [10]),
+])
+def test_parts_are_full_except_last(size, sizes):
+    data = os.urandom(size)
+    s3 = FakeS3()
+    assert s3_upload.upload_stream(Trickle(data), bucket="b", key="k", client=s3, part_size=MIN, concurrency=2) == size
+    assert [len(s3.parts[n]) for n in sorted(s3.parts)] == sizes
+    assert s3.completed == sorted(s3.parts)
+    assert b"".join(s3.parts[n] for n in sorted(s3.parts)) == data
+
+
+def test_part_size_is_raised_to_s3_minimum():
+    s3 = FakeS3()
+    s3_upload.upload_stream(io.BytesIO(os.urandom(MIN * 2)), bucket="b", key="k", client=s3, part_size=100)
+    assert [len(p) for p in s3.parts.values()] == [MIN, MIN]
+
+
+def test_empty_stream_aborts():
+    s3 = FakeS3()
+    assert s3_upload.upload_stream(io.BytesIO(b""), bucket="b", key="k", client=s3) == 0
+    assert s3.aborted and s3.completed is None
+
+
+def test_retryable_part_error_is_retried():
+    s3 = FakeS3(fail_part=2, fail_times=2, status=503)
+    data = os.urandom(MIN * 3)
+    assert s3_upload.upload_stream(io.BytesIO(data), bucket="b", key="k", client=s3, part_size=MIN) == len(data)
+    assert s3.calls == 5
+    assert b"".join(s3.parts[n] for n in sorted(s3.parts)) == data
+
+
+def test_fatal_part_error_aborts_upload():
+    s3 = FakeS3(fail_part=2, fail_times=1, status=403)
+    with pytest.raises(ClientError):
+        s3_upload.upload_stream(io.BytesIO(os.urandom(MIN * 3)), bucket="b", key="k", client=s3, part_size=MIN)
+    assert s3.aborted and s3.completed is None
+
+
+def test_upload_file_small_goes_to_put_object(tmp_path):
+    path = tmp_path / "small.bin"
+    path.write_bytes(b"x" * 10)
+    s3 = FakeS3()
+    assert s3_upload.upload_file(str(path), bucket="b", key="k", client=s3, part_size=MIN) == 10
+    assert s3.put == b"x" * 10 and not s3.parts
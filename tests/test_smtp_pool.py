@@ -0,0 +1,134 @@
+import smtplib
+
+import pytest
+
+from app.utils.email_sender import smtp_pool
+
+
+class FakeSMTP:
+    def __init__(self, fail=None, noop_code=250):
+        self.fail = list(fail or [])     # исключения для очередных sendmail
+        self.noop_code = noop_code
+        self.sent = []
+        self.closed = False
+
+    def sendmail(self, sender, recipients, data, mail_options=()):
+        if self.fail:
+            exc = self.fail.pop(0)
+            if exc is not None:
+                raise exc
+        self.sent.append((recipients[0], data))
+        self.options = list(mail_options)
+
+    def noop(self):
+        return (self.noop_code, b"ok")
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    p = smtp_pool.SMTPPool("smtp.test", 587, size=2)
+    p.connects = []
+    p.next_fail = []
+
+    def connect():
+        smtp = FakeSMTP(fail=p.next_fail)
+        p.next_fail = []
+        p.connects.append(smtp)
+        return smtp_pool._Conn(smtp=smtp)
+
+    monkeypatch.setattr(p, "_connect", connect)
+    return p
+
+
+MSG = smtp_pool.prepare_message("Sender <s@test>", "Тема", "<p>hi</p>")
+
+
+def test_message_rendered_once_with_per_recipient_to():
+    data = MSG.for_recipient("a@test")
+    assert data.startswith(b"To: a@test\r\n") and b"Subject: =?utf-8?" in data
+    assert MSG.for_recipient("b@test")[len(b"To: b@test\r\n"):] == MSG.data
+
+
+def test_message_uses_crlf_only():
+    long_subject = "Длинная тема письма " * 10
+    msg = smtp_pool.prepare_message("Sender <s@test>", long_subject, "<p>hi</p>\n<p>there</p>",
+                                    text_body="line1\nline2", headers={"List-Unsubscribe": "<mailto:u@test>"})
+    data = msg.for_recipient("a@test")
+    assert data.count(b"\r\n") > 10
+    assert data.replace(b"\r\n", b"").count(b"\n") == 0
+    assert b"\r" not in data.replace(b"\r\n", b"")
+
+
+def test_internationalized_recipients(pool):
+    pool.send(MSG, "user@пример.рф")
+    rcpt, data = pool.connects[0].sent[-1]
+    assert rcpt == "user@xn--e1afmkfd.xn--p1ai" and pool.connects[0].options == []
+    assert data.startswith(b"To: user@xn--e1afmkfd.xn--p1ai\r\n")
+
+    pool.send(MSG, "пользователь@test")
+    rcpt, data = pool.connects[0].sent[-1]
+    assert rcpt == "пользователь@test" and pool.connects[0].options == ["SMTPUTF8"]
+    assert data.startswith("To: пользователь@test\r\n".encode("utf-8"))
+
+
+def test_server_without_smtputf8_keeps_session(pool):
+    pool.next_fail = [smtplib.SMTPNotSupportedError("SMTPUTF8 not supported by server")]
+    with pytest.raises(smtplib.SMTPNotSupportedError):
+        pool.send(MSG, "пользователь@test")
+    pool.send(MSG, "a@test")
+    assert len(pool.connects) == 1
+
+
+def test_connection_is_reused(pool):
+    for rcpt in ("a@test", "b@test", "c@test"):
+        pool.send(MSG, rcpt)
+    assert len(pool.connects) == 1
+    assert [r for r, _ in pool.connects[0].sent] == ["a@test", "b@test", "c@test"]
+
+
+def test_dropped_reused_session_reconnects_once(pool):
+    pool.send(MSG, "a@test")
+    pool.connects[0].fail = [smtplib.SMTPServerDisconnected("timeout")]
+    pool.send(MSG, "b@test")
+    assert len(pool.connects) == 2 and pool.connects[0].closed
+    assert [r for r, _ in pool.connects[1].sent] == ["b@test"]
+    # свежая сессия вернулась в пул
+    pool.send(MSG, "c@test")
+    assert len(pool.connects) == 2
+
+
+def test_drop_on_fresh_session_is_raised_and_not_pooled(pool):
+    pool.next_fail = [ConnectionResetError("reset")]
+    with pytest.raises(ConnectionResetError):
+        pool.send(MSG, "a@test")
+    assert pool.connects[0].closed and pool._idle == []
+
+
+def test_refused_recipient_keeps_session(pool):
+    pool.next_fail = [smtplib.SMTPRecipientsRefused({"bad@test": (550, b"no such user")})]
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        pool.send(MSG, "bad@test")
+    pool.send(MSG, "a@test")
+    assert len(pool.connects) == 1 and not pool.connects[0].closed
+    assert [r for r, _ in pool.connects[0].sent] == ["a@test"]
+
+
+def test_worn_out_session_is_replaced(pool, monkeypatch):
+    monkeypatch.setattr(smtp_pool, "SMTP_MAX_MESSAGES", 2)
+    for rcpt in ("a@test", "b@test", "c@test"):
+        pool.send(MSG, rcpt)
+    assert len(pool.connects) == 2 and pool.connects[0].closed
+
+
+def test_idle_session_failing_noop_is_replaced(pool, monkeypatch):
+    monkeypatch.setattr(smtp_pool, "SMTP_NOOP_AFTER", 0)
+    pool.send(MSG, "a@test")
+    pool.connects[0].noop_code = 421
+    pool.send(MSG, "b@test")
+    assert len(pool.connects) == 2 and pool.connects[0].closed
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.models.models_v2 import (
+    AdVisit, LandingVisit, Purchase, TrafficHourly, TrafficRollupState, TrafficTotal,
+)
+from app.services_v2 import traffic_rollup as tr
+
+T0 = datetime(2026, 3, 1, 10, 0)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    for model in (LandingVisit, AdVisit, Purchase, TrafficHourly, TrafficTotal, TrafficRollupState):
+        model.__table__.create(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def _visits(db, *stamps, landing_id=1):
+    db.execute(insert(LandingVisit.__table__), [
+        {"landing_id": landing_id, "visited_at": ts, "from_ad": False} for ts in stamps
+    ])
+
+
+def _rolled_up(db, last_id):
+    """Сырые визиты с id <= last_id уже в бакетах — как после refresh()."""
+    counts = {}
+    rows = db.query(LandingVisit.landing_id, LandingVisit.visited_at).filter(LandingVisit.id <= last_id)
+    for tid, ts in rows:
+        key = (tid, tr._floor_hour(ts))
+        counts[key] = counts.get(key, 0) + 1
+    if counts:
+        db.execute(insert(TrafficHourly.__table__), [
+            {"kind": tr.KIND_LANDING, "target_id": tid, "bucket": b, "visits": n} for (tid, b), n in counts.items()
+        ])
+    db.execute(insert(TrafficRollupState.__table__), [
+        {"source": s.name, "last_id": last_id if s.name == "landing_visits" else 0, "updated_at": T0}
+        for s in tr._SOURCES
+    ])
+
+
+def _brute(stamps, start, end):
+    return sum(1 for ts in stamps if (start is None or ts >= start) and (end is None or ts < end))
+
+
+STAMPS = [
+    T0.replace(minute=5), T0.replace(minute=40),               # 10:05, 10:40
+    T0.replace(hour=11, minute=10), T0.replace(hour=11, minute=50),
+    T0.replace(hour=12, minute=0), T0.replace(hour=12, minute=30),
+    T0.replace(hour=13, minute=20),
+]
+
+
+@pytest.mark.parametrize("start, end", [
+    (T0.replace(minute=30), T0.replace(hour=12, minute=45)),   # оба края неполные
+    (T0.replace(minute=30), T0.replace(minute=50)),            # внутри одного часа
+    (T0.replace(minute=30), T0.replace(hour=11, minute=30)),   # соседние часы, без целых
+    (T0, T0.replace(hour=12)),                                 # ровно по часам
+    (None, T0.replace(hour=11, minute=30)),
+    (T0.replace(hour=11, minute=30), None),
+])
+@pytest.mark.parametrize("last_id", [0, 4, 7])
+def test_window_totals_are_exact(db, start, end, last_id):
+    _visits(db, *STAMPS)
+    _rolled_up(db, last_id)
+    got = tr.totals(db, tr.KIND_LANDING, [1], start_dt=start, end_dt=end)
+    assert got["visits"] == _brute(STAMPS, start, end)
+
+
+def test_by_target_window_edges(db):
+    _visits(db, *STAMPS, landing_id=1)
+    _visits(db, T0.replace(minute=45), T0.replace(hour=11, minute=5), landing_id=2)
+    _rolled_up(db, 8)
+    got = tr.by_target(db, tr.KIND_LANDING, [1, 2], "visits",
+                       start_dt=T0.replace(minute=30), end_dt=T0.replace(hour=11, minute=30))
+    assert got == {1: 2, 2: 2}
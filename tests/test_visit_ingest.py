@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+import fakeredis
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+from app.services_v2 import visit_ingest as vi
+
+
+class FakeSession:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.fixture
+def r(monkeypatch):
+    server = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(vi, "_rds", server)
+    return server
+
+
+def _fake_apply(poison=(), transient=()):
+    written = []
+
+    def apply(db, events, *, nowait, use_hll):
+        ids = [ev["id"] for ev in events]
+        if any(i in transient for i in ids):
+            raise OperationalError("INSERT", {}, Exception("server has gone away"))
+        if any(i in poison for i in ids):
+            raise DataError("INSERT", {}, Exception("Data too long"))
+        written.extend(ids)
+        return {"inserted": len(events), "ad_updates": 0}
+
+    return apply, written
+
+
+def _push(r, *ids):
+    for i in ids:
+        r.xadd(vi.STREAM_KEY, {"k": vi.KIND_LANDING_VISIT, "id": str(i), "ts": "1700000000.000", "ad": "0"})
+
+
+def test_flush_moves_poison_event_to_dead_letter(r, monkeypatch):
+    apply, written = _fake_apply(poison={"2"})
+    monkeypatch.setattr(vi, "_apply", apply)
+    _push(r, 1, 2, 3)
+
+    stats = vi.flush(FakeSession(), batch_size=10)
+
+    assert written == ["1", "3"]
+    assert stats["dead"] == 1 and stats["inserted"] == 2 and stats["pending"] == 0
+    dead = r.xrange(vi.DEAD_STREAM_KEY)
+    assert len(dead) == 1 and dead[0][1]["id"] == "2" and "Data too long" in dead[0][1]["error"]
+    assert r.get(vi.FLUSH_LOCK_KEY) is None
+
+
+def test_flush_keeps_batch_on_transient_error(r, monkeypatch):
+    apply, written = _fake_apply(transient={"2"})
+    monkeypatch.setattr(vi, "_apply", apply)
+    _push(r, 1, 2, 3)
+
+    with pytest.raises(OperationalError):
+        vi.flush(FakeSession(), batch_size=10)
+
+    assert written == []
+    assert r.xlen(vi.STREAM_KEY) == 3
+    assert r.xlen(vi.DEAD_STREAM_KEY) == 0
+    assert r.get(vi.FLUSH_LOCK_KEY) is None
+
+
+def test_one_by_one_drops_only_committed_on_transient_error(r, monkeypatch):
+    apply, written = _fake_apply(poison={"1"}, transient={"3"})
+    monkeypatch.setattr(vi, "_apply", apply)
+    _push(r, 1, 2, 3, 4)
+
+    with pytest.raises(OperationalError):
+        vi._apply_one_by_one(FakeSession(), r, r.xrange(vi.STREAM_KEY))
+
+    assert written == ["2"]
+    assert [f["id"] for _, f in r.xrange(vi.STREAM_KEY)] == ["3", "4"]
+    assert [f["id"] for _, f in r.xrange(vi.DEAD_STREAM_KEY)] == ["1"]
+
+
+def test_flush_does_not_release_foreign_lock(r, monkeypatch):
+    apply, _ = _fake_apply()
+    monkeypatch.setattr(vi, "_apply", apply)
+    _push(r, 1)
+
+    def steal(db, events, **kw):
+        r.set(vi.FLUSH_LOCK_KEY, "someone-else")     # наш lock истёк и его взяли
+        return apply(db, events, **kw)
+
+    monkeypatch.setattr(vi, "_apply", steal)
+    vi.flush(FakeSession(), batch_size=10)
+    assert r.get(vi.FLUSH_LOCK_KEY) == "someone-else"
+
+
+def test_record_visit_clips_fields_to_column_size(r, monkeypatch):
+    monkeypatch.setattr(vi, "_unique_window", lambda kind: timedelta(hours=24))
+    assert vi.record_visit(None, vi.KIND_AD_VISIT, 5, fbc="f" * 400, fbp="p", ip="1" * 60)
+    (_, event), = r.xrange(vi.STREAM_KEY)
+    assert len(event["fbc"]) == 255
+    assert event["fbp"] == "p"
+    assert len(event["ip"]) == 45